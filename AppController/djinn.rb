@@ -783,6 +783,18 @@ class Djinn
       }
     end
 
+    # The warm pool's VMs are not part of any node, so nothing else stops
+    # them.
+    if my_node.is_shadow? and stop_deployment and is_cloud? and
+        @options['warm_pool_size']
+      imc = InfrastructureManagerClient.new(@@secret)
+      begin
+        imc.clear_warm_pool(@options)
+      rescue FailedNodeException
+        Djinn.log_warn("Failed to clear the warm pool")
+      end
+    end
+
     Djinn.log_info("---- Stopping AppController ----")
 
     return "OK"
@@ -1453,6 +1465,12 @@ class Djinn
     return BAD_SECRET_MSG unless valid_secret?(secret)
     return INVALID_REQUEST unless %w(true false).include?(read_only)
 
+    # Tools that require read-only mode check this flag, so it is cleared
+    # before any node accepts writes and set after every node stops.
+    if read_only == 'false'
+      ZKInterface.set(DATASTORE_READ_ONLY_PATH, read_only, false)
+    end
+
     @nodes.each { | node |
       if node.is_db_master? or node.is_db_slave?
         acc = AppControllerClient.new(node.private_ip, @@secret)
@@ -1461,6 +1479,10 @@ class Djinn
       end
     }
 
+    if read_only == 'true'
+      ZKInterface.set(DATASTORE_READ_ONLY_PATH, read_only, false)
+    end
+
     return 'OK'
   end
 
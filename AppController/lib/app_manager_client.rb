@@ -34,6 +34,7 @@ class AppManagerClient
     @conn.options["protocol.http.send_timeout"] = MAX_TIME_OUT
     @conn.options["protocol.http.receive_timeout"] = MAX_TIME_OUT
     @conn.add_method("start_app", "config")
+    @conn.add_method("start_apps", "configs")
     @conn.add_method("stop_app", "app_name")
     @conn.add_method("stop_app_instance", "app_name", "port")
     @conn.add_method("restart_app_instances_for_app", "app_name", "language")
@@ -114,6 +115,24 @@ class AppManagerClient
     return Integer(result)
   end
 
+  # Wrapper for SOAP call to the AppManager to start several application
+  # server instances at once.
+  #
+  # Args:
+  #   configs: An Array of Hashes, each containing the arguments that
+  #     start_app takes, keyed by name.
+  # Returns:
+  #   An Array of Hashes, one for each config, containing the app_name,
+  #   app_port, success, and ready_time (in seconds) of each instance.
+  #
+  def start_apps(configs)
+    result = "[]"
+    make_call(MAX_TIME_OUT, false, "start_apps") {
+      result = @conn.start_apps(JSON.dump(configs))
+    }
+    return JSON.load(result)
+  end
+
   # Wrapper for SOAP call to the AppManager to stop an application
   # process instance from the current host.
   #
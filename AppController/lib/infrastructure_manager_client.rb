@@ -60,6 +60,7 @@ class InfrastructureManagerClient
     @conn.add_method("run_instances", "parameters", "secret")
     @conn.add_method("describe_instances", "parameters", "secret")
     @conn.add_method("terminate_instances", "parameters", "secret")
+    @conn.add_method("clear_warm_pool", "parameters", "secret")
     @conn.add_method("attach_disk", "parameters", "disk_name", "instance_id",
       "secret")
     @conn.add_method("get_cpu_usage", "secret")
@@ -166,6 +167,7 @@ class InfrastructureManagerClient
     end
     parameters['instance_ids'] = instance_ids
     parameters['region'] = options['region']
+    parameters['zone'] = options['zone']
 
     terminate_result = make_call(NO_TIMEOUT, RETRY_ON_FAIL,
       "terminate_instances") {
@@ -173,6 +175,20 @@ class InfrastructureManagerClient
     }
     Djinn.log_debug("Terminate instances says [#{terminate_result}]")
   end
+
+
+  # Terminates the VMs that the InfrastructureManager keeps ready for this
+  # deployment's configuration, and stops it from starting more.
+  def clear_warm_pool(options)
+    parameters = get_parameters_from_credentials(options)
+    parameters['region'] = options['region']
+    parameters['zone'] = options['zone']
+
+    clear_result = make_call(NO_TIMEOUT, ABORT_ON_FAIL, "clear_warm_pool") {
+      @conn.clear_warm_pool(parameters.to_json, @secret)
+    }
+    Djinn.log_debug("Clear warm pool says [#{clear_result}]")
+  end
  
   
   def spawn_vms(num_vms, options, job, disks)
@@ -181,6 +197,9 @@ class InfrastructureManagerClient
     parameters['cloud'] = 'cloud1'
     parameters['zone'] = options['zone']
     parameters['region'] = options['region']
+    if options['warm_pool_size']
+      parameters['warm_pool_size'] = options['warm_pool_size'].to_s
+    end
 
     run_result = run_instances(parameters)
     Djinn.log_debug("[IM] Run instances info says [#{run_result}]")
@@ -9,6 +9,9 @@ ZOOKEEPER_PORT="2181"
 # The path in ZooKeeper where the deployment ID is stored.
 DEPLOYMENT_ID_PATH = '/appscale/deployment_id'
 
+# The path in ZooKeeper that indicates whether datastore writes are disabled.
+DATASTORE_READ_ONLY_PATH = '/appscale/datastore_read_only'
+
 def configure_zookeeper(nodes, my_index)
   # TODO: create multi node configuration
   zoocfg = <<EOF
@@ -12,3 +12,11 @@ class NoKeyException(Exception):
 
 class AmbiguousKeyException(Exception):
   """ Indicates that there is more than one key to choose from. """
+
+
+class InvalidBackupException(BRException):
+  """ Indicates that a backup file is corrupt or has an unknown format. """
+
+
+class GCSException(BRException):
+  """ Indicates that a transfer to or from Google Cloud Storage failed. """
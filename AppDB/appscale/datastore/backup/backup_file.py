@@ -0,0 +1,306 @@
+""" Reads and writes datastore backup files.
+
+A backup file starts with a header, followed by blocks of records. Each block
+contains a header with the compressed length and the number of records,
+followed by the zlib-compressed records. Each record is prefixed with its
+length. An empty block marks the end of the records, and it is followed by an
+index of block offsets and a trailer that points to the index.
+
+Files written by older versions contain a stream of pickled entities, and
+they can still be read with read_entities.
+"""
+import cPickle
+import struct
+import zlib
+
+from appscale.datastore.backup.backup_exceptions import InvalidBackupException
+
+# The bytes at the start of every backup file in this format.
+MAGIC = 'ASBACKUP'
+
+# The version of the format written by BackupWriter.
+FORMAT_VERSION = 1
+
+# The bytes at the end of a complete backup file.
+TRAILER_MAGIC = 'ASBKEND\x00'
+
+# The format of the file header: magic and version.
+HEADER = struct.Struct('>8sB')
+
+# The format of a block header: compressed length and record count.
+BLOCK_HEADER = struct.Struct('>II')
+
+# The format of a record's length prefix.
+RECORD_LENGTH = struct.Struct('>I')
+
+# The format of an index entry: block offset and record count.
+INDEX_ENTRY = struct.Struct('>QI')
+
+# The format of the trailer: index offset, block count, and magic.
+TRAILER = struct.Struct('>QI8s')
+
+
+class BackupWriter(object):
+  """ Writes records to a backup file in compressed blocks. """
+
+  # The number of uncompressed bytes to buffer before writing a block.
+  BLOCK_SIZE = 1024 * 1024
+
+  # The zlib compression level for each block.
+  COMPRESSION_LEVEL = 6
+
+  def __init__(self, file_object, checkpoint=None):
+    """ Constructor.
+
+    Args:
+      file_object: A file-like object opened for binary writing.
+      checkpoint: A value from checkpoint(). If given, the file is truncated
+        and writing resumes from that position.
+    """
+    self.file_object = file_object
+    self.closed = False
+    if checkpoint is not None:
+      self.restore(checkpoint)
+      return
+
+    self.pending = []
+    self.pending_size = 0
+    self.index = []
+    self.offset = 0
+    self.records = 0
+    self._write(HEADER.pack(MAGIC, FORMAT_VERSION))
+
+  @property
+  def size(self):
+    """ The number of bytes the file will contain before the index. """
+    return self.offset + self.pending_size
+
+  def _write(self, data):
+    """ Writes data to the file and tracks the current offset.
+
+    Args:
+      data: A string.
+    """
+    self.file_object.write(data)
+    self.offset += len(data)
+
+  def write(self, record):
+    """ Adds a record to the file.
+
+    Args:
+      record: A string containing an encoded entity.
+    """
+    self.pending.append(RECORD_LENGTH.pack(len(record)))
+    self.pending.append(record)
+    self.pending_size += RECORD_LENGTH.size + len(record)
+    self.records += 1
+    if self.pending_size >= self.BLOCK_SIZE:
+      self.flush_block()
+
+  def flush_block(self):
+    """ Compresses the buffered records and writes them as a block. """
+    if not self.pending:
+      return
+
+    count = len(self.pending) // 2
+    compressed = zlib.compress(''.join(self.pending), self.COMPRESSION_LEVEL)
+    self.index.append((self.offset, count))
+    self._write(BLOCK_HEADER.pack(len(compressed), count))
+    self._write(compressed)
+    self.pending = []
+    self.pending_size = 0
+
+  def checkpoint(self):
+    """ Records the current position in the file.
+
+    Returns:
+      A value that can be passed to restore.
+    """
+    return (self.offset, list(self.index), list(self.pending),
+            self.pending_size, self.records)
+
+  def restore(self, checkpoint):
+    """ Discards the records written since a checkpoint.
+
+    Args:
+      checkpoint: A value from checkpoint().
+    """
+    (self.offset, index, pending, self.pending_size,
+     self.records) = checkpoint
+    self.index = list(index)
+    self.pending = list(pending)
+    self.file_object.seek(self.offset)
+    self.file_object.truncate()
+
+  def close(self):
+    """ Writes any buffered records and the block index. """
+    if self.closed:
+      return
+
+    self.flush_block()
+    self._write(BLOCK_HEADER.pack(0, 0))
+    index_offset = self.offset
+    self._write(''.join(INDEX_ENTRY.pack(offset, count)
+                        for offset, count in self.index))
+    self._write(TRAILER.pack(index_offset, len(self.index), TRAILER_MAGIC))
+    self.file_object.close()
+    self.closed = True
+
+
+class BackupReader(object):
+  """ Streams records from a backup file one block at a time. """
+  def __init__(self, file_object):
+    """ Constructor.
+
+    Args:
+      file_object: A file-like object opened for binary reading and
+        positioned at the start of the file.
+    Raises:
+      InvalidBackupException if the file does not have a valid header.
+    """
+    self.file_object = file_object
+    header = file_object.read(HEADER.size)
+    if len(header) != HEADER.size:
+      raise InvalidBackupException('Backup file is too short')
+
+    magic, version = HEADER.unpack(header)
+    if magic != MAGIC:
+      raise InvalidBackupException('Backup file has an unknown format')
+
+    if version > FORMAT_VERSION:
+      raise InvalidBackupException(
+        'Unsupported backup format version: {}'.format(version))
+
+  def _read(self, length):
+    """ Reads an exact number of bytes from the file.
+
+    Args:
+      length: An integer specifying the number of bytes.
+    Returns:
+      A string.
+    Raises:
+      InvalidBackupException if the file ends early.
+    """
+    data = self.file_object.read(length)
+    if len(data) != length:
+      raise InvalidBackupException('Backup file is truncated')
+    return data
+
+  def read_block(self):
+    """ Reads the next block from the current position.
+
+    Returns:
+      A list of records, or None if there are no more blocks.
+    Raises:
+      InvalidBackupException if the block is incomplete or corrupt.
+    """
+    length, count = BLOCK_HEADER.unpack(self._read(BLOCK_HEADER.size))
+    if length == 0:
+      return None
+
+    try:
+      payload = zlib.decompress(self._read(length))
+    except zlib.error as error:
+      raise InvalidBackupException('Corrupt backup block: {}'.format(error))
+
+    records = []
+    position = 0
+    try:
+      for _ in range(count):
+        record_length, = RECORD_LENGTH.unpack_from(payload, position)
+        position += RECORD_LENGTH.size
+        records.append(payload[position:position + record_length])
+        position += record_length
+    except struct.error:
+      raise InvalidBackupException('Backup block has an invalid record')
+
+    if len(records) != count or position != len(payload):
+      raise InvalidBackupException('Backup block has the wrong length')
+
+    return records
+
+  def read_block_at(self, offset):
+    """ Reads the block that starts at a given offset.
+
+    Args:
+      offset: An integer taken from the block index.
+    Returns:
+      A list of records.
+    """
+    self.file_object.seek(offset)
+    return self.read_block()
+
+  def blocks(self):
+    """ Yields the records in each block in order.
+
+    Yields:
+      Lists of records.
+    """
+    while True:
+      records = self.read_block()
+      if records is None:
+        return
+      yield records
+
+  def __iter__(self):
+    """ Yields each record in the file in order. """
+    for records in self.blocks():
+      for record in records:
+        yield record
+
+  def read_index(self):
+    """ Reads the block index from the end of the file.
+
+    Returns:
+      A list of (offset, record count) tuples for each block.
+    Raises:
+      InvalidBackupException if the file was not closed properly.
+    """
+    try:
+      self.file_object.seek(-TRAILER.size, 2)
+    except IOError:
+      raise InvalidBackupException('Backup file is missing its index')
+
+    index_offset, block_count, magic = TRAILER.unpack(
+      self._read(TRAILER.size))
+    if magic != TRAILER_MAGIC:
+      raise InvalidBackupException('Backup file is missing its index')
+
+    self.file_object.seek(index_offset)
+    index_data = self._read(INDEX_ENTRY.size * block_count)
+    return [INDEX_ENTRY.unpack_from(index_data, INDEX_ENTRY.size * position)
+            for position in range(block_count)]
+
+
+def is_block_format(file_object):
+  """ Checks if a backup file was written by BackupWriter.
+
+  Args:
+    file_object: A file-like object positioned at the start of the file.
+  Returns:
+    A boolean indicating whether or not the file starts with MAGIC. The
+    file is returned to its starting position.
+  """
+  magic = file_object.read(len(MAGIC))
+  file_object.seek(0)
+  return magic == MAGIC
+
+
+def read_entities(file_object):
+  """ Yields the encoded entities in a backup file of either format.
+
+  Args:
+    file_object: A file-like object positioned at the start of the file.
+  Yields:
+    Strings containing encoded entities.
+  """
+  if is_block_format(file_object):
+    for record in BackupReader(file_object):
+      yield record
+    return
+
+  while True:
+    try:
+      yield cPickle.load(file_object)
+    except EOFError:
+      return
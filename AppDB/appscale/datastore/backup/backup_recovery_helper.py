@@ -236,6 +236,45 @@ def tar_backup_files(file_paths, target):
   return backup_file_location
 
 
+def tar_backup_files_to_bucket(file_paths, full_object_name):
+  """ Streams a compressed tar of files directly to GCS without creating a
+  local copy.
+
+  Args:
+    file_paths: A list of files to tar up.
+    full_object_name: A str, the full GCS object name for the tar.
+  Returns:
+    True on success, False otherwise.
+  """
+  bucket_name, object_name = gcs_helper.extract_gcs_tokens(full_object_name)
+  if not bucket_name or not object_name:
+    logging.error("Invalid GCS object name '{0}'".format(full_object_name))
+    return False
+
+  upload = gcs_helper.ChunkedUpload(bucket_name, object_name)
+  tar = None
+  try:
+    tar = tarfile.open(fileobj=upload, mode="w|gz")
+    for name in file_paths:
+      tar.add(name)
+    tar.close()
+    upload.close()
+  except (IOError, OSError, tarfile.TarError,
+          backup_exceptions.GCSException) as error:
+    logging.error("Error while uploading tar to '{0}': {1}".format(
+      full_object_name, error))
+    if tar is not None:
+      # Discard the compressed data that is still buffered. Otherwise the
+      # stream writes it to the aborted upload when it is garbage collected.
+      tar.fileobj.closed = True
+      tar.closed = True
+    return False
+  finally:
+    upload.abort()
+
+  return True
+
+
 def untar_backup_files(source):
   """ Restores a previous backup into the Cassandra directory structure
   from a tar ball.
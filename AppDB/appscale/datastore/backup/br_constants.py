@@ -28,6 +28,7 @@ DEFAULT_PORT = 8423
 
 # HTTP Codes.
 HTTP_OK = 200
+HTTP_PARTIAL_CONTENT = 206
 
 # The percentage of disk fullness that is considered reasonable.
 PADDING_PERCENTAGE = 0.9
@@ -1,7 +1,6 @@
 """ This process performs a backup of all the application entities for the given
 app ID to the local filesystem.
 """
-import cPickle
 import errno
 import logging
 import multiprocessing
@@ -14,6 +13,7 @@ import time
 from appscale.datastore import appscale_datastore_batch
 from appscale.datastore import dbconstants
 from appscale.datastore import entity_utils
+from appscale.datastore.backup.backup_file import BackupWriter
 from appscale.datastore.zkappscale import zktransaction as zk
 
 # The location to look at in order to verify that an app is deployed.
@@ -42,6 +42,10 @@ class DatastoreBackup(multiprocessing.Process):
   # Retry sleep on datastore error in seconds.
   DB_ERROR_PERIOD = 30
 
+  # The number of times a batch that could not be written is retried before
+  # the backup is aborted.
+  MAX_WRITE_RETRIES = 3
+
   # Max backup file size in bytes.
   MAX_FILE_SIZE = 100000000 # <- 100 MB
 
@@ -76,7 +80,8 @@ class DatastoreBackup(multiprocessing.Process):
     self.backup_timestamp = time.strftime("%Y%m%d-%H%M%S")
     self.backup_dir = None
     self.current_fileno = 0
-    self.current_file_size = 0
+    self.filename = None
+    self.writer = None
     self.entities_backed_up = 0
     self.db_access = None
 
@@ -150,7 +155,8 @@ class DatastoreBackup(multiprocessing.Process):
         if self.source_code:
           self.backup_source_code()
 
-        self.run_backup()
+        if not self.run_backup():
+          logging.error("Backup of {0} did not complete.".format(self.app_id))
         try:
           self.zoo_keeper.release_lock_with_path(zk.DS_BACKUP_LOCK_PATH)
         except zk.ZKTransactionException, zk_exception:
@@ -215,57 +221,127 @@ class DatastoreBackup(multiprocessing.Process):
 
     return True
 
+  def open_backup_file(self):
+    """ Opens the current backup file for writing.
+
+    Returns:
+      True on success, False otherwise.
+    """
+    try:
+      self.writer = BackupWriter(open(self.filename, 'wb'))
+    except (IOError, OSError) as error:
+      logging.error("Unable to open backup file {0}: {1}".
+        format(self.filename, error))
+      self.writer = None
+      return False
+
+    return True
+
+  def close_backup_file(self):
+    """ Writes the block index and closes the current backup file.
+
+    Returns:
+      True on success, False otherwise.
+    """
+    if self.writer is None:
+      return True
+
+    try:
+      self.writer.close()
+    except (IOError, OSError) as error:
+      logging.error("Unable to close backup file {0}: {1}".
+        format(self.filename, error))
+      return False
+    finally:
+      self.writer = None
+
+    return True
+
+  def batch_checkpoint(self):
+    """ Records how much of the backup has been written.
+
+    Returns:
+      A tuple containing the file number, the writer's checkpoint, and the
+      number of entities backed up.
+    """
+    writer_checkpoint = None
+    if self.writer is not None:
+      writer_checkpoint = self.writer.checkpoint()
+    return self.current_fileno, writer_checkpoint, self.entities_backed_up
+
+  def discard_batch(self, checkpoint):
+    """ Removes the entities written since a checkpoint from the backup files.
+
+    Args:
+      checkpoint: A value from batch_checkpoint().
+    Returns:
+      True on success, False otherwise.
+    """
+    fileno, writer_checkpoint, entities_backed_up = checkpoint
+    try:
+      if self.writer is not None:
+        self.writer.file_object.close()
+        self.writer = None
+
+      # Remove files started after the checkpoint.
+      while True:
+        if ((self.current_fileno > fileno or writer_checkpoint is None) and
+            self.filename is not None and os.path.exists(self.filename)):
+          os.remove(self.filename)
+        if self.current_fileno == fileno:
+          break
+        self.current_fileno -= 1
+        self.set_filename()
+
+      if writer_checkpoint is not None:
+        self.writer = BackupWriter(open(self.filename, 'r+b'),
+                                   writer_checkpoint)
+    except (IOError, OSError) as error:
+      logging.error("Unable to discard partial batch from {0}: {1}".
+        format(self.filename, error))
+      return False
+
+    self.entities_backed_up = entities_backed_up
+    return True
+
   def dump_entity(self, entity):
-    """ Dumps the entity content into a backup file.
+    """ Adds the entity content to the open backup file.
 
     Args:
       entity: The entity to be backed up.
     Returns:
       True on success, False otherwise.
     """
-    # Open file and write pickled batch.
-    if self.current_file_size + len(entity) > self.MAX_FILE_SIZE:
+    if (self.writer is not None and
+        self.writer.size + len(entity) > self.MAX_FILE_SIZE):
+      if not self.close_backup_file():
+        return False
       self.current_fileno += 1
-      self.set_filename()
-      self.current_file_size = 0
-
-    try:
-      with open(self.filename, 'ab+') as file_object:
-        cPickle.dump(entity, file_object, cPickle.HIGHEST_PROTOCOL)
+      if not self.set_filename():
+        return False
 
-      self.entities_backed_up += 1
-      self.current_file_size += len(entity)
-    except IOError as io_error:
-      logging.error(
-        "Encountered IOError while accessing backup file {0}".
-        format(self.filename))
-      logging.error(io_error.message)
-      return False
-    except OSError as os_error:
-      logging.error(
-        "Encountered OSError while accessing backup file {0}".
-        format(self.filename))
-      logging.error(os_error.message)
+    if self.writer is None and not self.open_backup_file():
       return False
-    except Exception as exception:
+
+    try:
+      self.writer.write(entity)
+    except (IOError, OSError) as error:
       logging.error(
-        "Encountered an unexpected error while accessing backup file {0}".
-        format(self.filename))
-      logging.error(exception.message)
+        "Encountered an error while writing backup file {0}: {1}".
+        format(self.filename, error))
       return False
 
+    self.entities_backed_up += 1
     return True
 
-  def process_entity(self, entity):
-    """ Verifies entity, fetches from journal if necessary and calls
-    dump_entity.
+  def should_back_up(self, key):
+    """ Checks if an entity's kind is included in backups.
 
     Args:
-      entity: The entity to be backed up.
+      key: The key to the entity table.
     Returns:
-      True on success, False otherwise.
+      True if the entity should be backed up, False otherwise.
     """
-    key = entity.keys()[0]
     kind = entity_utils.get_kind_from_entity_key(key)
     # Skip protected and private entities.
     if re.match(self.PROTECTED_KINDS, kind) or\
@@ -276,126 +352,144 @@ class DatastoreBackup(multiprocessing.Process):
         logging.debug("Skipping key: {0}".format(key))
         return False
 
-    one_entity = entity[key][dbconstants.APP_ENTITY_SCHEMA[0]]
-    if one_entity == dbconstants.TOMBSTONE:
-      return False
-    app_id = key.split(dbconstants.KEY_DELIMITER)[0]
-    root_key = entity_utils.get_root_key_from_entity_key(key)
+    return True
+
+  def process_entity_batch(self, entities):
+    """ Verifies a batch of entities and writes them to the backup file.
+
+    Entities are written to the entity table when their transactions commit,
+    so each version is only checked against the transaction blacklist. Rows
+    with blacklisted versions are fetched again together in case they have
+    been replaced since the range query.
+
+    Args:
+      entities: A list of entities from the entity table.
+    Returns:
+      True on success, False otherwise.
+    """
+    rows = []
+    for entity in entities:
+      key = entity.keys()[0]
+      if self.should_back_up(key):
+        rows.append((key, entity[key]))
+
+    invalid_keys = [key for key, row in rows
+                    if not self.verify_entity(
+                      key, row[dbconstants.APP_ENTITY_SCHEMA[1]])]
+    if invalid_keys:
+      current_rows = self.db_access.batch_get_entity(
+        dbconstants.APP_ENTITY_TABLE, invalid_keys,
+        dbconstants.APP_ENTITY_SCHEMA)
+      refreshed = {}
+      for key in invalid_keys:
+        row = current_rows.get(key, {})
+        version = row.get(dbconstants.APP_ENTITY_SCHEMA[1])
+        if version is None or not self.verify_entity(key, version):
+          logging.error("Unable to find a valid version of {0}".format(key))
+          continue
+        refreshed[key] = row
+
+      rows = [(key, refreshed[key] if key in invalid_keys else row)
+              for key, row in rows
+              if key not in invalid_keys or key in refreshed]
 
     success = True
-    while True:
-      # Acquire lock.
-      txn_id = self.zoo_keeper.get_transaction_id(app_id)
-      try:
-        if self.zoo_keeper.acquire_lock(app_id, txn_id, root_key):
-          version = entity[key][dbconstants.APP_ENTITY_SCHEMA[1]]
-          if not self.verify_entity(key, version):
-            # Fetch from the journal.
-            entity = entity_utils.fetch_journal_entry(self.db_access, key)
-            if not entity:
-              logging.error("Bad journal entry for key: {0} and result: {1}".
-                format(key, entity))
-              success = False
-            else:
-              one_entity = entity[key][dbconstants.APP_ENTITY_SCHEMA[0]]
-
-          if self.dump_entity(one_entity):
-            logging.debug("Backed up key: {0}".format(key))
-            success = True
-          else:
-            success = False
-        else:
-          logging.warn("Entity with key: {0} not found".format(key))
-          success = False
-      except zk.ZKTransactionException, zk_exception:
-        logging.error("Zookeeper exception {0} while requesting entity lock".
-          format(zk_exception))
-        success = False
-      except zk.ZKInternalException, zk_exception:
-        logging.error("Zookeeper exception {0} while requesting entity lock".
-          format(zk_exception))
-        success = False
-      except dbconstants.AppScaleDBConnectionError, db_exception:
-        logging.error("Database exception {0} while requesting entity lock".
-          format(db_exception))
-        success = False
-      finally:
-        if not success:
-          if not self.zoo_keeper.notify_failed_transaction(app_id, txn_id):
-            logging.error("Unable to invalidate txn for {0} with txnid: {1}"\
-              .format(app_id, txn_id))
-          logging.error("Failed to backup entity. Retrying shortly...")
+    for key, row in rows:
+      one_entity = row[dbconstants.APP_ENTITY_SCHEMA[0]]
+      if one_entity == dbconstants.TOMBSTONE:
+        continue
 
-        try:
-          self.zoo_keeper.release_lock(app_id, txn_id)
-        except zk.ZKTransactionException, zk_exception:
-          logging.error(
-            "Zookeeper exception {0} while releasing entity lock.".
-              format(zk_exception))
-        except zk.ZKInternalException, zk_exception:
-          logging.error(
-            "Zookeeper exception {0} while releasing entity lock.".
-              format(zk_exception))
-
-      if success:
-        break
+      if self.dump_entity(one_entity):
+        logging.debug("Backed up key: {0}".format(key))
       else:
-        time.sleep(self.DB_ERROR_PERIOD)
+        success = False
 
     return success
 
   def run_backup(self):
     """ Runs the backup process. Loops on the entire dataset and dumps it into
     a file.
+
+    Returns:
+      True if every entity was backed up, False otherwise.
     """
     logging.info("Backup started")
     start = time.time()
 
     first_key = '{0}\x00'.format(self.app_id)
     start_inclusive = True
-    entities_remaining = []
+    write_failures = 0
+    success = True
     while True:
+      checkpoint = self.batch_checkpoint()
       try:
         # Fetch batch.
-        entities = entities_remaining + self.get_entity_batch(first_key,
-          self.BATCH_SIZE, start_inclusive)
-        logging.info("Processing {0} entities".format(self.BATCH_SIZE))
+        entities = self.get_entity_batch(first_key, self.BATCH_SIZE,
+          start_inclusive)
+        logging.info("Processing {0} entities".format(len(entities)))
 
         if not entities:
           break
 
         # Loop through entities retrieved and if not to be skipped, process.
         skip = False
+        skip_kinds = self.skip_kinds
+        next_key = entities[-1].keys()[0]
+        to_process = []
         for entity in entities:
-          first_key = entity.keys()[0]
-          kind = entity_utils.get_kind_from_entity_key(first_key)
-          logging.debug("Processing key: {0}".format(first_key))
+          key = entity.keys()[0]
+          kind = entity_utils.get_kind_from_entity_key(key)
+          logging.debug("Processing key: {0}".format(key))
 
           index = 1
-          for skip_kind in self.skip_kinds:
+          for skip_kind in skip_kinds:
             if re.match(skip_kind, kind):
               logging.warn("Skipping entities of kind: {0}".format(skip_kind))
 
               skip = True
-              first_key = first_key[:first_key.find(skip_kind)+
+              next_key = key[:key.find(skip_kind)+
                  len(skip_kind)+1] + dbconstants.TERMINATING_STRING
- 
-              self.skip_kinds = self.skip_kinds[index:]
+
+              skip_kinds = skip_kinds[index:]
               break
             index += 1
           if skip:
             break
-          self.process_entity(entity)
-
-        if not skip:
-          first_key = entities[-1].keys()[0]
-        start_inclusive = False
+          to_process.append(entity)
+
+        # The position only advances once the batch has been written.
+        if self.process_entity_batch(to_process):
+          first_key = next_key
+          self.skip_kinds = skip_kinds
+          start_inclusive = False
+          write_failures = 0
+          continue
+
+        write_failures += 1
+        logging.error("Unable to write batch starting at {0}".
+          format(repr(first_key)))
       except dbconstants.AppScaleDBConnectionError, connection_error:
         logging.error("Error getting a batch: {0}".format(connection_error))
-        time.sleep(self.DB_ERROR_PERIOD)
 
+      # Remove anything written for the failed batch before it is fetched
+      # again so that the backup does not contain duplicates.
+      if not self.discard_batch(checkpoint):
+        success = False
+        break
+
+      if write_failures > self.MAX_WRITE_RETRIES:
+        logging.error("Giving up on backup after {0} failed writes".
+          format(write_failures))
+        success = False
+        break
+
+      time.sleep(self.DB_ERROR_PERIOD)
+
+    if not self.close_backup_file():
+      success = False
     del self.db_access
 
     time_taken = time.time() - start
     logging.info("Backed up {0} entities".format(self.entities_backed_up))
     logging.info("Backup took {0} seconds".format(str(time_taken)))
+    return success
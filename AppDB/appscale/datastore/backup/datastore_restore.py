@@ -1,11 +1,19 @@
-import cPickle
 import glob
 import logging
 import multiprocessing
 import random
 import time
 
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
 from appscale.datastore import appscale_datastore_batch
+from appscale.datastore import dbconstants
+from appscale.datastore.backup.backup_exceptions import InvalidBackupException
+from appscale.datastore.backup.backup_file import BackupReader
+from appscale.datastore.backup.backup_file import is_block_format
+from appscale.datastore.backup.backup_file import read_entities
+from appscale.datastore.cassandra_env import cassandra_interface
 from appscale.datastore.backup.datastore_backup import DatastoreBackup
 from appscale.datastore.datastore_distributed import DatastoreDistributed
 from appscale.datastore.zkappscale import zktransaction as zk
@@ -13,6 +21,182 @@ from appscale.datastore.zkappscale import zktransaction as zk
 from google.appengine.datastore import datastore_pb
 from google.appengine.datastore import entity_pb
 
+# The state each bulk restore worker process uses to write entities.
+_bulk_worker = {}
+
+
+def split_batch(batch, threshold):
+  """ Divides an entity's mutations into batches that are not too large to
+  apply atomically.
+
+  The entity row is written in the last batch, so an interrupted write is
+  compared against the previous version when it is restored again.
+
+  Args:
+    batch: A list of dictionaries representing mutations.
+    threshold: The maximum size of each batch in bytes.
+  Returns:
+    A list of batches.
+  """
+  entity_rows = [mutation for mutation in batch
+                 if mutation['table'] == dbconstants.APP_ENTITY_TABLE]
+  batches = []
+  current = []
+  current_size = 0
+  for mutation in batch:
+    if mutation['table'] == dbconstants.APP_ENTITY_TABLE:
+      continue
+    size = cassandra_interface.batch_size([mutation])
+    if current and current_size + size > threshold:
+      batches.append(current)
+      current = []
+      current_size = 0
+    current.append(mutation)
+    current_size += size
+
+  if current:
+    batches.append(current)
+  batches.append(entity_rows)
+  return batches
+
+
+def init_bulk_worker(table, app_id, composite_indexes, writers):
+  """ Prepares a worker process for a bulk restore.
+
+  Args:
+    table: The database used (e.g. cassandra).
+    app_id: A str, the application ID to restore entities under.
+    composite_indexes: A list of encoded CompositeIndex objects.
+    writers: The number of batches each process writes concurrently.
+  """
+  datastore_batch = appscale_datastore_batch.DatastoreFactory.getDatastore(
+    table)
+  indexes = []
+  for encoded_index in composite_indexes:
+    index = entity_pb.CompositeIndex()
+    index.ParseFromString(encoded_index)
+    indexes.append(index)
+
+  _bulk_worker['app_id'] = app_id
+  _bulk_worker['datastore'] = DatastoreDistributed(datastore_batch)
+  _bulk_worker['composite_indexes'] = indexes
+  _bulk_worker['writers'] = ThreadPool(writers)
+
+
+def restore_unit(work):
+  """ Writes the entities in part of a backup file directly to the entity
+  and index tables.
+
+  Args:
+    work: A tuple containing a backup file path and a block offset. The
+      whole file is restored when the offset is None.
+  Returns:
+    A tuple containing the work, the number of entities and bytes restored,
+    and an error message if the work failed.
+  """
+  try:
+    entities, restored_bytes, deltas = restore_entities(*work)
+  except Exception as error:
+    logging.exception('Unable to restore {}'.format(work))
+    return work, 0, 0, str(error)
+
+  # The statistics are only updated once the whole unit is written, so a unit
+  # that is retried is not counted twice.
+  app_id = _bulk_worker['app_id']
+  try:
+    _bulk_worker['datastore'].datastore_batch.update_entity_stats(
+      app_id, deltas)
+  except dbconstants.AppScaleDBConnectionError:
+    # The groomer corrects the counters when it reconciles them.
+    logging.warning('Unable to update statistics for {}'.format(app_id))
+
+  return work, entities, restored_bytes, None
+
+
+def restore_entities(backup_file, offset):
+  """ Writes the entities in part of a backup file.
+
+  Args:
+    backup_file: A str, the backup file location to restore from.
+    offset: The offset of the block to restore, or None for the whole file.
+  Returns:
+    A tuple containing the number of entities and bytes restored, and a
+    dictionary mapping (namespace, kind) tuples to (bytes, entities) tuples
+    for the restored entities.
+  """
+  entities = 0
+  restored_bytes = 0
+  deltas = {}
+
+  def write_chunk(chunk):
+    """ Writes a list of encoded entities and counts them. """
+    for stat_key, (size, number) in write_entities(chunk).iteritems():
+      total_size, total_number = deltas.get(stat_key, (0, 0))
+      deltas[stat_key] = (total_size + size, total_number + number)
+    return len(chunk), sum(len(entity) for entity in chunk)
+
+  with open(backup_file, 'rb') as file_object:
+    if offset is None:
+      records = read_entities(file_object)
+      chunk = []
+      for record in records:
+        chunk.append(record)
+        if len(chunk) == DatastoreRestore.BATCH_SIZE:
+          written, written_bytes = write_chunk(chunk)
+          entities += written
+          restored_bytes += written_bytes
+          chunk = []
+      if chunk:
+        written, written_bytes = write_chunk(chunk)
+        entities += written
+        restored_bytes += written_bytes
+    else:
+      records = BackupReader(file_object).read_block_at(offset)
+      entities, restored_bytes = write_chunk(records)
+
+  return entities, restored_bytes, deltas
+
+
+def write_entities(encoded_entities):
+  """ Writes entities and their indexes using concurrent batches.
+
+  Args:
+    encoded_entities: A list of encoded entities.
+  Returns:
+    A dictionary mapping (namespace, kind) tuples to (bytes, entities) tuples
+    for the entities written.
+  """
+  app_id = _bulk_worker['app_id']
+  datastore = _bulk_worker['datastore']
+  entities = []
+  for encoded_entity in encoded_entities:
+    entity = entity_pb.EntityProto(encoded_entity)
+    entity.mutable_key().set_app(app_id)
+    entities.append(entity)
+
+  # The application is not serving writes, so every entity is stored with
+  # the version used for writes that do not go through ZooKeeper.
+  txn_hash = defaultdict(lambda: DatastoreDistributed.LOCK_FREE_VERSION)
+  mutations = datastore.put_mutations(
+    entities, txn_hash, _bulk_worker['composite_indexes'])
+
+  def apply_mutations(mutation):
+    batch, entity_change, txn = mutation
+    for part in split_batch(batch, cassandra_interface.LARGE_BATCH_THRESHOLD):
+      datastore.datastore_batch.batch_mutate(app_id, part, [entity_change],
+                                             txn)
+
+  _bulk_worker['writers'].map(apply_mutations, mutations)
+
+  # The statistics come from the entities themselves rather than the changes
+  # that were applied. When a unit is retried, the entities written by the
+  # failed attempt would otherwise not be counted. Entities that existed
+  # before the restore are counted again until the groomer reconciles the
+  # counters.
+  return cassandra_interface.stats_deltas(
+    [{'key': entity.key(), 'old': None, 'new': entity}
+     for entity in entities])
+
 
 class DatastoreRestore(multiprocessing.Process):
   """ Backs up all the entities for a set application ID. """
@@ -29,7 +213,17 @@ class DatastoreRestore(multiprocessing.Process):
   # The amount of seconds between polling to get the restore lock.
   LOCK_POLL_PERIOD = 60
 
-  def __init__(self, app_id, backup_dir, zoo_keeper, table_name):
+  # The number of batches each bulk restore process writes at once.
+  BULK_WRITERS = 8
+
+  # The number of times to retry parts of a bulk restore that fail.
+  BULK_RETRIES = 3
+
+  # The amount of seconds between bulk restore progress reports.
+  REPORT_PERIOD = 30
+
+  def __init__(self, app_id, backup_dir, zoo_keeper, table_name, bulk=False,
+               processes=None):
     """ Constructor.
 
     Args:
@@ -37,6 +231,11 @@ class DatastoreRestore(multiprocessing.Process):
       backup_dir: A str, the location of the backup file.
       zoo_keeper: A ZooKeeper client.
       table_name: The database used (e.g. cassandra).
+      bulk: A boolean indicating whether to write entities and indexes
+        directly instead of going through dynamic_put. The restore is
+        refused unless the datastore is in read-only mode.
+      processes: The number of processes to use for a bulk restore. Defaults
+        to the number of CPUs.
     """
     multiprocessing.Process.__init__(self)
 
@@ -44,8 +243,11 @@ class DatastoreRestore(multiprocessing.Process):
     self.backup_dir = backup_dir
     self.zoo_keeper = zoo_keeper
     self.table = table_name
+    self.bulk = bulk
+    self.processes = processes or multiprocessing.cpu_count()
 
     self.entities_restored = 0
+    self.bytes_restored = 0
     self.indexes = []
     self.ds_distributed = None
 
@@ -137,24 +339,121 @@ class DatastoreRestore(multiprocessing.Process):
     """
     entities_to_store = []
     with open(backup_file, 'rb') as file_object:
-      while True:
-        try:
-          entity = cPickle.load(file_object)
-          entities_to_store.append(entity)
-
-          # If batch size is met, store entities.
-          if len(entities_to_store) == self.BATCH_SIZE:
-            logging.info("Storing a batch of {0} entities...".
-              format(len(entities_to_store)))
-            self.store_entity_batch(entities_to_store)
-            entities_to_store = []
-        except EOFError:
-          break
+      for entity in read_entities(file_object):
+        entities_to_store.append(entity)
+
+        # If batch size is met, store entities.
+        if len(entities_to_store) == self.BATCH_SIZE:
+          logging.info("Storing a batch of {0} entities...".
+            format(len(entities_to_store)))
+          self.store_entity_batch(entities_to_store)
+          entities_to_store = []
 
     if entities_to_store:
       logging.info("Storing {0} entities...".format(len(entities_to_store)))
       self.store_entity_batch(entities_to_store)
 
+  def backup_files(self):
+    """ Lists the backup files in the backup directory.
+
+    Returns:
+      A list of backup file locations.
+    """
+    return [backup_file for backup_file in sorted(glob.glob('{0}/*{1}'.
+              format(self.backup_dir, DatastoreBackup.BACKUP_FILE_SUFFIX)))
+            if backup_file.endswith(".backup")]
+
+  def bulk_work(self, backup_files):
+    """ Divides backup files into parts that can be restored in parallel.
+
+    Args:
+      backup_files: A list of backup file locations.
+    Returns:
+      A list of (backup file, block offset) tuples. The offset is None when
+      the whole file must be read at once.
+    """
+    work = []
+    for backup_file in backup_files:
+      with open(backup_file, 'rb') as file_object:
+        if not is_block_format(file_object):
+          work.append((backup_file, None))
+          continue
+
+        try:
+          index = BackupReader(file_object).read_index()
+        except InvalidBackupException:
+          logging.warning('{} does not have a block index'.format(backup_file))
+          work.append((backup_file, None))
+          continue
+
+      work.extend((backup_file, offset) for offset, _ in index)
+    return work
+
+  def report_progress(self, start, message):
+    """ Logs the bulk restore throughput.
+
+    Args:
+      start: The time the restore started.
+      message: A str describing the stage of the restore.
+    """
+    elapsed = max(time.time() - start, 0.001)
+    logging.info(
+      '{}: {} entities ({:.1f} MB) in {:.1f} seconds, {:.1f} entities/s, '
+      '{:.2f} MB/s'.format(
+        message, self.entities_restored, self.bytes_restored / 1000000.0,
+        elapsed, self.entities_restored / elapsed,
+        self.bytes_restored / 1000000.0 / elapsed))
+
+  def run_bulk_restore(self, backup_files):
+    """ Restores backup files using parallel processes that write entities and
+    indexes directly.
+
+    Args:
+      backup_files: A list of backup file locations.
+    Returns:
+      A list of the parts that could not be restored.
+    """
+    start = time.time()
+    composite_indexes = self.ds_distributed.datastore_batch.get_indices(
+      self.app_id)
+    pool = multiprocessing.Pool(
+      self.processes, init_bulk_worker,
+      (self.table, self.app_id, composite_indexes, self.BULK_WRITERS))
+
+    work = self.bulk_work(backup_files)
+    logging.info('Restoring {} parts with {} processes'.format(
+      len(work), self.processes))
+    last_report = time.time()
+    try:
+      for _ in range(self.BULK_RETRIES + 1):
+        failed = []
+        for part, entities, restored_bytes, error in pool.imap_unordered(
+            restore_unit, work):
+          if error is not None:
+            failed.append(part)
+            continue
+
+          self.entities_restored += entities
+          self.bytes_restored += restored_bytes
+          if time.time() - last_report > self.REPORT_PERIOD:
+            self.report_progress(start, 'Restore progress')
+            last_report = time.time()
+
+        if not failed:
+          break
+
+        logging.warning('Retrying {} parts'.format(len(failed)))
+        work = failed
+    finally:
+      pool.close()
+      pool.join()
+
+    self.report_progress(start, 'Bulk restore finished')
+    if failed:
+      logging.error('Unable to restore {} parts: {}'.format(
+        len(failed), failed))
+    return failed
+
   def run_restore(self):
     """ Runs the restore process. Reads the backup file and stores entities
     in batches.
@@ -162,9 +461,15 @@ class DatastoreRestore(multiprocessing.Process):
     logging.info("Restore started")
     start = time.time()
 
-    for backup_file in glob.glob('{0}/*{1}'.
-        format(self.backup_dir, DatastoreBackup.BACKUP_FILE_SUFFIX)):
-      if backup_file.endswith(".backup"):
+    backup_files = self.backup_files()
+    if self.bulk:
+      if not self.zoo_keeper.datastore_is_read_only():
+        logging.error('A bulk restore requires the datastore to be in '
+                      'read-only mode')
+        return
+      self.run_bulk_restore(backup_files)
+    else:
+      for backup_file in backup_files:
         logging.info("Restoring \"{0}\" data from: {1}".\
           format(self.app_id, backup_file))
         self.read_from_file_and_restore(backup_file)
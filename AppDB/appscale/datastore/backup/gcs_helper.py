@@ -4,19 +4,314 @@ import json
 import logging
 import os
 import requests
-import subprocess
+import time
 import urllib
 
+from multiprocessing.pool import ThreadPool
+
 import backup_recovery_helper
 
+from appscale.datastore.backup.backup_exceptions import GCSException
 from appscale.datastore.backup.br_constants import BACKUP_DIR_LOCATION
 from appscale.datastore.backup.br_constants import HTTP_OK
+from appscale.datastore.backup.br_constants import HTTP_PARTIAL_CONTENT
 
 # Google Cloud Storage prefix for apps/ directory.
 APPS_GCS_PREFIX = 'apps/'
 
-# The upload request timeout in seconds (12 hours).
-REQUEST_TIMEOUT = 12*60*60
+# The location of the Google Cloud Storage JSON API.
+GCS_API = 'https://www.googleapis.com'
+
+# The timeout for transferring a single chunk in seconds.
+CHUNK_TIMEOUT = 10*60
+
+# The number of bytes in each uploaded or downloaded chunk. This is a
+# multiple of 256 KB.
+CHUNK_SIZE = 32*1024*1024
+
+# The number of chunks transferred at the same time.
+TRANSFER_WORKERS = 4
+
+# The number of times to try transferring a chunk.
+CHUNK_ATTEMPTS = 4
+
+# The number of seconds to wait after a chunk fails, multiplied by the number
+# of failed attempts.
+RETRY_DELAY = 2
+
+# The maximum number of objects that can be combined in a compose request.
+MAX_COMPOSE_SOURCES = 32
+
+# The suffix added to the temporary object for each uploaded chunk.
+PART_SUFFIX = '.part-{:05d}'
+
+
+def object_url(bucket_name, object_name):
+  """ Builds the URL for an object's metadata.
+
+  Args:
+    bucket_name: A str, the name of the GCS bucket.
+    object_name: A str, the name of the object.
+  Returns:
+    A str containing the URL.
+  """
+  return '{0}/storage/v1/b/{1}/o/{2}'.format(
+    GCS_API, bucket_name, urllib.quote_plus(object_name))
+
+
+def with_retries(description, function, *args):
+  """ Calls a function until it succeeds or runs out of attempts.
+
+  Args:
+    description: A str describing the operation for the logs.
+    function: The function to call.
+    args: The arguments to pass to the function.
+  Returns:
+    The function's return value.
+  Raises:
+    GCSException if every attempt fails.
+  """
+  for attempt in range(1, CHUNK_ATTEMPTS + 1):
+    try:
+      return function(*args)
+    except (requests.RequestException, GCSException) as error:
+      logging.warning("Attempt {0} to {1} failed: {2}".format(
+        attempt, description, error))
+      if attempt < CHUNK_ATTEMPTS:
+        time.sleep(RETRY_DELAY * attempt)
+
+  raise GCSException("Unable to {0}".format(description))
+
+
+def upload_object(bucket_name, object_name, data):
+  """ Uploads data as a single object.
+
+  Args:
+    bucket_name: A str, the name of the GCS bucket.
+    object_name: A str, the name of the object.
+    data: A str containing the object's contents.
+  Raises:
+    GCSException if the upload is not accepted.
+  """
+  url = '{0}/upload/storage/v1/b/{1}/o?uploadType=media&name={2}'.format(
+    GCS_API, bucket_name, urllib.quote_plus(object_name))
+  response = gcs_post_request(url, data=data,
+    headers={'content-type': 'application/octet-stream'})
+  if response.status_code != HTTP_OK:
+    raise GCSException("Upload of '{0}' returned {1}".format(
+      object_name, response.status_code))
+
+
+def compose_objects(bucket_name, source_names, object_name):
+  """ Combines uploaded chunks into one object.
+
+  Objects with more chunks than a compose request allows are combined in
+  stages.
+
+  Args:
+    bucket_name: A str, the name of the GCS bucket.
+    source_names: A list of object names in the order they are combined.
+    object_name: A str, the name of the object to create.
+  Returns:
+    A list of the intermediate objects that were created.
+  Raises:
+    GCSException if a compose request fails. Any intermediate objects are
+    deleted first.
+  """
+  intermediates = []
+  try:
+    while len(source_names) > MAX_COMPOSE_SOURCES:
+      combined = []
+      for start in range(0, len(source_names), MAX_COMPOSE_SOURCES):
+        group = source_names[start:start + MAX_COMPOSE_SOURCES]
+        if len(group) == 1:
+          combined.extend(group)
+          continue
+
+        group_name = '{0}.compose-{1}-{2:05d}'.format(
+          object_name, len(intermediates), start // MAX_COMPOSE_SOURCES)
+        with_retries("compose '{0}'".format(group_name), compose_request,
+                     bucket_name, group, group_name)
+        intermediates.append(group_name)
+        combined.append(group_name)
+      source_names = combined
+
+    with_retries("compose '{0}'".format(object_name), compose_request,
+                 bucket_name, source_names, object_name)
+  except GCSException:
+    delete_objects(bucket_name, intermediates)
+    raise
+
+  return intermediates
+
+
+def compose_request(bucket_name, source_names, object_name):
+  """ Sends a single compose request.
+
+  Args:
+    bucket_name: A str, the name of the GCS bucket.
+    source_names: A list of at most MAX_COMPOSE_SOURCES object names.
+    object_name: A str, the name of the object to create.
+  Raises:
+    GCSException if the request is not accepted.
+  """
+  body = {
+    'sourceObjects': [{'name': name} for name in source_names],
+    'destination': {'contentType': 'application/x-gzip'}
+  }
+  url = '{0}/compose'.format(object_url(bucket_name, object_name))
+  response = gcs_post_request(url, data=json.dumps(body),
+    headers={'content-type': 'application/json'})
+  if response.status_code != HTTP_OK:
+    raise GCSException("Compose of '{0}' returned {1}".format(
+      object_name, response.status_code))
+
+
+def delete_objects(bucket_name, object_names):
+  """ Removes temporary objects. Failures are only logged.
+
+  Args:
+    bucket_name: A str, the name of the GCS bucket.
+    object_names: A list of object names.
+  """
+  for object_name in object_names:
+    try:
+      gcs_delete_request(object_url(bucket_name, object_name))
+    except requests.RequestException as error:
+      logging.warning("Unable to delete '{0}': {1}".format(object_name, error))
+
+
+class ChunkedUpload(object):
+  """ A file-like object that uploads what is written to it in parallel
+  chunks, which are combined into one object when it is closed. """
+  def __init__(self, bucket_name, object_name, chunk_size=None,
+               workers=None):
+    """ Constructor.
+
+    Args:
+      bucket_name: A str, the name of the GCS bucket.
+      object_name: A str, the name of the object to create.
+      chunk_size: The number of bytes in each chunk.
+      workers: The number of chunks to upload at the same time.
+    """
+    self.bucket_name = bucket_name
+    self.object_name = object_name
+    self.chunk_size = chunk_size or CHUNK_SIZE
+    self.workers = workers or TRANSFER_WORKERS
+    self.pool = ThreadPool(self.workers)
+    self.buffer = []
+    self.buffer_size = 0
+    self.part_names = []
+    self.pending = []
+    self.bytes_uploaded = 0
+    self.closed = False
+
+  def write(self, data):
+    """ Adds data to the object, uploading each chunk as it fills.
+
+    Args:
+      data: A str.
+    Raises:
+      GCSException if the upload is closed or a chunk could not be uploaded.
+    """
+    if self.closed:
+      raise GCSException("Upload of '{0}' is already closed".format(
+        self.object_name))
+
+    self.buffer.append(data)
+    self.buffer_size += len(data)
+    while self.buffer_size >= self.chunk_size:
+      buffered = ''.join(self.buffer)
+      self.start_part(buffered[:self.chunk_size])
+      remainder = buffered[self.chunk_size:]
+      self.buffer = [remainder]
+      self.buffer_size = len(remainder)
+
+  def start_part(self, data):
+    """ Starts uploading a chunk. Waits for an earlier chunk to finish when
+    too many are in progress, which limits the memory used.
+
+    Args:
+      data: A str containing the chunk.
+    Raises:
+      GCSException if an earlier chunk could not be uploaded.
+    """
+    while len(self.pending) >= self.workers * 2:
+      self.pending.pop(0).get()
+
+    part_name = self.object_name + PART_SUFFIX.format(len(self.part_names))
+    self.part_names.append(part_name)
+    self.pending.append(self.pool.apply_async(
+      with_retries,
+      ("upload '{0}'".format(part_name), upload_object, self.bucket_name,
+       part_name, data)))
+    self.bytes_uploaded += len(data)
+
+  def close(self):
+    """ Uploads the last chunk and combines the chunks into the object.
+
+    Raises:
+      GCSException if the object could not be created.
+    """
+    self.closed = True
+    temporary = list(self.part_names)
+    try:
+      if self.buffer_size > 0 or not self.part_names:
+        self.start_part(''.join(self.buffer))
+        temporary = list(self.part_names)
+        self.buffer = []
+        self.buffer_size = 0
+
+      while self.pending:
+        self.pending.pop(0).get()
+
+      temporary.extend(compose_objects(self.bucket_name, self.part_names,
+                                       self.object_name))
+    finally:
+      self.pool.close()
+      self.pool.join()
+      delete_objects(self.bucket_name, temporary)
+
+  def abort(self):
+    """ Stops the upload without creating the object and removes the chunks
+    uploaded so far. Does nothing if the upload was already closed. """
+    if self.closed:
+      return
+
+    self.closed = True
+    self.pool.close()
+    self.pool.join()
+    self.pending = []
+    delete_objects(self.bucket_name, self.part_names)
+
+
+def upload_stream(full_object_name, source):
+  """ Uploads the contents of a file-like object to GCS.
+
+  Args:
+    full_object_name: A str, a full GCS object name.
+    source: A file-like object opened for reading.
+  Returns:
+    The number of bytes uploaded.
+  Raises:
+    GCSException if the upload fails.
+  """
+  bucket_name, object_name = extract_gcs_tokens(full_object_name)
+  if not bucket_name or not object_name:
+    raise GCSException("Invalid GCS object name '{0}'".format(
+      full_object_name))
+
+  upload = ChunkedUpload(bucket_name, object_name)
+  try:
+    while True:
+      data = source.read(upload.chunk_size)
+      if not data:
+        break
+      upload.write(data)
+    upload.close()
+  finally:
+    upload.abort()
+  return upload.bytes_uploaded
 
 
 def upload_to_bucket(full_object_name, local_path):
@@ -42,37 +337,64 @@ def upload_to_bucket(full_object_name, local_path):
       "GCS.".format(local_path))
     return False
 
-  # First HTTP request that initiates the upload.
-  url = 'https://www.googleapis.com/upload/storage/v1/b/{0}' \
-        '/o?uploadType=resumable&name={1}'.format(bucket_name, object_name)
+  start = time.time()
   try:
-    response = gcs_post_request(url)
-    location = response.headers['Location']
-    logging.debug("Response Header Location (aka /upload URL): {0}".
-      format(location))
-  except requests.HTTPError as error:
-    logging.error("HTTPError on getting GCS session ID. Error: {0}".
-      format(error))
-    return False
-  except KeyError as key_error:
-    logging.error("KeyError on getting GCS session ID. Error: {0}.".
-      format(key_error))
-    return False
-
-  # Actual file upload.
-  new_url = location
-  try:
-    response = gcs_put_request(new_url, local_path)
-    logging.debug("Final GCS response: {0}".format(str(response)))
-  except requests.HTTPError as error:
-    logging.error("Error on initial GCS upload".format(error))
+    with open(local_path, 'rb') as source:
+      size = upload_stream(full_object_name, source)
+  except (IOError, GCSException) as error:
+    logging.error("Error while uploading '{0}' to GCS: {1}".format(
+      local_path, error))
     return False
 
   logging.info("Successfully uploaded '{0}' to GCS. "
-    "GCS object name is '{1}'.".format(local_path, full_object_name))
+    "GCS object name is '{1}'. {2}".format(
+      local_path, full_object_name, transfer_rate(size, start)))
   return True
 
 
+def transfer_rate(size, start):
+  """ Describes how quickly data was transferred.
+
+  Args:
+    size: The number of bytes transferred.
+    start: The time the transfer started.
+  Returns:
+    A str.
+  """
+  elapsed = max(time.time() - start, 0.001)
+  return 'Transferred {0} bytes in {1:.1f} seconds ({2:.2f} MB/s).'.format(
+    size, elapsed, size / 1000000.0 / elapsed)
+
+
+def download_range(url, local_path, start, end):
+  """ Downloads part of an object into its place in a local file.
+
+  Args:
+    url: A str, the object's media link.
+    local_path: A str, the path to the local file.
+    start: The offset of the first byte.
+    end: The offset of the last byte (inclusive).
+  Raises:
+    GCSException if the range could not be downloaded.
+  """
+  response = gcs_get_request(url, headers={
+    'Range': 'bytes={0}-{1}'.format(start, end)}, stream=True)
+  if response.status_code != HTTP_PARTIAL_CONTENT:
+    raise GCSException("Range request returned {0}".format(
+      response.status_code))
+
+  written = 0
+  with open(local_path, 'r+b') as local_file:
+    local_file.seek(start)
+    for data in response.iter_content(1024*1024):
+      local_file.write(data)
+      written += len(data)
+
+  if written != end - start + 1:
+    raise GCSException("Received {0} of {1} bytes".format(
+      written, end - start + 1))
+
+
 def download_from_bucket(full_object_name, local_path):
   """ Downloads a file from GCS.
 
@@ -90,8 +412,7 @@ def download_from_bucket(full_object_name, local_path):
     return False
 
   # First send HTTP request to retrieve file metadata.
-  url = "https://www.googleapis.com/storage/v1/b/{0}/o/{1}".format(
-    bucket_name, urllib.quote_plus(object_name))
+  url = object_url(bucket_name, object_name)
   try:
     response = gcs_get_request(url)
     if response.status_code != HTTP_OK:
@@ -111,22 +432,38 @@ def download_from_bucket(full_object_name, local_path):
   bytes_available = disk_stats.f_bavail * disk_stats.f_frsize
 
   # Compare to GCS file size.
-  if int(content['size']) >= bytes_available:
+  size = int(content['size'])
+  if size >= bytes_available:
     logging.error('Not enough space to download a backup.')
     return False
 
-  # Invoke 'curl' to retrieve the resource and store to local_path.
+  # Download ranges of the object in parallel into a file of the final size.
+  start = time.time()
+  pool = ThreadPool(TRANSFER_WORKERS)
   try:
-    logging.debug("Downloading GCS object: curl -o {0} {1}".format(
-      local_path, content['mediaLink']))
-    subprocess.check_output(['curl', '-o', local_path, content['mediaLink']])
-  except subprocess.CalledProcessError as called_process_error:
+    with open(local_path, 'wb') as local_file:
+      local_file.truncate(size)
+
+    results = [
+      pool.apply_async(with_retries, (
+        "download bytes {0}-{1} of '{2}'".format(
+          offset, min(offset + CHUNK_SIZE, size) - 1, full_object_name),
+        download_range, content['mediaLink'], local_path, offset,
+        min(offset + CHUNK_SIZE, size) - 1))
+      for offset in range(0, size, CHUNK_SIZE)]
+    for result in results:
+      result.get()
+  except (IOError, GCSException) as error:
     logging.error("Error while downloading file from GCS. Error: {0}".
-      format(called_process_error))
+      format(error))
     return False
+  finally:
+    pool.close()
+    pool.join()
 
   logging.info("Successfully downloaded '{0}' from GCS. "
-    "Local file name is '{1}'.".format(full_object_name, local_path))
+    "Local file name is '{1}'. {2}".format(
+      full_object_name, local_path, transfer_rate(size, start)))
   return True
 
 
@@ -156,39 +493,43 @@ def extract_gcs_tokens(full_object_name):
   return bucket_name, object_name
 
 
-def gcs_get_request(url):
+def gcs_get_request(url, headers=None, stream=False):
   """ Performs a GET request to the given url.
 
   Args:
-    url: A str, the URL to POST to.
+    url: A str, the URL to GET.
+    headers: A dictionary of headers to send.
+    stream: A boolean indicating whether to stream the response body.
   Raises:
     HTTPError if the resource cannot be reached.
   """
-  return requests.request('GET', url, verify=False)
+  return requests.request('GET', url, headers=headers, stream=stream,
+    timeout=CHUNK_TIMEOUT, verify=False)
 
 
-def gcs_post_request(url):
+def gcs_post_request(url, data=None, headers=None):
   """ Performs a POST request to the given url.
 
   Args:
     url: A str, the URL to POST to.
+    data: A str containing the request body.
+    headers: A dictionary of headers to send.
   Raises:
     HTTPError if the resource cannot be reached.
   """
-  return requests.request('POST', url, verify=False)
+  return requests.request('POST', url, data=data, headers=headers,
+    timeout=CHUNK_TIMEOUT, verify=False)
 
 
-def gcs_put_request(url, local_path):
-  """ Performs a PUT request to the given url.
+def gcs_delete_request(url):
+  """ Performs a DELETE request to the given url.
 
   Args:
-    url: A str, the URL to send data to.
+    url: A str, the URL of the resource to delete.
   Raises:
     HTTPError if the resource cannot be reached.
   """
-  return requests.request('PUT', url, data=open(local_path, 'rb'),
-    headers={'content-type': 'application/x-gzip'},
-    timeout=REQUEST_TIMEOUT, verify=False)
+  return requests.request('DELETE', url, timeout=CHUNK_TIMEOUT, verify=False)
 
 
 def list_bucket(bucket_name):
@@ -199,8 +540,7 @@ def list_bucket(bucket_name):
   Returns:
     A list of str, the names of the files in the bucket.
   """
-  url = "https://www.googleapis.com/storage/v1/b/{0}/o".\
-    format(bucket_name)
+  url = "{0}/storage/v1/b/{1}/o".format(GCS_API, bucket_name)
   try:
     response = gcs_get_request(url)
     if response.status_code != HTTP_OK:
@@ -5,6 +5,7 @@
 """
 import cassandra
 import logging
+import random
 import sys
 import time
 
@@ -61,6 +62,13 @@ PRIMED_KEY = 'primed'
 # The size in bytes that a batch must be to use the batches table.
 LARGE_BATCH_THRESHOLD = 5 << 10
 
+# The number of seconds an entity group lease is held before it expires.
+GROUP_LEASE_TTL = 30
+
+# The number of counter rows that each kind's statistics are spread across.
+# Writers pick a row at random to avoid contending on a single counter.
+STATS_SHARDS = 16
+
 
 def batch_size(batch):
   """ Calculates the size of a batch.
@@ -142,25 +150,27 @@ def index_deletions(old_entity, new_entity, composite_indices=()):
   kind = get_entity_kind(old_entity.key())
   entity_key = str(encode_index_pb(old_entity.key().path()))
 
-  new_props = {}
-  for prop in new_entity.property_list():
-    if prop.name() not in new_props:
-      new_props[prop.name()] = []
-    new_props[prop.name()].append(prop)
-
-  changed_props = {}
-  for prop in old_entity.property_list():
-    if prop.name() in new_props and prop in new_props[prop.name()]:
-      continue
+  prefix = dbconstants.KEY_DELIMITER.join([app_id, namespace])
 
-    if prop.name() not in changed_props:
-      changed_props[prop.name()] = []
-    changed_props[prop.name()].append(prop)
+  # Compare index keys rather than properties. Properties can differ in fields
+  # that are not part of the key (such as whether the property is repeated),
+  # and a deletion in the same batch as a put for the same row wins the
+  # timestamp tie, which would remove the new entry.
+  new_keys = set(entry[0] for entry
+                 in get_index_kv_from_tuple([(prefix, new_entity)]))
 
+  changed_prop_names = set()
+  deleted_keys = set()
+  for prop in old_entity.property_list():
     value = str(encode_index_pb(prop.value()))
 
     key = dbconstants.KEY_DELIMITER.join(
       [app_id, namespace, kind, prop.name(), value, entity_key])
+    if key in new_keys or key in deleted_keys:
+      continue
+
+    changed_prop_names.add(prop.name())
+    deleted_keys.add(key)
     deletions.append({'table': dbconstants.ASC_PROPERTY_TABLE,
                       'key': key,
                       'operation': TxnActions.DELETE})
@@ -172,7 +182,6 @@ def index_deletions(old_entity, new_entity, composite_indices=()):
                       'key': reverse_key,
                       'operation': TxnActions.DELETE})
 
-  changed_prop_names = set(changed_props.keys())
   for index in composite_indices:
     if index.definition().entity_type() != kind:
       continue
@@ -252,6 +261,33 @@ def mutations_for_entity(entity, txn, current_value=None,
   return mutations
 
 
+def stats_deltas(entity_changes):
+  """ Calculates how entity changes affect datastore statistics.
+
+  Args:
+    entity_changes: A list of dictionaries containing the key, the old entity,
+      and the new entity for each change.
+  Returns:
+    A dictionary mapping (namespace, kind) tuples to (bytes, entities) tuples
+    of changes.
+  """
+  deltas = {}
+  for entity_change in entity_changes:
+    key = entity_change['key']
+    stat_key = (key.name_space(), get_entity_kind(key))
+    size, number = deltas.get(stat_key, (0, 0))
+    if entity_change['old'] is not None:
+      size -= entity_change['old'].ByteSize()
+      number -= 1
+    if entity_change['new'] is not None:
+      size += entity_change['new'].ByteSize()
+      number += 1
+    deltas[stat_key] = (size, number)
+
+  return {stat_key: delta for stat_key, delta in deltas.iteritems()
+          if delta != (0, 0)}
+
+
 class FailedBatch(Exception):
   pass
 
@@ -332,6 +368,9 @@ class DatastoreProxy(AppDBInterface):
 
     self.session.default_consistency_level = ConsistencyLevel.QUORUM
 
+    # Indicates that a missing entity_stats table has been reported.
+    self.missing_stats_reported = False
+
   def close(self):
     """ Close all sessions and connections to Cassandra. """
     self.cluster.shutdown()
@@ -636,6 +675,169 @@ class DatastoreProxy(AppDBInterface):
     else:
       self._normal_batch(mutations)
 
+  def acquire_group_lease(self, app, entity_group, holder,
+                          ttl=GROUP_LEASE_TTL):
+    """ Takes an exclusive lease on an entity group for a write that does not
+    use ZooKeeper.
+
+    Args:
+      app: A string containing the application ID.
+      entity_group: A string containing the root key of the entity group.
+      holder: A UUID identifying the writer.
+      ttl: The number of seconds before the lease expires.
+    Returns:
+      A boolean indicating whether or not the lease was acquired.
+    Raises:
+      AppScaleDBConnectionError if the lease could not be requested.
+    """
+    statement = """
+      UPDATE group_leases USING TTL {ttl}
+      SET holder = %(holder)s
+      WHERE app = %(app)s AND entity_group = %(entity_group)s
+      IF holder = NULL
+    """.format(ttl=ttl)
+    query = SimpleStatement(statement, retry_policy=self.no_retries)
+    parameters = {'app': app, 'entity_group': bytearray(entity_group),
+                  'holder': holder}
+    try:
+      return self.session.execute(query, parameters).was_applied
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during acquire_group_lease'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
+  def release_group_lease(self, app, entity_group, holder):
+    """ Releases a lease taken with acquire_group_lease.
+
+    Args:
+      app: A string containing the application ID.
+      entity_group: A string containing the root key of the entity group.
+      holder: The UUID used to acquire the lease.
+    Returns:
+      A boolean indicating whether or not the lease was still held.
+    Raises:
+      AppScaleDBConnectionError if the lease could not be released.
+    """
+    statement = """
+      DELETE FROM group_leases
+      WHERE app = %(app)s AND entity_group = %(entity_group)s
+      IF holder = %(holder)s
+    """
+    query = SimpleStatement(statement, retry_policy=self.no_retries)
+    parameters = {'app': app, 'entity_group': bytearray(entity_group),
+                  'holder': holder}
+    try:
+      return self.session.execute(query, parameters).was_applied
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during release_group_lease'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
+  def group_lease_held(self, app, entity_group):
+    """ Checks if a writer currently holds a lease on an entity group.
+
+    The read uses SERIAL consistency so that it reflects every lease that has
+    been acquired.
+
+    Args:
+      app: A string containing the application ID.
+      entity_group: A string containing the root key of the entity group.
+    Returns:
+      A boolean indicating whether or not the lease is held.
+    Raises:
+      AppScaleDBConnectionError if the lease could not be checked.
+    """
+    statement = """
+      SELECT holder FROM group_leases
+      WHERE app = %(app)s AND entity_group = %(entity_group)s
+    """
+    query = SimpleStatement(statement, retry_policy=self.retry_policy,
+                            consistency_level=ConsistencyLevel.SERIAL)
+    parameters = {'app': app, 'entity_group': bytearray(entity_group)}
+    try:
+      results = list(self.session.execute(query, parameters))
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during group_lease_held'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
+    return bool(results) and results[0].holder is not None
+
+  def update_entity_stats(self, app, deltas):
+    """ Adds changes to the statistics counters for an application.
+
+    Counter updates are not idempotent, so they are not retried. Any drift is
+    corrected when the groomer reconciles the counters with a full scan.
+
+    Args:
+      app: A string containing the application ID.
+      deltas: A dictionary mapping (namespace, kind) tuples to
+        (bytes, entities) tuples.
+    Raises:
+      AppScaleDBConnectionError if the counters could not be updated.
+    """
+    # Upgraded deployments don't have the table until the groomer creates it.
+    # The driver keeps the schema metadata current, so checking it does not
+    # cost a round trip.
+    keyspace = self.cluster.metadata.keyspaces.get(KEYSPACE)
+    if keyspace is None or 'entity_stats' not in keyspace.tables:
+      if not self.missing_stats_reported:
+        self.logger.warning('The entity_stats table does not exist yet. '
+                            'Statistics are not updated until it is created.')
+        self.missing_stats_reported = True
+      return
+
+    statement = """
+      UPDATE entity_stats
+      SET bytes = bytes + %(bytes)s, entities = entities + %(entities)s
+      WHERE app = %(app)s AND namespace = %(namespace)s
+      AND kind = %(kind)s AND shard = %(shard)s
+    """
+    query = SimpleStatement(statement, retry_policy=self.no_retries)
+    futures = []
+    for (namespace, kind), (size, number) in deltas.iteritems():
+      parameters = {'bytes': size, 'entities': number, 'app': app,
+                    'namespace': namespace, 'kind': kind,
+                    'shard': random.randrange(STATS_SHARDS)}
+      futures.append(self.session.execute_async(query, parameters))
+
+    try:
+      for future in futures:
+        future.result()
+    except (cassandra.InvalidRequest,) + dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during update_entity_stats'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
+  def get_entity_stats(self):
+    """ Fetches the statistics counters for every application.
+
+    Returns:
+      A dictionary mapping application IDs to dictionaries that map
+      (namespace, kind) tuples to (bytes, entities) tuples.
+    Raises:
+      AppScaleDBConnectionError if the counters could not be fetched.
+    """
+    statement = """
+      SELECT app, namespace, kind, bytes, entities FROM entity_stats
+    """
+    query = SimpleStatement(statement, retry_policy=self.retry_policy)
+    try:
+      results = self.session.execute(query)
+      stats = {}
+      for result in results:
+        app_stats = stats.setdefault(result.app.encode('utf-8'), {})
+        stat_key = (result.namespace.encode('utf-8'),
+                    result.kind.encode('utf-8'))
+        size, number = app_stats.get(stat_key, (0, 0))
+        app_stats[stat_key] = (size + result.bytes, number + result.entities)
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      message = 'Exception during get_entity_stats'
+      logging.exception(message)
+      raise AppScaleDBConnectionError(message)
+
+    return stats
+
   def batch_delete(self, table_name, row_keys, column_names=()):
     """
     Remove a set of rows corresponding to a set of keys.
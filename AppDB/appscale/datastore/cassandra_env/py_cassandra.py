@@ -31,6 +31,9 @@ PROFILING = False
 
 MAX_ROW_COUNT = 10000000
 
+# The number of row keys to fetch in each page when listing a table.
+KEY_PAGE_SIZE = 1000
+
 
 class DatastoreProxy(AppDBInterface):
   def __init__(self):
@@ -82,6 +85,52 @@ class DatastoreProxy(AppDBInterface):
       list.append(results_dict[column])
     return list
 
+  def batch_get_entity(self, table_name, row_keys, column_names):
+    """ Fetches the given columns for many rows with a single query.
+
+    Args:
+      table_name: A string containing the name of the table.
+      row_keys: A list of row keys to fetch.
+      column_names: A list of column names to retrieve values for.
+    Returns:
+      A dictionary mapping each row key that exists to a dictionary of
+      column names and values.
+    Raises:
+      AppScaleDBConnectionError if the rows could not be fetched.
+    """
+    if not row_keys:
+      return {}
+
+    prefix = table_name + '/'
+    statement = """
+      SELECT * FROM "{table}"
+      WHERE {key} IN %(keys)s
+      AND {column} IN %(columns)s
+    """.format(table=table_name,
+               key=ThriftColumn.KEY,
+               column=ThriftColumn.COLUMN_NAME)
+    query = SimpleStatement(statement, retry_policy=self.retry_policy)
+    # Keys decoded from JSON are unicode, which bytearray cannot convert.
+    keys = []
+    for row_key in set(row_keys):
+      if isinstance(row_key, unicode):
+        row_key = row_key.encode('utf-8')
+      keys.append(bytearray(prefix + row_key))
+    parameters = {
+      'keys': ValueSequence(keys),
+      'columns': ValueSequence(column_names)}
+    try:
+      results = self.session.execute(query, parameters)
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      raise AppScaleDBConnectionError('Unable to fetch entities')
+
+    rows = {}
+    for (key, column, value) in results:
+      row_key = str(key)[len(prefix):]
+      rows.setdefault(row_key, {})[column] = value
+
+    return rows
+
   def put_entity(self, table_name, row_key, column_names, cell_values):
     error = [ERROR_DEFAULT]
     list = error
@@ -164,6 +213,39 @@ class DatastoreProxy(AppDBInterface):
 
     return response
 
+  def iterate_row_keys(self, table_name, start_after=''):
+    """ Lists the row keys in a table without fetching any columns. Pages
+    are fetched as the keys are consumed.
+
+    Args:
+      table_name: A string containing the name of the table.
+      start_after: A string specifying the row key to list from. Only keys
+        that follow it are included.
+    Yields:
+      Row keys in token order.
+    Raises:
+      AppScaleDBConnectionError if the keys could not be fetched.
+    """
+    prefix = table_name + '/'
+    statement = 'SELECT DISTINCT {key} FROM "{table}"'.format(
+      table=table_name, key=ThriftColumn.KEY)
+    parameters = None
+    if start_after:
+      statement += ' WHERE token({key}) > token(%s)'.format(
+        key=ThriftColumn.KEY)
+      parameters = (bytearray(prefix + start_after),)
+
+    query = SimpleStatement(statement, retry_policy=self.retry_policy,
+                            fetch_size=KEY_PAGE_SIZE)
+    try:
+      results = self.session.execute(query, parameters)
+      for (key,) in results:
+        key = str(key)
+        if key.startswith(prefix):
+          yield key[len(prefix):]
+    except dbconstants.TRANSIENT_CASSANDRA_ERRORS:
+      raise AppScaleDBConnectionError('Unable to fetch row keys')
+
   def delete_row(self, table_name, row_key):
     response = [ERROR_DEFAULT]
     row_key = bytearray('/'.join([table_name, row_key]))
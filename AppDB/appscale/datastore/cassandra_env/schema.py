@@ -104,6 +104,61 @@ def create_batch_tables(cluster, session):
     raise
 
 
+def create_group_leases_table(session):
+  """ Create the table that holds entity group leases for lock-free writes.
+
+  Args:
+    session: A cassandra-driver session.
+  """
+  logging.info('Trying to create group_leases')
+  create_table = """
+    CREATE TABLE IF NOT EXISTS group_leases (
+      app text,
+      entity_group blob,
+      holder uuid,
+      PRIMARY KEY ((app, entity_group))
+    )
+  """
+  statement = SimpleStatement(create_table, retry_policy=NO_RETRIES)
+  try:
+    session.execute(statement)
+  except cassandra.OperationTimedOut:
+    logging.warning(
+      'Encountered an operation timeout while creating group_leases table. '
+      'Waiting 1 minute for schema to settle.')
+    time.sleep(60)
+    raise
+
+
+def create_entity_stats_table(session):
+  """ Create the table that holds statistics counters for each kind.
+
+  Args:
+    session: A cassandra-driver session.
+  """
+  logging.info('Trying to create entity_stats')
+  create_table = """
+    CREATE TABLE IF NOT EXISTS entity_stats (
+      app text,
+      namespace text,
+      kind text,
+      shard int,
+      bytes counter,
+      entities counter,
+      PRIMARY KEY ((app), namespace, kind, shard)
+    )
+  """
+  statement = SimpleStatement(create_table, retry_policy=NO_RETRIES)
+  try:
+    session.execute(statement)
+  except cassandra.OperationTimedOut:
+    logging.warning(
+      'Encountered an operation timeout while creating entity_stats table. '
+      'Waiting 1 minute for schema to settle.')
+    time.sleep(60)
+    raise
+
+
 def prime_cassandra(replication):
   """ Create Cassandra keyspace and initial tables.
 
@@ -170,6 +225,8 @@ def prime_cassandra(replication):
       raise
 
   create_batch_tables(cluster, session)
+  create_group_leases_table(session)
+  create_entity_stats_table(session)
   create_pull_queue_tables(cluster, session)
 
   first_entity = session.execute(
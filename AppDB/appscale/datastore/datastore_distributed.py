@@ -5,6 +5,7 @@ import md5
 import random
 import sys
 import time
+import uuid
 
 import dbconstants
 import helper_functions
@@ -97,13 +98,21 @@ class DatastoreDistributed():
   # The number of entities to fetch at a time when updating indices.
   BATCH_SIZE = 100
 
-  def __init__(self, datastore_batch, zookeeper=None, log_level=logging.INFO):
+  # The version stored with entities that are written while holding an entity
+  # group lease. ZooKeeper never assigns this transaction ID.
+  LOCK_FREE_VERSION = 0
+
+  def __init__(self, datastore_batch, zookeeper=None, log_level=logging.INFO,
+               lock_free_writes=False):
     """
        Constructor.
      
      Args:
        datastore_batch: A reference to the batch datastore interface.
        zookeeper: A reference to the zookeeper interface.
+       log_level: A logging constant that specifies the instance logging level.
+       lock_free_writes: A boolean indicating whether non-transactional writes
+         should use entity group leases instead of ZooKeeper locks.
     """
     class_name = self.__class__.__name__
     self.logger = logging.getLogger(class_name)
@@ -119,6 +128,8 @@ class DatastoreDistributed():
     # zookeeper instance for accesing ZK functionality.
     self.zookeeper = zookeeper
 
+    self.lock_free_writes = lock_free_writes
+
   def get_limit(self, query):
     """ Returns the limit that should be used for the given query.
   
@@ -529,6 +540,26 @@ class DatastoreDistributed():
     """
     self.logger.debug('Inserting {} entities with transaction hash {}'.
                       format(len(entities), txn_hash))
+    entity_changes = []
+    try:
+      for batch, entity_change, txn in self.put_mutations(
+          entities, txn_hash, composite_indexes):
+        self.datastore_batch.batch_mutate(app, batch, [entity_change], txn)
+        entity_changes.append(entity_change)
+    finally:
+      self.update_stats(app, entity_changes)
+
+  def put_mutations(self, entities, txn_hash, composite_indexes=()):
+    """ Gets the mutations needed to store each entity.
+
+    Args:
+      entities: List of entities.
+      txn_hash: A mapping of root keys to transaction IDs.
+      composite_indexes: A list or tuple of CompositeIndex objects.
+    Returns:
+      A list of tuples containing a batch, an entity change, and a
+      transaction ID for each entity.
+    """
     entity_keys = []
     for entity in entities:
       prefix = self.get_table_prefix(entity)
@@ -537,6 +568,8 @@ class DatastoreDistributed():
     current_values = self.datastore_batch.batch_get_entity(
       dbconstants.APP_ENTITY_TABLE, entity_keys, APP_ENTITY_SCHEMA)
 
+    mutations = []
+    previous_entities = {}
     for entity in entities:
       prefix = self.get_table_prefix(entity)
       entity_key = get_entity_key(prefix, entity.key().path())
@@ -544,7 +577,9 @@ class DatastoreDistributed():
       txn = txn_hash[root_key]
 
       current_value = None
-      if current_values[entity_key]:
+      if entity_key in previous_entities:
+        current_value = previous_entities[entity_key]
+      elif current_values[entity_key]:
         current_value = entity_pb.EntityProto(
           current_values[entity_key][APP_ENTITY_SCHEMA[0]])
 
@@ -553,7 +588,12 @@ class DatastoreDistributed():
 
       entity_change = {'key': entity.key(),
                        'old': current_value, 'new': entity}
-      self.datastore_batch.batch_mutate(app, batch, [entity_change], txn)
+      mutations.append((batch, entity_change, txn))
+
+      # If the same key is written again in this request, the next version
+      # replaces this one rather than the stored one.
+      previous_entities[entity_key] = entity
+    return mutations
 
   def delete_entities(self, app, keys, txn_hash, composite_indexes=()):
     """ Deletes the entities and the indexes associated with them.
@@ -564,6 +604,26 @@ class DatastoreDistributed():
       txn_hash: A mapping of root keys to transaction IDs.
       composite_indexes: A list or tuple of CompositeIndex objects.
     """
+    entity_changes = []
+    try:
+      for batch, entity_change, txn in self.delete_mutations(
+          keys, txn_hash, composite_indexes):
+        self.datastore_batch.batch_mutate(app, batch, [entity_change], txn)
+        entity_changes.append(entity_change)
+    finally:
+      self.update_stats(app, entity_changes)
+
+  def delete_mutations(self, keys, txn_hash, composite_indexes=()):
+    """ Gets the mutations needed to delete each existing entity.
+
+    Args:
+      keys: A list of keys to be deleted.
+      txn_hash: A mapping of root keys to transaction IDs.
+      composite_indexes: A list or tuple of CompositeIndex objects.
+    Returns:
+      A list of tuples containing a batch, an entity change, and a
+      transaction ID for each entity.
+    """
     entity_keys = []
     for key in keys:
       prefix = self.get_table_prefix(key)
@@ -573,21 +633,65 @@ class DatastoreDistributed():
     current_values = self.datastore_batch.batch_get_entity(
       dbconstants.APP_ENTITY_TABLE, entity_keys, APP_ENTITY_SCHEMA)
 
+    mutations = []
     for key in entity_keys:
-      if not current_values[key]:
+      # Each entity only needs to be deleted once.
+      current_row = current_values.pop(key, None)
+      if not current_row:
         continue
 
       root_key = self.get_root_key_from_entity_key(key)
       txn = txn_hash[root_key]
 
-      current_value = entity_pb.EntityProto(
-        current_values[key][APP_ENTITY_SCHEMA[0]])
+      current_value = entity_pb.EntityProto(current_row[APP_ENTITY_SCHEMA[0]])
       batch = cassandra_interface.deletions_for_entity(
         current_value, composite_indexes)
 
       entity_change = {'key': current_value.key(),
                        'old': current_value, 'new': None}
-      self.datastore_batch.batch_mutate(app, batch, [entity_change], txn)
+      mutations.append((batch, entity_change, txn))
+    return mutations
+
+  def apply_lock_free_mutations(self, app, entities, get_mutations):
+    """ Applies non-transactional mutations while holding entity group leases
+    instead of ZooKeeper locks.
+
+    Large batches are left to the ZooKeeper path because interrupted ones are
+    recovered by the transaction garbage collector.
+
+    Args:
+      app: A string containing the application ID.
+      entities: A list of entities or keys being mutated.
+      get_mutations: A function that takes a mapping of root keys to
+        transaction IDs and returns the mutations for the entities.
+    Returns:
+      A boolean indicating whether or not the mutations were applied.
+    Raises:
+      ZKTransactionException: If the leases could not be acquired.
+    """
+    # Transactions only wait for leases while a lock-free writer is known.
+    self.zookeeper.enable_lock_free_writes()
+    leases = self.acquire_leases_for_nontrans(
+      app, entities, retries=self.NON_TRANS_LOCK_RETRY_COUNT)
+    try:
+      txn_hash = {root_key: self.LOCK_FREE_VERSION for root_key in leases}
+      mutations = get_mutations(txn_hash)
+      for batch, _, _ in mutations:
+        if (cassandra_interface.batch_size(batch) >
+            cassandra_interface.LARGE_BATCH_THRESHOLD):
+          return False
+
+      entity_changes = []
+      try:
+        for batch, entity_change, txn in mutations:
+          self.datastore_batch.batch_mutate(app, batch, [entity_change], txn)
+          entity_changes.append(entity_change)
+      finally:
+        self.update_stats(app, entity_changes)
+    finally:
+      self.release_leases_for_nontrans(app, leases)
+
+    return True
 
   def delete_entities_txn(self, app, keys, txn_hash):
     """ Updates the transaction table with entities to delete.
@@ -671,6 +775,11 @@ class DatastoreDistributed():
         txn_hash = self.acquire_locks_for_trans(
           entities, put_request.transaction().handle())
         self.put_entities_txn(entities, txn_hash, app_id)
+      elif self.lock_free_writes and self.apply_lock_free_mutations(
+          app_id, entities,
+          lambda leases: self.put_mutations(
+            entities, leases, put_request.composite_index_list())):
+        self.logger.debug('Updated {} entities'.format(len(entities)))
       else:
         txn_hash = self.acquire_locks_for_nontrans(app_id, entities, 
           retries=self.NON_TRANS_LOCK_RETRY_COUNT)
@@ -761,7 +870,71 @@ class DatastoreDistributed():
       raise zkte
 
     return txn_hash
-      
+
+  def acquire_leases_for_nontrans(self, app_id, entities, retries=0):
+    """ Acquires entity group leases for non-transaction operations.
+
+    This is used instead of acquire_locks_for_nontrans when lock-free writes
+    are enabled. After each lease is taken, the group is checked for a
+    ZooKeeper lock so that the write does not interfere with an ongoing
+    transaction. Transactions wait for leases to be released after taking
+    their locks.
+
+    Args:
+      app_id: The application ID.
+      entities: A list of entities (either entity_pb.EntityProto or a 
+                entity_pb.Reference) that we want to acquire leases for.
+      retries: The number of times to retry if a group is in use.
+    Returns:
+      A dictionary mapping root keys to lease holder UUIDs.
+    Raises:
+      ZKTransactionException: If a group is in use by another writer.
+    """
+    root_keys = set()
+    for entity in entities:
+      if isinstance(entity, entity_pb.EntityProto):
+        entity = entity.key()
+      root_keys.add(self.get_root_key_from_entity_key(entity))
+
+    leases = {}
+    try:
+      for root_key in sorted(root_keys):
+        holder = uuid.uuid4()
+        if not self.datastore_batch.acquire_group_lease(app_id, root_key,
+                                                        holder):
+          raise zktransaction.ZKTransactionException(
+            'Entity group {} is in use'.format(root_key))
+        leases[root_key] = holder
+
+        if self.zookeeper.is_group_locked(app_id, root_key):
+          raise zktransaction.ZKTransactionException(
+            'Entity group {} is locked by a transaction'.format(root_key))
+    except zktransaction.ZKTransactionException as zkte:
+      self.release_leases_for_nontrans(app_id, leases)
+      if retries > 0:
+        time.sleep(self.LOCK_RETRY_TIME)
+        self.logger.warning('Retrying to acquire lease. Retries left: {}'.
+          format(retries))
+        return self.acquire_leases_for_nontrans(app_id, entities, retries-1)
+      raise zkte
+
+    return leases
+
+  def release_leases_for_nontrans(self, app_id, leases):
+    """ Releases entity group leases for non-transactional operations.
+
+    Leases that can't be released expire on their own.
+
+    Args:
+      app_id: The application ID.
+      leases: A dictionary mapping root keys to lease holder UUIDs.
+    """
+    for root_key, holder in leases.iteritems():
+      try:
+        self.datastore_batch.release_group_lease(app_id, root_key, holder)
+      except dbconstants.AppScaleDBConnectionError:
+        self.logger.warning('Unable to release lease on {}'.format(root_key))
+
   def get_root_key(self, app_id, ns, ancestor_list):
     """ Gets the root key string from an ancestor listing.
    
@@ -937,13 +1110,6 @@ class DatastoreDistributed():
       if last_path.type() not in ent_kinds:
         ent_kinds.append(last_path.type())
 
-    if delete_request.has_transaction():
-      txn_hash = self.acquire_locks_for_trans(keys, 
-        delete_request.transaction().handle())
-    else:
-      txn_hash = self.acquire_locks_for_nontrans(app_id, keys, 
-        retries=self.NON_TRANS_LOCK_RETRY_COUNT) 
-
     # We use the marked changes field to signify if we should 
     # look up composite indexes because delete request do not
     # include that information.
@@ -960,6 +1126,18 @@ class DatastoreDistributed():
         if index.definition().entity_type() in ent_kinds:
           filtered_indexes.append(index)
 
+    if delete_request.has_transaction():
+      txn_hash = self.acquire_locks_for_trans(keys, 
+        delete_request.transaction().handle())
+    elif self.lock_free_writes and self.apply_lock_free_mutations(
+        app_id, keys,
+        lambda leases: self.delete_mutations(keys, leases, filtered_indexes)):
+      self.logger.debug('Removed {} entities'.format(len(keys)))
+      return
+    else:
+      txn_hash = self.acquire_locks_for_nontrans(app_id, keys, 
+        retries=self.NON_TRANS_LOCK_RETRY_COUNT) 
+
     if delete_request.has_transaction():
       self.delete_entities_txn(
         app_id,
@@ -1189,6 +1367,7 @@ class DatastoreDistributed():
     references = index_dict.keys()
     # Prevent duplicate entities across queries with a cursor.
     references.sort()
+    validate_entries = self.index_validation_enabled(app_id)
     offset = 0
     results = []
     to_fetch = limit
@@ -1207,6 +1386,12 @@ class DatastoreDistributed():
       entity_keys.sort()
 
       for reference in entity_keys:
+        if not validate_entries:
+          results.append(entities[reference])
+          if len(results) >= limit:
+            return results[:limit]
+          continue
+
         use_result = False
         indexes_to_check = index_dict[reference]
         for index_info in indexes_to_check:
@@ -1629,6 +1814,8 @@ class DatastoreDistributed():
     if startrow > endrow:
       return []
 
+    validate_entries = self.index_validation_enabled(app_id)
+
     # Since the validity of each reference is not checked until after the
     # range query has been performed, we may need to fetch additional
     # references in order to satisfy the query.
@@ -1827,8 +2014,15 @@ class DatastoreDistributed():
       # we construct a new list in order of valid references.
       new_entities = []
       for reference in references:
-        if self.__valid_index_entry(reference, potential_entities, direction,
-          property_name):
+        if not validate_entries:
+          # Entities that were deleted after the index was read are still
+          # skipped.
+          valid = (reference[reference.keys()[0]]['reference']
+                   in potential_entities)
+        else:
+          valid = self.__valid_index_entry(reference, potential_entities,
+                                           direction, property_name)
+        if valid:
           entity_key = reference[reference.keys()[0]]['reference']
           valid_entity = potential_entities[entity_key]
           new_entities.append(valid_entity)
@@ -2816,6 +3010,24 @@ class DatastoreDistributed():
 
     return prop_value
 
+  def index_validation_enabled(self, app_id):
+    """ Checks if index entries must be compared with their entities when
+    running queries.
+
+    Index entries are deleted in the same batch as the entity change that
+    invalidates them, so validation is only needed for applications that
+    might still have entries left over from older versions.
+
+    Args:
+      app_id: A string containing the application ID.
+    Returns:
+      A boolean indicating whether or not to validate index entries.
+    """
+    if self.zookeeper is None:
+      return True
+
+    return not self.zookeeper.index_validation_disabled(app_id)
+
   def __valid_index_entry(self, entry, entities, direction, prop_name):
     """ Checks if an index entry is valid.
 
@@ -3250,6 +3462,26 @@ class DatastoreDistributed():
                                'old': current_value, 'new': entity})
 
     self.datastore_batch.batch_mutate(app, batch, entity_changes, txn)
+    self.update_stats(app, entity_changes)
+
+  def update_stats(self, app, entity_changes):
+    """ Adds the effect of applied entity changes to the statistics counters.
+
+    Args:
+      app: A string containing the application ID.
+      entity_changes: A list of dictionaries containing the key, the old
+        entity, and the new entity for each change.
+    """
+    deltas = cassandra_interface.stats_deltas(entity_changes)
+    if not deltas:
+      return
+
+    try:
+      self.datastore_batch.update_entity_stats(app, deltas)
+    except dbconstants.AppScaleDBConnectionError:
+      # The changes have been applied, and the groomer corrects the counters
+      # when it reconciles them.
+      self.logger.warning('Unable to update statistics for {}'.format(app))
 
   def commit_transaction(self, app_id, http_request_data):
     """ Handles the commit phase of a transaction.
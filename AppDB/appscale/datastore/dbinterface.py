@@ -11,6 +11,9 @@ class AppDBInterface:
   def get_entity(self, table_name, row_key, column_names, txnid = 0):  
     raise NotImplementedError("get_entity is not implemented in %s." % self.__class__)
 
+  def batch_get_entity(self, table_name, row_keys, column_names):
+    raise NotImplementedError("batch_get_entity is not implemented in %s." % self.__class__)
+
   def put_entity(self, table_name, row_key, column_names, cell_values, txnid = 0):
     raise NotImplementedError("put_entity is not implemented in %s." % self.__class__)
 
@@ -20,6 +23,9 @@ class AppDBInterface:
   def get_table(self, table_name, column_names, txnid = 0):
     raise NotImplementedError("get_table is not implemented in %s." % self.__class__)
 
+  def iterate_row_keys(self, table_name, start_after=''):
+    raise NotImplementedError("iterate_row_keys is not implemented in %s." % self.__class__)
+
   def delete_row(self, table_name, row_id, txnid = 0):
     raise NotImplementedError("delete_row is not implemented in %s." % self.__class__)
 
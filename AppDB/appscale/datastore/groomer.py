@@ -1,4 +1,6 @@
+import base64
 import datetime
+import json
 import logging
 import os
 import random
@@ -12,6 +14,7 @@ import dbconstants
 import utils
 
 from appscale.taskqueue.distributed_tq import TaskName
+from .cassandra_env.schema import create_entity_stats_table
 from .datastore_distributed import DatastoreDistributed
 from .unpackaged import APPSCALE_LIB_DIR
 from .unpackaged import APPSCALE_PYTHON_APPSERVER
@@ -42,6 +45,148 @@ from app_dashboard_data import RequestInfo
 from dashboard_logs import RequestLogLine
 
 
+def encode_key(key):
+  """ Makes a row key safe to store in JSON.
+
+  Args:
+    key: A string containing a row key or None.
+  Returns:
+    A base64-encoded string or None.
+  """
+  if key is None:
+    return None
+  return base64.b64encode(key)
+
+
+def decode_key(encoded_key):
+  """ Reverses encode_key.
+
+  Args:
+    encoded_key: A base64-encoded string or None.
+  Returns:
+    A string containing a row key or None.
+  """
+  if encoded_key is None:
+    return None
+  return base64.b64decode(encoded_key)
+
+
+def choose_split_points(samples, range_count):
+  """ Picks keys that divide a table into ranges with similar row counts.
+
+  Args:
+    samples: A list of keys seen at regular row intervals during a scan.
+    range_count: The desired number of ranges.
+  Returns:
+    A sorted list of at most range_count - 1 keys.
+  """
+  samples = sorted(set(samples))
+  if len(samples) < range_count:
+    return samples
+
+  return sorted(set(samples[index * len(samples) // range_count]
+                    for index in range(1, range_count)))
+
+
+class GroomerRange(object):
+  """ A slice of a table's key space that a groomer worker scans. """
+
+  # Keep at most twice this many split point samples for each range.
+  MAX_SAMPLES = 64
+
+  # The initial number of rows between split point samples.
+  SAMPLE_INTERVAL = 1000
+
+  def __init__(self, name, task_id, start_key, end_key):
+    """ Constructor.
+
+    Args:
+      name: A string used as the range's ZooKeeper node name.
+      task_id: The ID of the groomer task that scans this range.
+      start_key: The key before the first row in the range (exclusive).
+      end_key: The last key in the range (inclusive).
+    """
+    self.name = name
+    self.task_id = task_id
+    self.start_key = start_key
+    self.end_key = end_key
+    self.last_key = start_key
+    self.done = False
+    # The number of scans of this range that raised an exception.
+    self.failures = 0
+    # Whether or not the range was given up on before it was fully scanned.
+    self.failed = False
+    self.checked = 0
+    self.samples = []
+    self.sample_interval = self.SAMPLE_INTERVAL
+    # Raw totals by app, namespace, and kind, including internal ones.
+    self.stats = {}
+    self.last_logged = time.time()
+
+  def record_batch(self, last_key, count):
+    """ Advances the range's position and samples keys for future splits.
+
+    Args:
+      last_key: The last key in the batch that was just processed.
+      count: The number of rows in the batch.
+    """
+    previous = self.checked
+    self.checked += count
+    self.last_key = last_key
+    if previous // self.sample_interval == self.checked // self.sample_interval:
+      return
+
+    self.samples.append(last_key)
+    if len(self.samples) >= 2 * self.MAX_SAMPLES:
+      self.samples = self.samples[1::2]
+      self.sample_interval *= 2
+
+  def encode(self):
+    """ Serializes the range's checkpoint.
+
+    Returns:
+      A JSON string.
+    """
+    return json.dumps({
+      'task': self.task_id,
+      'start': encode_key(self.start_key),
+      'end': encode_key(self.end_key),
+      'last': encode_key(self.last_key),
+      'done': self.done,
+      'failures': self.failures,
+      'failed': self.failed,
+      'checked': self.checked,
+      'samples': [encode_key(sample) for sample in self.samples],
+      'interval': self.sample_interval,
+      'stats': self.stats
+    })
+
+  @classmethod
+  def decode(cls, name, data):
+    """ Restores a range from its checkpoint.
+
+    Args:
+      name: A string containing the range's ZooKeeper node name.
+      data: A JSON string produced by encode.
+    Returns:
+      A GroomerRange object.
+    """
+    checkpoint = json.loads(data)
+    groomer_range = cls(name, checkpoint['task'],
+                        decode_key(checkpoint['start']),
+                        decode_key(checkpoint['end']))
+    groomer_range.last_key = decode_key(checkpoint['last'])
+    groomer_range.done = checkpoint['done']
+    groomer_range.failures = checkpoint.get('failures', 0)
+    groomer_range.failed = checkpoint.get('failed', False)
+    groomer_range.checked = checkpoint['checked']
+    groomer_range.samples = [decode_key(sample)
+                             for sample in checkpoint['samples']]
+    groomer_range.sample_interval = checkpoint['interval']
+    groomer_range.stats = checkpoint['stats']
+    return groomer_range
+
+
 class DatastoreGroomer(threading.Thread):
   """ Scans the entire database for each application. """
 
@@ -84,12 +229,53 @@ class DatastoreGroomer(threading.Thread):
   # process have an upper limit on each run.
   DASHBOARD_BATCH = 1000
 
-  # The path in ZooKeeper where the groomer state is stored.
+  # The path in ZooKeeper where the state of the cleanup tasks that follow
+  # the range scans is stored.
   GROOMER_STATE_PATH = '/appscale/groomer_state'
 
   # The characters used to separate values when storing the groomer state.
   GROOMER_STATE_DELIMITER = '||'
 
+  # The path in ZooKeeper that holds a checkpoint for each range in a pass.
+  GROOMER_RANGES_PATH = '/appscale/groomer_ranges'
+
+  # The path in ZooKeeper where workers hold leases on the ranges they scan.
+  GROOMER_LEASES_PATH = '/appscale/groomer_leases'
+
+  # The path in ZooKeeper where split points from the last pass are stored.
+  GROOMER_SPLITS_PATH = '/appscale/groomer_splits'
+
+  # The number of ranges each table is divided into once split points are
+  # known.
+  RANGES_PER_TASK = 16
+
+  # The number of threads on each datastore node that scan ranges.
+  WORKERS = 4
+
+  # The amount of seconds between checks for unclaimed ranges.
+  RANGE_POLL_PERIOD = 60
+
+  # The number of times a range's scan can fail before it is given up on.
+  MAX_RANGE_ATTEMPTS = 3
+
+  # The amount of seconds between writes of the statistics counters to the
+  # stat entities.
+  STATS_COMPACTION_PERIOD = 60 * 60
+
+  # The amount of seconds between full scans that correct the statistics
+  # counters.
+  STATS_RECONCILIATION_PERIOD = 7 * 24 * 60 * 60
+
+  # The path in ZooKeeper where the time of the last compaction is stored.
+  STATS_COMPACTED_PATH = '/appscale/groomer_stats_compacted'
+
+  # The path in ZooKeeper where the time of the last reconciliation is stored.
+  STATS_RECONCILED_PATH = '/appscale/groomer_stats_reconciled'
+
+  # The path in ZooKeeper where the statistics counters are recorded when a
+  # pass that scans entities starts.
+  STATS_SNAPSHOT_PATH = '/appscale/groomer_stats_snapshot'
+
   # The ID for the task to clean up entities.
   CLEAN_ENTITIES_TASK = 'entities'
 
@@ -166,7 +352,16 @@ class DatastoreGroomer(threading.Thread):
         logging.info("Did not get the groomer lock.")
       sleep_time = random.randint(1, self.LOCK_POLL_PERIOD)
       logging.info('Sleeping for {:.1f} minutes.'.format(sleep_time/60.0))
-      time.sleep(sleep_time)
+
+      # Help with any pass that another node is coordinating in the meantime.
+      wake_time = time.time() + sleep_time
+      while time.time() < wake_time:
+        time.sleep(min(self.RANGE_POLL_PERIOD, wake_time - time.time()))
+        try:
+          self.groom_ranges()
+          self.compact_statistics_if_due()
+        except Exception:
+          logging.exception('Unable to groom ranges')
 
   def get_groomer_lock(self):
     """ Tries to acquire the lock to the datastore groomer.
@@ -176,16 +371,17 @@ class DatastoreGroomer(threading.Thread):
     """
     return self.zoo_keeper.get_lock_with_path(zk.DS_GROOM_LOCK_PATH)
 
-  def get_entity_batch(self, last_key):
+  def get_entity_batch(self, last_key, end_key=""):
     """ Gets a batch of entites to operate on.
 
     Args:
       last_key: The last key from a previous query.
+      end_key: The last key that can be included in the batch.
     Returns:
       A list of entities.
     """
     return self.db_access.range_query(dbconstants.APP_ENTITY_TABLE,
-      dbconstants.APP_ENTITY_SCHEMA, last_key, "", self.BATCH_SIZE,
+      dbconstants.APP_ENTITY_SCHEMA, last_key, end_key, self.BATCH_SIZE,
       start_inclusive=False)
 
   def reset_statistics(self):
@@ -531,30 +727,24 @@ class DatastoreGroomer(threading.Thread):
       retry_time=self.ds_access.LOCK_RETRY_TIME
     )
 
-  def clean_up_indexes(self, direction):
+  def clean_up_indexes(self, direction, groomer_range):
     """ Deletes invalid single property index entries.
 
-    This is needed because we do not delete index entries when updating or
-    deleting entities. With time, this results in queries taking an increasing
-    amount of time.
+    Entity changes delete the index entries they invalidate, but entries
+    written by older versions or by interrupted operations can remain. With
+    time, these result in queries taking an increasing amount of time.
 
     Args:
       direction: The direction of the index.
+      groomer_range: The GroomerRange to scan.
     """
     if direction == datastore_pb.Query_Order.ASCENDING:
       table_name = dbconstants.ASC_PROPERTY_TABLE
-      task_id = self.CLEAN_ASC_INDICES_TASK
     else:
       table_name = dbconstants.DSC_PROPERTY_TABLE
-      task_id = self.CLEAN_DSC_INDICES_TASK
 
-    # If we have state information beyond what function to use,
-    # load the last seen start key.
-    if len(self.groomer_state) > 1 and self.groomer_state[0] == task_id:
-      start_key = self.groomer_state[1]
-    else:
-      start_key = ''
-    end_key = dbconstants.TERMINATING_STRING
+    start_key = groomer_range.last_key
+    end_key = groomer_range.end_key
 
     while True:
       references = self.db_access.range_query(
@@ -569,10 +759,6 @@ class DatastoreGroomer(threading.Thread):
         break
 
       self.index_entries_checked += len(references)
-      if time.time() > self.last_logged + self.LOG_PROGRESS_FREQUENCY:
-        logging.info('Checked {} index entries'
-          .format(self.index_entries_checked))
-        self.last_logged = time.time()
       first_ref = references[0].keys()[0]
       logging.debug('Fetched {} total refs, starting with {}, direction: {}'
         .format(self.index_entries_checked, [first_ref], direction))
@@ -598,21 +784,21 @@ class DatastoreGroomer(threading.Thread):
 
       for entity_key in invalid_refs:
         self.lock_and_delete_indexes(invalid_refs[entity_key], direction, entity_key)
-      self.update_groomer_state([task_id, start_key])
+      self.update_range(groomer_range, start_key, len(references))
 
-  def clean_up_kind_indices(self):
+  def clean_up_kind_indices(self, groomer_range):
     """ Deletes invalid kind index entries.
 
-    This is needed because the datastore does not delete kind index entries
-    when deleting entities.
+    Entity deletions remove their kind index entries, but entries written by
+    older versions can remain.
+
+    Args:
+      groomer_range: The GroomerRange to scan.
     """
     table_name = dbconstants.APP_KIND_TABLE
-    task_id = self.CLEAN_KIND_INDICES_TASK
 
-    start_key = ''
-    end_key = dbconstants.TERMINATING_STRING
-    if len(self.groomer_state) > 1:
-      start_key = self.groomer_state[1]
+    start_key = groomer_range.last_key
+    end_key = groomer_range.end_key
 
     while True:
       references = self.db_access.range_query(
@@ -627,10 +813,6 @@ class DatastoreGroomer(threading.Thread):
         break
 
       self.index_entries_checked += len(references)
-      if time.time() > self.last_logged + self.LOG_PROGRESS_FREQUENCY:
-        logging.info('Checked {} index entries'.
-          format(self.index_entries_checked))
-        self.last_logged = time.time()
       first_ref = references[0].keys()[0]
       logging.debug('Fetched {} kind indices, starting with {}'.
         format(len(references), [first_ref]))
@@ -648,7 +830,7 @@ class DatastoreGroomer(threading.Thread):
         if entity_key not in entities:
           self.lock_and_delete_kind_index(reference)
 
-      self.update_groomer_state([task_id, start_key])
+      self.update_range(groomer_range, start_key, len(references))
 
   def clean_up_composite_indexes(self):
     """ Deletes old composite indexes and bad references.
@@ -725,17 +907,37 @@ class DatastoreGroomer(threading.Thread):
       self.namespace_info[app_id] = {namespace: {'size': 0, 'number': 0}}
 
     if namespace not in self.namespace_info[app_id]:
-      self.namespace_info[app_id] = {namespace: {'size': 0, 'number': 0}}
-    if namespace not in self.namespace_info[app_id]:
-      self.stats[app_id][namespace] = {'size': 0, 'number': 0}
+      self.namespace_info[app_id][namespace] = {'size': 0, 'number': 0}
 
-  def process_statistics(self, key, entity, size):
+  def counts_toward_statistics(self, app_id, kind):
+    """ Checks if a kind should be included in an application's statistics.
+
+    Args:
+      app_id: The application ID.
+      kind: A string representing an entity kind.
+    Returns:
+      True if the kind belongs in the statistics, False otherwise.
+    """
+    if re.match(self.PROTECTED_KINDS, kind):
+      return False
+
+    if re.match(self.PRIVATE_KINDS, kind):
+      return False
+
+    # Do not generate statistics for applications which are internal to
+    # AppScale.
+    return app_id not in self.APPSCALE_APPLICATIONS
+
+  def process_statistics(self, key, entity, size, groomer_range=None):
     """ Processes an entity and adds to the global statistics.
 
     Args:
       key: The key to the entity table.
       entity: EntityProto entity.
       size: A int of the size of the entity.
+      groomer_range: The GroomerRange to add raw totals to instead of the
+        global statistics. These totals are used to correct the statistics
+        counters.
     Returns:
       True on success, False otherwise.
     """
@@ -747,21 +949,22 @@ class DatastoreGroomer(threading.Thread):
         .format(entity))
       return False
 
-    if re.match(self.PROTECTED_KINDS, kind):
-      return True
-
-    if re.match(self.PRIVATE_KINDS, kind):
-      return True
-
     app_id = entity.key().app()
     if not app_id:
       logging.warning("Entity of kind {0} did not have an app id"\
         .format(kind))
       return False
 
-    # Do not generate statistics for applications which are internal to
-    # AppScale.
-    if app_id in self.APPSCALE_APPLICATIONS:
+    if groomer_range is not None:
+      # The counters track every kind, so the totals are not filtered.
+      kinds = groomer_range.stats.setdefault(app_id, {}).\
+        setdefault(namespace, {})
+      kind_stats = kinds.setdefault(kind, [0, 0])
+      kind_stats[0] += size
+      kind_stats[1] += 1
+      return True
+
+    if not self.counts_toward_statistics(app_id, kind):
       return True
 
     self.initialize_kind(app_id, kind)
@@ -782,12 +985,13 @@ class DatastoreGroomer(threading.Thread):
     #TODO implement
     return True
 
-  def process_entity(self, entity):
+  def process_entity(self, entity, groomer_range=None):
     """ Processes an entity by updating statistics, indexes, and removes
         tombstones.
 
     Args:
       entity: The entity to operate on.
+      groomer_range: The GroomerRange that contains the entity.
     Returns:
       True on success, False otherwise.
     """
@@ -799,7 +1003,7 @@ class DatastoreGroomer(threading.Thread):
 
     ent_proto = entity_pb.EntityProto()
     ent_proto.ParseFromString(one_entity)
-    self.process_statistics(key, ent_proto, len(one_entity))
+    self.process_statistics(key, ent_proto, len(one_entity), groomer_range)
 
     return True
 
@@ -925,31 +1129,27 @@ class DatastoreGroomer(threading.Thread):
     logging.info("Removed {0} task name entities".format(counter))
     return True
 
-  def clean_up_entities(self):
-    # If we have state information beyond what function to use,
-    # load the last seen key.
-    if (len(self.groomer_state) > 1 and
-      self.groomer_state[0] == self.CLEAN_ENTITIES_TASK):
-      last_key = self.groomer_state[1]
-    else:
-      last_key = ""
+  def clean_up_entities(self, groomer_range):
+    """ Collects statistics for the entities in a range.
+
+    Args:
+      groomer_range: The GroomerRange to scan.
+    """
+    last_key = groomer_range.last_key
     while True:
       try:
         logging.debug('Fetching {} entities'.format(self.BATCH_SIZE))
-        entities = self.get_entity_batch(last_key)
+        entities = self.get_entity_batch(last_key, groomer_range.end_key)
 
         if not entities:
           break
 
         for entity in entities:
-          self.process_entity(entity)
+          self.process_entity(entity, groomer_range)
 
         last_key = entities[-1].keys()[0]
         self.entities_checked += len(entities)
-        if time.time() > self.last_logged + self.LOG_PROGRESS_FREQUENCY:
-          logging.info('Checked {} entities'.format(self.entities_checked))
-          self.last_logged = time.time()
-        self.update_groomer_state([self.CLEAN_ENTITIES_TASK, last_key])
+        self.update_range(groomer_range, last_key, len(entities))
       except datastore_errors.Error, error:
         logging.error("Error getting a batch: {0}".format(error))
         time.sleep(self.DB_ERROR_PERIOD)
@@ -1124,22 +1324,13 @@ class DatastoreGroomer(threading.Thread):
       logging.exception(zkie)
     self.groomer_state = state
 
-  def run_groomer(self):
-    """ Runs the grooming process. Loops on the entire dataset sequentially
-        and updates stats, indexes, and transactions.
-    """
-    self.db_access = appscale_datastore_batch.DatastoreFactory.getDatastore(
-      self.table_name)
-    self.ds_access = DatastoreDistributed(
-      datastore_batch=self.db_access, zookeeper=self.zoo_keeper)
+  def scan_tasks(self):
+    """ Lists the tasks that scan a table and can be split into ranges.
 
-    logging.info("Groomer started")
-    start = time.time()
-
-    self.reset_statistics()
-    self.composite_index_cache = {}
-
-    tasks = [
+    Returns:
+      A list of dictionaries describing each task.
+    """
+    return [
       {
         'id': self.CLEAN_ENTITIES_TASK,
         'description': 'clean up entities',
@@ -1163,7 +1354,493 @@ class DatastoreGroomer(threading.Thread):
         'description': 'clean up kind indices',
         'function': self.clean_up_kind_indices,
         'args': []
-      },
+      }
+    ]
+
+  def connect_datastore(self):
+    """ Creates the datastore accessors if they do not already exist. """
+    if self.db_access is None:
+      self.db_access = appscale_datastore_batch.DatastoreFactory.getDatastore(
+        self.table_name)
+    if self.ds_access is None:
+      self.ds_access = DatastoreDistributed(
+        datastore_batch=self.db_access, zookeeper=self.zoo_keeper)
+
+  def get_range_path(self, name):
+    """ Gets the ZooKeeper path that holds a range's checkpoint.
+
+    Args:
+      name: A string containing the range's name.
+    Returns:
+      A string containing a ZooKeeper path.
+    """
+    return zk.PATH_SEPARATOR.join([self.GROOMER_RANGES_PATH, name])
+
+  def get_lease_path(self, name):
+    """ Gets the ZooKeeper path of the lease for a range.
+
+    Args:
+      name: A string containing the range's name.
+    Returns:
+      A string containing a ZooKeeper path.
+    """
+    return zk.PATH_SEPARATOR.join([self.GROOMER_LEASES_PATH, name])
+
+  def save_range(self, groomer_range):
+    """ Persists a range's checkpoint to ZooKeeper.
+
+    Args:
+      groomer_range: A GroomerRange object.
+    """
+    # We don't want to crash the worker if we can't update the checkpoint.
+    try:
+      self.zoo_keeper.update_node(self.get_range_path(groomer_range.name),
+                                  groomer_range.encode())
+    except zk.ZKInternalException as zkie:
+      logging.exception(zkie)
+
+  def update_range(self, groomer_range, last_key, count):
+    """ Records a processed batch and reports the range's progress.
+
+    Args:
+      groomer_range: The GroomerRange being scanned.
+      last_key: The last key in the batch.
+      count: The number of rows in the batch.
+    """
+    groomer_range.record_batch(last_key, count)
+    self.save_range(groomer_range)
+    if time.time() > groomer_range.last_logged + self.LOG_PROGRESS_FREQUENCY:
+      logging.info('Range {}: checked {} rows'.format(
+        groomer_range.name, groomer_range.checked))
+      groomer_range.last_logged = time.time()
+
+  def get_split_points(self):
+    """ Fetches the split points recorded during the previous pass.
+
+    Returns:
+      A dictionary mapping task IDs to sorted lists of keys.
+    """
+    node = self.zoo_keeper.get_node(self.GROOMER_SPLITS_PATH)
+    if not node or not node[0]:
+      return {}
+
+    try:
+      split_points = json.loads(node[0])
+    except ValueError:
+      logging.warning('Ignoring invalid split points: {}'.format(node[0]))
+      return {}
+
+    return {task_id: [decode_key(key) for key in keys]
+            for task_id, keys in split_points.iteritems()}
+
+  def save_split_points(self, ranges):
+    """ Stores split points for the next pass based on sampled keys.
+
+    Args:
+      ranges: A list of finished GroomerRange objects.
+    """
+    samples = {}
+    for groomer_range in ranges:
+      samples.setdefault(groomer_range.task_id, []).extend(
+        groomer_range.samples)
+
+    # Keep the split points for tables that were not scanned in this pass.
+    split_points = self.get_split_points()
+    for task_id, task_samples in samples.iteritems():
+      split_points[task_id] = choose_split_points(task_samples,
+                                                  self.RANGES_PER_TASK)
+
+    split_points = {task_id: [encode_key(key) for key in keys]
+                    for task_id, keys in split_points.iteritems()}
+
+    try:
+      self.zoo_keeper.update_node(self.GROOMER_SPLITS_PATH,
+                                  json.dumps(split_points))
+    except zk.ZKInternalException as zkie:
+      logging.exception(zkie)
+
+  def ranges_ready(self):
+    """ Checks if there is a pass in progress.
+
+    Returns:
+      A boolean indicating whether all of the pass's ranges exist.
+    """
+    node = self.zoo_keeper.get_node(self.GROOMER_RANGES_PATH)
+    return bool(node) and node[0].isdigit()
+
+  def create_ranges(self, task_ids=None):
+    """ Divides each table into ranges for a new pass.
+
+    Args:
+      task_ids: A list of scan task IDs to include. Defaults to all of them.
+    """
+    # Remove anything left over from a pass that was not fully created.
+    self.zoo_keeper.delete_recursive(self.GROOMER_RANGES_PATH)
+    self.zoo_keeper.delete_recursive(self.STATS_SNAPSHOT_PATH)
+    self.zoo_keeper.update_node(self.GROOMER_LEASES_PATH, '')
+
+    if task_ids is None or self.CLEAN_ENTITIES_TASK in task_ids:
+      self.save_stats_snapshot()
+
+    split_points = self.get_split_points()
+    range_count = 0
+    for task in self.scan_tasks():
+      if task_ids is not None and task['id'] not in task_ids:
+        continue
+
+      boundaries = ([''] + split_points.get(task['id'], []) +
+                    [dbconstants.TERMINATING_STRING])
+      for index in range(len(boundaries) - 1):
+        name = '{}-{:04d}'.format(task['id'], index)
+        self.save_range(GroomerRange(name, task['id'], boundaries[index],
+                                     boundaries[index + 1]))
+        range_count += 1
+
+    # Workers only start claiming ranges once they have all been created.
+    self.zoo_keeper.update_node(self.GROOMER_RANGES_PATH, str(range_count))
+    logging.info('Divided the datastore into {} ranges'.format(range_count))
+
+  def load_ranges(self):
+    """ Fetches the checkpoints for every range in the current pass.
+
+    Returns:
+      A list of GroomerRange objects.
+    """
+    ranges = []
+    for name in self.zoo_keeper.get_children(self.GROOMER_RANGES_PATH):
+      node = self.zoo_keeper.get_node(self.get_range_path(name))
+      if node:
+        ranges.append(GroomerRange.decode(name, node[0]))
+    return ranges
+
+  def claim_range(self):
+    """ Acquires a lease on a range that still needs to be scanned.
+
+    Returns:
+      A GroomerRange object or None if there are no ranges left to claim.
+    """
+    names = self.zoo_keeper.get_children(self.GROOMER_RANGES_PATH)
+    random.shuffle(names)
+    for name in names:
+      node = self.zoo_keeper.get_node(self.get_range_path(name))
+      if not node or GroomerRange.decode(name, node[0]).done:
+        continue
+
+      if not self.zoo_keeper.get_lock_with_path(self.get_lease_path(name)):
+        continue
+
+      # Another worker may have finished the range before the lease was
+      # acquired.
+      node = self.zoo_keeper.get_node(self.get_range_path(name))
+      if node:
+        groomer_range = GroomerRange.decode(name, node[0])
+        if not groomer_range.done:
+          return groomer_range
+
+      self.release_range(name)
+
+    return None
+
+  def release_range(self, name):
+    """ Releases the lease on a range.
+
+    Args:
+      name: A string containing the range's name.
+    """
+    try:
+      self.zoo_keeper.release_lock_with_path(self.get_lease_path(name))
+    except zk.ZKTransactionException as zk_exception:
+      logging.error('Unable to release lease for {}: {}'.format(
+        name, zk_exception))
+
+  def groom_range(self, groomer_range):
+    """ Scans a range and marks it as done if the scan succeeds.
+
+    Args:
+      groomer_range: The GroomerRange to scan.
+    """
+    task = next(task for task in self.scan_tasks()
+                if task['id'] == groomer_range.task_id)
+    logging.info('Starting to {} in range {}'.format(
+      task['description'], groomer_range.name))
+    start = time.time()
+    try:
+      task['function'](*(task['args'] + [groomer_range]))
+    except Exception as exception:
+      logging.error('Exception encountered while trying to {} in range {}:'.
+        format(task['description'], groomer_range.name))
+      logging.exception(exception)
+      self.record_range_failure(groomer_range)
+      return
+
+    groomer_range.done = True
+    self.save_range(groomer_range)
+    logging.info('Finished range {}: checked {} rows in {:.1f} seconds'.format(
+      groomer_range.name, groomer_range.checked, time.time() - start))
+
+  def record_range_failure(self, groomer_range):
+    """ Records a failed scan so that the range is scanned again later.
+
+    The scan resumes from the last checkpoint, since the range's statistics
+    may include part of a batch that was not checkpointed. After
+    MAX_RANGE_ATTEMPTS failures, the range is marked as done and failed.
+
+    Args:
+      groomer_range: The GroomerRange that could not be scanned.
+    """
+    try:
+      node = self.zoo_keeper.get_node(self.get_range_path(groomer_range.name))
+    except zk.ZKInternalException as zkie:
+      logging.exception(zkie)
+      return
+
+    if node:
+      groomer_range = GroomerRange.decode(groomer_range.name, node[0])
+
+    groomer_range.failures += 1
+    if groomer_range.failures >= self.MAX_RANGE_ATTEMPTS:
+      logging.error('Giving up on range {} after {} failed attempts'.format(
+        groomer_range.name, groomer_range.failures))
+      groomer_range.done = True
+      groomer_range.failed = True
+
+    self.save_range(groomer_range)
+
+  def process_ranges(self):
+    """ Scans ranges until there are none left to claim. """
+    while True:
+      try:
+        groomer_range = self.claim_range()
+      except zk.ZKInternalException as zkie:
+        logging.exception(zkie)
+        return
+
+      if groomer_range is None:
+        return
+
+      try:
+        self.groom_range(groomer_range)
+      finally:
+        self.release_range(groomer_range.name)
+
+  def groom_ranges(self):
+    """ Scans the current pass's unclaimed ranges with several workers. """
+    if not self.ranges_ready():
+      return
+
+    self.connect_datastore()
+    workers = [threading.Thread(target=self.process_ranges)
+               for _ in range(self.WORKERS)]
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+
+  def last_run_time(self, path):
+    """ Fetches the time a periodic job last ran.
+
+    Args:
+      path: A string containing the ZooKeeper node for the job.
+    Returns:
+      A float containing a UNIX timestamp or None if the job has not run.
+    """
+    node = self.zoo_keeper.get_node(path)
+    if not node or not node[0]:
+      return None
+
+    return float(node[0])
+
+  def reconciliation_due(self):
+    """ Checks if the next pass should correct the statistics counters.
+
+    Returns:
+      A boolean indicating whether or not entities should be scanned.
+    """
+    reconciled = self.last_run_time(self.STATS_RECONCILED_PATH)
+    return (reconciled is None or
+            time.time() - reconciled > self.STATS_RECONCILIATION_PERIOD)
+
+  def save_stats_snapshot(self):
+    """ Records the statistics counters before entities are scanned. """
+    self.connect_datastore()
+    # Deployments that predate the counters do not have the table yet.
+    create_entity_stats_table(self.db_access.session)
+    counters = self.db_access.get_entity_stats()
+    snapshot = {app_id: [[namespace, kind, size, number]
+                         for (namespace, kind), (size, number)
+                         in app_stats.iteritems()]
+                for app_id, app_stats in counters.iteritems()}
+    self.zoo_keeper.update_node(self.STATS_SNAPSHOT_PATH, json.dumps(snapshot))
+
+  def load_stats_snapshot(self):
+    """ Fetches the statistics counters recorded when the pass started.
+
+    Returns:
+      A dictionary in the format returned by get_entity_stats, or None if
+      there is no snapshot.
+    """
+    node = self.zoo_keeper.get_node(self.STATS_SNAPSHOT_PATH)
+    if not node or not node[0]:
+      return None
+
+    snapshot = json.loads(node[0])
+    return {app_id.encode('utf-8'): {
+              (namespace.encode('utf-8'), kind.encode('utf-8')): (size, number)
+              for namespace, kind, size, number in app_stats}
+            for app_id, app_stats in snapshot.iteritems()}
+
+  def reconcile_statistics(self, ranges, counters):
+    """ Corrects the statistics counters using the totals from a full scan.
+
+    The totals are compared with the counters as they were when the scan
+    started, and the differences are added to the current counters. This
+    keeps the changes that writes made to the counters during the scan.
+
+    Args:
+      ranges: A list of finished GroomerRange objects that scanned entities.
+      counters: A dictionary containing the counters when the scan started,
+        in the format returned by get_entity_stats.
+    """
+    totals = {}
+    for groomer_range in ranges:
+      for app_id, namespaces in groomer_range.stats.iteritems():
+        app_totals = totals.setdefault(app_id.encode('utf-8'), {})
+        for namespace, kinds in namespaces.iteritems():
+          for kind, (size, number) in kinds.iteritems():
+            stat_key = (namespace.encode('utf-8'), kind.encode('utf-8'))
+            current_size, current_number = app_totals.get(stat_key, (0, 0))
+            app_totals[stat_key] = (current_size + size,
+                                    current_number + number)
+
+    for app_id in set(totals) | set(counters):
+      scanned = totals.get(app_id, {})
+      counted = counters.get(app_id, {})
+      deltas = {}
+      for stat_key in set(scanned) | set(counted):
+        scanned_size, scanned_number = scanned.get(stat_key, (0, 0))
+        counted_size, counted_number = counted.get(stat_key, (0, 0))
+        delta = (scanned_size - counted_size, scanned_number - counted_number)
+        if delta != (0, 0):
+          deltas[stat_key] = delta
+
+      if deltas:
+        logging.info('Correcting {} statistics counters for {}'.
+                     format(len(deltas), app_id))
+        self.db_access.update_entity_stats(app_id, deltas)
+
+  def compact_statistics(self):
+    """ Writes the statistics counters to the stat entities. """
+    self.stats = {}
+    self.namespace_info = {}
+    counters = self.db_access.get_entity_stats()
+    for app_id, app_stats in counters.iteritems():
+      for (namespace, kind), (size, number) in app_stats.iteritems():
+        if number <= 0 or not self.counts_toward_statistics(app_id, kind):
+          continue
+
+        self.initialize_kind(app_id, kind)
+        self.initialize_namespace(app_id, namespace)
+        self.stats[app_id][kind]['size'] += size
+        self.stats[app_id][kind]['number'] += number
+        self.namespace_info[app_id][namespace]['size'] += size
+        self.namespace_info[app_id][namespace]['number'] += number
+
+    timestamp = datetime.datetime.utcnow()
+
+    if not self.update_statistics(timestamp):
+      logging.error("There was an error updating the statistics")
+
+    if not self.update_namespaces(timestamp):
+      logging.error("There was an error updating the namespaces")
+
+  def compact_statistics_if_due(self):
+    """ Compacts the statistics counters if no node has done so recently. """
+    # The counters are not trusted until a full scan has corrected them.
+    if self.last_run_time(self.STATS_RECONCILED_PATH) is None:
+      return
+
+    compacted = self.last_run_time(self.STATS_COMPACTED_PATH)
+    if (compacted is not None and
+        time.time() - compacted < self.STATS_COMPACTION_PERIOD):
+      return
+
+    if not self.zoo_keeper.get_lock_with_path(zk.DS_STATS_LOCK_PATH):
+      return
+
+    try:
+      # Another node may have finished a compaction before the lock was
+      # acquired.
+      compacted = self.last_run_time(self.STATS_COMPACTED_PATH)
+      if (compacted is not None and
+          time.time() - compacted < self.STATS_COMPACTION_PERIOD):
+        return
+
+      self.connect_datastore()
+      logging.info('Compacting datastore statistics')
+      self.compact_statistics()
+      self.zoo_keeper.update_node(self.STATS_COMPACTED_PATH, str(time.time()))
+    finally:
+      self.zoo_keeper.release_lock_with_path(zk.DS_STATS_LOCK_PATH)
+
+  def run_groomer(self):
+    """ Runs the grooming process. Splits the dataset into ranges that
+        workers on each datastore node scan in parallel, and then updates
+        stats, logs, and tasks.
+    """
+    self.connect_datastore()
+
+    logging.info("Groomer started")
+    start = time.time()
+
+    self.reset_statistics()
+    self.composite_index_cache = {}
+
+    if self.ranges_ready():
+      logging.info('Resuming the previous grooming pass')
+    elif self.reconciliation_due():
+      self.create_ranges()
+    else:
+      # The statistics counters are kept up to date on write, so the
+      # entities only need to be scanned occasionally.
+      self.create_ranges([task['id'] for task in self.scan_tasks()
+                          if task['id'] != self.CLEAN_ENTITIES_TASK])
+
+    # Ranges that other nodes are scanning become available again if those
+    # nodes lose their leases.
+    while True:
+      self.groom_ranges()
+      ranges = self.load_ranges()
+      finished = len([groomer_range for groomer_range in ranges
+                      if groomer_range.done])
+      logging.info('Groomed {} of {} ranges'.format(finished, len(ranges)))
+      if finished == len(ranges):
+        break
+      time.sleep(self.RANGE_POLL_PERIOD)
+
+    entity_ranges = [groomer_range for groomer_range in ranges
+                     if groomer_range.task_id == self.CLEAN_ENTITIES_TASK]
+    if entity_ranges:
+      failed_ranges = [groomer_range.name for groomer_range in entity_ranges
+                       if groomer_range.failed]
+      counters = self.load_stats_snapshot()
+      if failed_ranges:
+        logging.warning('Not correcting statistics because ranges {} were '
+                        'not fully scanned'.format(failed_ranges))
+      elif counters is None:
+        logging.warning('Not correcting statistics because there is no '
+                        'snapshot of the counters')
+      else:
+        self.reconcile_statistics(entity_ranges, counters)
+        self.zoo_keeper.update_node(self.STATS_RECONCILED_PATH,
+                                    str(time.time()))
+        # Publish the corrected statistics right away.
+        self.zoo_keeper.update_node(self.STATS_COMPACTED_PATH, '')
+
+    self.save_split_points(ranges)
+    self.zoo_keeper.delete_recursive(self.GROOMER_RANGES_PATH)
+    self.zoo_keeper.delete_recursive(self.STATS_SNAPSHOT_PATH)
+
+    tasks = [
       {
         'id': self.CLEAN_LOGS_TASK,
         'description': 'clean up old logs',
@@ -1190,6 +1867,11 @@ class DatastoreGroomer(threading.Thread):
       self.update_groomer_state(
         groomer_state[0].split(self.GROOMER_STATE_DELIMITER))
 
+    # State written by older versions can refer to a scan task.
+    if self.groomer_state and self.groomer_state[0] not in [
+      task['id'] for task in tasks]:
+      self.update_groomer_state([])
+
     for task_number in range(len(tasks)):
       task = tasks[task_number]
       if (len(self.groomer_state) > 0 and self.groomer_state[0] != '' and
@@ -1208,18 +1890,13 @@ class DatastoreGroomer(threading.Thread):
 
     self.update_groomer_state([])
 
-    timestamp = datetime.datetime.utcnow()
+    self.compact_statistics_if_due()
 
-    if not self.update_statistics(timestamp):
-      logging.error("There was an error updating the statistics")
-
-    if not self.update_namespaces(timestamp):
-      logging.error("There was an error updating the namespaces")
-
-    del self.db_access
-    del self.ds_access
+    self.db_access = None
+    self.ds_access = None
 
     time_taken = time.time() - start
+    logging.info("Groomer checked {0} entities".format(self.entities_checked))
     logging.info("Groomer cleaned {0} journal entries".format(
       self.journal_entries_cleaned))
     logging.info("Groomer checked {0} index entries".format(
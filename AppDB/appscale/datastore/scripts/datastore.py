@@ -19,6 +19,7 @@ import tornado.web
 from M2Crypto import SSL
 from .. import dbconstants
 from ..appscale_datastore_batch import DatastoreFactory
+from ..cassandra_env.schema import create_group_leases_table
 from ..datastore_distributed import DatastoreDistributed
 from ..utils import clean_app_id
 from ..utils import UnprocessedQueryResult
@@ -675,6 +676,7 @@ def usage():
   print "\t--type=<" + ','.join(dbconstants.VALID_DATASTORES) +  ">"
   print "\t--no_encryption"
   print "\t--port"
+  print "\t--lock_free_writes"
 
 
 pb_application = tornado.web.Application([
@@ -699,11 +701,12 @@ def main():
   port = dbconstants.DEFAULT_SSL_PORT
   is_encrypted = True
   verbose = False
+  lock_free_writes = False
 
   argv = sys.argv[1:]
   try:
     opts, args = getopt.getopt(argv, "t:p:n:v:",
-      ["type=", "port", "no_encryption", "verbose"])
+      ["type=", "port", "no_encryption", "verbose", "lock_free_writes"])
   except getopt.GetoptError:
     usage()
     sys.exit(1)
@@ -718,6 +721,8 @@ def main():
       is_encrypted = False
     elif opt in ("-v", "--verbose"):
       verbose = True
+    elif opt == "--lock_free_writes":
+      lock_free_writes = True
 
   if verbose:
     logger.setLevel(logging.DEBUG)
@@ -733,8 +738,13 @@ def main():
     host=zookeeper_locations, start_gc=True, db_access=datastore_batch,
     log_level=logger.getEffectiveLevel())
 
+  if lock_free_writes:
+    create_group_leases_table(datastore_batch.session)
+    zookeeper.enable_lock_free_writes()
+
   datastore_access = DatastoreDistributed(
-    datastore_batch, zookeeper=zookeeper, log_level=logger.getEffectiveLevel())
+    datastore_batch, zookeeper=zookeeper, log_level=logger.getEffectiveLevel(),
+    lock_free_writes=lock_free_writes)
   if port == dbconstants.DEFAULT_SSL_PORT and not is_encrypted:
     port = dbconstants.DEFAULT_PORT
 
@@ -46,6 +46,11 @@ def init_parser():
     action="store_true", default=False, help='Start with a clean datastore.')
   main_args.add_argument('-d', '--debug',  required=False, action="store_true",
     default=False, help='Display debug messages.')
+  main_args.add_argument('--bulk', required=False, action="store_true",
+    default=False, help='Write entities and indexes directly using parallel '
+    'processes. The datastore must be in read-only mode.')
+  main_args.add_argument('-p', '--processes', required=False, type=int,
+    default=None, help='The number of processes to use for a bulk restore.')
 
   # TODO
   # Read in source code location and owner and deploy the app
@@ -111,6 +116,19 @@ def main():
   if not backup_dir_exists(args.backup_dir):
     return
 
+  # Initialize connection to Zookeeper and database related variables.
+  zk_connection_locations = appscale_info.get_zk_locations_string()
+  zookeeper = zk.ZKTransaction(host=zk_connection_locations)
+  db_info = appscale_info.get_db_info()
+  table = db_info[':table']
+
+  # Check before any data is deleted.
+  if args.bulk and not zookeeper.datastore_is_read_only():
+    logging.error("A bulk restore requires the datastore to be in read-only "
+      "mode. Exiting...")
+    zookeeper.close()
+    return
+
   if args.clear_datastore:
     message = "Deleting \"{0}\" data...".\
       format(args.app_id, args.backup_dir)
@@ -124,22 +142,18 @@ def main():
         APP_KIND_TABLE: APP_KIND_SCHEMA,
         TRANSACTIONS_TABLE: TRANSACTIONS_SCHEMA
       }
-      for table, schema in tables_to_clear.items():
-        fetch_and_delete_entities('cassandra', table, schema, args.app_id, False)
+      for table_name, schema in tables_to_clear.items():
+        fetch_and_delete_entities('cassandra', table_name, schema,
+                                  args.app_id, False)
     except Exception as exception:
       logging.error("Unhandled exception while deleting \"{0}\" data: {1} " \
         "Exiting...".format(args.app_id, exception.message))
+      zookeeper.close()
       return
 
-  # Initialize connection to Zookeeper and database related variables.
-  zk_connection_locations = appscale_info.get_zk_locations_string()
-  zookeeper = zk.ZKTransaction(host=zk_connection_locations)
-  db_info = appscale_info.get_db_info()
-  table = db_info[':table']
-
   # Start restore process.
   ds_restore = DatastoreRestore(args.app_id.strip('/'), args.backup_dir,
-    zookeeper, table)
+    zookeeper, table, bulk=args.bulk, processes=args.processes)
   try:
     ds_restore.run()
   finally:
@@ -7,7 +7,9 @@ functions.
 #TODO(raj) Rewrite this to use the lastest version of the AppScale
 # datastore API.
 
+import collections
 import datetime
+import itertools
 import json
 import logging
 import re
@@ -72,6 +74,91 @@ VALID_USER_TYPES = ["user", "xmpp_user", "app", "channel"]
 # Port separator used to store http and https application ports.
 PORT_SEPARATOR = '-'
 
+# The number of seconds that a row can be served from the cache. Other
+# UserAppServers do not invalidate this server's cache, so this bounds how
+# long their changes can go unnoticed.
+DEFAULT_CACHE_TTL = 10
+
+# The maximum number of rows to keep in the cache.
+CACHE_SIZE = 10000
+
+# The maximum number of keys returned by a single listing request.
+MAX_PAGE_SIZE = 1000
+
+
+class RowCache(object):
+  """ A bounded cache of user and app rows that expire after a TTL. """
+  def __init__(self, ttl, max_size=CACHE_SIZE):
+    """ Constructor.
+
+    Args:
+      ttl: The number of seconds to keep each row. The cache is disabled if
+        this is 0.
+      max_size: The maximum number of rows to keep.
+    """
+    self.ttl = ttl
+    self.max_size = max_size
+    self.rows = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, table, row_key):
+    """ Fetches a row that has not expired.
+
+    Args:
+      table: A string containing the table name.
+      row_key: A string containing the row key.
+    Returns:
+      The result of get_entity for every column in the table, or None if
+      the row is not cached.
+    """
+    entry = self.rows.get((table, row_key))
+    if entry is None or entry[0] < time.time():
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    return entry[1]
+
+  def put(self, table, row_key, result):
+    """ Stores a row, evicting the oldest one if the cache is full.
+
+    Args:
+      table: A string containing the table name.
+      row_key: A string containing the row key.
+      result: The result of get_entity for every column in the table.
+    """
+    if not self.ttl:
+      return
+
+    self.rows.pop((table, row_key), None)
+    while len(self.rows) >= self.max_size:
+      self.rows.popitem(last=False)
+    self.rows[(table, row_key)] = (time.time() + self.ttl, result)
+
+  def invalidate(self, table, row_key):
+    """ Removes a row from the cache.
+
+    Args:
+      table: A string containing the table name.
+      row_key: A string containing the row key.
+    """
+    self.rows.pop((table, row_key), None)
+
+  def stats(self):
+    """ Reports how effective the cache has been.
+
+    Returns:
+      A dictionary containing the hit and miss counts and the number of
+      cached rows.
+    """
+    return {'hits': self.hits, 'misses': self.misses,
+            'entries': len(self.rows)}
+
+
+# Rows recently fetched by the lookup functions.
+row_cache = RowCache(DEFAULT_CACHE_TTL)
+
 
 class Users:
   attributes_ = USERS_SCHEMA
@@ -117,6 +204,11 @@ class Users:
     userstring += "capabilities:" + str(self.capabilities_) + "\n"
     return userstring
 
+  def to_dict(self):
+    """ Returns the user's fields as a dictionary keyed by column name. """
+    return {attribute: getattr(self, attribute + "_")
+            for attribute in Users.attributes_}
+
   def checksum(self):
     return 1
 
@@ -188,7 +280,8 @@ class Apps:
     appstring += "indexes:" + str(self.indexes_) + "\n"
     return appstring
 
-  def to_json(self):
+  def to_dict(self):
+    """ Returns the fields that describe how to reach the app. """
     hosts = {}
     for index, host in enumerate(self.host_):
       ports = self.port_[index].split(PORT_SEPARATOR)
@@ -203,7 +296,10 @@ class Apps:
     if self.owner_:
       response['owner'] = self.owner_
 
-    return json.dumps(response)
+    return response
+
+  def to_json(self):
+    return json.dumps(self.to_dict())
 
   def checksum(self):
     return "true"
@@ -243,13 +339,93 @@ class Apps:
     return "true"
 
 
+def get_cached_entity(table, row_key, column_names):
+  """ Fetches columns from a row, using the cache when possible. Only use this
+  for lookups. Functions that modify a row should read it from the database.
+
+  Args:
+    table: A string containing the table name.
+    row_key: A string containing the row key.
+    column_names: A list of columns to fetch.
+  Returns:
+    A list in the format returned by db.get_entity.
+  Raises:
+    AppScaleDBConnectionError if the row could not be fetched.
+  """
+  if table == USER_TABLE:
+    schema = user_schema
+  else:
+    schema = app_schema
+
+  result = row_cache.get(table, row_key)
+  if result is None:
+    try:
+      result = db.get_entity(table, row_key, schema)
+    except KeyError:
+      # The row is missing some columns, so only fetch the ones requested.
+      return db.get_entity(table, row_key, column_names)
+    row_cache.put(table, row_key, result)
+
+  if result[0] not in ERROR_CODES or len(result) != len(schema) + 1:
+    return list(result)
+
+  values = dict(zip(schema, result[1:]))
+  return [result[0]] + [values[column] for column in column_names]
+
+
+def put_entity(table, row_key, column_names, cell_values):
+  """ Writes columns to a row and removes it from the cache.
+
+  Args:
+    table: A string containing the table name.
+    row_key: A string containing the row key.
+    column_names: A list of columns to write.
+    cell_values: A list of values for each column.
+  Returns:
+    A list in the format returned by db.put_entity.
+  """
+  try:
+    return db.put_entity(table, row_key, column_names, cell_values)
+  finally:
+    row_cache.invalidate(table, row_key)
+
+
+def delete_row(table, row_key):
+  """ Deletes a row and removes it from the cache.
+
+  Args:
+    table: A string containing the table name.
+    row_key: A string containing the row key.
+  Returns:
+    A list in the format returned by db.delete_row.
+  """
+  try:
+    return db.delete_row(table, row_key)
+  finally:
+    row_cache.invalidate(table, row_key)
+
+
+def get_cache_stats(secret):
+  """ Reports the hit and miss counts for the row cache.
+
+  Args:
+    secret: The secret key for authentication.
+  Returns:
+    A JSON-encoded dictionary containing the cache statistics.
+  """
+  if secret != super_secret:
+    return "Error: bad secret"
+
+  return json.dumps(row_cache.stats())
+
+
 def does_user_exist(username, secret):
   global db
   global super_secret
   if secret != super_secret:
     return "Error: bad secret"
   try:
-    result = db.get_entity(USER_TABLE, username, ["email"])
+    result = get_cached_entity(USER_TABLE, username, ["email"])
   except AppScaleDBConnectionError as db_error:
     return 'Error: {}'.format(db_error)
   if result[0] in ERROR_CODES and len(result) == 2:
@@ -264,7 +440,7 @@ def does_app_exist(appname, secret):
   if secret != super_secret:
     return "Error: bad secret"
   try:
-    result = db.get_entity(APP_TABLE, appname, ["name"])
+    result = get_cached_entity(APP_TABLE, appname, ["name"])
   except AppScaleDBConnectionError as db_error:
     return 'Error: {}'.format(db_error)
   if result[0] in ERROR_CODES and len(result) == 2:
@@ -296,7 +472,7 @@ def get_user_data(username, secret):
   if secret != super_secret:
     return "Error: bad secret"
   try:
-    result = db.get_entity(USER_TABLE, username, user_schema)
+    result = get_cached_entity(USER_TABLE, username, user_schema)
   except AppScaleDBConnectionError as db_error:
     return 'Error: {}'.format(db_error)
 
@@ -322,7 +498,7 @@ def get_app_data(appname, secret):
     return "Error: Null appname"
 
   try:
-    result = db.get_entity(APP_TABLE, appname, app_schema)
+    result = get_cached_entity(APP_TABLE, appname, app_schema)
   except AppScaleDBConnectionError as db_error:
     return 'Error: {}'.format(db_error)
 
@@ -339,6 +515,80 @@ def get_app_data(appname, secret):
   return app.to_json()
 
 
+def get_users_data(usernames, secret):
+  """ Fetches the records for many users at once.
+
+  Args:
+    usernames: A JSON-encoded list of user emails.
+    secret: The secret key for authentication.
+  Returns:
+    A JSON-encoded dictionary mapping each email that exists to a dictionary
+    of its fields, or an error message.
+  """
+  global db
+  global super_secret
+  global user_schema
+  if secret != super_secret:
+    return "Error: bad secret"
+
+  try:
+    usernames = json.loads(usernames)
+  except ValueError:
+    return "Error: usernames must be a JSON list"
+
+  try:
+    rows = db.batch_get_entity(USER_TABLE, usernames, user_schema)
+  except AppScaleDBConnectionError as db_error:
+    return 'Error: {}'.format(db_error)
+
+  users = {}
+  for username, columns in rows.iteritems():
+    if len(columns) != len(user_schema):
+      continue
+    user = Users("a", "b", "c")
+    user.unpackit([columns[column] for column in user_schema])
+    users[username] = user.to_dict()
+
+  return json.dumps(users)
+
+
+def get_apps_data(appnames, secret):
+  """ Fetches the details for many apps at once.
+
+  Args:
+    appnames: A JSON-encoded list of application IDs.
+    secret: The secret key for authentication.
+  Returns:
+    A JSON-encoded dictionary mapping each application ID that exists to the
+    details returned by get_app_data, or an error message.
+  """
+  global db
+  global super_secret
+  global app_schema
+  if secret != super_secret:
+    return "Error: bad secret"
+
+  try:
+    appnames = json.loads(appnames)
+  except ValueError:
+    return "Error: appnames must be a JSON list"
+
+  try:
+    rows = db.batch_get_entity(APP_TABLE, appnames, app_schema)
+  except AppScaleDBConnectionError as db_error:
+    return 'Error: {}'.format(db_error)
+
+  apps = {}
+  for appname, columns in rows.iteritems():
+    if len(columns) != len(app_schema):
+      continue
+    app = Apps("a", "b", "c")
+    app.unpackit([columns[column] for column in app_schema])
+    apps[appname] = app.to_dict()
+
+  return json.dumps(apps)
+
+
 def commit_new_user(user, passwd, utype, secret):
   global db
   global super_secret
@@ -359,7 +609,7 @@ def commit_new_user(user, passwd, utype, secret):
 
   n_user = Users(user, passwd, utype)
   array = n_user.arrayit()
-  result = db.put_entity(USER_TABLE, user, user_schema, array)
+  result = put_entity(USER_TABLE, user, user_schema, array)
   if result[0] not in ERROR_CODES:
     return "false"
   return "true"
@@ -398,7 +648,7 @@ def add_admin_for_app(user, app, secret):
   n_user.date_change_ = str(time.mktime(t.timetuple()))
   array = n_user.arrayit()
 
-  result = db.put_entity(USER_TABLE, user, user_schema, array)
+  result = put_entity(USER_TABLE, user, user_schema, array)
   if result[0] in ERROR_CODES:
     return "true"
   else:
@@ -441,14 +691,14 @@ def commit_new_app(appname, user, language, secret):
     n_app = Apps(appname, user, language)
     array = n_user.arrayit()
 
-    result = db.put_entity(USER_TABLE, user, user_schema, array)
+    result = put_entity(USER_TABLE, user, user_schema, array)
     if result[0] in ERROR_CODES:
       ret = "true"
     else:
       return "false"
 
     array = n_app.arrayit()
-    result = db.put_entity(APP_TABLE, appname, app_schema, array)
+    result = put_entity(APP_TABLE, appname, app_schema, array)
     if result[0] in ERROR_CODES:
       ret = "true"
     else:
@@ -503,7 +753,7 @@ def commit_tar(app_name, tar, secret):
     values += [str(int(version) + 1)]
     values += [date]
     values += ["true"] #enable bit
-    result = db.put_entity(APP_TABLE, app_name, columns, values)
+    result = put_entity(APP_TABLE, app_name, columns, values)
     if result[0] not in ERROR_CODES:
       return "Error: unable to commit new tar ball %s" % result[0]
   else:
@@ -520,70 +770,111 @@ def delete_all_apps(secret):
     return "Error: bad secret"
 
   ret = "true"
-  result = db.get_table(APP_TABLE, ['name'])
-  if result[0] not in ERROR_CODES:
+  try:
+    appnames = list(db.iterate_row_keys(APP_TABLE))
+  except AppScaleDBConnectionError:
     return "false"
-  result = result[1:]
-  for ii in result:
-    if delete_app(ii, secret) == "false":
+
+  for appname in appnames:
+    if delete_app(appname, secret) == "false":
       ret = "false"
   return ret
 
 
+def list_keys(table, start_after, limit):
+  """ Lists a page of row keys from a table.
+
+  Args:
+    table: A string containing the table name.
+    start_after: A string containing the last key of the previous page, or
+      an empty string to start from the beginning.
+    limit: The maximum number of keys to return.
+  Returns:
+    A JSON-encoded dictionary containing the list of keys and the cursor
+    to pass as start_after to fetch the next page. The cursor is empty when
+    there are no more keys.
+  """
+  try:
+    limit = max(min(int(limit), MAX_PAGE_SIZE), 1)
+  except ValueError:
+    return "Error: limit must be an integer"
+
+  try:
+    keys = list(itertools.islice(
+      db.iterate_row_keys(table, start_after), limit))
+  except AppScaleDBConnectionError as db_error:
+    return 'Error: {}'.format(db_error)
+
+  cursor = ''
+  if len(keys) == limit and keys:
+    cursor = keys[-1]
+  return json.dumps({'keys': keys, 'cursor': cursor})
+
+
+def list_users(start_after, limit, secret):
+  """ Lists the emails of users in pages. Use get_users_data to fetch the
+  details for each page.
+
+  Args:
+    start_after: A string containing the cursor from the previous page, or
+      an empty string.
+    limit: The maximum number of users to return.
+    secret: The secret key for authentication.
+  Returns:
+    A JSON-encoded dictionary containing 'keys' and 'cursor'.
+  """
+  if secret != super_secret:
+    return "Error: bad secret"
+
+  return list_keys(USER_TABLE, start_after, limit)
+
+
+def list_apps(start_after, limit, secret):
+  """ Lists the IDs of applications in pages. Use get_apps_data to fetch the
+  details for each page.
+
+  Args:
+    start_after: A string containing the cursor from the previous page, or
+      an empty string.
+    limit: The maximum number of applications to return.
+    secret: The secret key for authentication.
+  Returns:
+    A JSON-encoded dictionary containing 'keys' and 'cursor'.
+  """
+  if secret != super_secret:
+    return "Error: bad secret"
+
+  return list_keys(APP_TABLE, start_after, limit)
+
+
 def get_all_users(secret):
   global db
   global super_secret
-  global user_schema
-  users = []
   if secret != super_secret:
     return "Error: bad secret"
 
-  result = db.get_table(USER_TABLE, user_schema)
-  if result[0] not in ERROR_CODES:
-    return "Error:" + result[0]
-  result = result[1:]
-  for ii in range(0, (len(result)/len(user_schema))):
-    partial = result[(ii * len(user_schema)): ((1 + ii) * len(user_schema))]
-    if len(partial) != len(user_schema):
-      pass
-    else:
-      a = Users("x", "x", "user")
-      a.unpackit(partial)
-      users.append(a)
+  try:
+    users = list(db.iterate_row_keys(USER_TABLE))
+  except AppScaleDBConnectionError as db_error:
+    return "Error:" + str(db_error)
 
   # this is a placeholder, soap exception happens if returning empty string
-  userstring = "____"
-  for kk in users:
-    userstring += ":" + kk.email_
-  return userstring
+  return ':'.join(["____"] + users)
 
 
 def get_all_apps(secret):
   global db
   global super_secret
-  global app_schema
-  apps = []
   if secret != super_secret:
     return "Error: bad secret"
 
-  result = db.get_table(APP_TABLE, app_schema)
-  if result[0] not in ERROR_CODES:
-    return "Error:" + result[0]
-  result = result[1:]
-  for ii in range(0, (len(result)/len(app_schema))):
-    partial = result[(ii * len(app_schema)): ((1 + ii) * len(app_schema))]
-    if len(partial) != len(app_schema):
-      pass
-    else:
-      a = Apps("x", "x", "x")
-      a.unpackit(partial)
-      apps.append(a)
+  try:
+    apps = list(db.iterate_row_keys(APP_TABLE))
+  except AppScaleDBConnectionError as db_error:
+    return "Error:" + str(db_error)
 
   # this is a placeholder, soap exception happens if returning empty string
-  appstring = "____"
-  for kk in apps:
-    appstring += ":" + kk.name_
-  return appstring
+  return ':'.join(["____"] + apps)
 
 
 def add_instance(appname, host, port, https_port, secret):
@@ -604,7 +895,7 @@ def add_instance(appname, host, port, https_port, secret):
     return "false"
 
   # We only have one host/port for each app.
-  result = db.put_entity(APP_TABLE, appname, columns, [host,
+  result = put_entity(APP_TABLE, appname, columns, [host,
     "{}{}{}".format(port, PORT_SEPARATOR, https_port)])
   if result[0] not in ERROR_CODES:
     return "false"
@@ -625,7 +916,7 @@ def delete_app(appname, secret):
   if result[0] not in ERROR_CODES or len(result) == 1:
     return "false: unable to get entity for app"
 
-  result = db.put_entity(APP_TABLE, appname,
+  result = put_entity(APP_TABLE, appname,
                          ["host", "port", "num_entries"], ["", "", "0"])
   if result[0] not in ERROR_CODES:
     return "false: unable to delete instances"
@@ -669,7 +960,7 @@ def delete_instance(appname, host, port, secret):
   hosts = ':'.join(hosts)
   ports = ':'.join(ports)
 
-  result = db.put_entity(APP_TABLE, appname, ['host', 'port'], [hosts, ports])
+  result = put_entity(APP_TABLE, appname, ['host', 'port'], [hosts, ports])
   if result[0] not in ERROR_CODES:
     return "false"
   return ret
@@ -700,7 +991,7 @@ def commit_new_token(user, token, token_exp, secret):
   values = [token, token_exp, date_change]
   columns += ['date_change']
 
-  result = db.put_entity(USER_TABLE, user, columns, values)
+  result = put_entity(USER_TABLE, user, columns, values)
   if result[0] not in ERROR_CODES:
     return "false"
   return "true"
@@ -764,7 +1055,7 @@ def change_password(user, password, secret):
   if result[1] == "false":
     return "Error: User must be enabled to change password"
 
-  result = db.put_entity(USER_TABLE, user, ['pw'], [password])
+  result = put_entity(USER_TABLE, user, ['pw'], [password])
   if result[0] not in ERROR_CODES:
     return "Error:" + result[0]
   return "true"
@@ -787,7 +1078,7 @@ def enable_app(appname, secret):
   if result[1] == "true":
     return "Error: Trying to enable an application that is already enabled"
 
-  result = db.put_entity(APP_TABLE, appname, ['enabled'], ['true'])
+  result = put_entity(APP_TABLE, appname, ['enabled'], ['true'])
   if result[0] not in ERROR_CODES:
     return "false"
   return "true"
@@ -809,7 +1100,7 @@ def disable_app(appname, secret):
     return "Error: " + result[0]
   if result[1] == "false":
     return "Error: Trying to disable an application twice"
-  result = db.put_entity(APP_TABLE, appname, ['enabled'], ['false'])
+  result = put_entity(APP_TABLE, appname, ['enabled'], ['false'])
   if result[0] not in ERROR_CODES:
     return "false"
   return "true"
@@ -823,7 +1114,7 @@ def is_app_enabled(appname, secret):
     return "Error: bad secret"
 
   try:
-    result = db.get_entity(APP_TABLE, appname, ['enabled'])
+    result = get_cached_entity(APP_TABLE, appname, ['enabled'])
   except AppScaleDBConnectionError as db_error:
     return 'Error: {}'.format(db_error)
 
@@ -848,7 +1139,7 @@ def enable_user(user, secret):
     return "Error: " + result[0]
   if result[1] == "true":
     return "Error: Trying to enable a user twice"
-  result = db.put_entity(USER_TABLE, user, ['enabled'], ['true'])
+  result = put_entity(USER_TABLE, user, ['enabled'], ['true'])
   if result[0] not in ERROR_CODES:
     return "false"
   return "true"
@@ -871,7 +1162,7 @@ def disable_user(user, secret):
   if result[1] == "false":
     return "Error: Trying to disable a user twice"
 
-  result = db.put_entity(USER_TABLE, user, ['enabled'], ['false'])
+  result = put_entity(USER_TABLE, user, ['enabled'], ['false'])
   if result[0] not in ERROR_CODES:
     return "false"
   return "true"
@@ -895,7 +1186,7 @@ def delete_user(user, secret):
   if result[1] == 'true':
     return "Error: unable to delete active user. Disable user first"
 
-  result = db.delete_row(USER_TABLE, user)
+  result = delete_row(USER_TABLE, user)
   if result[0] not in ERROR_CODES:
     return "false"
   return "true"
@@ -909,7 +1200,7 @@ def is_user_enabled(user, secret):
     return "Error: bad secret"
 
   try:
-    result = db.get_entity(USER_TABLE, user, ['enabled'])
+    result = get_cached_entity(USER_TABLE, user, ['enabled'])
   except AppScaleDBConnectionError as db_error:
     return 'Error: {}'.format(db_error)
 
@@ -937,7 +1228,7 @@ def get_key_block(app_id, block_size, secret):
     key = "1"
   next_key = str(int(key) + int(block_size))
   #Update number of entries
-  result = db.put_entity(APP_TABLE, app_id, ['num_entries'], [next_key])
+  result = put_entity(APP_TABLE, app_id, ['num_entries'], [next_key])
   if result[0] not in ERROR_CODES:
     return "false"
   return key
@@ -950,7 +1241,7 @@ def is_user_cloud_admin(username, secret):
     return "Error: bad secret"
 
   try:
-    result = db.get_entity(USER_TABLE, username, ["is_cloud_admin"])
+    result = get_cached_entity(USER_TABLE, username, ["is_cloud_admin"])
   except AppScaleDBConnectionError as db_error:
     return 'Error: {}'.format(db_error)
 
@@ -965,7 +1256,7 @@ def set_cloud_admin_status(username, is_cloud_admin, secret):
   global super_secret
   if secret != super_secret:
     return "Error: bad secret"
-  result = db.put_entity(USER_TABLE, username, ['is_cloud_admin'], [is_cloud_admin])
+  result = put_entity(USER_TABLE, username, ['is_cloud_admin'], [is_cloud_admin])
   if result[0] not in ERROR_CODES:
     return "false:" + result[0]
   return "true"
@@ -978,7 +1269,7 @@ def get_capabilities(username, secret):
     return "Error: bad secret"
 
   try:
-    result = db.get_entity(USER_TABLE, username, ["capabilities"])
+    result = get_cached_entity(USER_TABLE, username, ["capabilities"])
   except AppScaleDBConnectionError as db_error:
     return 'Error: {}'.format(db_error)
 
@@ -993,7 +1284,7 @@ def set_capabilities(username, capabilities, secret):
   global super_secret
   if secret != super_secret:
     return "Error: bad secret"
-  result = db.put_entity(USER_TABLE, username, ['capabilities'], [capabilities])
+  result = put_entity(USER_TABLE, username, ['capabilities'], [capabilities])
   if result[0] not in ERROR_CODES:
     return "false:" + result[0]
   return "true"
@@ -1005,6 +1296,7 @@ def usage():
   print "      --type or -t for type of datastore"
   print "        type available: cassandra"
   print "      --port or -p for server port"
+  print "      --cache-ttl for the seconds to cache lookups (0 to disable)"
 
 
 def main():
@@ -1017,6 +1309,7 @@ def main():
   global datastore_type
   global db
   global ERROR_CODES
+  global row_cache
   global user_schema
 
   for ii in range(1, len(sys.argv)):
@@ -1029,6 +1322,9 @@ def main():
     elif sys.argv[ii] in ('-p', "--port"):
       bindport = int(sys.argv[ii + 1] )
       ii += 1
+    elif sys.argv[ii] == "--cache-ttl":
+      row_cache = RowCache(int(sys.argv[ii + 1]))
+      ii += 1
     else:
       pass
 
@@ -1083,8 +1379,12 @@ def main():
   server.registerFunction(get_key_block)
   server.registerFunction(get_all_apps)
   server.registerFunction(get_all_users)
+  server.registerFunction(list_apps)
+  server.registerFunction(list_users)
   server.registerFunction(get_user_data)
   server.registerFunction(get_app_data)
+  server.registerFunction(get_users_data)
+  server.registerFunction(get_apps_data)
   server.registerFunction(get_tar)
   server.registerFunction(get_token)
   server.registerFunction(get_version)
@@ -1112,5 +1412,7 @@ def main():
   server.registerFunction(get_capabilities)
   server.registerFunction(set_capabilities)
 
+  server.registerFunction(get_cache_stats)
+
   while 1:
     server.serve_forever()
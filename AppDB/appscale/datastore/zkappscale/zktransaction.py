@@ -13,9 +13,11 @@ import time
 import urllib
 
 from appscale.datastore.cassandra_env import cassandra_interface
+from appscale.datastore.dbconstants import AppScaleDBConnectionError
 from appscale.datastore.unpackaged import APPSCALE_PYTHON_APPSERVER
 from kazoo.exceptions import KazooException
 from kazoo.exceptions import ZookeeperError
+from kazoo.protocol.states import KazooState
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
 from google.appengine.datastore import entity_pb
@@ -94,12 +96,29 @@ GC_TIME_PATH = "gclast_time"
 # Lock path for the datastore groomer.
 DS_GROOM_LOCK_PATH = "/appscale_datastore_groomer"
 
+# Lock path for compacting datastore statistics.
+DS_STATS_LOCK_PATH = "/appscale_datastore_stats"
+
 # Lock path for the datastore backup.
 DS_BACKUP_LOCK_PATH = "/appscale_datastore_backup"
 
 # Lock path for the datastore backup.
 DS_RESTORE_LOCK_PATH = "/appscale_datastore_restore"
 
+# Each datastore server that protects non-transactional writes with entity
+# group leases instead of ZooKeeper locks holds an ephemeral child of this
+# node.
+LOCK_FREE_WRITES_PATH = "/appscale_datastore_lock_free_writes"
+
+# Each child of this node is an application whose index entries are deleted
+# along with the entity changes that invalidate them, so queries for that
+# application do not need to validate index entries.
+TRUSTED_INDEXES_PATH = "/appscale_datastore_trusted_indexes"
+
+# The AppController sets this node to "true" once every datastore server has
+# stopped accepting writes.
+READ_ONLY_PATH = "/appscale/datastore_read_only"
+
 # A unique prefix for cross group transactions.
 XG_PREFIX = "xg"
 
@@ -146,6 +165,14 @@ class ZKTransaction:
   # How long to wait before retrying an operation.
   ZK_RETRY_TIME = .5
 
+  # How long to wait before checking if an entity group lease is released.
+  LEASE_RETRY_TIME = .05
+
+  # The number of seconds a transaction waits for a lease to be released.
+  # Leases live much longer, so this keeps the wait well under the deadline
+  # of the request that is acquiring the lock.
+  LEASE_WAIT_TIMEOUT = 5
+
   # The number of seconds to wait before we consider a zk call a failure.
   DEFAULT_ZK_TIMEOUT = 3
 
@@ -185,6 +212,26 @@ class ZKTransaction:
 
     self.__counter_cache = {}
 
+    # Blacklisted transaction IDs for each blacklist node. An entry is only
+    # kept while a child watch on its node is pending, and the watch event
+    # discards it.
+    self.blacklist_cache = {}
+    self.blacklist_cache_lock = threading.Lock()
+    self.blacklist_generation = 0
+    self.blacklist_listener_handle = None
+
+    # Indicates if any writes use entity group leases. The handle that is
+    # watching the writers' nodes keeps it current.
+    self.lock_free_writes = None
+    self.lock_free_writes_handle = None
+
+    # The node that indicates this client writes using entity group leases.
+    self.lock_free_writer = None
+
+    # Applications whose queries skip index validation. This is None until
+    # the node is watched.
+    self.trusted_index_apps = None
+
     # for gc
     self.gc_running = False
     self.gc_cv = threading.Condition()
@@ -337,6 +384,29 @@ class ZKTransaction:
       self.logger.exception(kazoo_exception)
       self.reestablish_connection()
 
+  def get_children(self, path):
+    """ Lists the children of the ZooKeeper node at the given path.
+
+    Args:
+      path: A PATH_SEPARATOR-separated str that represents the parent node.
+    Returns:
+      A list of child node names. The list is empty if the node does not
+      exist.
+    Raises:
+      ZKInternalException: If there was an error trying to list the children.
+    """
+    if self.needs_connection or not self.handle.connected:
+      self.reestablish_connection()
+
+    try:
+      return self.run_with_retry(self.handle.get_children, path)
+    except kazoo.exceptions.NoNodeError:
+      return []
+    except kazoo.exceptions.KazooException as kazoo_exception:
+      self.logger.exception(kazoo_exception)
+      self.reestablish_connection()
+      raise ZKInternalException('Unable to list children of {}'.format(path))
+
   def delete_recursive(self, path):
     """ Deletes the ZooKeeper node at path, and any child nodes it may have.
 
@@ -714,9 +784,54 @@ class ZKTransaction:
     except kazoo.exceptions.NoNodeError:
       return True
 
+  def commit_transaction_ops(self, add_operations, applied=None):
+    """ Commits a kazoo transaction, which applies all of its operations in a
+    single round trip.
+
+    A TransactionRequest can only be committed once, so a new one is built
+    for each attempt. If the connection is lost after the server applied an
+    attempt, the next attempt fails with NodeExistsError or NoNodeError. In
+    that case, applied is called to check whether the earlier attempt
+    succeeded.
+
+    Args:
+      add_operations: A function that adds the operations to a kazoo
+        TransactionRequest.
+      applied: A function that returns True if the operations have already
+        been applied.
+    Returns:
+      A list of the results for each operation in the transaction.
+    Raises:
+      KazooException: The error raised by the first operation that failed.
+    """
+    attempts = []
+
+    def commit():
+      transaction = self.handle.transaction()
+      add_operations(transaction)
+      attempts.append(transaction)
+      return transaction.commit()
+
+    results = self.run_with_retry(commit)
+    for result in results:
+      if (isinstance(result, Exception) and
+          not isinstance(result, kazoo.exceptions.RolledBackError)):
+        if (len(attempts) > 1 and applied is not None and
+            isinstance(result, (kazoo.exceptions.NodeExistsError,
+                                kazoo.exceptions.NoNodeError)) and
+            applied()):
+          self.logger.info('Transaction was applied by an earlier attempt')
+          return results
+        raise result
+    return results
+
   def acquire_additional_lock(self, app_id, txid, entity_key, create):
     """ Acquire an additional lock for a cross group transaction.
 
+    The lock node and the transaction's lock list are written together in a
+    single ZooKeeper transaction, so a lock is never held without being
+    recorded in the lock list.
+
     Args:
       app_id: A str representing the application ID.
       txid: The transaction ID you are acquiring a lock for. Built into
@@ -740,14 +855,43 @@ class ZKTransaction:
 
     txpath = self.get_transaction_path(app_id, txid)
     lockrootpath = self.get_lock_root_path(app_id, entity_key)
-    lockpath = None
+    transaction_lock_path = self.get_transaction_lock_list_path(app_id, txid)
 
     try:
-      self.logger.debug(
-        'Trying to create path {} with value {}'.format(lockrootpath, txpath))
-      lockpath = self.run_with_retry(self.handle.create, lockrootpath,
-        value=str(txpath), acl=ZOO_ACL_OPEN, ephemeral=False, 
-        sequence=False, makepath=True)
+      if create:
+        lock_list_str = lockrootpath
+        lock_list_version = None
+      else:
+        tx_lockpath, stat = self.run_with_retry(self.handle.get,
+          transaction_lock_path)
+        lock_list = tx_lockpath.split(LOCK_LIST_SEPARATOR)
+        lock_list.append(lockrootpath)
+        if len(lock_list) > MAX_GROUPS_FOR_XG:
+          raise ZKBadRequest("acquire_additional_lock: Too many " \
+            "groups for this XG transaction.")
+        lock_list_str = LOCK_LIST_SEPARATOR.join(lock_list)
+        lock_list_version = stat.version
+
+      def add_operations(transaction):
+        self.logger.debug(
+          'Trying to create path {} with value {}'.format(lockrootpath, txpath))
+        transaction.create(lockrootpath, value=str(txpath), acl=ZOO_ACL_OPEN,
+          ephemeral=False, sequence=False)
+        if lock_list_version is None:
+          transaction.create(transaction_lock_path, value=str(lock_list_str),
+            acl=ZOO_ACL_OPEN, ephemeral=False, sequence=False)
+        else:
+          transaction.set_data(transaction_lock_path, str(lock_list_str),
+            version=lock_list_version)
+
+      def lock_held():
+        try:
+          holder = self.run_with_retry(self.handle.get, lockrootpath)[0]
+        except kazoo.exceptions.NoNodeError:
+          return False
+        return holder == txpath
+
+      self.commit_transaction_ops(add_operations, applied=lock_held)
     except kazoo.exceptions.NodeExistsError:
       # fail to get lock
       try:
@@ -768,6 +912,26 @@ class ZKTransaction:
           'Lock {} was in use but was released'.format(lockrootpath))
       raise ZKTransactionException("acquire_additional_lock: There is " \
         "already another transaction using {0} lock".format(lockrootpath))
+    except kazoo.exceptions.NoNodeError:
+      # The first lock taken for an application needs its parent created.
+      lock_parent = lockrootpath.rsplit(PATH_SEPARATOR, 1)[0]
+      try:
+        lock_parent_exists = self.run_with_retry(self.handle.exists,
+          lock_parent)
+        if not lock_parent_exists:
+          self.run_with_retry(self.handle.ensure_path, lock_parent)
+      except kazoo.exceptions.KazooException as kazoo_exception:
+        self.logger.exception(kazoo_exception)
+        self.reestablish_connection()
+        raise ZKTransactionException("Couldn't create lock root {0}" \
+          .format(lock_parent))
+      if lock_parent_exists:
+        raise ZKTransactionException("Transaction {0} is not valid" \
+          .format(txid))
+      return self.acquire_additional_lock(app_id, txid, entity_key, create)
+    except kazoo.exceptions.BadVersionError:
+      raise ZKTransactionException("Lock list {0} was modified concurrently" \
+        .format(transaction_lock_path))
     except kazoo.exceptions.KazooException as kazoo_exception:
       self.logger.exception(kazoo_exception)
       self.reestablish_connection()
@@ -775,43 +939,230 @@ class ZKTransaction:
         .format(lockrootpath))
 
     self.logger.debug(
-      'Created new lock root path {} with value {}'
-      .format(lockrootpath, txpath))
+      'Created new lock root path {} with value {}. Lock list {} is {}'
+      .format(lockrootpath, txpath, transaction_lock_path, lock_list_str))
 
-    transaction_lock_path = self.get_transaction_lock_list_path(app_id, txid)
+    try:
+      self.wait_for_group_lease(app_id, entity_key)
+    except ZKTransactionException:
+      # Lock-free writers back off while the lock exists, so it should not
+      # be held by a transaction that is going to fail.
+      def remove_operations(transaction):
+        transaction.delete(lockrootpath)
+        if lock_list_version is None:
+          transaction.delete(transaction_lock_path)
+        else:
+          transaction.set_data(transaction_lock_path, str(tx_lockpath),
+            version=lock_list_version + 1)
 
+      def lock_released():
+        try:
+          holder = self.run_with_retry(self.handle.get, lockrootpath)[0]
+        except kazoo.exceptions.NoNodeError:
+          return True
+        return holder != txpath
+
+      try:
+        self.commit_transaction_ops(remove_operations, applied=lock_released)
+      except kazoo.exceptions.KazooException as kazoo_exception:
+        self.logger.warning('Unable to release lock {}: {}'.format(
+          lockrootpath, kazoo_exception))
+      raise
+
+    return True
+
+  def enable_lock_free_writes(self):
+    """ Indicates to all ZooKeeper clients that this client protects some
+    non-transactional writes with entity group leases instead of ZooKeeper
+    locks.
+
+    The indication is an ephemeral node, so it is removed when this client's
+    session ends. Call this before each lock-free write so that the node is
+    created again after the session is lost.
+
+    Raises:
+      ZKTransactionException: If the flag could not be set.
+    """
+    if self.lock_free_writer is not None:
+      return
+
+    handle = self.handle
+    self.watch_connection_state(handle)
     try:
-      if create:
-        self.run_with_retry(self.handle.create_async, transaction_lock_path,
-          value=str(lockpath), acl=ZOO_ACL_OPEN, ephemeral=False,
-          makepath=False, sequence=False)
-        self.logger.debug(
-          'Created lock list path {} with value {}'
-          .format(transaction_lock_path, lockpath))
-      else:
-        tx_lockpath = self.run_with_retry(self.handle.get,
-          transaction_lock_path)[0]
-        lock_list = tx_lockpath.split(LOCK_LIST_SEPARATOR)
-        lock_list.append(lockpath)
-        lock_list_str = LOCK_LIST_SEPARATOR.join(lock_list)
-        self.run_with_retry(self.handle.set_async, transaction_lock_path,
-          str(lock_list_str))
-        self.logger.debug(
-          'Set lock list path {} to value {}'
-          .format(transaction_lock_path, lock_list_str))
-        # We do this check last, otherwise we may have left over locks to 
-        # to a lack of a lock path reference.
-        if len(lock_list) > MAX_GROUPS_FOR_XG:
-          raise ZKBadRequest("acquire_additional_lock: Too many " \
-            "groups for this XG transaction.")
+      self.run_with_retry(handle.ensure_path, LOCK_FREE_WRITES_PATH)
+      self.lock_free_writer = self.run_with_retry(handle.create,
+        PATH_SEPARATOR.join([LOCK_FREE_WRITES_PATH, 'writer-']),
+        acl=ZOO_ACL_OPEN, ephemeral=True, sequence=True)
+    except kazoo.exceptions.KazooException as kazoo_exception:
+      self.logger.exception(kazoo_exception)
+      self.reestablish_connection()
+      raise ZKTransactionException('Unable to enable lock-free writes')
+
+  def lock_free_writes_enabled(self):
+    """ Checks if any non-transactional writes use entity group leases.
+
+    Returns:
+      A boolean indicating whether or not lock-free writes are enabled.
+    """
+    handle = self.handle
+    if self.lock_free_writes_handle is not handle:
+      self.lock_free_writes_handle = handle
+
+      def update_flag(children):
+        """ Updates the flag when writers start or stop.
+
+        Returns:
+          False if the watch is stale and should be stopped.
+        """
+        if self.lock_free_writes_handle is not handle:
+          return False
+        self.lock_free_writes = bool(children)
+
+      try:
+        self.run_with_retry(handle.ensure_path, LOCK_FREE_WRITES_PATH)
+        handle.ChildrenWatch(LOCK_FREE_WRITES_PATH, update_flag)
+      except kazoo.exceptions.KazooException as kazoo_exception:
+        self.logger.exception(kazoo_exception)
+        self.lock_free_writes_handle = None
+        # Without the watch, assume that leases may be held.
+        return True
+
+    return bool(self.lock_free_writes)
+
+  def datastore_is_read_only(self):
+    """ Checks if the AppController has disabled datastore writes.
+
+    Returns:
+      A boolean indicating whether the datastore is in read-only mode.
+    Raises:
+      ZKTransactionException: If the mode could not be fetched.
+    """
+    try:
+      value = self.run_with_retry(self.handle.get, READ_ONLY_PATH)[0]
+    except kazoo.exceptions.NoNodeError:
+      return False
+    except kazoo.exceptions.KazooException as kazoo_exception:
+      self.logger.exception(kazoo_exception)
+      self.reestablish_connection()
+      raise ZKTransactionException('Unable to fetch the read-only mode')
+
+    return value == 'true'
 
+  def disable_index_validation(self, app_id):
+    """ Indicates that an application's index entries no longer need to be
+    validated at query time.
+
+    Args:
+      app_id: A str specifying the application ID.
+    Raises:
+      ZKTransactionException: If the flag could not be set.
+    """
+    path = PATH_SEPARATOR.join([TRUSTED_INDEXES_PATH, app_id])
+    try:
+      self.run_with_retry(self.handle.ensure_path, path)
     except kazoo.exceptions.KazooException as kazoo_exception:
       self.logger.exception(kazoo_exception)
       self.reestablish_connection()
-      raise ZKTransactionException("Couldn't create or set a lock at path {0}" \
-        .format(transaction_lock_path))
+      raise ZKTransactionException(
+        'Unable to disable index validation for {}'.format(app_id))
 
-    return True
+  def enable_index_validation(self, app_id):
+    """ Indicates that an application's index entries must be validated at
+    query time.
+
+    Args:
+      app_id: A str specifying the application ID.
+    Raises:
+      ZKTransactionException: If the flag could not be cleared.
+    """
+    path = PATH_SEPARATOR.join([TRUSTED_INDEXES_PATH, app_id])
+    try:
+      self.run_with_retry(self.handle.delete, path)
+    except kazoo.exceptions.NoNodeError:
+      pass
+    except kazoo.exceptions.KazooException as kazoo_exception:
+      self.logger.exception(kazoo_exception)
+      self.reestablish_connection()
+      raise ZKTransactionException(
+        'Unable to enable index validation for {}'.format(app_id))
+
+  def index_validation_disabled(self, app_id):
+    """ Checks if queries can skip validating an application's index entries.
+
+    Args:
+      app_id: A str specifying the application ID.
+    Returns:
+      A boolean indicating whether or not index validation is disabled.
+    """
+    if self.trusted_index_apps is None:
+      def update_apps(children):
+        """ Replaces the set of trusted applications when it changes. """
+        self.trusted_index_apps = frozenset(children)
+
+      try:
+        self.run_with_retry(self.handle.ensure_path, TRUSTED_INDEXES_PATH)
+        self.handle.ChildrenWatch(TRUSTED_INDEXES_PATH, update_apps)
+      except kazoo.exceptions.KazooException as kazoo_exception:
+        self.logger.exception(kazoo_exception)
+        return False
+
+    return app_id in (self.trusted_index_apps or ())
+
+  def wait_for_group_lease(self, app_id, entity_key):
+    """ Waits until no lock-free writer holds a lease on an entity group.
+
+    This is called after the group's ZooKeeper lock is acquired. Lock-free
+    writers check for the ZooKeeper lock after taking their lease, so once
+    the lease is free, no other writer can modify the group until the lock
+    is released.
+
+    Args:
+      app_id: A str representing the application ID.
+      entity_key: The root key of the entity group.
+    Raises:
+      ZKTransactionException: If a lease was not released in time.
+    """
+    if not self.lock_free_writes_enabled():
+      return
+
+    if self.db_access is None:
+      self.db_access = cassandra_interface.DatastoreProxy()
+
+    deadline = time.time() + self.LEASE_WAIT_TIMEOUT
+    try:
+      while self.db_access.group_lease_held(app_id, entity_key):
+        if time.time() > deadline:
+          raise ZKTransactionException(
+            'Timed out waiting for lease on {}'.format(entity_key))
+        time.sleep(self.LEASE_RETRY_TIME)
+    except AppScaleDBConnectionError:
+      raise ZKTransactionException(
+        'Unable to check lease on {}'.format(entity_key))
+
+  def is_group_locked(self, app_id, entity_key):
+    """ Checks if a ZooKeeper transaction holds the lock on an entity group.
+
+    Args:
+      app_id: A str representing the application ID.
+      entity_key: The root key of the entity group.
+    Returns:
+      A boolean indicating whether or not the group is locked.
+    Raises:
+      ZKTransactionException: If the lock could not be checked.
+    """
+    if self.needs_connection or not self.handle.connected:
+      self.reestablish_connection()
+
+    lockrootpath = self.get_lock_root_path(app_id, entity_key)
+    try:
+      # Make sure this server has seen every lock that has been created.
+      self.run_with_retry(self.handle.sync, lockrootpath)
+      return self.run_with_retry(self.handle.exists, lockrootpath) is not None
+    except kazoo.exceptions.KazooException as kazoo_exception:
+      self.logger.exception(kazoo_exception)
+      self.reestablish_connection()
+      raise ZKTransactionException(
+        "Couldn't check lock at path {}".format(lockrootpath))
 
   def is_xg(self, app_id, tx_id):
     """ Checks to see if the transaction can operate over multiple entity
@@ -868,13 +1219,22 @@ class ZKTransaction:
       self.reestablish_connection()
 
     lockrootpath = self.get_lock_root_path(app_id, entity_key)
+    transaction_lock_path = self.get_transaction_lock_list_path(app_id, txid)
 
     try:
-      if self.is_in_transaction(app_id, txid):  # use current lock
-        transaction_lock_path = self.get_transaction_lock_list_path(
-          app_id, txid)
+      if self.is_blacklisted(app_id, txid):
+        raise ZKTransactionException(
+          'Transaction {} is blacklisted'.format(txid))
+
+      # Fetching the lock list directly tells us whether the transaction
+      # already holds any locks without a separate exists call.
+      try:
         prelockpath = self.run_with_retry(self.handle.get,
           transaction_lock_path)[0]
+      except kazoo.exceptions.NoNodeError:
+        prelockpath = None
+
+      if prelockpath is not None:  # use current lock
         lock_list = prelockpath.split(LOCK_LIST_SEPARATOR)
         self.logger.debug('Lock list: {}'.format(lock_list))
         if lockrootpath in lock_list:
@@ -941,6 +1301,9 @@ class ZKTransaction:
     Callers must call acquire_lock before calling release_lock. Upon calling
     release_lock, the given transaction ID is no longer valid.
 
+    The locks and the transaction's nodes are deleted in a single ZooKeeper
+    transaction. If that fails, they are deleted one at a time instead.
+
     Args:
       app_id: The application ID we are releasing a lock for.
       txid: The transaction ID we are releasing a lock for.
@@ -956,24 +1319,31 @@ class ZKTransaction:
     if self.needs_connection or not self.handle.connected:
       self.reestablish_connection()
 
-    self.check_transaction(app_id, txid)
+    try:
+      if self.is_blacklisted(app_id, txid):
+        raise ZKTransactionException("Transaction {0} timed out.".format(txid))
+    except ZKInternalException as zk_exception:
+      self.logger.exception(zk_exception)
+      self.reestablish_connection()
+      raise ZKTransactionException("Couldn't see if transaction {0} is valid" \
+        .format(txid))
+
     txpath = self.get_transaction_path(app_id, txid)
-     
     transaction_lock_path = self.get_transaction_lock_list_path(app_id, txid)
     try:
       lock_list_str = self.run_with_retry(self.handle.get,
         transaction_lock_path)[0]
       lock_list = lock_list_str.split(LOCK_LIST_SEPARATOR)
-      for lock_path in lock_list:
-        self.logger.debug('Lock released: {}'.format(lock_path))
-        self.run_with_retry(self.handle.delete, lock_path)
-      self.run_with_retry(self.handle.delete, transaction_lock_path)
+      children = self.run_with_retry(self.handle.get_children, txpath)
     except kazoo.exceptions.NoNodeError:
       try:
         if self.is_blacklisted(app_id, txid):
           raise ZKTransactionException(
             "Unable to release lock {0} for app id {1}" \
             .format(transaction_lock_path, app_id))
+        elif not self.run_with_retry(self.handle.exists, txpath):
+          raise ZKTransactionException(
+            'Transaction {} is invalid'.format(txid))
         else:
           return True
       except ZKInternalException as zk_exception:
@@ -982,44 +1352,74 @@ class ZKTransaction:
         raise ZKTransactionException("Internal exception prevented us from " \
           "releasing lock {0} for app id {1}".format(transaction_lock_path,
           app_id))
+      except kazoo.exceptions.KazooException as kazoo_exception:
+        self.logger.exception(kazoo_exception)
+        self.reestablish_connection()
+        raise ZKTransactionException(
+          'Unable to determine status of transaction {}'.format(txid))
     except kazoo.exceptions.KazooException as kazoo_exception:
       self.logger.exception(kazoo_exception)
       self.reestablish_connection()
       raise ZKTransactionException("Couldn't release lock {0} for appid {1}" \
         .format(transaction_lock_path, app_id))
 
+    child_paths = [PATH_SEPARATOR.join([txpath, child]) for child in children]
     try:
-      if self.is_xg(app_id, txid):
-        xg_path = self.get_xg_path(app_id, txid)
-        self.run_with_retry(self.handle.delete, xg_path)
-
-      for child in self.run_with_retry(self.handle.get_children, txpath):
-        lock_path = PATH_SEPARATOR.join([txpath, child])
-        self.logger.debug('Removing lock: {}'.format(lock_path))
-        self.run_with_retry(self.handle.delete, lock_path)
-
-      # This deletes the transaction root path.
-      self.run_with_retry(self.handle.delete, txpath)
-
-    except ZKInternalException as zk_exception:
-      # Although there was a failure doing the async deletes, since we've
-      # already released the locks above, we can safely return True here.
-      self.logger.exception(zk_exception)
-      self.reestablish_connection()
+      def add_operations(transaction):
+        for lock_path in lock_list:
+          transaction.delete(lock_path)
+        for child_path in child_paths:
+          transaction.delete(child_path)
+        # This deletes the transaction root path.
+        transaction.delete(txpath)
+
+      def transaction_removed():
+        return self.run_with_retry(self.handle.exists, txpath) is None
+
+      self.commit_transaction_ops(add_operations,
+                                  applied=transaction_removed)
+      self.logger.debug('Locks released: {}'.format(lock_list))
       return True
     except kazoo.exceptions.KazooException as kazoo_exception:
-      # Although there was a failure doing the async deletes, since we've
-      # already released the locks above, we can safely return True here.
-      self.logger.exception(kazoo_exception)
-      self.reestablish_connection()
-      return True
+      self.logger.warning('Unable to release locks for transaction {0} at ' \
+        'once: {1}'.format(txid, repr(kazoo_exception)))
+
+    return self.release_lock_nodes(lock_list + child_paths + [txpath])
 
+  def release_lock_nodes(self, paths):
+    """ Deletes lock and transaction nodes one at a time, skipping any that
+    have already been removed.
+
+    Args:
+      paths: A list of ZooKeeper paths to delete, in order.
+    Returns:
+      True once the locks have been released.
+    Raises:
+      ZKTransactionException: If a lock could not be released.
+    """
+    for index, path in enumerate(paths):
+      try:
+        self.run_with_retry(self.handle.delete, path)
+        self.logger.debug('Removed: {}'.format(path))
+      except kazoo.exceptions.NoNodeError:
+        pass
+      except kazoo.exceptions.KazooException as kazoo_exception:
+        self.logger.exception(kazoo_exception)
+        self.reestablish_connection()
+        if index == 0:
+          raise ZKTransactionException("Couldn't release lock {0}" \
+            .format(path))
+        # The remaining transaction nodes are cleaned up by the garbage
+        # collector.
+        return True
     return True
 
   def is_blacklisted(self, app_id, txid, retries=5):
     """ Checks to see if the given transaction ID has been blacklisted (that is,
     if it is no longer considered to be a valid transaction).
 
+    The check is answered from the watched blacklist cache when possible.
+
     Args:
       app_id: The application ID whose transaction ID we want to validate.
       txid: The transaction ID that we want to validate.
@@ -1033,10 +1433,7 @@ class ZKTransaction:
       self.reestablish_connection()
 
     try:
-      blacklist_root = self.get_blacklist_root_path(app_id)
-      blacklist_txn = PATH_SEPARATOR.join([blacklist_root, 
-        str(txid)]) 
-      return self.run_with_retry(self.handle.exists, blacklist_txn)
+      return str(txid) in self.get_blacklist_cache(app_id)
     except kazoo.exceptions.KazooException as kazoo_exception:
       self.logger.exception(kazoo_exception)
       if retries > 0:
@@ -1050,6 +1447,89 @@ class ZKTransaction:
       raise ZKInternalException("Couldn't see if appid {0}'s transaction, " \
         "{1}, is blacklisted.".format(app_id, txid))
 
+  def get_blacklist_cache(self, app_id):
+    """ Fetches the set of blacklisted transaction IDs for an application.
+
+    The set is read from ZooKeeper only if it isn't cached. Reading it leaves
+    a watch on the blacklist node, which discards the cached set when the
+    node's children change.
+
+    Args:
+      app_id: A str specifying the application ID.
+    Returns:
+      A set of blacklisted transaction IDs as strs.
+    Raises:
+      KazooException: If the blacklist could not be fetched.
+    """
+    blacklist_root = self.get_blacklist_root_path(app_id)
+    with self.blacklist_cache_lock:
+      if blacklist_root in self.blacklist_cache:
+        return self.blacklist_cache[blacklist_root]
+
+      handle = self.handle
+      generation = self.blacklist_generation
+    self.watch_connection_state(handle)
+
+    # The same callback is used for every request, so ZooKeeper keeps a
+    # single watch on the node no matter how often it is fetched.
+    try:
+      children = self.run_with_retry(handle.get_children, blacklist_root,
+        watch=self.handle_blacklist_change)
+    except kazoo.exceptions.NoNodeError:
+      self.run_with_retry(handle.ensure_path, blacklist_root)
+      children = self.run_with_retry(handle.get_children, blacklist_root,
+        watch=self.handle_blacklist_change)
+
+    blacklist = frozenset(children)
+    with self.blacklist_cache_lock:
+      # Don't cache the result if the blacklist changed while it was fetched.
+      if generation == self.blacklist_generation:
+        self.blacklist_cache[blacklist_root] = blacklist
+    return blacklist
+
+  def handle_blacklist_change(self, event):
+    """ Discards a cached blacklist once its node's children change. Every
+    blacklist is discarded when the session's watches are reset.
+
+    Args:
+      event: A WatchedEvent for the blacklist node.
+    """
+    with self.blacklist_cache_lock:
+      if event.path is None:
+        self.blacklist_cache.clear()
+      else:
+        self.blacklist_cache.pop(event.path, None)
+      self.blacklist_generation += 1
+
+  def clear_blacklist_cache(self):
+    """ Discards all cached blacklists. """
+    with self.blacklist_cache_lock:
+      self.blacklist_cache.clear()
+      self.blacklist_generation += 1
+
+  def watch_connection_state(self, handle):
+    """ Calls handle_state_change when a connection's state changes.
+
+    Args:
+      handle: A KazooClient.
+    """
+    with self.blacklist_cache_lock:
+      if self.blacklist_listener_handle is not handle:
+        handle.add_listener(self.handle_state_change)
+        self.blacklist_listener_handle = handle
+
+  def handle_state_change(self, state):
+    """ Discards cached blacklists and the lock-free writer node when the
+    ZooKeeper session is lost, since the session's watches and ephemeral
+    nodes are gone. A suspended session keeps its watches, and ZooKeeper
+    delivers the events that were missed once it reconnects.
+
+    Args:
+      state: A KazooState specifying the new state of the connection.
+    """
+    if state == KazooState.LOST:
+      self.clear_blacklist_cache()
+      self.lock_free_writer = None
 
   def get_valid_transaction_id(self, app_id, target_txid, entity_key):
     """ This returns valid transaction id for the entity key.
@@ -1248,6 +1728,9 @@ class ZKTransaction:
   def reestablish_connection(self):
     """ Checks the connection and resets it as needed. """
     self.logger.warning('Re-establishing ZooKeeper connection.')
+    self.clear_blacklist_cache()
+    self.lock_free_writer = None
+    self.trusted_index_apps = None
     try:
       self.handle.restart()
       self.needs_connection = False
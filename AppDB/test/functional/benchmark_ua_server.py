@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+""" Measures UserAppServer lookups per second with and without the row cache.
+
+This runs the lookup functions in-process against the deployment's datastore,
+so it must be run on a machine that can reach Cassandra.
+"""
+import argparse
+import sys
+import time
+
+from appscale.datastore import appscale_datastore
+from appscale.datastore.scripts import ua_server
+
+
+def load_schemas():
+  """ Prepares the module state that ua_server.main normally sets up. """
+  ua_server.db = appscale_datastore.DatastoreFactory.getDatastore('cassandra')
+  ua_server.ERROR_CODES = appscale_datastore.DatastoreFactory.error_codes()
+  ua_server.user_schema = ua_server.db.get_schema(ua_server.USER_TABLE)[1:]
+  ua_server.app_schema = ua_server.db.get_schema(ua_server.APP_TABLE)[1:]
+  ua_server.Users.attributes_ = ua_server.user_schema
+  ua_server.Apps.attributes_ = ua_server.app_schema
+
+
+def run_lookups(user, app, requests):
+  """ Performs a mix of the lookups that clients poll.
+
+  Args:
+    user: A string containing an existing user's email.
+    app: A string containing an existing application ID.
+    requests: The number of lookups to perform.
+  Returns:
+    The number of lookups performed per second.
+  """
+  secret = ua_server.super_secret
+  lookups = [
+    lambda: ua_server.get_user_data(user, secret),
+    lambda: ua_server.is_user_enabled(user, secret),
+    lambda: ua_server.get_capabilities(user, secret),
+    lambda: ua_server.get_app_data(app, secret),
+    lambda: ua_server.does_app_exist(app, secret)
+  ]
+  start = time.time()
+  for index in range(requests):
+    lookups[index % len(lookups)]()
+  return requests / (time.time() - start)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--user', required=True,
+                      help='The email of an existing user')
+  parser.add_argument('--app', required=True,
+                      help='The ID of an existing application')
+  parser.add_argument('--requests', type=int, default=5000,
+                      help='The number of lookups to perform for each run')
+  args = parser.parse_args()
+
+  load_schemas()
+
+  ua_server.row_cache = ua_server.RowCache(0)
+  uncached = run_lookups(args.user, args.app, args.requests)
+
+  ua_server.row_cache = ua_server.RowCache(ua_server.DEFAULT_CACHE_TTL)
+  cached = run_lookups(args.user, args.app, args.requests)
+
+  print('Without cache: {:.0f} lookups/s'.format(uncached))
+  print('With cache: {:.0f} lookups/s ({hits} hits, {misses} misses)'.format(
+    cached, **ua_server.row_cache.stats()))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -2,6 +2,7 @@
 # Test for soap calls
 # Test each exit point on the soap calls
 
+import json
 import os
 import SOAPpy
 import sys
@@ -196,6 +197,14 @@ ret = server.get_app_data("xxx", "xxx")
 if ret != BAD_SECRET:
   err(helper_functions.lineno(), ret)
 
+ret = server.get_users_data('["xxx"]', "xxx")
+if ret != BAD_SECRET:
+  err(helper_functions.lineno(), ret)
+
+ret = server.get_apps_data('["xxx"]', "xxx")
+if ret != BAD_SECRET:
+  err(helper_functions.lineno(), ret)
+
 ret = server.get_tar("xxx", "xxx")
 if ret != BAD_SECRET:
   err(helper_functions.lineno(), ret)
@@ -309,6 +318,10 @@ if "____" not in ret:
   print "Make sure you run appscale with at least one app uploaded"
   err(helper_functions.lineno(), ret)
 
+ret = json.loads(server.list_users("", 1, super_secret))
+if len(ret['keys']) != 1:
+  err(helper_functions.lineno(), ret)
+
 ret = server.get_user_data(user[0], super_secret)
 if "Error" not in ret:
   err(helper_functions.lineno(), ret)
@@ -317,6 +330,14 @@ ret = server.get_app_data(app[0], super_secret)
 if "Error" not in ret:
   err(helper_functions.lineno(), ret)
 
+ret = server.get_users_data(json.dumps([user[0]]), super_secret)
+if ret != "{}":
+  err(helper_functions.lineno(), ret)
+
+ret = server.get_apps_data(json.dumps([app[0]]), super_secret)
+if ret != "{}":
+  err(helper_functions.lineno(), ret)
+
 ret = server.get_tar(app[0], super_secret)
 if "Error" not in ret:
   err(helper_functions.lineno(), ret)
@@ -2,14 +2,18 @@
 
 """ Unit tests for backup_data.py """
 
+import os
 import re
+import shutil
+import tempfile
 import time
 import unittest
 
 from appscale.datastore import appscale_datastore_batch
-from appscale.datastore import entity_utils
+from appscale.datastore.backup.backup_file import read_entities
 from appscale.datastore.backup.datastore_backup import DatastoreBackup
 from appscale.datastore.dbconstants import AppScaleDBConnectionError
+from appscale.datastore.dbconstants import TOMBSTONE
 from appscale.datastore.zkappscale.zktransaction import ZKTransactionException
 from flexmock import flexmock
 
@@ -119,43 +123,62 @@ class TestBackup(unittest.TestCase):
     zookeeper = flexmock()
     fake_backup = flexmock(DatastoreBackup('app_id', zookeeper,
       "cassandra", False, []))
-
-  def test_process_entity(self):
+    backup_dir = tempfile.mkdtemp()
+    fake_backup.backup_dir = backup_dir + '/'
+    fake_backup.set_filename()
+    fake_backup.MAX_FILE_SIZE = 100
+
+    try:
+      for entity in ['a' * 40, 'b' * 40, 'c' * 40]:
+        self.assertEquals(True, fake_backup.dump_entity(entity))
+      fake_backup.close_backup_file()
+
+      # The second file is started once the first one is full.
+      backup_files = sorted(os.listdir(backup_dir))
+      self.assertEquals(2, len(backup_files))
+      with open(os.path.join(backup_dir, backup_files[0]), 'rb') as first:
+        self.assertEquals(['a' * 40, 'b' * 40], list(read_entities(first)))
+      with open(os.path.join(backup_dir, backup_files[1]), 'rb') as second:
+        self.assertEquals(['c' * 40], list(read_entities(second)))
+    finally:
+      shutil.rmtree(backup_dir)
+
+  def test_process_entity_batch(self):
     zookeeper = flexmock()
     fake_backup = flexmock(DatastoreBackup('app_id', zookeeper,
       "cassandra", False, []))
-
-    flexmock(re).should_receive('match').at_least().times(2).and_return(None)
-    flexmock(entity_utils).\
-      should_receive('get_root_key_from_entity_key').and_return('root_key')
-    fake_backup.zoo_keeper.should_receive('get_transaction_id').\
-      and_return('txn_id')
-
-    # Test successful operation.
-    fake_backup.zoo_keeper.should_receive('acquire_lock').and_return(True)
-
-    # ... with valid entity.
+    key = FAKE_ENCODED_ENTITY.keys()[0]
+    private_entity = {'guestbook27\x00\x00__kind__:Greeting\x01':
+                        {'txnID': '1', 'entity': 'private'}}
+    deleted_entity = {'guestbook27\x00\x00Greeting:2\x01':
+                        {'txnID': '1', 'entity': TOMBSTONE}}
+    fake_backup.db_access = flexmock()
+
+    # Test with valid entities.
     fake_backup.should_receive('verify_entity').and_return(True)
-    fake_backup.should_receive('dump_entity').and_return(True)
-    fake_backup.zoo_keeper.should_receive("release_lock").and_return()
-    self.assertEquals(True, fake_backup.process_entity(FAKE_ENCODED_ENTITY))
-
-    # ... with blacklisted entity.
-    fake_backup.should_receive('verify_entity').and_return(False)
-    flexmock(entity_utils).should_receive('fetch_journal_entry').\
-      and_return(FAKE_ENCODED_ENTITY)
-    fake_backup.should_receive('dump_entity').and_return(True)
-    fake_backup.zoo_keeper.should_receive("release_lock").and_return()
-    self.assertEquals(True, fake_backup.process_entity(FAKE_ENCODED_ENTITY))
-
-    # Test with failure to get the entity lock.
-    fake_backup.zoo_keeper.should_receive('acquire_lock').and_return(False)
-    fake_backup.zoo_keeper.\
-      should_receive("notify_failed_transaction").and_return()
-    fake_backup.zoo_keeper.should_receive("release_lock").and_return()
-    flexmock(time).should_receive('sleep').and_return()
-    fake_backup.zoo_keeper.should_receive('acquire_lock').and_return(True)
-    self.assertEquals(True, fake_backup.process_entity(FAKE_ENCODED_ENTITY))
+    fake_backup.should_receive('dump_entity').\
+      with_args(FAKE_ENCODED_ENTITY[key]['entity']).and_return(True).once()
+    self.assertEquals(True, fake_backup.process_entity_batch(
+      [FAKE_ENCODED_ENTITY, private_entity, deleted_entity]))
+
+    # Test with a blacklisted version that has since been replaced.
+    fake_backup.should_receive('verify_entity').with_args(key, '1').\
+      and_return(False)
+    fake_backup.should_receive('verify_entity').with_args(key, '2').\
+      and_return(True)
+    fake_backup.db_access.should_receive('batch_get_entity').\
+      and_return({key: {'txnID': '2', 'entity': 'new'}}).once()
+    fake_backup.should_receive('dump_entity').with_args('new').\
+      and_return(True).once()
+    self.assertEquals(True,
+                      fake_backup.process_entity_batch([FAKE_ENCODED_ENTITY]))
+
+    # Test with an entity that does not have a valid version.
+    fake_backup.db_access.should_receive('batch_get_entity').\
+      and_return({key: {'txnID': '1', 'entity': 'old'}})
+    fake_backup.should_receive('dump_entity').never()
+    self.assertEquals(True,
+                      fake_backup.process_entity_batch([FAKE_ENCODED_ENTITY]))
 
   def test_run_backup(self):
     zookeeper = flexmock()
@@ -165,17 +188,17 @@ class TestBackup(unittest.TestCase):
       "cassandra", False, []))
     fake_backup.should_receive("get_entity_batch").\
       and_return([FAKE_ENCODED_ENTITY])
-    fake_backup.should_receive("process_entity").\
-      with_args(FAKE_ENCODED_ENTITY).and_return()
+    fake_backup.should_receive("process_entity_batch").\
+      with_args([FAKE_ENCODED_ENTITY]).and_return(True)
     fake_backup.should_receive("get_entity_batch").\
       and_return([])
-    self.assertEquals(None, fake_backup.run_backup())
+    self.assertEquals(True, fake_backup.run_backup())
 
     # Test with no entities.
     fake_backup = flexmock(DatastoreBackup('app_id', zookeeper,
       "cassandra", False, []))
     fake_backup.should_receive("get_entity_batch").and_return([])
-    self.assertEquals(None, fake_backup.run_backup())
+    self.assertEquals(True, fake_backup.run_backup())
 
     # Test with exception tossed.
     fake_backup = flexmock(DatastoreBackup('app_id', zookeeper,
@@ -184,7 +207,62 @@ class TestBackup(unittest.TestCase):
       and_raise(AppScaleDBConnectionError)
     flexmock(time).should_receive('sleep').and_return()
     fake_backup.should_receive("get_entity_batch").and_return([])
-    self.assertEquals(None, fake_backup.run_backup())
+    self.assertEquals(True, fake_backup.run_backup())
+
+    # Test with a batch that can never be written.
+    fake_backup = flexmock(DatastoreBackup('app_id', zookeeper,
+      "cassandra", False, []))
+    fake_backup.should_receive("get_entity_batch").\
+      and_return([FAKE_ENCODED_ENTITY])
+    fake_backup.should_receive("process_entity_batch").and_return(False).\
+      times(DatastoreBackup.MAX_WRITE_RETRIES + 1)
+    self.assertEquals(False, fake_backup.run_backup())
+
+  def test_run_backup_retries_failed_batch(self):
+    zookeeper = flexmock()
+    fake_backup = flexmock(DatastoreBackup('app_id', zookeeper,
+      "cassandra", False, []))
+    backup_dir = tempfile.mkdtemp()
+    fake_backup.backup_dir = backup_dir + '/'
+    fake_backup.set_filename()
+    fake_backup.MAX_FILE_SIZE = 100
+    flexmock(time).should_receive('sleep')
+
+    batches = [['a' * 40], ['b' * 40, 'c' * 40, 'd' * 40]]
+    keys = {}
+    for batch in batches:
+      keys[batch[0]] = [{'app_id\x00\x00Greeting:{0}\x01'.format(entity):
+                        {'entity': entity}} for entity in batch]
+    fake_backup.should_receive('get_entity_batch').\
+      and_return(keys['a' * 40]).\
+      and_return(keys['b' * 40]).\
+      and_return(keys['b' * 40]).\
+      and_return([])
+
+    # The second batch fails after starting a new file.
+    attempts = []
+    def process_entity_batch(entities):
+      attempts.append(len(entities))
+      for entity in entities:
+        fake_backup.dump_entity(entity.values()[0]['entity'])
+        if len(attempts) == 2 and fake_backup.current_fileno == 1:
+          raise AppScaleDBConnectionError('Connection lost')
+      return True
+    fake_backup.should_receive('process_entity_batch').\
+      replace_with(process_entity_batch)
+
+    try:
+      self.assertEquals(True, fake_backup.run_backup())
+      self.assertEquals([1, 3, 3], attempts)
+      self.assertEquals(4, fake_backup.entities_backed_up)
+
+      entities = []
+      for backup_file in sorted(os.listdir(backup_dir)):
+        with open(os.path.join(backup_dir, backup_file), 'rb') as backup:
+          entities.extend(read_entities(backup))
+      self.assertEquals(['a' * 40, 'b' * 40, 'c' * 40, 'd' * 40], entities)
+    finally:
+      shutil.rmtree(backup_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+""" Unit tests for backup_file.py """
+
+import cPickle
+import StringIO
+import unittest
+
+from appscale.datastore.backup import backup_file
+from appscale.datastore.backup.backup_exceptions import InvalidBackupException
+
+
+class ClosableStringIO(StringIO.StringIO):
+  """ Keeps the contents available after the file is closed. """
+  def close(self):
+    pass
+
+
+class TestBackupFile(unittest.TestCase):
+  """
+  A set of test cases for reading and writing backup files.
+  """
+  def write_records(self, records, block_size):
+    output = ClosableStringIO()
+    writer = backup_file.BackupWriter(output)
+    writer.BLOCK_SIZE = block_size
+    for record in records:
+      writer.write(record)
+    writer.close()
+    return output.getvalue()
+
+  def test_round_trip(self):
+    records = ['entity-{}'.format(index) * index for index in range(20)]
+    data = self.write_records(records, 50)
+    reader = backup_file.BackupReader(StringIO.StringIO(data))
+    self.assertEquals(records, list(reader))
+
+    # The index can be used to read blocks out of order.
+    index = reader.read_index()
+    self.assertGreater(len(index), 1)
+    self.assertEquals(len(records), sum(count for _, count in index))
+    offset, count = index[-1]
+    self.assertEquals(records[-count:], reader.read_block_at(offset))
+
+  def test_restore_checkpoint(self):
+    output = ClosableStringIO()
+    writer = backup_file.BackupWriter(output)
+    writer.BLOCK_SIZE = 50
+    for record in ['first'] * 12:
+      writer.write(record)
+    checkpoint = writer.checkpoint()
+    for record in ['discarded'] * 12:
+      writer.write(record)
+
+    writer.restore(checkpoint)
+    writer.write('last')
+    writer.close()
+    reader = backup_file.BackupReader(StringIO.StringIO(output.getvalue()))
+    self.assertEquals(['first'] * 12 + ['last'], list(reader))
+    self.assertEquals(13, sum(count for _, count in reader.read_index()))
+
+  def test_empty_file(self):
+    data = self.write_records([], 50)
+    reader = backup_file.BackupReader(StringIO.StringIO(data))
+    self.assertEquals([], list(reader))
+    self.assertEquals([], reader.read_index())
+
+  def test_legacy_file(self):
+    output = StringIO.StringIO()
+    for record in ['a', 'b']:
+      cPickle.dump(record, output, cPickle.HIGHEST_PROTOCOL)
+    output.seek(0)
+    self.assertEquals(['a', 'b'], list(backup_file.read_entities(output)))
+
+    data = StringIO.StringIO(self.write_records(['a', 'b'], 50))
+    self.assertEquals(['a', 'b'], list(backup_file.read_entities(data)))
+
+  def test_invalid_file(self):
+    self.assertRaises(InvalidBackupException, backup_file.BackupReader,
+                      StringIO.StringIO('not a backup'))
+
+    data = self.write_records(['a' * 100, 'b' * 100], 50)
+    reader = backup_file.BackupReader(StringIO.StringIO(data[:40]))
+    self.assertRaises(InvalidBackupException, list, reader)
+
+    # Files that were not closed do not have an index.
+    output = ClosableStringIO()
+    writer = backup_file.BackupWriter(output)
+    writer.write('a')
+    writer.flush_block()
+    reader = backup_file.BackupReader(StringIO.StringIO(output.getvalue()))
+    self.assertRaises(InvalidBackupException, reader.read_index)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -91,5 +91,48 @@ class TestCassandra(unittest.TestCase):
     db.batch_mutate(app_id, [], [], transaction)
 
 
+  def test_group_leases(self):
+    flexmock(file_io) \
+        .should_receive('read') \
+        .and_return('127.0.0.1')
+
+    session = flexmock(default_consistency_level=None)
+    session.should_receive('execute').and_return(flexmock(was_applied=True))\
+      .and_return(flexmock(was_applied=False))
+    flexmock(Cluster).should_receive('connect').and_return(session)
+
+    db = cassandra_interface.DatastoreProxy()
+    self.assertTrue(db.acquire_group_lease('app', 'group', 'holder'))
+    self.assertFalse(db.acquire_group_lease('app', 'group', 'holder'))
+
+    session.should_receive('execute').and_return([])
+    self.assertFalse(db.group_lease_held('app', 'group'))
+    session.should_receive('execute').and_return([flexmock(holder='holder')])
+    self.assertTrue(db.group_lease_held('app', 'group'))
+
+  def test_update_entity_stats_without_table(self):
+    flexmock(file_io) \
+        .should_receive('read') \
+        .and_return('127.0.0.1')
+
+    session = flexmock(default_consistency_level=None)
+    flexmock(Cluster).should_receive('connect').and_return(session)
+    db = cassandra_interface.DatastoreProxy()
+    keyspaces = {}
+    db.cluster = flexmock(metadata=flexmock(keyspaces=keyspaces))
+    deltas = {('', 'Kind'): (100, 1)}
+
+    # Updates are skipped with a single warning until the table exists.
+    session.should_receive('execute_async').never()
+    flexmock(db.logger).should_receive('warning').once()
+    db.update_entity_stats('app', deltas)
+    db.update_entity_stats('app', deltas)
+
+    keyspaces[cassandra_interface.KEYSPACE] = flexmock(
+      tables={'entity_stats': None})
+    session.should_receive('execute_async').\
+      and_return(flexmock(result=lambda: None)).once()
+    db.update_entity_stats('app', deltas)
+
 if __name__ == "__main__":
   unittest.main()    
@@ -2,6 +2,7 @@
 # Programmer: Navraj Chohan <nlake44@gmail.com>
 
 import sys
+import time
 import unittest
 
 from appscale.datastore import dbconstants
@@ -26,10 +27,13 @@ from appscale.datastore.utils import get_entity_kind
 from appscale.datastore.utils import get_index_key_from_params
 from appscale.datastore.utils import get_index_kv_from_tuple
 from appscale.datastore.utils import get_kind_key
+from appscale.datastore.zkappscale import zktransaction as zk
 from appscale.datastore.zkappscale.zktransaction import TX_TIMEOUT
 from appscale.datastore.zkappscale.zktransaction import ZKTransactionException
 from cassandra.cluster import Cluster
 from flexmock import flexmock
+from test_zookeeper import FakeZooKeeper
+import kazoo.client
 
 sys.path.append(APPSCALE_PYTHON_APPSERVER)
 from google.appengine.api import api_base_pb
@@ -45,6 +49,60 @@ class Item(db.Model):
   name = db.StringProperty(required = True)
 
 
+class FakeDatastoreBatch(object):
+  """ Stores entities and entity group leases in memory, counting the
+  requests made to the database. """
+  def __init__(self):
+    self.rows = {}
+    self.leases = {}
+    self.stats = {}
+    self.requests = 0
+
+  def valid_data_version(self):
+    return True
+
+  def get_indices(self, app_id):
+    return []
+
+  def batch_get_entity(self, table_name, row_keys, column_names):
+    self.requests += 1
+    return {key: dict(self.rows.get((table_name, key), {}))
+            for key in row_keys}
+
+  def batch_mutate(self, app, mutations, entity_changes, txn):
+    self.requests += 1
+    for mutation in mutations:
+      row = (mutation['table'], mutation['key'])
+      if mutation['operation'] == dbconstants.TxnActions.PUT:
+        self.rows[row] = mutation['values']
+      else:
+        self.rows.pop(row, None)
+
+  def update_entity_stats(self, app, deltas):
+    self.requests += 1
+    for stat_key, (size, number) in deltas.iteritems():
+      current = self.stats.get((app,) + stat_key, (0, 0))
+      self.stats[(app,) + stat_key] = (current[0] + size, current[1] + number)
+
+  def acquire_group_lease(self, app, entity_group, holder):
+    self.requests += 1
+    if (app, entity_group) in self.leases:
+      return False
+    self.leases[(app, entity_group)] = holder
+    return True
+
+  def release_group_lease(self, app, entity_group, holder):
+    self.requests += 1
+    if self.leases.get((app, entity_group)) != holder:
+      return False
+    del self.leases[(app, entity_group)]
+    return True
+
+  def group_lease_held(self, app, entity_group):
+    self.requests += 1
+    return (app, entity_group) in self.leases
+
+
 class TestDatastoreServer(unittest.TestCase):
   """
   A set of test cases for the datastore server (datastore server v2)
@@ -341,6 +399,7 @@ class TestDatastoreServer(unittest.TestCase):
     db_batch.should_receive('batch_get_entity').and_return(
       {entity_key1: {}, entity_key2: {}})
     db_batch.should_receive('batch_mutate')
+    db_batch.should_receive('update_entity_stats')
     dd = DatastoreDistributed(db_batch, zookeeper)
     putreq_pb = datastore_pb.PutRequest()
     putreq_pb.add_entity()
@@ -371,6 +430,7 @@ class TestDatastoreServer(unittest.TestCase):
     db_batch.should_receive('batch_get_entity').and_return(
       {entity_key1: {}, entity_key2: {}})
     db_batch.should_receive('batch_mutate')
+    db_batch.should_receive('update_entity_stats')
     dd = DatastoreDistributed(db_batch, zookeeper)
 
     # Make sure it does not throw an exception
@@ -421,6 +481,145 @@ class TestDatastoreServer(unittest.TestCase):
     flexmock(dd).should_receive("get_root_key_from_entity_key").and_return("rootkey").once()
     self.assertRaises(ZKTransactionException, dd.acquire_locks_for_trans, [entity], 1)
          
+  def test_dynamic_put_lock_free(self):
+    app_id = 'test'
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    db_batch.should_receive('batch_get_entity').and_return(
+      {'test\x00blah\x00test_kind:bob\x01': {}})
+    db_batch.should_receive('batch_mutate').with_args(
+      app_id, list, list, DatastoreDistributed.LOCK_FREE_VERSION).once()
+    db_batch.should_receive('update_entity_stats').once()
+    db_batch.should_receive('acquire_group_lease').and_return(True).once()
+    db_batch.should_receive('release_group_lease').and_return(True).once()
+
+    zookeeper = flexmock()
+    zookeeper.should_receive('enable_lock_free_writes').once()
+    zookeeper.should_receive('is_group_locked').and_return(False).once()
+    zookeeper.should_receive('get_transaction_id').never()
+    zookeeper.should_receive('acquire_lock').never()
+
+    dd = DatastoreDistributed(db_batch, zookeeper, lock_free_writes=True)
+    putreq_pb = datastore_pb.PutRequest()
+    putreq_pb.add_entity().MergeFrom(self.get_new_entity_proto(
+      app_id, "test_kind", "bob", "prop1name", "prop1val", ns="blah"))
+    putresp_pb = datastore_pb.PutResponse()
+    dd.dynamic_put(app_id, putreq_pb, putresp_pb)
+    self.assertEquals(len(putresp_pb.key_list()), 1)
+
+  def test_acquire_leases_for_nontrans(self):
+    app_id = 'test'
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    zookeeper = flexmock()
+    dd = DatastoreDistributed(db_batch, zookeeper, lock_free_writes=True)
+    entity_list = [
+      self.get_new_entity_proto(
+        app_id, "test_kind", "bob", "prop1name", "prop1val", ns="blah"),
+      self.get_new_entity_proto(
+        app_id, "test_kind", "nancy", "prop1name", "prop2val", ns="blah")]
+
+    db_batch.should_receive('acquire_group_lease').and_return(True)
+    zookeeper.should_receive('is_group_locked').and_return(False)
+    leases = dd.acquire_leases_for_nontrans(app_id, entity_list)
+    self.assertEquals(['test\x00blah\x00test_kind:bob\x01',
+                       'test\x00blah\x00test_kind:nancy\x01'],
+                      sorted(leases.keys()))
+
+    # Groups locked by a ZooKeeper transaction are released and retried.
+    zookeeper.should_receive('is_group_locked').and_return(True)
+    db_batch.should_receive('release_group_lease').times(2)
+    flexmock(time).should_receive('sleep')
+    self.assertRaises(ZKTransactionException, dd.acquire_leases_for_nontrans,
+      app_id, entity_list, retries=1)
+
+    # Groups leased by another writer are retried.
+    db_batch.should_receive('acquire_group_lease').and_return(False)
+    db_batch.should_receive('release_group_lease').never()
+    self.assertRaises(ZKTransactionException, dd.acquire_leases_for_nontrans,
+      app_id, entity_list)
+
+  def test_lock_free_writes_round_trips(self):
+    app_id = 'test'
+    fake_zookeeper = FakeZooKeeper()
+    flexmock(kazoo.client)
+    kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
+    db_batch = FakeDatastoreBatch()
+    zookeeper = zk.ZKTransaction(host="something", db_access=db_batch)
+    entity = self.get_new_entity_proto(
+      app_id, "test_kind", "bob", "prop1name", "prop1val", ns="blah")
+    root_key = 'test\x00blah\x00test_kind:bob\x01'
+
+    def put_requests(lock_free_writes):
+      dd = DatastoreDistributed(db_batch, zookeeper,
+                                lock_free_writes=lock_free_writes)
+      putreq_pb = datastore_pb.PutRequest()
+      putreq_pb.add_entity().MergeFrom(entity)
+      dd.dynamic_put(app_id, putreq_pb, datastore_pb.PutResponse())
+      before = (fake_zookeeper.round_trips, db_batch.requests)
+      dd.dynamic_put(app_id, putreq_pb, datastore_pb.PutResponse())
+      return (fake_zookeeper.round_trips - before[0],
+              db_batch.requests - before[1])
+
+    # A put using ZooKeeper locks creates a transaction and a lock.
+    zk_round_trips, db_requests = put_requests(lock_free_writes=False)
+    self.assertEquals(2, db_requests)
+
+    zookeeper.enable_lock_free_writes()
+    lock_free_round_trips, db_requests = put_requests(lock_free_writes=True)
+    self.assertEquals(2, lock_free_round_trips)
+    self.assertEquals(4, db_requests)
+    self.assertGreater(zk_round_trips, 2 * lock_free_round_trips)
+    self.assertEquals({}, db_batch.leases)
+
+    # Transactions wait for lock-free writers to finish with a group.
+    txid = zookeeper.get_transaction_id(app_id)
+    db_batch.leases[(app_id, root_key)] = 'writer'
+    flexmock(time).should_receive('sleep').replace_with(
+      lambda seconds: db_batch.leases.clear()).once()
+    zookeeper.acquire_lock(app_id, txid, root_key)
+
+    # Lock-free writers defer to transactions that hold the lock.
+    dd = DatastoreDistributed(db_batch, zookeeper, lock_free_writes=True)
+    self.assertRaises(ZKTransactionException, dd.acquire_leases_for_nontrans,
+      app_id, [entity])
+    self.assertEquals({}, db_batch.leases)
+
+  def test_lock_free_writers_are_tracked(self):
+    app_id = 'test'
+    fake_zookeeper = FakeZooKeeper()
+    flexmock(kazoo.client)
+    kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
+    db_batch = FakeDatastoreBatch()
+    zookeeper = zk.ZKTransaction(host="something", db_access=db_batch)
+    root_key = 'test\x00blah\x00test_kind:bob\x01'
+    lock_path = zookeeper.get_lock_root_path(app_id, root_key)
+
+    # A lease that is not released in time fails the transaction without
+    # leaving its lock behind.
+    zookeeper.enable_lock_free_writes()
+    db_batch.leases[(app_id, root_key)] = 'writer'
+    clock = [0]
+    def advance(seconds):
+      clock[0] += seconds
+    flexmock(time).should_receive('time').replace_with(lambda: clock[0])
+    flexmock(time).should_receive('sleep').replace_with(advance)
+    txid = zookeeper.get_transaction_id(app_id)
+    self.assertRaises(ZKTransactionException, zookeeper.acquire_lock,
+                      app_id, txid, root_key)
+    self.assertLessEqual(clock[0], zk.ZKTransaction.LEASE_WAIT_TIMEOUT + 1)
+    self.assertNotIn(lock_path, fake_zookeeper.nodes)
+    self.assertTrue(zookeeper.release_lock(app_id, txid))
+
+    # Once the writer's session ends, transactions stop checking leases.
+    fake_zookeeper.delete(zookeeper.lock_free_writer)
+    zookeeper.lock_free_writer = None
+    self.assertFalse(zookeeper.lock_free_writes_enabled())
+    requests = db_batch.requests
+    txid = zookeeper.get_transaction_id(app_id)
+    self.assertTrue(zookeeper.acquire_lock(app_id, txid, root_key))
+    self.assertEquals(requests, db_batch.requests)
+
   def test_acquire_locks_for_nontrans(self):
     app_id = 'test'
     PREFIX = 'x\x01'
@@ -456,6 +655,7 @@ class TestDatastoreServer(unittest.TestCase):
     db_batch.should_receive('valid_data_version').and_return(True)
     db_batch.should_receive("batch_get_entity").and_return(row_values)
     db_batch.should_receive('batch_mutate')
+    db_batch.should_receive('update_entity_stats')
 
     dd = DatastoreDistributed(db_batch, zookeeper) 
 
@@ -834,6 +1034,40 @@ class TestDatastoreServer(unittest.TestCase):
     deletions = index_deletions(old_entity, new_entity, (composite_index,))
     self.assertEqual(len(deletions), 2)
 
+    # Entries that the new entity writes again should not be deleted, even
+    # if the property differs in fields that are not part of the index key.
+    new_entity = entity_pb.EntityProto()
+    new_entity.MergeFrom(old_entity)
+    new_entity.property_list()[0].set_multiple(
+      not old_entity.property_list()[0].multiple())
+    self.assertListEqual([], index_deletions(old_entity, new_entity))
+
+  def test_put_mutations_same_key(self):
+    app_id = 'test'
+    entity_key = 'test\x00blah\x00test_kind:bob\x01'
+    stored = self.get_new_entity_proto(
+      app_id, "test_kind", "bob", "prop1name", "stored", ns="blah")
+    first = self.get_new_entity_proto(
+      app_id, "test_kind", "bob", "prop1name", "first", ns="blah")
+    second = self.get_new_entity_proto(
+      app_id, "test_kind", "bob", "prop1name", "second", ns="blah")
+
+    db_batch = flexmock()
+    db_batch.should_receive('valid_data_version').and_return(True)
+    db_batch.should_receive('batch_get_entity').and_return(
+      {entity_key: {APP_ENTITY_SCHEMA[0]: stored.Encode(),
+                    APP_ENTITY_SCHEMA[1]: '1'}})
+    dd = DatastoreDistributed(db_batch, None)
+
+    # The second version replaces the first one rather than the stored one,
+    # so none of the first version's index entries are left behind.
+    mutations = dd.put_mutations([first, second], {entity_key: 2})
+    self.assertEqual(mutations[1][1]['old'], first)
+    deleted = [mutation['key'] for mutation in mutations[1][0]
+               if mutation['operation'] == dbconstants.TxnActions.DELETE]
+    self.assertEqual(
+      deleted, [mutation['key'] for mutation in index_deletions(first, second)])
+
   def test_deletions_for_entity(self):
     entity = self.get_new_entity_proto(*self.BASIC_ENTITY)
 
@@ -969,6 +1203,7 @@ class TestDatastoreServer(unittest.TestCase):
     entity_key = get_entity_key(prefix, entity.key().path())
     db_batch.should_receive('batch_get_entity').and_return({entity_key: {}})
     db_batch.should_receive('batch_mutate')
+    db_batch.should_receive('update_entity_stats')
 
     dd.apply_txn_changes(app, txn)
 
@@ -1,29 +1,120 @@
 #!/usr/bin/env python
 
+import gc
 import json
 import logging
 import os
+import random
+import re
 import requests
-import subprocess
+import shutil
+import StringIO
+import sys
+import tarfile
+import tempfile
+import threading
 import unittest
 import urllib
+import urlparse
 
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
 from appscale.datastore.backup import backup_recovery_helper
 from appscale.datastore.backup import gcs_helper
+from appscale.datastore.backup.backup_exceptions import GCSException
 from flexmock import flexmock
 
 FakeInvalidGCSPath = 'gs://'
 FakeGCSPath = 'gs://foo/bar/baz.tar.gz'
 
 
-class FakeInvalidResponse(object):
-  def __init__(self):
-    self.headers = {}
+class FakeGCSHandler(BaseHTTPRequestHandler):
+  """ Handles the subset of the GCS JSON API used by gcs_helper. """
+  def log_message(self, *args):
+    pass
+
+  def respond(self, status, body='', headers=None):
+    self.send_response(status)
+    for header, value in (headers or {}).items():
+      self.send_header(header, value)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def should_fail(self):
+    """ Fails each kind of request once to exercise retries. """
+    with self.server.lock:
+      key = (self.command, self.path.split('?')[0])
+      if key in self.server.failed:
+        return False
+      self.server.failed.add(key)
+      return True
+
+  def request_body(self):
+    return self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+
+  def object_name(self):
+    path = urlparse.urlparse(self.path).path
+    return urllib.unquote_plus(re.match('.*/o/([^/]+)', path).group(1))
+
+  def do_POST(self):
+    body = self.request_body()
+    if self.should_fail():
+      self.respond(503)
+      return
+
+    url = urlparse.urlparse(self.path)
+    objects = self.server.objects
+    if url.path.startswith('/upload/'):
+      name = urlparse.parse_qs(url.query)['name'][0]
+      objects[name] = body
+    elif self.object_name() in self.server.broken_objects:
+      self.respond(503)
+      return
+    else:
+      sources = json.loads(body)['sourceObjects']
+      self.server.compose_sizes.append(len(sources))
+      objects[self.object_name()] = ''.join(
+        objects[source['name']] for source in sources)
+    self.respond(200, '{}')
+
+  def do_DELETE(self):
+    self.server.objects.pop(self.object_name(), None)
+    self.respond(204)
+
+  def do_GET(self):
+    url = urlparse.urlparse(self.path)
+    if url.path.startswith('/download/'):
+      if self.should_fail():
+        self.respond(503)
+        return
+
+      data = self.server.objects[url.path[len('/download/'):]]
+      start, end = re.match(r'bytes=(\d+)-(\d+)',
+                            self.headers.getheader('Range')).groups()
+      self.respond(206, data[int(start):int(end) + 1])
+      return
 
+    name = self.object_name()
+    if name not in self.server.objects:
+      self.respond(404)
+      return
 
-class FakeResponse(object):
+    link = 'http://{0}:{1}/download/{2}'.format(
+      self.server.server_address[0], self.server.server_address[1], name)
+    self.respond(200, json.dumps(
+      {'size': str(len(self.server.objects[name])), 'mediaLink': link}))
+
+
+class FakeGCSServer(HTTPServer):
+  """ A local stand-in for GCS that keeps objects in memory. """
   def __init__(self):
-    self.headers = {'Location': 'some/location'}
+    HTTPServer.__init__(self, ('127.0.0.1', 0), FakeGCSHandler)
+    self.objects = {}
+    self.failed = set()
+    self.compose_sizes = []
+    self.broken_objects = set()
+    self.lock = threading.Lock()
 
 
 class TestGCSHelper(unittest.TestCase):
@@ -47,32 +138,18 @@ class TestGCSHelper(unittest.TestCase):
     self.assertEquals(False, gcs_helper.upload_to_bucket(FakeInvalidGCSPath,
       'some/file'))
 
-    # Test with valid GCS object name.
-    flexmock(gcs_helper).should_receive(
-      'extract_gcs_tokens').with_args(FakeGCSPath).\
+    # Test with a request error.
+    flexmock(gcs_helper).should_receive('extract_gcs_tokens').\
       and_return(('foo', 'bar/baz.tar.gz'))
-    # Test with successful POST request.
-    flexmock(gcs_helper).should_receive('gcs_post_request').\
-      and_return(FakeResponse())
-    flexmock(gcs_helper).should_receive('gcs_put_request').and_return()
-    self.assertEquals(True, gcs_helper.upload_to_bucket(FakeGCSPath,
-      'some/file'))
-    # Test with HTTPError from POST request.
     flexmock(gcs_helper).should_receive('gcs_post_request').\
-      and_raise(requests.HTTPError)
-    self.assertEquals(False, gcs_helper.upload_to_bucket(FakeGCSPath,
-      'some/file'))
-    # Test with missing Location from POST response.
-    flexmock(gcs_helper).should_receive('gcs_post_request').\
-      and_return(FakeInvalidResponse())
-    self.assertEquals(False, gcs_helper.upload_to_bucket(FakeGCSPath,
-      'some/file'))
-
-    # Test with HTTPError from PUT request.
-    flexmock(gcs_helper).should_receive('gcs_put_request').\
-      and_raise(requests.HTTPError)
-    self.assertEquals(False, gcs_helper.upload_to_bucket(FakeGCSPath,
-      'some/file'))
+      and_raise(requests.ConnectionError)
+    flexmock(gcs_helper).should_receive('gcs_delete_request')
+    flexmock(gcs_helper, RETRY_DELAY=0)
+    with tempfile.NamedTemporaryFile() as local_file:
+      local_file.write('data')
+      local_file.flush()
+      self.assertEquals(False, gcs_helper.upload_to_bucket(FakeGCSPath,
+        local_file.name))
 
   def test_download_from_bucket(self):
     # Suppress logging output.
@@ -115,12 +192,89 @@ class TestGCSHelper(unittest.TestCase):
     self.assertEquals(False, gcs_helper.download_from_bucket(FakeGCSPath,
       'some/file'))
 
-    # Test with sufficient disk space.
+  def test_transfer(self):
+    # Suppress logging output.
+    flexmock(logging).should_receive('warning').and_return()
+
+    server = FakeGCSServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    host, port = server.server_address
+    flexmock(gcs_helper, GCS_API='http://{0}:{1}'.format(host, port),
+             CHUNK_SIZE=1024, MAX_COMPOSE_SOURCES=4, RETRY_DELAY=0)
     disk_stats = flexmock(f_bavail=1024, f_frsize=4096)
     flexmock(os).should_receive('statvfs').and_return(disk_stats)
-    flexmock(subprocess).should_receive('check_output').and_return()
-    self.assertEquals(True, gcs_helper.download_from_bucket(FakeGCSPath,
-      'some/file'))
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+      data = ''.join(chr(random.randint(0, 255)) for _ in range(10000))
+      source = os.path.join(temp_dir, 'source')
+      with open(source, 'wb') as source_file:
+        source_file.write(data)
+
+      # Ten chunks should be combined in stages, and every temporary object
+      # should be removed.
+      self.assertEquals(True, gcs_helper.upload_to_bucket(FakeGCSPath,
+                                                          source))
+      self.assertEquals({'bar/baz.tar.gz': data}, server.objects)
+      self.assertTrue(all(size <= 4 for size in server.compose_sizes))
+
+      destination = os.path.join(temp_dir, 'destination')
+      self.assertEquals(True, gcs_helper.download_from_bucket(FakeGCSPath,
+                                                              destination))
+      with open(destination, 'rb') as destination_file:
+        self.assertEquals(data, destination_file.read())
+
+      # A tar can be streamed without a local copy.
+      self.assertEquals(True, backup_recovery_helper.tar_backup_files_to_bucket(
+        [source], 'gs://foo/snapshot.tar.gz'))
+      with tarfile.open(fileobj=StringIO.StringIO(server.objects['snapshot.tar.gz']),
+                        mode='r:gz') as tar:
+        member = tar.getmembers()[0]
+        self.assertEquals(data, tar.extractfile(member).read())
+
+      # The uploaded chunks are removed when the tar can't be finished.
+      large = os.path.join(temp_dir, 'large')
+      with open(large, 'wb') as large_file:
+        large_file.write(os.urandom(50000))
+      # The tar stream does not write to the aborted upload when it is
+      # garbage collected.
+      stderr = sys.stderr
+      sys.stderr = StringIO.StringIO()
+      try:
+        self.assertEquals(False,
+          backup_recovery_helper.tar_backup_files_to_bucket(
+            [large, os.path.join(temp_dir, 'missing')],
+            'gs://foo/failed.tar.gz'))
+        sys.exc_clear()
+        gc.collect()
+        output = sys.stderr.getvalue()
+      finally:
+        sys.stderr = stderr
+      self.assertEquals('', output)
+      self.assertEquals([], [name for name in server.objects
+                             if name.startswith('failed.tar.gz')])
+
+      # Intermediate objects are removed when the final compose fails.
+      server.broken_objects.add('broken.tar.gz')
+      self.assertEquals(False, gcs_helper.upload_to_bucket(
+        'gs://foo/broken.tar.gz', source))
+      self.assertEquals([], [name for name in server.objects
+                             if name.startswith('broken.tar.gz')])
+
+      self.assertEquals(False, gcs_helper.download_from_bucket(
+        'gs://foo/missing', destination))
+    finally:
+      server.shutdown()
+      server.server_close()
+      shutil.rmtree(temp_dir)
+
+  def test_write_after_close(self):
+    upload = gcs_helper.ChunkedUpload('foo', 'bar')
+    upload.abort()
+    self.assertRaises(GCSException, upload.write, 'data')
 
   def test_extract_gcs_tokens(self):
     # Test normal case.
@@ -137,7 +291,7 @@ class TestGCSHelper(unittest.TestCase):
   def test_gcs_post_request(self):
     pass
 
-  def test_gcs_put_request(self):
+  def test_gcs_delete_request(self):
     pass
 
 
@@ -3,6 +3,8 @@
 
 import datetime
 import sys
+import threading
+import time
 import unittest
 
 from appscale.datastore import appscale_datastore_batch
@@ -40,6 +42,65 @@ class FakeDatastore():
     raise dbconstants.AppScaleDBConnectionError("Bad connection")
 
 
+class FakeRangeDatastore():
+  """ Serves entity rows in key order like a ByteOrderedPartitioner. """
+  def __init__(self, keys):
+    self.keys = sorted(keys)
+    self.fetched = []
+    self.entity_stats = {}
+    self.session = None
+    self.lock = threading.Lock()
+  def valid_data_version(self):
+    return True
+  def get_entity_stats(self):
+    return {app: dict(app_stats)
+            for app, app_stats in self.entity_stats.iteritems()}
+  def update_entity_stats(self, app, deltas):
+    app_stats = self.entity_stats.setdefault(app, {})
+    for stat_key, (size, number) in deltas.iteritems():
+      current_size, current_number = app_stats.get(stat_key, (0, 0))
+      app_stats[stat_key] = (current_size + size, current_number + number)
+  def range_query(self, table_name, column_names, start_key, end_key, limit,
+    offset=0, start_inclusive=True, end_inclusive=True, keys_only=False):
+    if table_name != dbconstants.APP_ENTITY_TABLE:
+      return []
+    keys = [key for key in self.keys if start_key < key <= end_key][:limit]
+    with self.lock:
+      self.fetched.extend(keys)
+    return [{key: {dbconstants.APP_ENTITY_SCHEMA[0]: 'entity'}}
+            for key in keys]
+
+
+class FakeGroomerZooKeeper():
+  """ Keeps ZooKeeper nodes in a dictionary. """
+  def __init__(self):
+    self.nodes = {}
+    self.lock = threading.Lock()
+  def get_node(self, path):
+    if path not in self.nodes:
+      return False
+    return self.nodes[path], None
+  def update_node(self, path, value):
+    self.nodes[path] = str(value)
+  def get_children(self, path):
+    prefix = path + '/'
+    return [node[len(prefix):] for node in self.nodes.keys()
+            if node.startswith(prefix) and '/' not in node[len(prefix):]]
+  def delete_recursive(self, path):
+    for node in self.nodes.keys():
+      if node == path or node.startswith(path + '/'):
+        del self.nodes[node]
+  def get_lock_with_path(self, path):
+    with self.lock:
+      if path in self.nodes:
+        return False
+      self.nodes[path] = 'lease'
+      return True
+  def release_lock_with_path(self, path):
+    del self.nodes[path]
+    return True
+
+
 class FakeDistributedDB():
   def __init__(self):
     pass
@@ -104,7 +165,7 @@ class TestGroomer(unittest.TestCase):
       get_root_key_from_entity_key("hi/\x01otherstuff\x01moar"))
 
   def test_run_groomer(self):
-    zookeeper = flexmock()
+    zookeeper = FakeGroomerZooKeeper()
     dsg = groomer.DatastoreGroomer(zookeeper, "cassandra", "localhost:8888")
     dsg = flexmock(dsg)
     dsg.should_receive("get_entity_batch").and_return([])
@@ -112,10 +173,208 @@ class TestGroomer(unittest.TestCase):
     dsg.should_receive("update_statistics").and_raise(Exception)
     dsg.should_receive("remove_old_logs").and_return()
     dsg.should_receive("remove_old_tasks_entities").and_return()
+    dsg.should_receive("remove_old_dashboard_data").and_return()
     ds_factory = flexmock(appscale_datastore_batch.DatastoreFactory)
-    ds_factory.should_receive("getDatastore").and_return(FakeDatastore())
+    ds_factory.should_receive("getDatastore").and_return(FakeRangeDatastore([]))
+    flexmock(groomer).should_receive("create_entity_stats_table")
     self.assertRaises(Exception, dsg.run_groomer)
 
+  def test_groomer_range(self):
+    flexmock(groomer.GroomerRange, SAMPLE_INTERVAL=2, MAX_SAMPLES=1)
+    groomer_range = groomer.GroomerRange('entities-0000', 'entities', '',
+                                         '\xff\x00')
+    for key in ['a', 'b', 'c', 'd', 'e']:
+      groomer_range.record_batch(key, 1)
+
+    # Every other sample is dropped once the samples fill up.
+    self.assertEquals(groomer_range.samples, ['d'])
+    self.assertEquals(groomer_range.sample_interval, 4)
+
+    groomer_range.stats = {'app': {'': {'kind': [5, 1]}}}
+    restored = groomer.GroomerRange.decode(groomer_range.name,
+                                           groomer_range.encode())
+    self.assertEquals(restored.end_key, '\xff\x00')
+    self.assertEquals(restored.last_key, 'e')
+    self.assertEquals(restored.checked, 5)
+    self.assertEquals(restored.samples, ['d'])
+    self.assertEquals(restored.stats, groomer_range.stats)
+
+  def test_choose_split_points(self):
+    self.assertEquals(groomer.choose_split_points(['b', 'a'], 4), ['a', 'b'])
+    samples = [chr(ord('a') + index) for index in range(8)]
+    self.assertEquals(groomer.choose_split_points(samples, 4),
+                      ['c', 'e', 'g'])
+
+  def test_parallel_ranges(self):
+    zookeeper = FakeGroomerZooKeeper()
+    keys = ['app\x00\x00Kind:{:04d}\x01'.format(index)
+            for index in range(50)]
+    datastore = FakeRangeDatastore(keys)
+    flexmock(appscale_datastore_batch.DatastoreFactory).\
+      should_receive("getDatastore").and_return(datastore)
+    flexmock(groomer.GroomerRange, SAMPLE_INTERVAL=5)
+    flexmock(groomer).should_receive("create_entity_stats_table")
+
+    def count_entity(entity, groomer_range):
+      namespaces = groomer_range.stats.setdefault('app', {})
+      kind_stats = namespaces.setdefault('', {}).setdefault('Kind', [0, 0])
+      kind_stats[0] += 1
+      kind_stats[1] += 1
+
+    groomers = []
+    for _ in range(2):
+      dsg = flexmock(
+        groomer.DatastoreGroomer(zookeeper, "cassandra", "localhost:8888"))
+      dsg.BATCH_SIZE = 3
+      dsg.should_receive("process_entity").replace_with(count_entity)
+      dsg.should_receive("remove_old_logs")
+      dsg.should_receive("remove_old_tasks_entities")
+      dsg.should_receive("remove_old_dashboard_data")
+      dsg.should_receive("update_statistics").and_return(True)
+      dsg.should_receive("update_namespaces").and_return(True)
+      groomers.append(dsg)
+    coordinator, helper = groomers
+
+    # The first pass has no split points, so each table is a single range.
+    coordinator.run_groomer()
+    self.assertEquals(sorted(datastore.fetched), keys)
+    self.assertEquals(datastore.entity_stats, {'app': {('', 'Kind'): (50, 50)}})
+    self.assertEquals(coordinator.stats['app']['Kind']['number'], 50)
+    self.assertFalse(zookeeper.get_children(coordinator.GROOMER_RANGES_PATH))
+    split_points = coordinator.get_split_points()
+    self.assertEquals(len(split_points['entities']), 10)
+
+    # The next pass divides the entity table using the sampled keys, and
+    # both nodes scan ranges.
+    datastore.fetched = []
+    coordinator.create_ranges()
+    self.assertEquals(
+      len(zookeeper.get_children(coordinator.GROOMER_RANGES_PATH)), 14)
+    helper.groom_ranges()
+    self.assertEquals(sorted(datastore.fetched), keys)
+    coordinator.run_groomer()
+    self.assertEquals(sorted(datastore.fetched), keys)
+    self.assertEquals(coordinator.stats['app']['Kind']['number'], 50)
+
+    # Entities are not scanned again until the counters are due for
+    # reconciliation.
+    datastore.fetched = []
+    split_points = coordinator.get_split_points()
+    coordinator.run_groomer()
+    self.assertEquals(datastore.fetched, [])
+    self.assertEquals(coordinator.get_split_points(), split_points)
+
+  def test_groom_range_failure(self):
+    zookeeper = FakeGroomerZooKeeper()
+    dsg = flexmock(
+      groomer.DatastoreGroomer(zookeeper, "cassandra", "localhost:8888"))
+    groomer_range = groomer.GroomerRange('entities-0000', 'entities', '',
+                                         '\xff\x00')
+    dsg.save_range(groomer_range)
+
+    def fail_scan(groomer_range):
+      groomer_range.stats = {'app': {'': {'Kind': [5, 1]}}}
+      groomer_range.record_batch('a', 1)
+      raise dbconstants.AppScaleDBConnectionError('Bad connection')
+    dsg.should_receive('clean_up_entities').replace_with(fail_scan)
+
+    def load_range():
+      node = zookeeper.get_node(dsg.get_range_path(groomer_range.name))
+      return groomer.GroomerRange.decode(groomer_range.name, node[0])
+
+    # A failed scan leaves the range to be scanned again from its last
+    # checkpoint.
+    dsg.groom_range(dsg.claim_range())
+    restored = load_range()
+    self.assertFalse(restored.done)
+    self.assertEquals(restored.failures, 1)
+    self.assertEquals(restored.checked, 0)
+    self.assertEquals(restored.stats, {})
+
+    # The range is given up on after several failures.
+    for _ in range(dsg.MAX_RANGE_ATTEMPTS - 1):
+      dsg.release_range(groomer_range.name)
+      dsg.groom_range(dsg.claim_range())
+    restored = load_range()
+    self.assertTrue(restored.done)
+    self.assertTrue(restored.failed)
+    dsg.release_range(groomer_range.name)
+    self.assertIsNone(dsg.claim_range())
+
+  def test_compact_statistics(self):
+    zookeeper = FakeGroomerZooKeeper()
+    datastore = FakeRangeDatastore([])
+    datastore.update_entity_stats('app', {('', 'Kind'): (100, 2),
+                                          ('ns', 'Kind'): (50, 1),
+                                          ('', '__Stat_Kind__'): (10, 1)})
+    datastore.update_entity_stats('appscaledashboard', {('', 'Kind'): (5, 1)})
+    flexmock(appscale_datastore_batch.DatastoreFactory).\
+      should_receive("getDatastore").and_return(datastore)
+    dsg = flexmock(
+      groomer.DatastoreGroomer(zookeeper, "cassandra", "localhost:8888"))
+    dsg.should_receive("update_statistics").and_return(True)
+    dsg.should_receive("update_namespaces").and_return(True)
+
+    # The counters are not used until a full scan has corrected them.
+    dsg.compact_statistics_if_due()
+    self.assertEquals(dsg.stats, {})
+
+    zookeeper.update_node(dsg.STATS_RECONCILED_PATH, time.time())
+    dsg.compact_statistics_if_due()
+    self.assertEquals(dsg.stats, {'app': {'Kind': {'size': 150, 'number': 3}}})
+    self.assertEquals(dsg.namespace_info['app']['ns'],
+                      {'size': 50, 'number': 1})
+
+    # Compaction only happens once per period.
+    dsg.stats = {}
+    dsg.compact_statistics_if_due()
+    self.assertEquals(dsg.stats, {})
+
+  def test_reconcile_statistics(self):
+    datastore = FakeRangeDatastore([])
+    datastore.update_entity_stats('app', {('', 'Kind'): (90, 2),
+                                          ('', 'Gone'): (10, 1)})
+    dsg = groomer.DatastoreGroomer(FakeGroomerZooKeeper(), "cassandra",
+                                   "localhost:8888")
+    dsg.db_access = datastore
+    flexmock(groomer).should_receive("create_entity_stats_table")
+    dsg.save_stats_snapshot()
+    ranges = []
+    for name in ['entities-0000', 'entities-0001']:
+      groomer_range = groomer.GroomerRange(name, 'entities', '', '')
+      groomer_range.stats = {u'app': {u'': {u'Kind': [50, 1]}}}
+      ranges.append(groomer_range)
+
+    # Changes made while the ranges were being scanned are kept.
+    datastore.update_entity_stats('app', {('', 'Kind'): (20, 1)})
+    dsg.reconcile_statistics(ranges, dsg.load_stats_snapshot())
+    self.assertEquals(datastore.entity_stats,
+                      {'app': {('', 'Kind'): (120, 3), ('', 'Gone'): (0, 0)}})
+
+  def test_reconciliation_skips_failed_ranges(self):
+    zookeeper = FakeGroomerZooKeeper()
+    keys = ['app\x00\x00Kind:{:04d}\x01'.format(index)
+            for index in range(5)]
+    datastore = FakeRangeDatastore(keys)
+    datastore.update_entity_stats('app', {('', 'Kind'): (1, 1)})
+    flexmock(appscale_datastore_batch.DatastoreFactory).\
+      should_receive("getDatastore").and_return(datastore)
+    flexmock(groomer).should_receive("create_entity_stats_table")
+    dsg = flexmock(
+      groomer.DatastoreGroomer(zookeeper, "cassandra", "localhost:8888"))
+    dsg.should_receive("process_entity").and_raise(ValueError)
+    dsg.should_receive("remove_old_logs")
+    dsg.should_receive("remove_old_tasks_entities")
+    dsg.should_receive("remove_old_dashboard_data")
+    dsg.should_receive("update_statistics").and_return(True)
+    dsg.should_receive("update_namespaces").and_return(True)
+
+    dsg.run_groomer()
+    self.assertEquals(datastore.entity_stats, {'app': {('', 'Kind'): (1, 1)}})
+    self.assertFalse(zookeeper.get_node(dsg.STATS_RECONCILED_PATH))
+    self.assertFalse(zookeeper.get_node(dsg.STATS_SNAPSHOT_PATH))
+    self.assertTrue(dsg.reconciliation_due())
+
   def test_process_entity(self):
     zookeeper = flexmock()
     flexmock(entity_pb).should_receive('EntityProto').and_return(FakeEntity())
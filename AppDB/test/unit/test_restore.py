@@ -4,22 +4,34 @@
 
 import argparse
 import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
 import time
 import unittest
 
 from appscale.datastore import appscale_datastore_batch
 from appscale.datastore import datastore_distributed
+from appscale.datastore import dbconstants
+from appscale.datastore.backup import datastore_restore
+from appscale.datastore.backup.backup_file import BackupWriter
 from appscale.datastore.backup.datastore_restore import DatastoreRestore
+from appscale.datastore.scripts import restore_data
 from appscale.datastore.zkappscale.zktransaction import ZKTransactionException
 from flexmock import flexmock
+from google.appengine.datastore import entity_pb
+from multiprocessing.pool import ThreadPool
 
 
 class FakeArgumentParser(object):
-  def __init__(self):
-    pass
+  def __init__(self, **args):
+    self.args = args
   def parse_args(self):
-    return argparse.Namespace(app_id='app_id',
-      backup_dir='some/dir', clear_datastore=False, debug=False)
+    args = dict(app_id='app_id', backup_dir='some/dir', clear_datastore=False,
+                debug=False, bulk=False, processes=None)
+    args.update(self.args)
+    return argparse.Namespace(**args)
 
 
 class FakeDatastore(object):
@@ -34,6 +46,18 @@ class FakeDatastore(object):
     return True
 
 
+class FakePool(object):
+  """ Runs work in the current process. """
+  def __init__(self, processes, initializer, initargs):
+    pass
+  def imap_unordered(self, function, work):
+    return [function(part) for part in work]
+  def close(self):
+    pass
+  def join(self):
+    pass
+
+
 class FakeZookeeper(object):
   def __init__(self):
     pass
@@ -130,6 +154,105 @@ class TestRestore(unittest.TestCase):
 
     fake_restore.run_restore()
 
+  def test_bulk_restore_requires_read_only(self):
+    zookeeper = flexmock()
+    fake_restore = flexmock(DatastoreRestore('app_id', 'backup/dir',
+      zookeeper, "cassandra", bulk=True))
+    flexmock(glob).should_receive('glob').and_return(['some/file.backup'])
+
+    zookeeper.should_receive('datastore_is_read_only').and_return(False)
+    fake_restore.should_receive('run_bulk_restore').never()
+    fake_restore.run_restore()
+
+    zookeeper.should_receive('datastore_is_read_only').and_return(True)
+    fake_restore.should_receive('run_bulk_restore').once()
+    fake_restore.run_restore()
+
+  def test_split_batch(self):
+    entity_row = {'table': dbconstants.APP_ENTITY_TABLE, 'key': 'e' * 10,
+                  'values': {'entity': 'v' * 10}}
+    index_rows = [{'table': dbconstants.ASC_PROPERTY_TABLE,
+                   'key': str(index) * 10, 'values': {'reference': 'r' * 10}}
+                  for index in range(3)]
+    batches = datastore_restore.split_batch([entity_row] + index_rows, 40)
+
+    # The entity row is written after all of its indexes.
+    self.assertEquals(batches, [index_rows[:2], index_rows[2:], [entity_row]])
+
+  def test_bulk_work(self):
+    backup_dir = tempfile.mkdtemp()
+    try:
+      block_file = os.path.join(backup_dir, 'a.backup')
+      writer = BackupWriter(open(block_file, 'wb'))
+      writer.BLOCK_SIZE = 10
+      for record in ['a' * 10, 'b' * 10]:
+        writer.write(record)
+      writer.close()
+      legacy_file = os.path.join(backup_dir, 'b.backup')
+      with open(legacy_file, 'wb') as file_object:
+        file_object.write('legacy')
+
+      fake_restore = DatastoreRestore('app_id', backup_dir, flexmock(),
+                                      "cassandra", bulk=True)
+      backup_files = fake_restore.backup_files()
+      self.assertEquals(backup_files, [block_file, legacy_file])
+      work = fake_restore.bulk_work(backup_files)
+      self.assertEquals([part[0] for part in work],
+                        [block_file, block_file, legacy_file])
+      self.assertEquals(work[-1][1], None)
+    finally:
+      shutil.rmtree(backup_dir)
+
+  def test_write_entities(self):
+    entity = entity_pb.EntityProto(
+      FAKE_ENCODED_ENTITY.values()[0]['entity'])
+    entity.mutable_key().set_app('restored')
+    datastore = flexmock(datastore_batch=flexmock())
+    datastore.datastore_batch.should_receive('batch_mutate').\
+      with_args('restored', [], list, 0).once()
+    flexmock(datastore_restore, _bulk_worker={
+      'app_id': 'restored', 'datastore': datastore, 'composite_indexes': [],
+      'writers': ThreadPool(1)})
+
+    # Entities count towards the statistics even if they were already written.
+    datastore.should_receive('put_mutations').replace_with(
+      lambda entities, txn_hash, indexes: [
+        ([], {'old': entity, 'new': entity}, txn_hash[entity.key().app()])
+        for entity in entities])
+    self.assertEquals({('', 'Greeting'): (entity.ByteSize(), 1)},
+                      datastore_restore.write_entities([entity.Encode()]))
+
+  def test_run_bulk_restore(self):
+    flexmock(multiprocessing).should_receive('Pool').replace_with(FakePool)
+    fake_restore = flexmock(DatastoreRestore('app_id', 'backup/dir',
+      flexmock(), "cassandra", bulk=True, processes=2))
+    datastore_batch = flexmock()
+    flexmock(datastore_restore, _bulk_worker={
+      'app_id': 'app_id', 'datastore': flexmock(datastore_batch=datastore_batch)})
+    fake_restore.ds_distributed = flexmock(
+      datastore_batch=flexmock(get_indices=lambda app_id: []))
+    fake_restore.should_receive('bulk_work').and_return(
+      [('a.backup', 0), ('a.backup', 10)])
+
+    # Parts that fail are retried.
+    attempts = []
+    def restore_entities(backup_file, offset):
+      attempts.append(offset)
+      if attempts.count(offset) == 1 and offset == 10:
+        raise dbconstants.AppScaleDBConnectionError()
+      return 5, 100, {('', 'Greeting'): (100, 5)}
+    flexmock(datastore_restore).should_receive('restore_entities').\
+      replace_with(restore_entities)
+
+    # The statistics are updated once for each part that is restored.
+    datastore_batch.should_receive('update_entity_stats').\
+      with_args('app_id', {('', 'Greeting'): (100, 5)}).twice()
+
+    self.assertEquals([], fake_restore.run_bulk_restore(['a.backup']))
+    self.assertEquals(sorted(attempts), [0, 10, 10])
+    self.assertEquals(fake_restore.entities_restored, 10)
+    self.assertEquals(fake_restore.bytes_restored, 200)
+
   def test_init_parser(self):
     pass
 
@@ -140,8 +263,28 @@ class TestRestore(unittest.TestCase):
     pass
 
   def test_main(self):
-    # TODO
-    pass
+    flexmock(restore_data).should_receive('init_parser').and_return(
+      FakeArgumentParser(clear_datastore=True))
+    flexmock(restore_data).should_receive('app_is_deployed').and_return(True)
+    flexmock(restore_data).should_receive('backup_dir_exists').\
+      and_return(True)
+    flexmock(restore_data.appscale_info).\
+      should_receive('get_zk_locations_string').and_return('zk:2181')
+    flexmock(restore_data.appscale_info).should_receive('get_db_info').\
+      and_return({':table': 'cassandra'})
+    zookeeper = flexmock(FakeZookeeper())
+    flexmock(restore_data.zk).should_receive('ZKTransaction').\
+      and_return(zookeeper)
+
+    # The datastore is cleared, and the restore still uses the database type.
+    flexmock(restore_data).should_receive('fetch_and_delete_entities').\
+      times(6)
+    fake_restore = flexmock(run=lambda: None)
+    flexmock(restore_data).should_receive('DatastoreRestore').\
+      with_args('app_id', 'some/dir', zookeeper, 'cassandra', bulk=False,
+                processes=None).and_return(fake_restore).once()
+    zookeeper.should_receive('close').once()
+    restore_data.main()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import json
+import sys
+import time
+import unittest
+
+from flexmock import flexmock
+
+from appscale.datastore.unpackaged import APPSCALE_LIB_DIR
+
+sys.path.append(APPSCALE_LIB_DIR)
+import appscale_info
+
+flexmock(appscale_info).should_receive('get_secret').and_return('secret')
+from appscale.datastore.cassandra_env import py_cassandra
+from appscale.datastore.scripts import ua_server
+
+ERROR_DEFAULT = 'DB_ERROR:'
+USER_SCHEMA = ['email', 'pw', 'enabled', 'capabilities']
+
+
+class FakeDatastore(object):
+  def __init__(self):
+    self.rows = {}
+    self.reads = 0
+
+  def get_entity(self, table, row_key, column_names):
+    self.reads += 1
+    row = self.rows.get((table, row_key))
+    if row is None:
+      return [ERROR_DEFAULT + 'Not found']
+    return [ERROR_DEFAULT] + [row[column] for column in column_names]
+
+  def iterate_row_keys(self, table, start_after=''):
+    for row_table, row_key in sorted(self.rows):
+      if row_table == table and row_key > start_after:
+        yield row_key
+
+  def put_entity(self, table, row_key, column_names, cell_values):
+    row = self.rows.setdefault((table, row_key), {})
+    row.update(zip(column_names, cell_values))
+    return [ERROR_DEFAULT, '0']
+
+
+class TestUAServer(unittest.TestCase):
+  def setUp(self):
+    self.db = FakeDatastore()
+    self.db.rows[(ua_server.USER_TABLE, 'a@a.com')] = {
+      'email': 'a@a.com', 'pw': 'hash', 'enabled': 'true',
+      'capabilities': 'upload_app'}
+    flexmock(ua_server, db=self.db, user_schema=USER_SCHEMA,
+             ERROR_CODES=[ERROR_DEFAULT], row_cache=ua_server.RowCache(10))
+
+  def test_lookups_use_cache(self):
+    self.assertEquals('upload_app',
+                      ua_server.get_capabilities('a@a.com', 'secret'))
+    self.assertEquals('true', ua_server.is_user_enabled('a@a.com', 'secret'))
+    self.assertEquals('true', ua_server.does_user_exist('a@a.com', 'secret'))
+    self.assertEquals(1, self.db.reads)
+
+    # Missing rows are cached as well.
+    self.assertEquals('false', ua_server.does_user_exist('b@a.com', 'secret'))
+    self.assertEquals('false', ua_server.does_user_exist('b@a.com', 'secret'))
+    self.assertEquals(2, self.db.reads)
+
+    self.assertEquals({'hits': 3, 'misses': 2, 'entries': 2},
+                      json.loads(ua_server.get_cache_stats('secret')))
+
+  def test_writes_invalidate_cache(self):
+    self.assertEquals('upload_app',
+                      ua_server.get_capabilities('a@a.com', 'secret'))
+    self.assertEquals('true',
+                      ua_server.set_capabilities('a@a.com', '', 'secret'))
+    self.assertEquals('', ua_server.get_capabilities('a@a.com', 'secret'))
+
+    self.assertEquals('true', ua_server.disable_user('a@a.com', 'secret'))
+    self.assertEquals('false', ua_server.is_user_enabled('a@a.com', 'secret'))
+
+  def test_list_users(self):
+    self.db.rows[(ua_server.USER_TABLE, 'b@a.com')] = {}
+    self.db.rows[(ua_server.USER_TABLE, 'c@a.com')] = {}
+    self.db.rows[(ua_server.APP_TABLE, 'app1')] = {}
+
+    page = json.loads(ua_server.list_users('', 2, 'secret'))
+    self.assertEquals({'keys': ['a@a.com', 'b@a.com'], 'cursor': 'b@a.com'},
+                      page)
+    page = json.loads(ua_server.list_users(page['cursor'], 2, 'secret'))
+    self.assertEquals({'keys': ['c@a.com'], 'cursor': ''}, page)
+
+    self.assertEquals('____:a@a.com:b@a.com:c@a.com',
+                      ua_server.get_all_users('secret'))
+    self.assertEquals('____:app1', ua_server.get_all_apps('secret'))
+    self.assertEquals('Error: bad secret',
+                      ua_server.list_apps('', 2, 'bad secret'))
+
+  def test_bulk_lookups_accept_unicode_keys(self):
+    user = ['a@a.com', 'hash', 'true', 'upload_app']
+    rows = [(bytearray(ua_server.USER_TABLE + '/a@a.com'), column, value)
+            for column, value in zip(USER_SCHEMA, user)]
+    session = flexmock()
+    session.should_receive('execute').and_return(rows)
+    flexmock(py_cassandra.appscale_info).should_receive('get_db_ips').\
+      and_return(['127.0.0.1'])
+    flexmock(py_cassandra.Cluster).should_receive('connect').\
+      and_return(session)
+    flexmock(ua_server, db=py_cassandra.DatastoreProxy())
+
+    usernames = json.dumps([u'a@a.com', u'b\xe9@a.com'])
+    users = json.loads(ua_server.get_users_data(usernames, 'secret'))
+    self.assertEquals(['a@a.com'], users.keys())
+    self.assertEquals('hash', users['a@a.com']['pw'])
+
+  def test_expiry_and_eviction(self):
+    cache = ua_server.RowCache(10, max_size=2)
+    cache.put('table', 'a', ['a'])
+    cache.put('table', 'b', ['b'])
+    cache.put('table', 'c', ['c'])
+    self.assertIsNone(cache.get('table', 'a'))
+    self.assertEquals(['c'], cache.get('table', 'c'))
+
+    expired = time.time() + 11
+    flexmock(time).should_receive('time').and_return(expired)
+    self.assertIsNone(cache.get('table', 'c'))
+
+    disabled = ua_server.RowCache(0)
+    disabled.put('table', 'a', ['a'])
+    self.assertIsNone(disabled.get('table', 'a'))
+
+
+if __name__ == "__main__":
+  unittest.main()
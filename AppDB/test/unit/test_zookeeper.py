@@ -6,6 +6,7 @@ import kazoo.exceptions
 import kazoo.protocol
 import kazoo.protocol.states
 import time
+import types
 import unittest
 
 from appscale.datastore.zkappscale import zktransaction as zk
@@ -13,6 +14,197 @@ from appscale.datastore.zkappscale.zktransaction import ZKTransactionException
 from flexmock import flexmock
 
 
+class FakeTransactionRequest(object):
+  """ Collects operations for FakeZooKeeper and applies them atomically. """
+  def __init__(self, zookeeper):
+    self.zookeeper = zookeeper
+    self.operations = []
+
+  def create(self, path, value='', acl=None, ephemeral=False, sequence=False):
+    self.operations.append(('create', path, value))
+
+  def delete(self, path, version=-1):
+    self.operations.append(('delete', path, version))
+
+  def set_data(self, path, value, version=-1):
+    self.operations.append(('set_data', path, value, version))
+
+  def commit(self):
+    self.zookeeper.round_trips += 1
+    nodes = dict(self.zookeeper.nodes)
+    results = []
+    for operation in self.operations:
+      try:
+        result = getattr(self.zookeeper, '_' + operation[0])(
+          nodes, *operation[1:])
+      except kazoo.exceptions.KazooException as error:
+        return ([kazoo.exceptions.RolledBackError()] * len(results) + [error] +
+          [kazoo.exceptions.RolledBackError()] *
+          (len(self.operations) - len(results) - 1))
+      results.append(result)
+    self.zookeeper.nodes = nodes
+    self.zookeeper.fire_watches()
+    return results
+
+
+class FakeZooKeeper(object):
+  """ An in-memory ZooKeeper tree that counts round trips to the server. """
+  def __init__(self):
+    self.nodes = {'/': ['', 0]}
+    self.round_trips = 0
+    self.connected = True
+    self.sequence = 0
+    self.listeners = []
+    self.child_watches = {}
+    self.child_watchers = {}
+
+  def start(self):
+    pass
+
+  def add_listener(self, listener):
+    self.listeners.append(listener)
+
+  def set_state(self, state):
+    for listener in self.listeners:
+      listener(state)
+
+  def ChildrenWatch(self, path, func):
+    self.child_watches[path] = (func, None)
+    self.fire_watches()
+
+  def DataWatch(self, path, func):
+    self.round_trips += 1
+    if path in self.nodes:
+      func(self.nodes[path][0], flexmock(version=self.nodes[path][1]))
+    else:
+      func(None, None)
+
+  def sync(self, path):
+    self.round_trips += 1
+    return path
+
+  def fire_watches(self):
+    for path, (watchers, children) in self.child_watchers.items():
+      if sorted(self._children(path)) == children:
+        continue
+      del self.child_watchers[path]
+      for watcher in watchers:
+        watcher(flexmock(path=path))
+
+    for path, (func, children) in self.child_watches.items():
+      if path not in self.nodes:
+        continue
+      current = sorted(self._children(path))
+      if current == children:
+        continue
+      self.round_trips += 1
+      if func(current) is False:
+        del self.child_watches[path]
+      else:
+        self.child_watches[path] = (func, current)
+
+  def retry(self, function, *args, **kwargs):
+    return function(*args, **kwargs)
+
+  def transaction(self):
+    return FakeTransactionRequest(self)
+
+  def _create(self, nodes, path, value):
+    if path in nodes:
+      raise kazoo.exceptions.NodeExistsError()
+    if (path.rsplit('/', 1)[0] or '/') not in nodes:
+      raise kazoo.exceptions.NoNodeError()
+    nodes[path] = [value, 0]
+    return path
+
+  def _delete(self, nodes, path, version=-1):
+    if path not in nodes:
+      raise kazoo.exceptions.NoNodeError()
+    if any(node.startswith(path + '/') for node in nodes):
+      raise kazoo.exceptions.NotEmptyError()
+    del nodes[path]
+    return True
+
+  def _set_data(self, nodes, path, value, version=-1):
+    if path not in nodes:
+      raise kazoo.exceptions.NoNodeError()
+    if version != -1 and nodes[path][1] != version:
+      raise kazoo.exceptions.BadVersionError()
+    nodes[path] = [value, nodes[path][1] + 1]
+    return flexmock(version=nodes[path][1])
+
+  def create(self, path, value='', acl=None, ephemeral=False, sequence=False,
+             makepath=False):
+    self.round_trips += 1
+    if sequence:
+      path = '{0}{1:010d}'.format(path, self.sequence)
+      self.sequence += 1
+    if makepath:
+      parts = path.split('/')
+      for index in range(2, len(parts)):
+        self.nodes.setdefault('/'.join(parts[:index]), ['', 0])
+    result = self._create(self.nodes, path, value)
+    self.fire_watches()
+    return result
+
+  def create_async(self, *args, **kwargs):
+    result = self.create(*args, **kwargs)
+    return flexmock(get=lambda: result)
+
+  def ensure_path(self, path, acl=None):
+    self.round_trips += 1
+    parts = path.split('/')
+    for index in range(2, len(parts) + 1):
+      self.nodes.setdefault('/'.join(parts[:index]), ['', 0])
+    return True
+
+  def exists(self, path):
+    self.round_trips += 1
+    if path not in self.nodes:
+      return None
+    return flexmock(version=self.nodes[path][1])
+
+  def get(self, path):
+    self.round_trips += 1
+    if path not in self.nodes:
+      raise kazoo.exceptions.NoNodeError()
+    return self.nodes[path][0], flexmock(version=self.nodes[path][1])
+
+  def get_children(self, path, watch=None):
+    self.round_trips += 1
+    if path not in self.nodes:
+      raise kazoo.exceptions.NoNodeError()
+    children = self._children(path)
+    if watch is not None:
+      watchers = self.child_watchers.get(path, (set(), None))[0]
+      watchers.add(watch)
+      self.child_watchers[path] = (watchers, sorted(children))
+    return children
+
+  def _children(self, path):
+    return [node[len(path) + 1:] for node in self.nodes
+            if node.startswith(path + '/') and '/' not in node[len(path) + 1:]]
+
+  def set(self, path, value, version=-1):
+    self.round_trips += 1
+    return self._set_data(self.nodes, path, value, version)
+
+  def set_async(self, *args, **kwargs):
+    result = self.set(*args, **kwargs)
+    return flexmock(get=lambda: result)
+
+  def delete(self, path, version=-1, recursive=False):
+    self.round_trips += 1
+    result = self._delete(self.nodes, path, version)
+    self.fire_watches()
+    return result
+
+  def delete_async(self, *args, **kwargs):
+    result = self.delete(*args, **kwargs)
+    return flexmock(get=lambda: result)
+
+
+
 class TestZookeeperTransaction(unittest.TestCase):
   """
   """
@@ -217,6 +409,9 @@ class TestZookeeperTransaction(unittest.TestCase):
        and_return('/lock/root/path')
     zk.ZKTransaction.should_receive('get_transaction_prefix_path').\
        and_return('/rootpath/' + self.appid)
+    zk.ZKTransaction.should_receive('get_transaction_lock_list_path').\
+       and_return('/rootpath/' + self.appid + "/tx1")
+    zk.ZKTransaction.should_receive('is_blacklisted').and_return(False)
     fake_zookeeper = flexmock(name='fake_zoo', get='get',
       connected=lambda: True)
     fake_zookeeper.should_receive('start')
@@ -227,17 +422,16 @@ class TestZookeeperTransaction(unittest.TestCase):
 
     # first, test out getting a lock for a regular transaction, that we don't
     # already have the lock for
-    zk.ZKTransaction.should_receive('is_in_transaction').and_return(False)
-    zk.ZKTransaction.should_receive('acquire_additional_lock').and_return(True)
+    fake_zookeeper.should_receive('retry').with_args('get', str) \
+      .and_raise(kazoo.exceptions.NoNodeError)
+    zk.ZKTransaction.should_receive('acquire_additional_lock').\
+      with_args(self.appid, "txid", "somekey", create=True).and_return(True)
 
     transaction = zk.ZKTransaction(host="something", start_gc=False)
     self.assertEquals(True, transaction.acquire_lock(self.appid, "txid",
       "somekey"))
 
     # next, test when we're in a transaction and we already have the lock
-    zk.ZKTransaction.should_receive('is_in_transaction').and_return(True)
-    zk.ZKTransaction.should_receive('get_transaction_lock_list_path').\
-       and_return('/rootpath/' + self.appid + "/tx1")
     fake_zookeeper.should_receive('retry').with_args('get', str) \
       .and_return(['/lock/root/path'])
 
@@ -247,9 +441,6 @@ class TestZookeeperTransaction(unittest.TestCase):
 
     # next, test when we're in a non-XG transaction and we're not in the lock
     # root path
-    zk.ZKTransaction.should_receive('is_in_transaction').and_return(True)
-    zk.ZKTransaction.should_receive('get_transaction_lock_list_path').\
-       and_return('/rootpath/' + self.appid + "/tx1")
     fake_zookeeper.should_receive('retry').with_args('get', str) \
       .and_return(['/lock/root/path2'])
     zk.ZKTransaction.should_receive('is_xg').and_return(False)
@@ -260,22 +451,26 @@ class TestZookeeperTransaction(unittest.TestCase):
 
     # next, test when we're in a XG transaction and we're not in the lock
     # root path
-    zk.ZKTransaction.should_receive('is_in_transaction').and_return(True)
-    zk.ZKTransaction.should_receive('get_transaction_lock_list_path').\
-       and_return('/rootpath/' + self.appid + "/tx1")
     fake_zookeeper.should_receive('retry').with_args('get', str) \
       .and_return(['/lock/root/path2'])
     zk.ZKTransaction.should_receive('is_xg').and_return(True)
+    zk.ZKTransaction.should_receive('acquire_additional_lock').\
+      with_args(self.appid, "txid", "somekey", create=False).and_return(True)
 
     transaction = zk.ZKTransaction(host="something", start_gc=False)
     self.assertEquals(True, transaction.acquire_lock(self.appid, "txid",
       "somekey"))
 
+    # Blacklisted transactions can't acquire any more locks.
+    zk.ZKTransaction.should_receive('is_blacklisted').and_return(True)
+    transaction = zk.ZKTransaction(host="something", start_gc=False)
+    self.assertRaises(zk.ZKTransactionException, transaction.acquire_lock,
+      self.appid, "txid", "somekey")
+
 
   def test_acquire_additional_lock(self):
     # mock out waitForConnect
     flexmock(zk.ZKTransaction)
-    zk.ZKTransaction.should_receive('check_transaction')
     zk.ZKTransaction.should_receive('get_transaction_path').\
        and_return('/txn/path')
     zk.ZKTransaction.should_receive('get_lock_root_path').\
@@ -283,21 +478,29 @@ class TestZookeeperTransaction(unittest.TestCase):
     zk.ZKTransaction.should_receive('get_transaction_prefix_path').\
        and_return('/rootpath/' + self.appid)
 
-    fake_zookeeper = flexmock(name='fake_zoo', create='create',
-      create_async='create_async', get='get', set_async='set_async',
-      connected=lambda: True)
+    fake_txn = flexmock(name='fake_txn')
+    fake_txn.should_receive('create').with_args('/lock/root/path',
+      value='/txn/path', acl=None, ephemeral=False, sequence=False).once()
+    fake_txn.should_receive('create').with_args('/txn/path/lockpath',
+      value='/lock/root/path', acl=None, ephemeral=False, sequence=False)
+    fake_txn.should_receive('set_data').with_args('/txn/path/lockpath',
+      zk.LOCK_LIST_SEPARATOR.join(['path1', 'path2', 'path3',
+      '/lock/root/path']), version=3)
+
+    fake_zookeeper = flexmock(name='fake_zoo', get='get',
+      ensure_path='ensure_path', connected=lambda: True)
     fake_zookeeper.should_receive('start')
-    fake_zookeeper.should_receive('retry').with_args('create', str, makepath=bool, sequence=bool,
-      ephemeral=bool, value=str, acl=None).and_return("/some/lock/path")
-    fake_zookeeper.should_receive('retry').with_args('create_async', str, value=str,
-      acl=None, ephemeral=bool, makepath=bool, sequence=bool)
-    fake_zookeeper.should_receive('retry').with_args('create_async', str, value=str,
-      acl=str, ephemeral=bool, makepath=bool, sequence=bool)
+    fake_zookeeper.should_receive('transaction').and_return(fake_txn)
+    fake_zookeeper.should_receive('retry').with_args(types.FunctionType) \
+      .replace_with(lambda function: function())
+    fake_zookeeper.should_receive('retry').with_args('ensure_path',
+      zk.LOCK_FREE_WRITES_PATH)
+    fake_zookeeper.should_receive('ChildrenWatch')
+    fake_txn.should_receive('commit').and_return([True, True])
     lock_list = ['path1', 'path2', 'path3'] 
     lock_list_str = zk.LOCK_LIST_SEPARATOR.join(lock_list)
     fake_zookeeper.should_receive('retry').with_args('get', str) \
-      .and_return([lock_list_str])
-    fake_zookeeper.should_receive('retry').with_args('set_async', str, str)
+      .and_return([lock_list_str, flexmock(version=3)])
 
     flexmock(kazoo.client)
     kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
@@ -307,6 +510,10 @@ class TestZookeeperTransaction(unittest.TestCase):
       "txid", "somekey", False))
 
     # Test for when we want to create a new ZK node for the lock path
+    flexmock(fake_txn).should_receive('create').with_args('/lock/root/path',
+      value='/txn/path', acl=None, ephemeral=False, sequence=False)
+    fake_txn.should_receive('create').with_args('/txn/path/lockpath',
+      value='/lock/root/path', acl=None, ephemeral=False, sequence=False)
     self.assertEquals(True, transaction.acquire_additional_lock(self.appid,
       "txid", "somekey", True))
 
@@ -314,19 +521,22 @@ class TestZookeeperTransaction(unittest.TestCase):
     lock_list = ['path' + str(num+1) for num in range(zk.MAX_GROUPS_FOR_XG)]
     lock_list_str = zk.LOCK_LIST_SEPARATOR.join(lock_list)
     fake_zookeeper.should_receive('retry').with_args('get', str) \
-      .and_return([lock_list_str])
+      .and_return([lock_list_str, flexmock(version=3)])
 
     transaction = zk.ZKTransaction(host="something", start_gc=False)
     self.assertRaises(zk.ZKTransactionException,
       transaction.acquire_additional_lock, self.appid, "txid", "somekey", False)
 
     # Test for when there is a node which already exists.
-    fake_zookeeper.should_receive('retry').with_args('create', str, str, None,
-      bool, bool, bool).and_raise(kazoo.exceptions.NodeExistsError)
+    fake_zookeeper.should_receive('retry').with_args('get', str) \
+      .and_return(['/other/txn/path', flexmock(version=3)])
+    fake_txn.should_receive('commit') \
+      .and_return([kazoo.exceptions.NodeExistsError(),
+                   kazoo.exceptions.RolledBackError()])
+    zk.ZKTransaction.should_receive('is_orphan_lock').and_return(False)
     transaction = zk.ZKTransaction(host="something", start_gc=False)
     self.assertRaises(zk.ZKTransactionException,
-      transaction.acquire_additional_lock, self.appid, "txid", "somekey", False)
-
+      transaction.acquire_additional_lock, self.appid, "txid", "somekey", True)
 
   def test_check_transaction(self):
     # mock out getTransactionRootPath
@@ -376,26 +586,33 @@ class TestZookeeperTransaction(unittest.TestCase):
   def test_release_lock(self):
     # mock out getTransactionRootPath
     flexmock(zk.ZKTransaction)
-    zk.ZKTransaction.should_receive('check_transaction')
+    zk.ZKTransaction.should_receive('is_blacklisted').and_return(False)
     zk.ZKTransaction.should_receive('get_transaction_path').\
       and_return('/rootpath')
     zk.ZKTransaction.should_receive('get_transaction_lock_list_path').\
-      and_return('/rootpath')
-    zk.ZKTransaction.should_receive('is_xg').and_return(False)
+      and_return('/rootpath/lockpath')
+
+    # All of the nodes should be deleted in a single transaction.
+    fake_txn = flexmock(name='fake_txn')
+    for path in ['/1/2/3', '/rootpath/lockpath', '/rootpath/xg',
+                 '/rootpath']:
+      fake_txn.should_receive('delete').with_args(path).once()
 
     # mock out initializing a ZK connection
     fake_zookeeper = flexmock(name='fake_zoo', exists='exists', get='get',
-      delete='delete', delete_async='delete_async',
-      get_children='get_children', connected=lambda: True)
+      delete='delete', get_children='get_children', connected=lambda: True)
     fake_zookeeper.should_receive('start')
+    fake_zookeeper.should_receive('transaction').and_return(fake_txn)
+    fake_zookeeper.should_receive('retry').with_args(types.FunctionType) \
+      .replace_with(lambda function: function())
+    fake_txn.should_receive('commit').and_return([True, True, True, True])
     fake_zookeeper.should_receive('retry').with_args('exists', str) \
       .and_return(True)
     fake_zookeeper.should_receive('retry').with_args('get', str) \
       .and_return(['/1/2/3'])
-    fake_zookeeper.should_receive('retry').with_args('delete_async', str)
-    fake_zookeeper.should_receive('retry').with_args('delete', str)
     fake_zookeeper.should_receive('retry').with_args('get_children', str) \
-      .and_return(['1','2'])
+      .and_return(['lockpath', 'xg'])
+    fake_zookeeper.should_receive('retry').with_args('delete', str).never()
 
     flexmock(kazoo.client)
     kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
@@ -403,13 +620,26 @@ class TestZookeeperTransaction(unittest.TestCase):
     transaction = zk.ZKTransaction(host="something", start_gc=False)
     self.assertEquals(True, transaction.release_lock(self.appid, 1))
 
-    zk.ZKTransaction.should_receive('is_xg').and_return(True)
+    # If the transaction fails, the nodes are removed one at a time.
+    fake_txn.should_receive('commit') \
+      .and_return([True, kazoo.exceptions.NoNodeError(),
+                   kazoo.exceptions.RolledBackError(),
+                   kazoo.exceptions.RolledBackError()])
+    fake_txn.should_receive('delete')
+    fake_zookeeper.should_receive('retry').with_args('delete', str).times(4)
     self.assertEquals(True, transaction.release_lock(self.appid, 1))
 
     # Check to make sure it raises exception for blacklisted transactions.
-    zk.ZKTransaction.should_receive('is_xg').and_return(False)
+    zk.ZKTransaction.should_receive('is_blacklisted').and_return(True)
+    self.assertRaises(zk.ZKTransactionException, transaction.release_lock,
+      self.appid, 1)
+
+    # Transactions that don't exist can't be released.
+    zk.ZKTransaction.should_receive('is_blacklisted').and_return(False)
     fake_zookeeper.should_receive('retry').with_args('get', str) \
       .and_raise(kazoo.exceptions.NoNodeError)
+    fake_zookeeper.should_receive('retry').with_args('exists', str) \
+      .and_return(False)
     self.assertRaises(zk.ZKTransactionException, transaction.release_lock,
       self.appid, 1)
 
@@ -421,21 +651,99 @@ class TestZookeeperTransaction(unittest.TestCase):
       and_return("bl_root_path")
 
     # mock out initializing a ZK connection
-    fake_zookeeper = flexmock(name='fake_zoo', create='create', exists='exists',
-      get_children='get_children', connected=lambda: True)
+    fake_zookeeper = flexmock(name='fake_zoo', get_children='get_children',
+      ensure_path='ensure_path', connected=lambda: True)
     fake_zookeeper.should_receive('start')
-    fake_zookeeper.should_receive('retry').with_args('create', str, str, None,
-      bool, bool, bool).and_return()
-    fake_zookeeper.should_receive('retry').with_args('exists', str) \
-      .and_return(True)
-    fake_zookeeper.should_receive('retry').with_args('get_children', str) \
-      .and_return(['1','2'])
+    fake_zookeeper.should_receive('add_listener')
+    fake_zookeeper.should_receive('retry').with_args('get_children',
+      'bl_root_path', watch=object).and_return(['1', '2']).once()
 
     flexmock(kazoo.client)
     kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
 
     transaction = zk.ZKTransaction(host="something", start_gc=False)
     self.assertEquals(True, transaction.is_blacklisted(self.appid, 1))
+    self.assertEquals(False, transaction.is_blacklisted(self.appid, 3))
+
+    # The blacklist node is created if it doesn't exist.
+    transaction.clear_blacklist_cache()
+    fake_zookeeper.should_receive('retry').with_args('get_children',
+      'bl_root_path', watch=object).and_raise(kazoo.exceptions.NoNodeError).\
+      and_return([])
+    fake_zookeeper.should_receive('retry').with_args('ensure_path',
+      'bl_root_path').once()
+    self.assertEquals(False, transaction.is_blacklisted(self.appid, 1))
+
+  def test_index_validation(self):
+    fake_zookeeper = FakeZooKeeper()
+    flexmock(kazoo.client).should_receive('KazooClient').\
+      and_return(fake_zookeeper)
+    transaction = zk.ZKTransaction(host='something', start_gc=False)
+
+    self.assertFalse(transaction.index_validation_disabled(self.appid))
+
+    # Other clients see the flag through the watch.
+    other = zk.ZKTransaction(host='something', start_gc=False)
+    other.disable_index_validation(self.appid)
+    fake_zookeeper.fire_watches()
+    self.assertTrue(transaction.index_validation_disabled(self.appid))
+    self.assertFalse(transaction.index_validation_disabled('other-app'))
+
+    other.enable_index_validation(self.appid)
+    fake_zookeeper.fire_watches()
+    self.assertFalse(transaction.index_validation_disabled(self.appid))
+
+  def test_datastore_is_read_only(self):
+    fake_zookeeper = FakeZooKeeper()
+    flexmock(kazoo.client).should_receive('KazooClient').\
+      and_return(fake_zookeeper)
+    transaction = zk.ZKTransaction(host='something', start_gc=False)
+
+    self.assertFalse(transaction.datastore_is_read_only())
+    fake_zookeeper.create(zk.READ_ONLY_PATH, 'true', makepath=True)
+    self.assertTrue(transaction.datastore_is_read_only())
+    fake_zookeeper.set(zk.READ_ONLY_PATH, 'false')
+    self.assertFalse(transaction.datastore_is_read_only())
+
+  def test_blacklist_cache(self):
+    fake_zookeeper = FakeZooKeeper()
+    flexmock(kazoo.client)
+    kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
+    transaction = zk.ZKTransaction(host="something", start_gc=False)
+    blacklist_root = transaction.get_blacklist_root_path(self.appid)
+
+    self.assertEquals(False, transaction.is_blacklisted(self.appid, 1))
+
+    # Further checks are answered locally.
+    before = fake_zookeeper.round_trips
+    for txid in range(100):
+      self.assertEquals(False, transaction.is_blacklisted(self.appid, txid))
+    self.assertEquals(before, fake_zookeeper.round_trips)
+
+    # Changes to the blacklist are picked up by the watch.
+    fake_zookeeper.create(blacklist_root + '/5')
+    self.assertEquals(True, transaction.is_blacklisted(self.appid, 5))
+    fake_zookeeper.delete(blacklist_root + '/5')
+    self.assertEquals(False, transaction.is_blacklisted(self.appid, 5))
+
+    # Refetching the blacklist doesn't add more watches.
+    self.assertEquals(1, len(fake_zookeeper.child_watchers[blacklist_root][0]))
+
+    # Changes are only fetched when the blacklist is checked again.
+    before = fake_zookeeper.round_trips
+    for txid in range(10):
+      fake_zookeeper.create('{0}/{1}'.format(blacklist_root, txid))
+    self.assertEquals(before + 10, fake_zookeeper.round_trips)
+    self.assertEquals(True, transaction.is_blacklisted(self.appid, 9))
+    self.assertEquals(before + 11, fake_zookeeper.round_trips)
+
+    # The session's watches are gone once it is lost, so the cache is rebuilt.
+    fake_zookeeper.set_state(kazoo.protocol.states.KazooState.LOST)
+    fake_zookeeper.child_watchers.clear()
+    fake_zookeeper.nodes[blacklist_root + '/20'] = ['', 0]
+    self.assertEquals(True, transaction.is_blacklisted(self.appid, 20))
+    fake_zookeeper.delete(blacklist_root + '/20')
+    self.assertEquals(False, transaction.is_blacklisted(self.appid, 20))
 
   def test_register_updated_key(self):
     # mock out getTransactionRootPath
@@ -575,6 +883,82 @@ class TestZookeeperTransaction(unittest.TestCase):
       and_raise(kazoo.exceptions.NoNodeError)
     self.assertRaises(ZKTransactionException,
       transaction.release_lock_with_path, 'some/path')
-     
+
+  def test_lock_round_trips(self):
+    fake_zookeeper = FakeZooKeeper()
+    flexmock(kazoo.client)
+    kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
+    transaction = zk.ZKTransaction(host="something", start_gc=False)
+
+    # The first lock for an application also creates the lock root.
+    txid = transaction.get_transaction_id(self.appid)
+    transaction.acquire_lock(self.appid, txid, 'root_key')
+    transaction.release_lock(self.appid, txid)
+
+    # A non-transactional put takes a lock on one entity group and releases
+    # it after the write.
+    round_trips = {'acquire': 0, 'release': 0}
+    for _ in range(10):
+      txid = transaction.get_transaction_id(self.appid)
+      before = fake_zookeeper.round_trips
+      transaction.acquire_lock(self.appid, txid, 'root_key')
+      round_trips['acquire'] += fake_zookeeper.round_trips - before
+      before = fake_zookeeper.round_trips
+      transaction.release_lock(self.appid, txid)
+      round_trips['release'] += fake_zookeeper.round_trips - before
+
+    self.assertLessEqual(round_trips['acquire'], 2 * 10)
+    self.assertLessEqual(round_trips['release'], 3 * 10)
+    self.assertEquals([], [path for path in fake_zookeeper.nodes
+                           if '/locks/' in path or '/txids/tx' in path])
+
+    # Cross-group transactions add further locks atomically.
+    txid = transaction.get_transaction_id(self.appid, is_xg=True)
+    for root_key in ['root1', 'root2', 'root3']:
+      transaction.acquire_lock(self.appid, txid, root_key)
+    lock_list = fake_zookeeper.get(
+      transaction.get_transaction_lock_list_path(self.appid, txid))[0]
+    self.assertEquals(3, len(lock_list.split(zk.LOCK_LIST_SEPARATOR)))
+    self.assertRaises(ZKTransactionException, transaction.acquire_lock,
+      self.appid, txid + 1, 'root1')
+    transaction.release_lock(self.appid, txid)
+    self.assertEquals([], [path for path in fake_zookeeper.nodes
+                           if '/locks/' in path or '/txids/tx' in path])
+
+  def test_lock_commits_are_retried_safely(self):
+    fake_zookeeper = FakeZooKeeper()
+    flexmock(kazoo.client)
+    kazoo.client.should_receive('KazooClient').and_return(fake_zookeeper)
+    transaction = zk.ZKTransaction(host="something", start_gc=False)
+    txid = transaction.get_transaction_id(self.appid)
+    transaction.acquire_lock(self.appid, txid, 'root_key')
+    transaction.release_lock(self.appid, txid)
+
+    # Simulate a connection loss after the server applied each commit, which
+    # makes the retry run the commit a second time.
+    def retry(function, *args, **kwargs):
+      result = function(*args, **kwargs)
+      if isinstance(function, types.FunctionType):
+        result = function(*args, **kwargs)
+      return result
+    fake_zookeeper.retry = retry
+
+    txid = transaction.get_transaction_id(self.appid, is_xg=True)
+    self.assertTrue(transaction.acquire_lock(self.appid, txid, 'root1'))
+    self.assertTrue(transaction.acquire_lock(self.appid, txid, 'root2'))
+    lock_list = fake_zookeeper.get(
+      transaction.get_transaction_lock_list_path(self.appid, txid))[0]
+    self.assertEquals(2, len(lock_list.split(zk.LOCK_LIST_SEPARATOR)))
+    self.assertTrue(transaction.release_lock(self.appid, txid))
+    self.assertEquals([], [path for path in fake_zookeeper.nodes
+                           if '/locks/' in path or '/txids/tx' in path])
+
+    # A lock held by another transaction is still reported.
+    other_txid = transaction.get_transaction_id(self.appid)
+    transaction.acquire_lock(self.appid, other_txid, 'root1')
+    txid = transaction.get_transaction_id(self.appid)
+    self.assertRaises(ZKTransactionException, transaction.acquire_lock,
+                      self.appid, txid, 'root1')
+
 if __name__ == "__main__":
   unittest.main()    
@@ -35,7 +35,7 @@ from app_dashboard_data import InstanceInfo
 from app_dashboard_data import RequestInfo
 from app_dashboard_data import AppStatus
 
-from dashboard_logs import AppLogLine
+from dashboard_logs import build_log_rows
 from dashboard_logs import RequestLogLine
 
 jinja_environment = jinja2.Environment(
@@ -897,6 +897,30 @@ class LogServiceHostPage(AppDashboard):
 class LogUploadPage(webapp2.RequestHandler):
   """ Class to handle requests to the /logs/upload page. """
 
+  # A dict mapping each service name to the set of hosts that this instance
+  # knows are stored in its LoggedService entity.
+  known_hosts = {}
+
+  def register_host(self, service_name, host):
+    """ Makes sure the host is listed in the service's LoggedService entity.
+
+    Args:
+      service_name: The name of the service that uploaded logs.
+      host: The hostname of the machine that uploaded logs.
+    """
+    if host in self.known_hosts.get(service_name, ()):
+      return
+
+    service = LoggedService.get_by_id(service_name)
+    if service is None:
+      service = LoggedService(id=service_name)
+      service.hosts = [host]
+      service.put()
+    elif host not in service.hosts:
+      service.hosts.append(host)
+      service.put()
+    self.known_hosts[service_name] = set(service.hosts)
+
   def post(self):
     """ Saves logs records to the Datastore for later viewing. """
     encoded_data = self.request.body
@@ -906,52 +930,11 @@ class LogUploadPage(webapp2.RequestHandler):
     log_lines = data['logs']
 
     # First, check to see if this service has been registered.
-    service = LoggedService.get_by_id(service_name)
-    if service is None:
-      service = LoggedService(id=service_name)
-      service.hosts = [host]
-      service.put()
-    else:
-      if host not in service.hosts:
-        service.hosts.append(host)
-        service.put()
-
-    # Next, add in each log line as an AppLogLine
-    entities_to_store = {}
-    for log_line_dict in log_lines:
-      the_time = int(log_line_dict['timestamp'])
-      reversed_time = (2 ** 34 - the_time) * 1000000
-      key_name = service_name + host + str(reversed_time)
-      log_line = None
-      # Check the local cache first.
-      if key_name in entities_to_store:
-        log_line = entities_to_store[key_name]
-      else:
-        # Grab it from the datastore. 
-        log_line = RequestLogLine.get_by_id(id=key_name)
-      if not log_line:
-        # This is the first log for this timestamp.
-        log_line = RequestLogLine(id=key_name)
-        log_line.service_name = service_name
-        log_line.host = host
-        # Catch entity so that it does not repeatedly get fetched.
-        entities_to_store[key_name] = log_line
-
-      # Update the log entry with the given timestamp.
-      app_log_line = AppLogLine()
-      app_log_line.message = log_line_dict['message']
-      app_log_line.level = log_line_dict['level']
-      app_log_line.timestamp = datetime.datetime.fromtimestamp(the_time)
-
-      # We append to the list property of the log line.
-      log_line.app_logs.append(app_log_line)
-      # Update our local cache with the new version of the log line.
-      entities_to_store[key_name] = log_line
-
-    batch_put = []
-    for key_name in entities_to_store:
-      batch_put.append(entities_to_store[key_name])
-    ndb.put_multi(batch_put)
+    self.register_host(service_name, host)
+
+    # Log rows are never updated once written, so storing an upload is a
+    # single batch write with no reads.
+    ndb.put_multi(build_log_rows(service_name, host, log_lines))
 
 
 class LogDownloader(AppDashboard):
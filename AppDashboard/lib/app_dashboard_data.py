@@ -254,6 +254,21 @@ class AppDashboardData():
     """
     return model.get_by_id(key_name)
 
+  def get_multi(self, model, key_names):
+    """ Retrieves several objects from the datastore in a single batch,
+    referenced by their keynames.
+
+    Like get_by_id, this level of indirection makes the call easy to mock.
+
+    Args:
+      model: The ndb.Model that the requested objects belong to.
+      key_names: A list of strs that correspond to the Model's key names.
+    Returns:
+      A list containing the object for each keyname, or None for each object
+      that does not exist.
+    """
+    return ndb.get_multi([ndb.Key(model, key_name) for key_name in key_names])
+
   def get_all(self, obj, keys_only=False):
     """ Retrieves all objects from the datastore for a given model, or all of
     the keys for those objects.
@@ -521,21 +536,27 @@ class AppDashboardData():
       if not status_on_all_nodes:
         return {}
 
+      loaded_apps = set()
       for status in status_on_all_nodes:
         for app, done_loading in status['apps'].iteritems():
           if app == self.NO_APPS_RUNNING:
             continue
+          app_names_and_urls[app] = None
           if done_loading:
-            try:
-              host_url = self.helper.get_login_host()
-              ports = self.helper.get_app_ports(app)
-              app_names_and_urls[app] = [
-                "http://{0}:{1}".format(host_url, ports[0]),
-                "https://{0}:{1}".format(host_url, ports[1])]
-            except AppHelperException:
-              app_names_and_urls[app] = None
-          else:
-            app_names_and_urls[app] = None
+            loaded_apps.add(app)
+
+      # Look up the ports for every loaded app at once.
+      if loaded_apps:
+        try:
+          host_url = self.helper.get_login_host()
+          apps_ports = self.helper.get_apps_ports(list(loaded_apps))
+        except AppHelperException:
+          apps_ports = {}
+
+        for app, ports in apps_ports.iteritems():
+          app_names_and_urls[app] = [
+            "http://{0}:{1}".format(host_url, ports[0]),
+            "https://{0}:{1}".format(host_url, ports[1])]
 
       # To make sure that we only update apps that have been recently uploaded
       # or removed, we grab a list of all the apps that were running before we
@@ -602,15 +623,19 @@ class AppDashboardData():
     user_list = []
     try:
       all_users_list = self.helper.list_all_users()
+      users_data = self.helper.get_users_data(all_users_list)
+      stored_users = self.get_multi(UserInfo, all_users_list)
       users_to_update = []
-      for email in all_users_list:
-        user_info = self.get_by_id(UserInfo, email)
+      for email, user_info in zip(all_users_list, stored_users):
+        user_data = users_data.get(email, {})
+        is_user_cloud_admin = user_data.get('is_cloud_admin') == 'true'
+        can_upload_apps = 'upload_app' in user_data.get(
+          'capabilities', '').split(self.helper.USER_CAPABILITIES_DELIMITER)
+        owned_apps = user_data.get('applications', [])
+
         if user_info:
           # Only update the model in the Datastore if one of the fields has
           # changed.
-          is_user_cloud_admin = self.helper.is_user_cloud_admin(email)
-          can_upload_apps = self.helper.can_upload_apps(email)
-          owned_apps = self.helper.get_owned_apps(email)
           dash_layout_settings = self.get_dash_layout_settings(user_info)
           stored_layout_settings = user_info.dash_layout_settings
           if stored_layout_settings:
@@ -636,9 +661,9 @@ class AppDashboardData():
           user_list.append(user_info)
         else:
           user_info = UserInfo(id=email)
-          user_info.is_user_cloud_admin = self.helper.is_user_cloud_admin(email)
-          user_info.can_upload_apps = self.helper.can_upload_apps(email)
-          user_info.owned_apps = self.helper.get_owned_apps(email)
+          user_info.is_user_cloud_admin = is_user_cloud_admin
+          user_info.can_upload_apps = can_upload_apps
+          user_info.owned_apps = owned_apps
           user_info.dash_layout_settings = self.get_dash_layout_settings(
             user_info=user_info)
           users_to_update.append(user_info)
@@ -129,6 +129,10 @@ class AppDashboardHelper(object):
   # The time in seconds to wait before re-checking the app upload status.
   APP_UPLOAD_CHECK_INTERVAL = 1
 
+  # The maximum number of users or apps to request from the UserAppServer in
+  # a single bulk query.
+  BULK_QUERY_SIZE = 500
+
   def __init__(self):
     """ Sets up SOAP client fields, to avoid creating a new SOAP connection for
     every SOAP call.
@@ -287,8 +291,76 @@ class AppDashboardHelper(object):
     if not result or 'hosts' not in result or not result['hosts'].values():
       raise AppHelperException('{} does not have a port number.'.
                                format(appname))
-    return [int(result['hosts'].values()[0]['http']),
-            int(result['hosts'].values()[0]['https'])]
+    return self.ports_from_app_data(result)
+
+  def ports_from_app_data(self, app_data):
+    """ Extracts the ports an application runs on from its details.
+
+    Args:
+      app_data: A dict containing an application's details, as returned by
+        the UserAppServer.
+    Returns:
+      A list that indicates which ports the app runs on. ex. [8080,1443]
+    """
+    host_ports = app_data['hosts'].values()[0]
+    return [int(host_ports['http']), int(host_ports['https'])]
+
+  def get_apps_ports(self, appnames):
+    """ Queries the UserAppServer to learn which ports several applications
+    run on, using as few requests as possible.
+
+    Args:
+      appnames: A list of strs naming the applications.
+    Returns:
+      A dict mapping each application that has ports assigned to a list of
+      its ports. ex. {'app1': [8080,1443]}
+    Raises:
+      AppHelperException: If the UserAppServer returns an error.
+    """
+    apps_ports = {}
+    for appname, app_data in self.bulk_query('get_apps_data',
+                                             appnames).iteritems():
+      try:
+        apps_ports[appname] = self.ports_from_app_data(app_data)
+      except (IndexError, KeyError):
+        continue
+    return apps_ports
+
+  def get_users_data(self, emails):
+    """ Queries the UserAppServer for the data it stores for several users,
+    using as few requests as possible.
+
+    Args:
+      emails: A list of strs containing the users' e-mail addresses.
+    Returns:
+      A dict mapping each e-mail address that exists to a dict of the user's
+      fields. The 'applications' field is a list of app IDs.
+    Raises:
+      AppHelperException: If the UserAppServer returns an error.
+    """
+    return self.bulk_query('get_users_data', emails)
+
+  def bulk_query(self, method, names):
+    """ Calls a bulk UserAppServer method for a list of names, in batches.
+
+    Args:
+      method: A str naming the UserAppServer method.
+      names: A list of strs to pass to the method.
+    Returns:
+      A dict combining the results of each batch.
+    Raises:
+      AppHelperException: If the UserAppServer returns an error.
+    """
+    results = {}
+    uaserver = self.get_uaserver()
+    for start in range(0, len(names), self.BULK_QUERY_SIZE):
+      batch = names[start:start + self.BULK_QUERY_SIZE]
+      response = getattr(uaserver, method)(json.dumps(batch),
+                                           GLOBAL_SECRET_KEY)
+      if response.startswith('Error'):
+        raise AppHelperException(response)
+      results.update(json.loads(response))
+    return results
 
   def shell_check(self, argument):
     """ Checks for special characters in arguments that are part of shell
@@ -787,9 +859,7 @@ class AppDashboardHelper(object):
     """
     ret_list = []
     try:
-      uas = self.get_uaserver()
-      all_users = uas.get_all_users(GLOBAL_SECRET_KEY)
-      all_users_list = all_users.split(self.USER_DELIMITER)
+      all_users_list = self.list_users()
       my_ip = self.get_head_node_ip()
       for usr in all_users_list:
         if re.search('@' + my_ip + '$', usr):  # Skip the XMPP user accounts.
@@ -801,6 +871,30 @@ class AppDashboardHelper(object):
       logging.exception(err)
     return ret_list
 
+  def list_users(self):
+    """ Queries the UserAppServer for the e-mail address of every account, one
+    page at a time.
+
+    Returns:
+      A list of strs containing every account's e-mail address.
+    Raises:
+      AppHelperException: If the UserAppServer returns an error.
+    """
+    uaserver = self.get_uaserver()
+    emails = []
+    cursor = ''
+    while True:
+      response = uaserver.list_users(cursor, self.BULK_QUERY_SIZE,
+                                     GLOBAL_SECRET_KEY)
+      if response.startswith('Error'):
+        raise AppHelperException(response)
+
+      page = json.loads(response)
+      emails.extend(page['keys'])
+      cursor = page['cursor']
+      if not cursor:
+        return emails
+
   def list_all_users_permissions(self):
     """ Queries the UserAppServer and returns a list of all the users and the
       permissions they have in the system.
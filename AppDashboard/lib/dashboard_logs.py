@@ -1,7 +1,15 @@
 """ Models for storing logs from apps and services in AppScale. """
 
+import datetime
+import uuid
+
 from google.appengine.ext import ndb
 
+
+# The maximum number of AppLogLines stored in a single RequestLogLine. Buckets
+# with more lines than this are split across several entities.
+MAX_LINES_PER_ROW = 500
+
 class AppLogLine(ndb.Model):
   """ A Datastore Model that represents a single log line sent by an AppScale
   service.
@@ -19,11 +27,11 @@ class AppLogLine(ndb.Model):
 
 
 class RequestLogLine(ndb.Model):
-  """ A Datastore Model that represents all of the logs associated with a single
-  web request.
+  """ A Datastore Model that represents the logs a service uploaded from one
+  host for a single second.
 
-  As not all services within AppScale serve traditional web traffic, a
-  RequestLogLine may have only a single AppLogLine.
+  RequestLogLines are written once and never updated. Logs for the same second
+  that arrive in different uploads are stored in separate RequestLogLines.
 
   Fields:
     service_name: The name of the service that generated this request log. In
@@ -39,3 +47,60 @@ class RequestLogLine(ndb.Model):
   app_logs = ndb.StructuredProperty(AppLogLine, repeated=True, indexed=False)
   timestamp = ndb.DateTimeProperty(auto_now_add=True, auto_now=True)
 
+
+
+def request_log_line_key_name(service_name, host, timestamp, suffix=''):
+  """ Builds the key name for a RequestLogLine.
+
+  Key names sort newest first so that queries without an explicit order
+  return the most recent logs first.
+
+  Args:
+    service_name: The name of the service that generated the logs.
+    host: The hostname of the machine that generated the logs.
+    timestamp: An int containing the time bucket, in seconds since the epoch.
+    suffix: A str that makes the key unique to a single upload.
+  Returns:
+    A str containing the key name.
+  """
+  reversed_time = (2 ** 34 - timestamp) * 1000000
+  return service_name + host + str(reversed_time) + suffix
+
+
+def build_log_rows(service_name, host, log_lines, upload_id=None):
+  """ Groups uploaded log lines into new, immutable RequestLogLines.
+
+  Each row holds the lines for one second of one upload, so storing logs never
+  requires reading or rewriting rows written by earlier uploads.
+
+  Args:
+    service_name: The name of the service that generated the logs.
+    host: The hostname of the machine that generated the logs.
+    log_lines: A list of dicts, each containing a 'timestamp', 'level' and
+      'message'.
+    upload_id: A str that identifies this upload. Defaults to a random value.
+  Returns:
+    A list of RequestLogLines that have not yet been stored.
+  """
+  if upload_id is None:
+    upload_id = uuid.uuid4().hex
+
+  buckets = {}
+  for log_line_dict in log_lines:
+    the_time = int(log_line_dict['timestamp'])
+    app_log_line = AppLogLine(
+      message=log_line_dict['message'],
+      level=log_line_dict['level'],
+      timestamp=datetime.datetime.fromtimestamp(the_time))
+    buckets.setdefault(the_time, []).append(app_log_line)
+
+  rows = []
+  for the_time in sorted(buckets, reverse=True):
+    app_logs = buckets[the_time]
+    for chunk, start in enumerate(xrange(0, len(app_logs), MAX_LINES_PER_ROW)):
+      key_name = request_log_line_key_name(
+        service_name, host, the_time, '-{0}-{1}'.format(upload_id, chunk))
+      rows.append(RequestLogLine(
+        id=key_name, service_name=service_name, host=host,
+        app_logs=app_logs[start:start + MAX_LINES_PER_ROW]))
+  return rows
@@ -100,7 +100,8 @@ class FunctionalTestAppDashboard(unittest.TestCase):
 
     fake_soap.should_receive('commit_new_user').and_return('true')
     fake_soap.should_receive('commit_new_token').and_return()
-    fake_soap.should_receive('get_all_users').and_return("a@a.com:b@a.com")
+    fake_soap.should_receive('list_users')\
+      .and_return('{"keys": ["a@a.com", "b@a.com"], "cursor": ""}')
     fake_soap.should_receive('set_capabilities').and_return('true')
 
     self.request = self.fakeRequest()
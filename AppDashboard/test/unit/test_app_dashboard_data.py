@@ -120,6 +120,9 @@ class TestAppDashboardData(unittest.TestCase):
       .and_return(user_info2) \
       .and_return(user_info3) \
       .and_return(user_info4)
+    flexmock(AppDashboardData).should_receive('get_multi')\
+      .with_args(app_dashboard_data.UserInfo, list)\
+      .and_return([user_info1, user_info2, user_info3, user_info4])
 
 
   def setupFakePutsAndDeletes(self):
@@ -245,8 +248,8 @@ class TestAppDashboardData(unittest.TestCase):
       }]).once()
     flexmock(AppDashboardHelper).should_receive('get_login_host')\
       .and_return('1.1.1.1').never()
-    flexmock(AppDashboardHelper).should_receive('get_app_ports')\
-      .and_return(['8080', '1444']).never()
+    flexmock(AppDashboardHelper).should_receive('get_apps_ports')\
+      .never()
     self.setupAppStatusMocks()
     self.setupFakePutsAndDeletes()
 
@@ -262,8 +265,8 @@ class TestAppDashboardData(unittest.TestCase):
       }]).once()
     flexmock(AppDashboardHelper).should_receive('get_login_host')\
       .and_return('1.1.1.1').once()
-    flexmock(AppDashboardHelper).should_receive('get_app_ports')\
-      .and_return(['8080', '1444']).once()
+    flexmock(AppDashboardHelper).should_receive('get_apps_ports')\
+      .with_args(['app1']).and_return({'app1': ['8080', '1444']}).once()
     self.setupAppStatusMocks()
     self.setupFakePutsAndDeletes()
 
@@ -279,32 +282,24 @@ class TestAppDashboardData(unittest.TestCase):
     flexmock(ndb).should_receive('put_multi').and_return()
     flexmock(AppDashboardHelper).should_receive('list_all_users')\
       .and_return(['a@a.com', 'b@a.com', 'c@a.com', 'd@a.com']).once()
-    flexmock(AppDashboardHelper).should_receive('is_user_cloud_admin')\
-      .with_args('a@a.com').and_return(True).once()
-    flexmock(AppDashboardHelper).should_receive('is_user_cloud_admin')\
-      .with_args('b@a.com').and_return(False).once()
-    flexmock(AppDashboardHelper).should_receive('is_user_cloud_admin')\
-      .with_args('c@a.com').and_return(False).once()
-    flexmock(AppDashboardHelper).should_receive('is_user_cloud_admin') \
-      .with_args('d@a.com').and_return(False).once()
-
-    flexmock(AppDashboardHelper).should_receive('can_upload_apps')\
-      .with_args('a@a.com').and_return(True).once()
-    flexmock(AppDashboardHelper).should_receive('can_upload_apps')\
-      .with_args('b@a.com').and_return(True).once()
-    flexmock(AppDashboardHelper).should_receive('can_upload_apps')\
-      .with_args('c@a.com').and_return(False).once()
-    flexmock(AppDashboardHelper).should_receive('can_upload_apps') \
-      .with_args('d@a.com').and_return(False).once()
-
-    flexmock(AppDashboardHelper).should_receive('get_owned_apps')\
-      .with_args('a@a.com').and_return(['app1', 'app2']).once()
-    flexmock(AppDashboardHelper).should_receive('get_owned_apps')\
-      .with_args('b@a.com').and_return(['app2']).once()
-    flexmock(AppDashboardHelper).should_receive('get_owned_apps')\
-      .with_args('c@a.com').and_return(['app2']).once()
-    flexmock(AppDashboardHelper).should_receive('get_owned_apps') \
-      .with_args('d@a.com').and_return([]).once()
+    flexmock(AppDashboardHelper).should_receive('get_users_data')\
+      .with_args(['a@a.com', 'b@a.com', 'c@a.com', 'd@a.com'])\
+      .and_return({
+        'a@a.com': {'is_cloud_admin': 'true',
+                    'capabilities': 'upload_app',
+                    'applications': ['app1', 'app2']},
+        'b@a.com': {'is_cloud_admin': 'false',
+                    'capabilities': 'upload_app',
+                    'applications': ['app2']},
+        'c@a.com': {'is_cloud_admin': 'false',
+                    'capabilities': '',
+                    'applications': ['app2']},
+        'd@a.com': {'is_cloud_admin': 'false',
+                    'capabilities': '',
+                    'applications': []}}).once()
+    flexmock(AppDashboardHelper).should_receive('is_user_cloud_admin').never()
+    flexmock(AppDashboardHelper).should_receive('can_upload_apps').never()
+    flexmock(AppDashboardHelper).should_receive('get_owned_apps').never()
 
     self.setupUserInfoMocks()
 
@@ -1,4 +1,5 @@
 from flexmock import flexmock
+import json
 import sys
 import os
 import unittest
@@ -6,6 +7,7 @@ import urllib
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../../lib/"))
 from app_dashboard_helper import AppDashboardHelper
+from app_dashboard_helper import AppHelperException
 
 sys.path.append(os.path.join(os.path.expanduser("~"), "appscale/AppServer/"))
 from google.appengine.api import users
@@ -46,3 +48,55 @@ class TestAppDashboardHelper(unittest.TestCase):
     self.assertTrue( len(output) == 2 )
     self.assertEquals('app1', output[0] )
     self.assertEquals('app2', output[1] )
+
+  def test_get_users_data(self):
+    fake_uaserver = flexmock()
+    fake_uaserver.should_receive('get_users_data') \
+      .with_args('["a@a.com", "b@a.com"]', str) \
+      .and_return('{"a@a.com": {"applications": ["app1"]}}').once()
+    fake_uaserver.should_receive('get_users_data') \
+      .with_args('["c@a.com"]', str) \
+      .and_return('{"c@a.com": {"applications": []}}').once()
+    flexmock(AppDashboardHelper).should_receive('get_uaserver') \
+      .and_return(fake_uaserver)
+    flexmock(AppDashboardHelper, BULK_QUERY_SIZE=2)
+
+    output = AppDashboardHelper().get_users_data(
+      ['a@a.com', 'b@a.com', 'c@a.com'])
+    self.assertEquals({'a@a.com': {'applications': ['app1']},
+                       'c@a.com': {'applications': []}}, output)
+
+  def test_get_apps_ports(self):
+    fake_uaserver = flexmock()
+    fake_uaserver.should_receive('get_apps_data') \
+      .and_return(json.dumps({
+        'app1': {'hosts': {'1.1.1.1': {'http': 8080, 'https': 4380}}},
+        'app2': {'hosts': {}}}))
+    flexmock(AppDashboardHelper).should_receive('get_uaserver') \
+      .and_return(fake_uaserver)
+
+    output = AppDashboardHelper().get_apps_ports(['app1', 'app2', 'app3'])
+    self.assertEquals({'app1': [8080, 4380]}, output)
+
+    fake_uaserver.should_receive('get_apps_data') \
+      .and_return('Error: bad secret')
+    self.assertRaises(AppHelperException,
+                      AppDashboardHelper().get_apps_ports, ['app1'])
+
+  def test_list_all_users(self):
+    fake_uaserver = flexmock()
+    fake_uaserver.should_receive('list_users') \
+      .with_args('', 2, str) \
+      .and_return('{"keys": ["a@a.com", "b@1.1.1.1"], "cursor": "b@1.1.1.1"}')
+    fake_uaserver.should_receive('list_users') \
+      .with_args('b@1.1.1.1', 2, str) \
+      .and_return('{"keys": ["c@a.com"], "cursor": ""}')
+    flexmock(AppDashboardHelper).should_receive('get_uaserver') \
+      .and_return(fake_uaserver)
+    flexmock(AppDashboardHelper).should_receive('get_head_node_ip') \
+      .and_return('1.1.1.1')
+    flexmock(AppDashboardHelper, BULK_QUERY_SIZE=2)
+
+    # XMPP accounts are skipped.
+    self.assertEquals(['a@a.com', 'c@a.com'],
+                      AppDashboardHelper().list_all_users())
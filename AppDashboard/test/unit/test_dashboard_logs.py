@@ -0,0 +1,76 @@
+from flexmock import flexmock
+import logging
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../lib/"))
+import dashboard_logs
+
+sys.path.append(os.path.join(os.path.expanduser("~"), "appscale/AppServer/"))
+from google.appengine.ext import ndb
+
+
+class TestDashboardLogs(unittest.TestCase):
+
+
+  def test_build_log_rows_buckets_by_second(self):
+    log_lines = [
+      {'timestamp': 100.2, 'level': 2, 'message': 'first'},
+      {'timestamp': 101.5, 'level': 3, 'message': 'second'},
+      {'timestamp': 100.7, 'level': 4, 'message': 'third'},
+    ]
+    rows = dashboard_logs.build_log_rows('app', '1.1.1.1', log_lines,
+      upload_id='abc')
+
+    self.assertEquals(2, len(rows))
+    # Newer buckets come first, matching the order of their keys.
+    self.assertEquals(
+      dashboard_logs.request_log_line_key_name('app', '1.1.1.1', 101, '-abc-0'),
+      rows[0].key.id())
+    self.assertEquals(['second'], [log.message for log in rows[0].app_logs])
+    self.assertEquals(['first', 'third'],
+      [log.message for log in rows[1].app_logs])
+    self.assertTrue(rows[0].key.id() < rows[1].key.id())
+    for row in rows:
+      self.assertEquals('app', row.service_name)
+      self.assertEquals('1.1.1.1', row.host)
+
+
+  def test_build_log_rows_are_unique_per_upload(self):
+    log_lines = [{'timestamp': 100, 'level': 2, 'message': 'line'}]
+    first = dashboard_logs.build_log_rows('app', 'host', log_lines)
+    second = dashboard_logs.build_log_rows('app', 'host', log_lines)
+    self.assertNotEquals(first[0].key, second[0].key)
+
+
+  def test_build_log_rows_splits_large_buckets(self):
+    log_lines = [{'timestamp': 100, 'level': 2, 'message': str(i)}
+                 for i in range(5)]
+    original_max = dashboard_logs.MAX_LINES_PER_ROW
+    dashboard_logs.MAX_LINES_PER_ROW = 2
+    try:
+      rows = dashboard_logs.build_log_rows('app', 'host', log_lines,
+        upload_id='abc')
+    finally:
+      dashboard_logs.MAX_LINES_PER_ROW = original_max
+    self.assertEquals([2, 2, 1], [len(row.app_logs) for row in rows])
+    self.assertEquals(3, len(set(row.key for row in rows)))
+
+
+  def test_ingestion_benchmark(self):
+    put_calls = []
+    flexmock(ndb).should_receive('put_multi').replace_with(
+      lambda rows: put_calls.append(len(rows)))
+    log_lines = [{'timestamp': 1000 + i / 100, 'level': 2,
+                  'message': 'log line {0}'.format(i)} for i in range(10000)]
+
+    start = time.time()
+    ndb.put_multi(dashboard_logs.build_log_rows('app', 'host', log_lines))
+    elapsed = time.time() - start
+
+    # One write of 100 rows replaces 100 reads and 100 rewrites.
+    self.assertEquals([100], put_calls)
+    logging.info('Built {0} log lines/second'.format(
+      int(len(log_lines) / elapsed)))
@@ -5,7 +5,6 @@ import fnmatch
 import glob
 import json
 import logging
-import math
 import os
 import shutil
 import SOAPpy
@@ -16,6 +15,8 @@ import time
 import urllib2
 from xml.etree import ElementTree
 
+import appserver_pool
+
 from M2Crypto import SSL
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../lib/"))
@@ -35,9 +36,17 @@ from google.appengine.api.appcontroller_client import AppControllerClient
 # The amount of seconds to wait for an application to start up.
 START_APP_TIMEOUT = 180
 
-# The amount of seconds to wait between checking if an application is up.
+# The maximum amount of seconds to wait between checking if an application
+# is up.
 BACKOFF_TIME = 1
 
+# The amount of seconds to wait after the first check for an application. The
+# wait doubles after each failed check until it reaches BACKOFF_TIME.
+INITIAL_BACKOFF_TIME = .01
+
+# The maximum number of instances that start_apps waits on at once.
+MAX_CONCURRENT_STARTS = 50
+
 # The PID number to return when a process did not start correctly
 BAD_PID = -1
 
@@ -87,9 +96,20 @@ HTTP_OK = 200
 # The amount of seconds to wait before retrying to add routing.
 ROUTING_RETRY_INTERVAL = 5
 
+# The script that keeps AppServers waiting with the SDK already imported.
+APPSERVER_POOL_SCRIPT = os.path.join(constants.APPSCALE_HOME, 'AppManager',
+                                     'appserver_pool.py')
+
+# The monit watch for the AppServer pool.
+APPSERVER_POOL_WATCH = 'appserver_pool'
+
 # A DeploymentConfig accessor.
 deployment_config = None
 
+# The number of waiting AppServers to keep in the pool. Python, Go, and PHP
+# AppServers are started from scratch when this is 0.
+appserver_pool_size = 0
+
 
 class BadConfigurationException(Exception):
   """ An application is configured incorrectly. """
@@ -172,34 +192,19 @@ def remove_routing(app, port):
   appserver_ip = appscale_info.get_private_ip()
   acc.remove_appserver_from_haproxy(app, appserver_ip, port)
 
-def start_app(config):
-  """ Starts a Google App Engine application on this machine. It
-      will start it up and then proceed to fetch the main page.
+def configure_app_instance(config):
+  """ Writes the monit configuration for an application server instance.
 
   Args:
-    config: a dictionary that contains
-       app_name: Name of the application to start
-       app_port: Port to start on
-       language: What language the app is written in
-       load_balancer_ip: Public ip of load balancer
-       xmpp_ip: IP of XMPP service
-       env_vars: A dict of environment variables that should be passed to the
-        app.
-       max_memory: An int that names the maximum amount of memory that this
-        App Engine app is allowed to consume before being restarted.
-       syslog_server: The IP of the syslog server to send the application
-         logs to. Usually it's the login private IP.
+    config: A dictionary containing the instance configuration. See start_app
+      for the fields it contains.
   Returns:
-    PID of process on success, -1 otherwise
+    A string containing the monit watch for the application, or None if the
+    configuration is not valid.
   """
-  config = convert_config_from_json(config)
-  if config is None:
-    logging.error("Invalid configuration for application")
-    return BAD_PID
-
   if not misc.is_app_name_valid(config['app_name']):
     logging.error("Invalid app name for application: " + config['app_name'])
-    return BAD_PID
+    return None
   logging.info("Starting %s application %s" % (
     config['language'], config['app_name']))
 
@@ -225,13 +230,13 @@ def start_app(config):
     remove_conflicting_jars(config['app_name'])
     copy_successful = copy_modified_jars(config['app_name'])
     if not copy_successful:
-      return BAD_PID
+      return None
 
     # Account for MaxPermSize (~170MB), the parent process (~50MB), and thread
     # stacks (~20MB).
     max_heap = config['max_memory'] - 250
     if max_heap <= 0:
-      return BAD_PID
+      return None
     start_cmd = create_java_start_cmd(
       config['app_name'],
       config['app_port'],
@@ -244,7 +249,7 @@ def start_app(config):
   else:
     logging.error("Unknown application language %s for appname %s" \
       % (config['language'], config['app_name']))
-    return BAD_PID
+    return None
 
   logging.info("Start command: " + str(start_cmd))
   logging.info("Stop command: " + str(stop_cmd))
@@ -264,16 +269,15 @@ def start_app(config):
     syslog_server,
     appscale_info.get_private_ip())
 
-  if not monit_interface.start(watch):
-    logging.error("Unable to start application server with monit")
-    return BAD_PID
+  return watch
 
-  if not wait_on_app(int(config['app_port'])):
-    logging.error("Application server did not come up in time, "
-      "removing monit watch")
-    monit_interface.stop(watch)
-    return BAD_PID
+def finish_app_start(config, watch):
+  """ Routes traffic to an instance that is up and rotates its logs.
 
+  Args:
+    config: A dictionary containing the instance configuration.
+    watch: A string containing the monit watch for the application.
+  """
   threading.Thread(target=add_routing,
     args=(config['app_name'], config['app_port'])).start()
 
@@ -289,9 +293,113 @@ def start_app(config):
     logging.error("Error while setting up log rotation for application: {}".
       format(config['app_name']))
 
+def start_app(config):
+  """ Starts a Google App Engine application on this machine. It
+      will start it up and then proceed to fetch the main page.
 
+  Args:
+    config: a dictionary that contains
+       app_name: Name of the application to start
+       app_port: Port to start on
+       language: What language the app is written in
+       load_balancer_ip: Public ip of load balancer
+       xmpp_ip: IP of XMPP service
+       env_vars: A dict of environment variables that should be passed to the
+        app.
+       max_memory: An int that names the maximum amount of memory that this
+        App Engine app is allowed to consume before being restarted.
+       syslog_server: The IP of the syslog server to send the application
+         logs to. Usually it's the login private IP.
+  Returns:
+    PID of process on success, -1 otherwise
+  """
+  config = convert_config_from_json(config)
+  if config is None:
+    logging.error("Invalid configuration for application")
+    return BAD_PID
+
+  watch = configure_app_instance(config)
+  if watch is None:
+    return BAD_PID
+
+  if not monit_interface.start(watch):
+    logging.error("Unable to start application server with monit")
+    return BAD_PID
+
+  if not wait_on_app(int(config['app_port'])):
+    logging.error("Application server did not come up in time, "
+      "removing monit watch")
+    monit_interface.stop(watch)
+    return BAD_PID
+
+  finish_app_start(config, watch)
   return 0
 
+def start_apps(configs):
+  """ Starts several application server instances on this machine at once.
+
+  The monit configuration for every instance is written first so that monit
+  only needs to be reloaded once for each application. The instances are
+  then checked for readiness concurrently.
+
+  Args:
+    configs: A JSON string containing a list of configurations. Each one
+      contains the fields described in start_app.
+  Returns:
+    A JSON string containing a list with a result for each configuration, in
+    the same order. Each result contains the app_name and app_port, a
+    success boolean, and ready_time, the number of seconds it took for the
+    instance to respond.
+  """
+  try:
+    configs = json.loads(configs)
+  except (TypeError, ValueError) as error:
+    logging.error('Unable to parse configurations: {}'.format(error))
+    return json.dumps([])
+
+  results = []
+  pending = []
+  for config in configs:
+    result = {'app_name': config.get('app_name'),
+              'app_port': config.get('app_port'),
+              'success': False,
+              'ready_time': None}
+    results.append(result)
+    if not is_config_valid(config):
+      continue
+
+    watch = configure_app_instance(config)
+    if watch is not None:
+      pending.append((config, watch, result))
+
+  start = time.time()
+  for watch in set(watch for _, watch, _ in pending):
+    if not monit_interface.start(watch):
+      logging.error('Unable to start {} with monit'.format(watch))
+      pending = [instance for instance in pending if instance[1] != watch]
+
+  def wait_on_instance(config, watch, result):
+    if not wait_on_app(int(config['app_port'])):
+      logging.error('Application server on port {} did not come up in time, '
+        'removing monit watch'.format(config['app_port']))
+      monit_interface.stop('{}-{}'.format(watch, config['app_port']),
+                           is_group=False)
+      return
+
+    result['ready_time'] = time.time() - start
+    result['success'] = True
+    finish_app_start(config, watch)
+
+  for index in range(0, len(pending), MAX_CONCURRENT_STARTS):
+    threads = [threading.Thread(target=wait_on_instance, args=instance)
+               for instance in pending[index:index + MAX_CONCURRENT_STARTS]]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+  return json.dumps(results)
+
 def setup_logrotate(app_name, watch, log_size):
   """ Creates a logrotate script for the logs that the given application
       will create.
@@ -451,11 +559,10 @@ def wait_on_app(port):
   Returns:
     True on success, False otherwise
   """
-  retries = math.ceil(START_APP_TIMEOUT / BACKOFF_TIME)
   private_ip = appscale_info.get_private_ip()
 
   url = "http://" + private_ip + ":" + str(port) + FETCH_PATH
-  while retries > 0:
+  for backoff in backoff_times():
     try:
       opener = urllib2.build_opener(NoRedirection)
       response = opener.open(url)
@@ -464,14 +571,30 @@ def wait_on_app(port):
           format(url, response.code, response.headers.headers))
       return True
     except IOError:
-      retries -= 1
+      pass
 
-    time.sleep(BACKOFF_TIME)
+    time.sleep(backoff)
 
   logging.error('Application did not come up on {} after {} seconds'.
     format(url, START_APP_TIMEOUT))
   return False
 
+def backoff_times():
+  """ Yields the amount of seconds to wait between checks on an application.
+
+  The wait starts small since most application servers are up within a
+  fraction of a second, and it doubles up to BACKOFF_TIME.
+
+  Yields:
+    Floats that add up to at least START_APP_TIMEOUT.
+  """
+  backoff = INITIAL_BACKOFF_TIME
+  total = 0
+  while total < START_APP_TIMEOUT:
+    yield backoff
+    total += backoff
+    backoff = min(backoff * 2, BACKOFF_TIME)
+
 def create_python_app_env(public_ip, app_name):
   """ Returns the environment variables the python application server uses.
 
@@ -582,8 +705,14 @@ def create_python27_start_cmd(app_name,
     A string of the start command.
   """
   db_location = DATASTORE_PATH
-  cmd = [
-    "/usr/bin/python2",
+  cmd = ["/usr/bin/python2"]
+
+  # The AppServer started by the pool takes this command line as its process
+  # title so that monit and stop_service.py can still find it.
+  if appserver_pool_size > 0:
+    cmd.extend([APPSERVER_POOL_SCRIPT, "run"])
+
+  cmd += [
     constants.APPSCALE_HOME + "/AppServer/dev_appserver.py",
     "--port " + str(port),
     "--admin_port " + str(port + 10000),
@@ -787,17 +916,54 @@ def is_config_valid(config):
   return True
 
 
+def start_appserver_pool(size):
+  """ Starts the process that keeps AppServers waiting for applications.
+
+  Args:
+    size: An integer specifying the number of AppServers to keep waiting.
+  Returns:
+    True on success, False otherwise.
+  """
+  if appserver_pool.setproctitle is None:
+    logging.error('The AppServer pool requires the setproctitle module')
+    return False
+
+  start_cmd = '/usr/bin/python2 {} serve {} {}'.format(
+    APPSERVER_POOL_SCRIPT, appserver_pool.SERVE_IDENTIFIER, size)
+  stop_cmd = '/usr/bin/python2 {}/scripts/stop_service.py {} {}'.format(
+    constants.APPSCALE_HOME, APPSERVER_POOL_SCRIPT,
+    appserver_pool.SERVE_IDENTIFIER)
+  monit_app_configuration.create_config_file(
+    APPSERVER_POOL_WATCH, start_cmd, stop_cmd, [constants.APP_MANAGER_PORT])
+  if not monit_interface.start(APPSERVER_POOL_WATCH):
+    logging.error('Unable to start the AppServer pool')
+    return False
+
+  return True
+
+
 ################################
 # MAIN
 ################################
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--appserver-pool-size', type=int, default=0,
+                      help='The number of AppServers to keep waiting with the '
+                           'SDK already imported')
+  args = parser.parse_args()
+
   file_io.set_logging_format()
   deployment_config = DeploymentConfig(appscale_info.get_zk_locations_string())
 
+  if args.appserver_pool_size > 0 and \
+      start_appserver_pool(args.appserver_pool_size):
+    appserver_pool_size = args.appserver_pool_size
+
   INTERNAL_IP = appscale_info.get_private_ip()
   SERVER = SOAPpy.SOAPServer((INTERNAL_IP, constants.APP_MANAGER_PORT))
 
   SERVER.registerFunction(start_app)
+  SERVER.registerFunction(start_apps)
   SERVER.registerFunction(stop_app)
   SERVER.registerFunction(stop_app_instance)
   SERVER.registerFunction(restart_app_instances_for_app)
@@ -0,0 +1,348 @@
+""" Keeps a pool of AppServer processes with the SDK already imported.
+
+Starting dev_appserver.py from scratch spends most of its time importing the
+SDK and the API stubs. The pool process does those imports once and then
+forks children that wait for an application to run. When monit starts an
+AppServer through this script's 'run' command, the launcher hands its
+arguments, environment, and log file to one of the waiting children, which
+then runs dev_appserver.py as if it had been started directly.
+
+A claimed child forks again so that the AppServer is no longer a descendant
+of the pool, and it takes the launcher's command line as its process title.
+Monit and stop_service.py therefore find the AppServer itself, and its memory
+is counted against the application's limit instead of the pool's. The
+launcher renames itself and stays alive for as long as the AppServer runs.
+When either one exits, the other is stopped too. If the pool is not running,
+the launcher starts dev_appserver.py itself.
+"""
+
+import argparse
+import errno
+import fcntl
+import imp
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+try:
+  from setproctitle import setproctitle
+except ImportError:
+  setproctitle = None
+
+# The Unix socket that the pool's waiting children accept launchers on.
+POOL_SOCKET = '/var/run/appscale/appserver_pool.sock'
+
+# The default number of children to keep waiting for an application.
+DEFAULT_POOL_SIZE = 2
+
+# The amount of seconds to wait for a child to accept a launcher.
+CLAIM_TIMEOUT = 5
+
+# The amount of seconds between checks for exited children.
+REAP_INTERVAL = 1
+
+# The argument that identifies the pool process to stop_service.py. Claimed
+# AppServers and launchers do not include it in their command lines.
+SERVE_IDENTIFIER = '--size'
+
+# The process title a launcher uses once its AppServer has started.
+LAUNCHER_TITLE = 'appserver launcher for {pid}'
+
+# The location of the script that starts an AppServer.
+DEV_APPSERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'AppServer', 'dev_appserver.py')
+
+
+def read_message(connection):
+  """ Reads a newline-terminated JSON message from a socket.
+
+  Args:
+    connection: A connected socket.
+  Returns:
+    The decoded message, or None if the connection closed first.
+  """
+  data = ''
+  while not data.endswith('\n'):
+    chunk = connection.recv(4096)
+    if not chunk:
+      return None
+    data += chunk
+  return json.loads(data)
+
+
+def send_message(connection, message):
+  """ Writes a newline-terminated JSON message to a socket.
+
+  Args:
+    connection: A connected socket.
+    message: A JSON-serializable object.
+  """
+  connection.sendall(json.dumps(message) + '\n')
+
+
+def load_dev_appserver(script):
+  """ Imports dev_appserver.py as a module.
+
+  Args:
+    script: A string containing the location of dev_appserver.py.
+  Returns:
+    The dev_appserver module.
+  """
+  return imp.load_source('dev_appserver', script)
+
+
+def warm_up(dev_appserver):
+  """ Imports the modules that dev_appserver.py needs before serving.
+
+  Args:
+    dev_appserver: The dev_appserver module.
+  """
+  original_path = list(sys.path)
+  sys.path = (dev_appserver._SYS_PATH_ADDITIONS['dev_appserver.py'] +
+              sys.path + dev_appserver.EXTRA_PATHS)
+  if 'google' in sys.modules:
+    del sys.modules['google']
+
+  start = time.time()
+  from google.appengine.tools.devappserver2 import devappserver2
+  logging.info('Imported {} in {:.2f}s'.format(devappserver2.__name__,
+                                                 time.time() - start))
+
+  # dev_appserver sets up its own path when it runs.
+  sys.path = original_path
+
+
+def watch_launcher(connection):
+  """ Kills this process group once the launcher's connection closes.
+
+  Args:
+    connection: The socket connected to the launcher.
+  """
+  try:
+    while connection.recv(4096):
+      pass
+  except socket.error:
+    pass
+  os.killpg(0, signal.SIGKILL)
+
+
+def specialize(dev_appserver, script, request):
+  """ Turns a waiting child into the AppServer that a launcher asked for.
+
+  Args:
+    dev_appserver: The dev_appserver module.
+    script: A string containing the location of dev_appserver.py.
+    request: A dictionary containing the launcher's args, env, cwd, log, and
+      title.
+  """
+  setproctitle(request['title'])
+  if request['log'] is not None:
+    log_fd = os.open(request['log'], os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    os.dup2(log_fd, sys.stdout.fileno())
+    os.dup2(log_fd, sys.stderr.fileno())
+    os.close(log_fd)
+
+  os.environ.clear()
+  os.environ.update(request['env'])
+  os.chdir(request['cwd'])
+  sys.argv = request['args']
+  dev_appserver._run_file(script, {'__name__': '__main__', '__file__': script})
+
+
+def wait_for_launcher(dev_appserver, script, listener, claimed_fd):
+  """ Runs in a waiting child until a launcher claims it.
+
+  Args:
+    dev_appserver: The dev_appserver module.
+    script: A string containing the location of dev_appserver.py.
+    listener: The listening pool socket.
+    claimed_fd: A pipe used to tell the pool that this child was claimed.
+  """
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+  while True:
+    connection, _ = listener.accept()
+    try:
+      request = read_message(connection)
+    except (socket.error, ValueError):
+      request = None
+    if request is not None:
+      break
+    connection.close()
+
+  listener.close()
+
+  # Detach from the pool so that the AppServer is not counted as part of it.
+  # The pool reaps the intermediate child and starts a replacement.
+  if os.fork() != 0:
+    os._exit(0)
+
+  # The AppServer and the runtimes it starts are stopped as a group. The
+  # runtimes must not keep the launcher's connection open.
+  os.setsid()
+  os.write(claimed_fd, 'x')
+  os.close(claimed_fd)
+  flags = fcntl.fcntl(connection.fileno(), fcntl.F_GETFD)
+  fcntl.fcntl(connection.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+  send_message(connection, {'pid': os.getpid()})
+  watcher = threading.Thread(target=watch_launcher, args=(connection,))
+  watcher.daemon = True
+  watcher.start()
+
+  try:
+    specialize(dev_appserver, script, request)
+  finally:
+    os.killpg(0, signal.SIGKILL)
+
+
+def serve(pool_size, socket_path, script):
+  """ Keeps pool_size children waiting for launchers.
+
+  Args:
+    pool_size: An integer specifying the number of children to keep ready.
+    socket_path: A string containing the location of the pool socket.
+    script: A string containing the location of dev_appserver.py.
+  """
+  if setproctitle is None:
+    logging.error('The AppServer pool requires the setproctitle module')
+    sys.exit(1)
+
+  dev_appserver = load_dev_appserver(script)
+  warm_up(dev_appserver)
+
+  try:
+    os.makedirs(os.path.dirname(socket_path))
+  except OSError as error:
+    if error.errno != errno.EEXIST:
+      raise
+
+  try:
+    os.unlink(socket_path)
+  except OSError as error:
+    if error.errno != errno.ENOENT:
+      raise
+
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  listener.bind(socket_path)
+  listener.listen(pool_size)
+  claimed_reader, claimed_writer = os.pipe()
+
+  def fork_child():
+    pid = os.fork()
+    if pid == 0:
+      os.close(claimed_reader)
+      try:
+        wait_for_launcher(dev_appserver, script, listener, claimed_writer)
+      finally:
+        os._exit(1)
+    return pid
+
+  waiting = set(fork_child() for _ in range(pool_size))
+  logging.info('Started {} waiting AppServers'.format(len(waiting)))
+
+  def stop_pool(signum, frame):
+    for pid in waiting:
+      try:
+        os.kill(pid, signal.SIGKILL)
+      except OSError:
+        pass
+    sys.exit(0)
+
+  signal.signal(signal.SIGTERM, stop_pool)
+
+  while True:
+    readable, _, _ = select.select([claimed_reader], [], [], REAP_INTERVAL)
+    if readable:
+      os.read(claimed_reader, 4096)
+
+    # Claimed children exit as soon as they have forked the AppServer.
+    while True:
+      try:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+      except OSError as error:
+        if error.errno != errno.ECHILD:
+          raise
+        break
+      if pid == 0:
+        break
+      waiting.discard(pid)
+
+    while len(waiting) < pool_size:
+      waiting.add(fork_child())
+
+
+def run(args, socket_path):
+  """ Starts an AppServer using a waiting child, or from scratch if the pool
+  is not available.
+
+  Args:
+    args: A list of arguments for dev_appserver.py, starting with the
+      script's location.
+    socket_path: A string containing the location of the pool socket.
+  """
+  if setproctitle is None:
+    os.execv(sys.executable, [sys.executable] + args)
+
+  log = os.readlink('/proc/self/fd/{}'.format(sys.stdout.fileno()))
+  with open('/proc/self/cmdline') as cmdline:
+    title = ' '.join(cmdline.read().rstrip('\0').split('\0'))
+  request = {'args': args,
+             'env': dict(os.environ),
+             'cwd': os.getcwd(),
+             'log': log if log.startswith('/') else None,
+             'title': title}
+
+  connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  connection.settimeout(CLAIM_TIMEOUT)
+  try:
+    connection.connect(socket_path)
+    send_message(connection, request)
+    response = read_message(connection)
+  except (socket.error, ValueError) as error:
+    logging.warning('Unable to use AppServer pool: {}'.format(error))
+    response = None
+
+  if response is None:
+    connection.close()
+    os.execv(sys.executable, [sys.executable] + args)
+
+  logging.info('AppServer started by pool with PID {}'.format(
+    response['pid']))
+  setproctitle(LAUNCHER_TITLE.format(pid=response['pid']))
+  connection.settimeout(None)
+  try:
+    while connection.recv(4096):
+      pass
+  except socket.error:
+    pass
+  sys.exit(1)
+
+
+if __name__ == '__main__':
+  logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                      level=logging.INFO)
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--socket', default=POOL_SOCKET,
+                      help='The location of the pool socket')
+  subparsers = parser.add_subparsers(dest='command')
+  serve_parser = subparsers.add_parser(
+    'serve', help='Keep AppServers waiting for applications')
+  serve_parser.add_argument('--size', type=int, default=DEFAULT_POOL_SIZE,
+                            help='The number of AppServers to keep waiting')
+  serve_parser.add_argument('--script', default=DEV_APPSERVER,
+                            help='The location of dev_appserver.py')
+  run_parser = subparsers.add_parser(
+    'run', help='Start an AppServer with the given arguments')
+  run_parser.add_argument('args', nargs=argparse.REMAINDER,
+                          help='dev_appserver.py and its arguments')
+  options = parser.parse_args()
+
+  if options.command == 'serve':
+    serve(options.size, options.socket, options.script)
+  else:
+    run(options.args, options.socket)
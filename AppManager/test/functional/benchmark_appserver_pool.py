@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+""" Measures how long a Python AppServer takes to respond when it is started
+from scratch and when it is started by the AppServer pool.
+
+This must be run on a machine with the appengine role, and the application
+must already be deployed to /var/apps/<app_id>/app. The pool is started and
+stopped by this script.
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../"))
+import app_manager_server
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../../lib"))
+import appscale_info
+
+# The socket used by the pool that this script starts.
+BENCHMARK_SOCKET = '/tmp/benchmark_appserver_pool.sock'
+
+
+def time_until_ready(start_cmd, env_vars, port):
+  """ Starts an AppServer and waits for it to respond.
+
+  Args:
+    start_cmd: A string containing the command that starts the AppServer.
+    env_vars: A dictionary containing the AppServer's environment.
+    port: An integer specifying the port the AppServer listens on.
+  Returns:
+    The number of seconds it took for the AppServer to respond.
+  """
+  env = dict(os.environ)
+  env.update({key: str(value) for key, value in env_vars.iteritems()})
+  with open(os.devnull, 'w') as devnull:
+    start = time.time()
+    process = subprocess.Popen(shlex.split(start_cmd), env=env,
+                               stdout=devnull, stderr=devnull,
+                               preexec_fn=os.setsid)
+    try:
+      if not app_manager_server.wait_on_app(port):
+        raise Exception('AppServer on port {} did not start'.format(port))
+      return time.time() - start
+    finally:
+      os.killpg(process.pid, 9)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--app', required=True, help='A deployed application ID')
+  parser.add_argument('--port', type=int, default=21000,
+                      help='The port to start AppServers on')
+  parser.add_argument('--runs', type=int, default=5,
+                      help='The number of AppServers to start for each mode')
+  args = parser.parse_args()
+
+  load_balancer_ip = appscale_info.get_login_ip()
+  env_vars = app_manager_server.create_python_app_env(load_balancer_ip,
+                                                      args.app)
+
+  def start_cmd(port):
+    return app_manager_server.create_python27_start_cmd(
+      args.app, load_balancer_ip, port, load_balancer_ip, load_balancer_ip)
+
+  cold = [time_until_ready(start_cmd(args.port + run), env_vars,
+                           args.port + run)
+          for run in range(args.runs)]
+
+  pool = subprocess.Popen(['/usr/bin/python2',
+                           app_manager_server.APPSERVER_POOL_SCRIPT,
+                           '--socket', BENCHMARK_SOCKET, 'serve',
+                           '--size', str(args.runs)])
+  try:
+    while not os.path.exists(BENCHMARK_SOCKET):
+      time.sleep(.1)
+    # Give the pool time to fork its waiting AppServers.
+    time.sleep(1)
+
+    app_manager_server.appserver_pool_size = args.runs
+    warm = []
+    for run in range(args.runs):
+      port = args.port + run
+      cmd = start_cmd(port).replace(
+        ' run ', ' --socket {} run '.format(BENCHMARK_SOCKET), 1)
+      warm.append(time_until_ready(cmd, env_vars, port))
+  finally:
+    pool.terminate()
+
+  print('From scratch: {:.2f}s average, {:.2f}s max'.format(
+    sum(cold) / len(cold), max(cold)))
+  print('From pool: {:.2f}s average, {:.2f}s max'.format(
+    sum(warm) / len(warm), max(warm)))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -168,6 +168,48 @@ class TestAppManager(unittest.TestCase):
     flexmock(subprocess).should_receive('call').and_return(1)
     self.assertEqual(-1, app_manager_server.start_app(configuration))
 
+  def test_start_apps(self):
+    configs = []
+    for port in [2000, 2001, 2002]:
+      configs.append({
+        'app_name': 'test',
+        'app_port': port,
+        'language': 'python27',
+        'load_balancer_ip': '127.0.0.1',
+        'xmpp_ip': '127.0.0.1',
+        'env_vars': {},
+        'max_memory': 500
+      })
+    configs.append({'app_name': 'test'})
+
+    flexmock(appscale_info).should_receive('get_private_ip').\
+      and_return('<private_ip>')
+    flexmock(monit_app_configuration).should_receive('create_config_file').\
+      times(3)
+    flexmock(monit_interface).should_receive('start').with_args('app___test').\
+      and_return(True).once()
+    flexmock(monit_interface).should_receive('stop').\
+      with_args('app___test-2001', is_group=False).once()
+    # Applications start concurrently, so the result depends on the port.
+    flexmock(app_manager_server).should_receive('wait_on_app').\
+      replace_with(lambda port: port != 2001)
+    flexmock(app_manager_server).should_receive('finish_app_start').times(2)
+
+    results = json.loads(app_manager_server.start_apps(json.dumps(configs)))
+    self.assertEqual([2000, 2001, 2002, None],
+                     [result['app_port'] for result in results])
+    self.assertEqual([True, False, True, False],
+                     [result['success'] for result in results])
+    self.assertIsNotNone(results[0]['ready_time'])
+    self.assertIsNone(results[1]['ready_time'])
+
+  def test_backoff_times(self):
+    backoff_times = list(app_manager_server.backoff_times())
+    self.assertEqual(app_manager_server.INITIAL_BACKOFF_TIME, backoff_times[0])
+    self.assertEqual(app_manager_server.BACKOFF_TIME, max(backoff_times))
+    self.assertGreaterEqual(sum(backoff_times),
+                            app_manager_server.START_APP_TIMEOUT)
+
   def test_create_python_app_env(self):
     env_vars = app_manager_server.create_python_app_env('1', '2')
     self.assertEqual('1', env_vars['MY_IP_ADDRESS'])
@@ -239,6 +281,22 @@ class TestAppManager(unittest.TestCase):
       app_id, '20000', '127.0.0.2', max_heap)
     assert app_id in cmd
 
+  def test_create_python27_start_cmd(self):
+    flexmock(appscale_info).should_receive('get_private_ip').\
+      and_return('<private_ip>')
+    cmd = app_manager_server.create_python27_start_cmd(
+      'test', '<login_ip>', 20000, '<lb_ip>', '<xmpp_ip>')
+    self.assertTrue(cmd.startswith('/usr/bin/python2 {}/AppServer/'.
+      format(app_manager_server.constants.APPSCALE_HOME)))
+
+    flexmock(app_manager_server, appserver_pool_size=2)
+    cmd = app_manager_server.create_python27_start_cmd(
+      'test', '<login_ip>', 20000, '<lb_ip>', '<xmpp_ip>')
+    self.assertTrue(cmd.startswith('/usr/bin/python2 {} run {}/AppServer/'.
+      format(app_manager_server.APPSERVER_POOL_SCRIPT,
+             app_manager_server.constants.APPSCALE_HOME)))
+    self.assertIn('dev_appserver.py --port 20000', cmd)
+
   def test_create_java_stop_cmd(self): 
     port = "20000"
     flexmock(appscale_info).should_receive('get_private_ip').\
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+from flexmock import flexmock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../"))
+import appserver_pool
+
+
+class TestAppServerPool(unittest.TestCase):
+  def test_messages(self):
+    sender, receiver = socket.socketpair()
+    message = {'args': ['dev_appserver.py', '--port', '20000'],
+               'env': {'APPNAME': 'test'}}
+    appserver_pool.send_message(sender, message)
+    self.assertEqual(message, appserver_pool.read_message(receiver))
+
+    sender.close()
+    self.assertIsNone(appserver_pool.read_message(receiver))
+
+  def test_run_without_pool(self):
+    args = ['/root/appscale/AppServer/dev_appserver.py', '--port', '20000']
+    flexmock(os).should_receive('readlink').and_return('/var/log/app.log')
+    flexmock(os).should_receive('execv').\
+      with_args(sys.executable, [sys.executable] + args).\
+      and_raise(SystemExit).once()
+    self.assertRaises(SystemExit, appserver_pool.run, args,
+                      '/tmp/missing-appserver-pool.sock')
+
+  def test_claimed_appserver_is_detached(self):
+    temp_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(temp_dir, 'pool.sock')
+    output = os.path.join(temp_dir, 'appserver.json')
+    pool_cmd = '/usr/bin/python2 {} serve {} 1'.format(
+      appserver_pool.__file__, appserver_pool.SERVE_IDENTIFIER)
+    app_cmd = '/usr/bin/python2 {} run /root/appscale/AppServer/' \
+              'dev_appserver.py --port 20000'.format(appserver_pool.__file__)
+
+    # The pool runs dev_appserver.py with the title the launcher gives it.
+    titles = []
+    def run_file(script, script_globals):
+      with open(os.environ['OUTPUT'], 'w') as output_file:
+        json.dump({'pid': os.getpid(), 'title': titles[-1]}, output_file)
+      time.sleep(30)
+    fake_dev_appserver = flexmock(_run_file=run_file)
+
+    pool_pid = os.fork()
+    if pool_pid == 0:
+      try:
+        # The pool runs in its own process group, so it does not need to be
+        # restored afterwards, and its children can be cleaned up with it.
+        os.setpgid(0, 0)
+        appserver_pool.setproctitle = titles.append
+        appserver_pool.load_dev_appserver = lambda script: fake_dev_appserver
+        appserver_pool.warm_up = lambda dev_appserver: None
+        appserver_pool.serve(1, socket_path, 'dev_appserver.py')
+      finally:
+        os._exit(0)
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      for _ in range(50):
+        try:
+          connection.connect(socket_path)
+          break
+        except socket.error:
+          time.sleep(.1)
+      appserver_pool.send_message(connection, {
+        'args': ['dev_appserver.py'], 'env': {'OUTPUT': output},
+        'cwd': temp_dir, 'log': None, 'title': app_cmd})
+      pid = appserver_pool.read_message(connection)['pid']
+      for _ in range(50):
+        if os.path.exists(output) and os.path.getsize(output):
+          break
+        time.sleep(.1)
+      with open(output) as output_file:
+        appserver = json.load(output_file)
+      self.assertEqual(pid, appserver['pid'])
+
+      # The AppServer leaves the pool's process tree once the intermediate
+      # child has exited.
+      for _ in range(50):
+        ancestors = []
+        parent = pid
+        while parent > 1:
+          with open('/proc/{}/stat'.format(parent)) as stat:
+            parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+          ancestors.append(parent)
+        if pool_pid not in ancestors:
+          break
+        time.sleep(.1)
+      self.assertNotIn(pool_pid, ancestors)
+
+      # Monit and stop_service.py match the AppServer as the application
+      # rather than as the pool.
+      self.assertEqual(app_cmd, appserver['title'])
+      self.assertIsNone(re.search(pool_cmd, appserver['title']))
+      self.assertNotIn(appserver_pool.SERVE_IDENTIFIER, appserver['title'])
+    finally:
+      connection.close()
+      os.killpg(pool_pid, signal.SIGKILL)
+      os.waitpid(pool_pid, 0)
+      shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -105,6 +105,8 @@ class InternalCursor():
     # Lets us know how many results we've seen so far. When
     # this hits the count we know we're done.
     self.__offset = offset
+    # Held while a batch is fetched, since that updates the query and offset.
+    self.__lock = threading.Lock()
 
   def get_query(self):
     return self.__query
@@ -121,6 +123,9 @@ class InternalCursor():
   def get_timestamp(self):
     return self.__creation
 
+  def get_lock(self):
+    return self.__lock
+
   def set_last_cursor(self, last_cursor):
     self.__last_cursor = last_cursor
 
@@ -131,6 +136,10 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
   """ A central server hooks up to a db and communicates via protocol 
       buffers.
 
+  Calls from different threads can be made concurrently. The cursors,
+  transaction actions, and index cache shared between calls are guarded by
+  their own locks, and each call to the datastore server uses its own
+  connection.
   """
 
   _PROPERTY_TYPE_TAGS = {
@@ -179,7 +188,6 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
     """
     super(DatastoreDistributed, self).__init__(service_name)
 
-    # TODO lock any use of these global variables
     assert isinstance(app_id, basestring) and app_id != ''
     self.__app_id = app_id
     self.__datastore_location = datastore_location
@@ -193,8 +201,10 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
     self.SetTrusted(trusted)
 
     self.__queries = {}
+    self.__queries_lock = threading.Lock()
 
     self.__tx_actions = {}
+    self.__tx_actions_lock = threading.Lock()
 
     self.__cursor_id = 1
     self.__cursor_lock = threading.Lock()
@@ -202,6 +212,7 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
     self.__require_indexes = require_indexes
     self.__root_path = root_path + self.__app_id + "/app"
     self.__cached_yaml = (None, None, None)
+    self.__index_lock = threading.Lock()
     if require_indexes:
       self._SetupIndexes()
 
@@ -465,7 +476,8 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
       cursor = query_result.mutable_cursor()
       cursor.set_app(self.__app_id)
       cursor.set_cursor(cursor_id)
-      self.__queries[cursor_id] = new_cursor
+      with self.__queries_lock:
+        self.__queries[cursor_id] = new_cursor
 
     if query.compile():
       compiled_query = query_result.mutable_compiled_query()
@@ -477,12 +489,43 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
     self.__ValidateAppId(next_request.cursor().app())
 
     cursor_handle = next_request.cursor().cursor()
-    if cursor_handle not in self.__queries:
+    with self.__queries_lock:
+      internal_cursor = self.__queries.get(cursor_handle)
+    if internal_cursor is None:
       raise apiproxy_errors.ApplicationError(
             datastore_pb.Error.BAD_REQUEST, 
             'Cursor %d not found' % cursor_handle)
- 
-    internal_cursor = self.__queries.get(cursor_handle)
+
+    with internal_cursor.get_lock():
+      # Another call may have used up the cursor while this one waited.
+      with self.__queries_lock:
+        if cursor_handle not in self.__queries:
+          raise apiproxy_errors.ApplicationError(
+                datastore_pb.Error.BAD_REQUEST,
+                'Cursor %d not found' % cursor_handle)
+      self.__FetchNextBatch(cursor_handle, internal_cursor, next_request,
+                            query_result)
+
+  def __DeleteCursor(self, cursor_handle):
+    """ Stops tracking a cursor.
+
+    Args:
+      cursor_handle: An int, the cursor identifier.
+    """
+    with self.__queries_lock:
+      self.__queries.pop(cursor_handle, None)
+
+  def __FetchNextBatch(self, cursor_handle, internal_cursor, next_request,
+                       query_result):
+    """ Fetches the next batch of results for a cursor. The caller must hold
+    the cursor's lock.
+
+    Args:
+      cursor_handle: An int, the cursor identifier.
+      internal_cursor: The InternalCursor for the query.
+      next_request: A datastore_pb.NextRequest.
+      query_result: A datastore_pb.QueryResult to fill in.
+    """
     last_cursor = internal_cursor.get_last_cursor()
     query = internal_cursor.get_query()
 
@@ -492,7 +535,7 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
         compiled_query = query_result.mutable_compiled_query()
         compiled_query.set_keys_only(query.keys_only())
         compiled_query.mutable_primaryscan().set_index_name(query.Encode())
-      del self.__queries[cursor_handle]
+      self.__DeleteCursor(cursor_handle)
       return
 
     if internal_cursor.get_offset() >= internal_cursor.get_count():
@@ -502,7 +545,7 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
         compiled_query = query_result.mutable_compiled_query()
         compiled_query.set_keys_only(query.keys_only())
         compiled_query.mutable_primaryscan().set_index_name(query.Encode())
-      del self.__queries[cursor_handle]
+      self.__DeleteCursor(cursor_handle)
       return
  
     count = _BATCH_SIZE
@@ -543,7 +586,7 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
       compiled_query.mutable_primaryscan().set_index_name(query.Encode())
    
     if not query_result.more_results():
-      del self.__queries[cursor_handle]
+      self.__DeleteCursor(cursor_handle)
     else:
       cursor = query_result.mutable_cursor()                                    
       cursor.set_app(self.__app_id)                                                  
@@ -560,7 +603,8 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
     """Send a begin transaction request from the datastore server. """
     request.set_app(self.__app_id)
     self._RemoteSend(request, transaction, "BeginTransaction")
-    self.__tx_actions[transaction.handle()] = []
+    with self.__tx_actions_lock:
+      self.__tx_actions[transaction.handle()] = []
     return transaction
 
   def _Dynamic_AddActions(self, request, _):
@@ -571,13 +615,6 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
           tasks that should be created when the transaction is comitted.
     """
     transaction = request.add_request_list()[0].transaction()
-    txn_actions = self.__tx_actions[transaction.handle()]
-    if ((len(txn_actions) + request.add_request_size()) >
-        _MAX_ACTIONS_PER_TXN):
-      raise apiproxy_errors.ApplicationError(
-          datastore_pb.Error.BAD_REQUEST,
-          'Too many messages, maximum allowed %s' % _MAX_ACTIONS_PER_TXN)
-
     new_actions = []
     for add_request in request.add_request_list():
       clone = taskqueue_service_pb.TaskQueueAddRequest()
@@ -585,7 +622,14 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
       clone.clear_transaction()
       new_actions.append(clone)
 
-    txn_actions.extend(new_actions)
+    with self.__tx_actions_lock:
+      txn_actions = self.__tx_actions[transaction.handle()]
+      if ((len(txn_actions) + request.add_request_size()) >
+          _MAX_ACTIONS_PER_TXN):
+        raise apiproxy_errors.ApplicationError(
+            datastore_pb.Error.BAD_REQUEST,
+            'Too many messages, maximum allowed %s' % _MAX_ACTIONS_PER_TXN)
+      txn_actions.extend(new_actions)
 
 
   def _Dynamic_Commit(self, transaction, transaction_response):
@@ -595,30 +639,24 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
 
     self._RemoteSend(transaction, transaction_response, "Commit")
 
-    response = taskqueue_service_pb.TaskQueueAddResponse()
-    try:
-      for action in self.__tx_actions[transaction.handle()]:
-        try:
-          apiproxy_stub_map.MakeSyncCall(
-              'taskqueue', 'Add', action, response)
-        except apiproxy_errors.ApplicationError, e:
-          logging.warning('Transactional task %s has been dropped, %s',
-                          action, e)
+    with self.__tx_actions_lock:
+      actions = self.__tx_actions.pop(transaction.handle(), [])
 
-    finally:
+    response = taskqueue_service_pb.TaskQueueAddResponse()
+    for action in actions:
       try:
-        del self.__tx_actions[transaction.handle()]
-      except KeyError:
-        pass
+        apiproxy_stub_map.MakeSyncCall(
+            'taskqueue', 'Add', action, response)
+      except apiproxy_errors.ApplicationError, e:
+        logging.warning('Transactional task %s has been dropped, %s',
+                        action, e)
    
   def _Dynamic_Rollback(self, transaction, transaction_response):
     """ Send a rollback request to the datastore server. """
     transaction.set_app(self.__app_id)
 
-    try:
-      del self.__tx_actions[transaction.handle()]
-    except KeyError:
-      pass
+    with self.__tx_actions_lock:
+      self.__tx_actions.pop(transaction.handle(), None)
 
     self._RemoteSend(transaction, transaction_response, "Rollback")
  
@@ -688,89 +726,94 @@ class DatastoreDistributed(apiproxy_stub.APIProxyStub):
     Args:
       _open: Function used to open a file.
     """
-    if not self.__root_path:
-      logging.warning("No index.yaml was loaded.")
-      return
-    index_yaml_file = os.path.join(self.__root_path, 'index.yaml')
-    if (self.__cached_yaml[0] == index_yaml_file and
-        os.path.exists(index_yaml_file) and
-        os.path.getmtime(index_yaml_file) == self.__cached_yaml[1]):
-      requested_indexes = self.__cached_yaml[2]
-    else:
-      try:
-        index_yaml_mtime = os.path.getmtime(index_yaml_file)
-        fh = _open(index_yaml_file, 'r')
-      except (OSError, IOError):
-        logging.info("Error reading file")
-        index_yaml_data = None
+    with self.__index_lock:
+      if not self.__root_path:
+        logging.warning("No index.yaml was loaded.")
+        return
+      index_yaml_file = os.path.join(self.__root_path, 'index.yaml')
+      if (self.__cached_yaml[0] == index_yaml_file and
+          os.path.exists(index_yaml_file) and
+          os.path.getmtime(index_yaml_file) == self.__cached_yaml[1]):
+        requested_indexes = self.__cached_yaml[2]
       else:
         try:
-          index_yaml_data = fh.read()
-        finally:
-          fh.close()
-      requested_indexes = []
-      if index_yaml_data is not None:
-        index_defs = datastore_index.ParseIndexDefinitions(index_yaml_data)
-        if index_defs is not None and index_defs.indexes is not None:
-          requested_indexes = datastore_index.IndexDefinitionsToProtos(
-              self.__app_id,
-              index_defs.indexes)
-          self.__cached_yaml = (index_yaml_file, index_yaml_mtime,
-                               requested_indexes)
+          index_yaml_mtime = os.path.getmtime(index_yaml_file)
+          fh = _open(index_yaml_file, 'r')
+        except (OSError, IOError):
+          logging.info("Error reading file")
+          index_yaml_data = None
+        else:
+          try:
+            index_yaml_data = fh.read()
+          finally:
+            fh.close()
+        requested_indexes = []
+        if index_yaml_data is not None:
+          index_defs = datastore_index.ParseIndexDefinitions(index_yaml_data)
+          if index_defs is not None and index_defs.indexes is not None:
+            requested_indexes = datastore_index.IndexDefinitionsToProtos(
+                self.__app_id,
+                index_defs.indexes)
+            self.__cached_yaml = (index_yaml_file, index_yaml_mtime,
+                                 requested_indexes)
      
-    existing_indexes = datastore_pb.CompositeIndices()
-    app_str = api_base_pb.StringProto()
-    app_str.set_value(self.__app_id)
-    self._Dynamic_GetIndices(app_str, existing_indexes)
-
-    requested = dict((x.definition().Encode(), x) for x in requested_indexes)
-    existing = dict((x.definition().Encode(), x) for x in 
-      existing_indexes.index_list())
-
-    # Delete any indexes that are no longer requested.
-    deleted = 0
-    for key, index in existing.iteritems():
-      if key not in requested:
-        self._Dynamic_DeleteIndex(index, api_base_pb.VoidProto())
-        deleted += 1
-
-    # Add existing indexes in the index cache.
-    for key, index in existing.iteritems():
-      new_index = entity_pb.CompositeIndex()
-      new_index.CopyFrom(index)
-      ent_kind = new_index.definition().entity_type()
-      if ent_kind in self.__index_cache:
-        new_indexes = self.__index_cache[ent_kind]
-        new_indexes.append(new_index)
-        self.__index_cache[ent_kind] = new_indexes
-      else:
-        self.__index_cache[ent_kind] = [new_index]
-  
-    # Compared the existing indexes to the requested ones and create any
-    # new indexes requested.
-    created = 0
-    for key, index in requested.iteritems():
-      if key not in existing:
+      existing_indexes = datastore_pb.CompositeIndices()
+      app_str = api_base_pb.StringProto()
+      app_str.set_value(self.__app_id)
+      self._Dynamic_GetIndices(app_str, existing_indexes)
+
+      requested = dict((x.definition().Encode(), x) for x in requested_indexes)
+      existing = dict((x.definition().Encode(), x) for x in 
+        existing_indexes.index_list())
+
+      # Delete any indexes that are no longer requested.
+      deleted = 0
+      for key, index in existing.iteritems():
+        if key not in requested:
+          self._Dynamic_DeleteIndex(index, api_base_pb.VoidProto())
+          deleted += 1
+
+      # Add existing indexes in the index cache.
+      index_cache = {}
+      for key, index in existing.iteritems():
         new_index = entity_pb.CompositeIndex()
         new_index.CopyFrom(index)
-        new_index.set_id(self._Dynamic_CreateIndex(new_index, 
-          api_base_pb.Integer64Proto()).value())
-        new_index.set_state(entity_pb.CompositeIndex.READ_WRITE)
-        self._Dynamic_UpdateIndex(new_index, api_base_pb.VoidProto())
-        created += 1
-  
         ent_kind = new_index.definition().entity_type()
-        if ent_kind in self.__index_cache:
-          new_indexes = self.__index_cache[ent_kind]
-     
+        if ent_kind in index_cache:
+          new_indexes = index_cache[ent_kind]
           new_indexes.append(new_index)
-          self.__index_cache[ent_kind] = new_indexes
+          index_cache[ent_kind] = new_indexes
         else:
-          self.__index_cache[ent_kind] = [new_index]
+          index_cache[ent_kind] = [new_index]
+  
+      # Compared the existing indexes to the requested ones and create any
+      # new indexes requested.
+      created = 0
+      for key, index in requested.iteritems():
+        if key not in existing:
+          new_index = entity_pb.CompositeIndex()
+          new_index.CopyFrom(index)
+          new_index.set_id(self._Dynamic_CreateIndex(new_index, 
+            api_base_pb.Integer64Proto()).value())
+          new_index.set_state(entity_pb.CompositeIndex.READ_WRITE)
+          self._Dynamic_UpdateIndex(new_index, api_base_pb.VoidProto())
+          created += 1
+  
+          ent_kind = new_index.definition().entity_type()
+          if ent_kind in index_cache:
+            new_indexes = index_cache[ent_kind]
+     
+            new_indexes.append(new_index)
+            index_cache[ent_kind] = new_indexes
+          else:
+            index_cache[ent_kind] = [new_index]
+
+      # Calls in other threads keep using the old cache until it is replaced.
+      self.__index_cache = index_cache
 
-    if created or deleted:
-      logging.info('Created %d and deleted %d index(es); total %d',
-                    created, deleted, len(requested))
+      if created or deleted:
+        logging.info('Created %d and deleted %d index(es); total %d',
+                      created, deleted, len(requested))
 
 def _FindIndexToUse(query, indexes):
   """ Matches the query with one of the composite indexes. 
@@ -30,9 +30,12 @@ programmatically access their request and application logs.
 
 
 
+import atexit
 import base64
+import collections
 import cStringIO
 import httplib
+import logging
 import os
 import re
 import sys
@@ -92,27 +95,211 @@ LOGIN_IP_FILENAME = "/etc/appscale/login_ip"
 # The file that the AppController writes this machine's public IP address to.
 MY_PUBLIC_IP_FILENAME = "/etc/appscale/my_public_ip"
 
-class SendLogsThread(threading.Thread):
-  """ Sends logs to the AppScale Dashboard in a thread. """
+# The port that the AppScale Dashboard accepts log uploads on.
+LOG_UPLOAD_PORT = 1443
 
-  def __init__(self, payload, nginx_host):
+# The maximum number of log lines held in memory waiting to be shipped. Once
+# this is reached the oldest lines are dropped.
+SHIPPER_MAX_QUEUED_LINES = 10000
+
+# The maximum number of log lines sent to the dashboard in one request.
+SHIPPER_BATCH_LINES = 1000
+
+# The number of seconds the shipper waits for a full batch before sending
+# whatever lines it has.
+SHIPPER_BATCH_SECONDS = 1.0
+
+# The number of seconds to wait for queued lines to be shipped at exit.
+SHIPPER_EXIT_TIMEOUT = 5
+
+
+class LogShipper(object):
+  """ Sends logs to the AppScale Dashboard from a single background thread.
+
+  Log lines from every flush are queued in memory and coalesced into batches
+  that are posted over one persistent HTTPS connection.
+  """
+
+  def __init__(self, nginx_host, max_queued_lines=SHIPPER_MAX_QUEUED_LINES,
+               batch_lines=SHIPPER_BATCH_LINES,
+               batch_seconds=SHIPPER_BATCH_SECONDS):
     """ Constructor.
 
     Args:
-      payload: The json payload to send to the dashboard.
       nginx_host: The NGINX host to send the logs to.
+      max_queued_lines: The maximum number of lines to hold in memory.
+      batch_lines: The maximum number of lines to send in one request.
+      batch_seconds: How long to wait for a full batch before sending.
+    """
+    self.nginx_host = nginx_host
+    self.max_queued_lines = max_queued_lines
+    self.batch_lines = batch_lines
+    self.batch_seconds = batch_seconds
+
+    # The number of lines that were accepted by the dashboard.
+    self.shipped_lines = 0
+
+    # The number of lines that were discarded because the queue was full or
+    # the dashboard could not be reached.
+    self.dropped_lines = 0
+
+    self._queue = collections.deque()
+    self._condition = threading.Condition()
+    self._connection = None
+    self._stopping = False
+    self._thread = None
+
+  def enqueue(self, service_name, host, logs):
+    """ Queues log lines to be shipped, dropping the oldest lines if the queue
+    is full.
+
+    Args:
+      service_name: The application ID the logs belong to.
+      host: The IP address of the machine the logs were written on.
+      logs: A list of dictionaries with 'timestamp', 'level' and 'message'.
+    """
+    with self._condition:
+      was_empty = not self._queue
+      source = (service_name, host)
+      for log in logs:
+        self._queue.append((source, log))
+
+      overflow = len(self._queue) - self.max_queued_lines
+      for _ in xrange(overflow):
+        self._queue.popleft()
+      if overflow > 0:
+        self.dropped_lines += overflow
+
+      if self._thread is None or not self._thread.is_alive():
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+      if was_empty or len(self._queue) >= self.batch_lines:
+        self._condition.notify()
+
+  def stats(self):
+    """ Returns counters describing the shipper's activity.
+
+    Returns:
+      A dictionary containing the number of lines shipped, dropped and
+      currently queued.
+    """
+    with self._condition:
+      return {'shipped_lines': self.shipped_lines,
+              'dropped_lines': self.dropped_lines,
+              'queued_lines': len(self._queue)}
+
+  def stop(self, timeout=SHIPPER_EXIT_TIMEOUT):
+    """ Ships any queued lines and stops the background thread.
+
+    Args:
+      timeout: The number of seconds to wait for queued lines to be shipped.
+    """
+    with self._condition:
+      self._stopping = True
+      self._condition.notify()
+      thread = self._thread
+    if thread is not None:
+      thread.join(timeout)
+
+  def _next_batch(self):
+    """ Waits for a batch of log lines to ship.
+
+    Returns:
+      A list of ((service_name, host), log) tuples, or None if the shipper has
+      been stopped and there is nothing left to ship.
+    """
+    with self._condition:
+      while not self._queue and not self._stopping:
+        self._condition.wait()
+
+      deadline = time.time() + self.batch_seconds
+      while len(self._queue) < self.batch_lines and not self._stopping:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        self._condition.wait(remaining)
+
+      if not self._queue:
+        return None
+
+      return [self._queue.popleft()
+              for _ in xrange(min(self.batch_lines, len(self._queue)))]
+
+  def _run(self):
+    """ Start function for the background thread. """
+    while True:
+      batch = self._next_batch()
+      if batch is None:
+        return
+
+      groups = collections.OrderedDict()
+      for source, log in batch:
+        groups.setdefault(source, []).append(log)
+
+      for (service_name, host), logs in groups.iteritems():
+        try:
+          payload = json.dumps({
+            'service_name' : service_name,
+            'host' : host,
+            'logs' : logs
+          })
+          shipped = self._post(payload)
+        except Exception:
+          # Keep shipping later batches, since this is the only thread.
+          logging.exception('Unable to ship logs')
+          shipped = False
+
+        with self._condition:
+          if shipped:
+            self.shipped_lines += len(logs)
+          else:
+            self.dropped_lines += len(logs)
+
+  def _post(self, payload):
+    """ Posts a payload to the dashboard, reconnecting once if the persistent
+    connection has been closed.
+
+    Args:
+      payload: The json payload to send to the dashboard.
+    Returns:
+      A boolean indicating whether the dashboard accepted the payload.
     """
-    self.__payload = payload
-    self.__response = None
-    self.__nginx_host = nginx_host
-    threading.Thread.__init__(self)
-
-  def run(self):
-    """ Start function for thread. Posts the payload to the dashboard. """
-    conn = httplib.HTTPSConnection(self.__nginx_host + ":1443")
     headers = {'Content-Type' : 'application/json'}
-    conn.request('POST', '/logs/upload', self.__payload, headers)
-    self.__response = conn.getresponse()
+    for attempt in range(2):
+      if self._connection is None:
+        self._connection = httplib.HTTPSConnection(
+          '{0}:{1}'.format(self.nginx_host, LOG_UPLOAD_PORT))
+      try:
+        self._connection.request('POST', '/logs/upload', payload, headers)
+        response = self._connection.getresponse()
+        response.read()
+        if response.getheader('connection', '').lower() == 'close':
+          self._connection.close()
+          self._connection = None
+        return response.status == httplib.OK
+      except (httplib.HTTPException, IOError) as error:
+        self._connection.close()
+        self._connection = None
+        if attempt > 0:
+          logging.debug('Unable to ship logs: {0}'.format(error))
+    return False
+
+
+_log_shipper = None
+_log_shipper_lock = threading.Lock()
+
+
+def log_shipper():
+  """ Returns the LogShipper used by this process, creating it if necessary. """
+  global _log_shipper
+  with _log_shipper_lock:
+    if _log_shipper is None:
+      _log_shipper = LogShipper(os.environ['NGINX_HOST'])
+      atexit.register(_log_shipper.stop)
+    return _log_shipper
+
 
 class Error(Exception):
   """Base error class for this module."""
@@ -319,13 +506,7 @@ class LogsBuffer(object):
     if not formatted_logs:
       return
  
-    payload = json.dumps({
-      'service_name' : appid,
-      'host' : os.environ['MY_IP_ADDRESS'],
-      'logs' : formatted_logs
-    })
-
-    SendLogsThread(payload, os.environ["NGINX_HOST"]).start()
+    log_shipper().enqueue(appid, os.environ['MY_IP_ADDRESS'], formatted_logs)
     self._clear()
 
     # AppScale: This currently causes problems when we try to call API requests
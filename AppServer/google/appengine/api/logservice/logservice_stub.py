@@ -415,15 +415,8 @@ class LogServiceStub(apiproxy_stub.APIProxyStub):
     if not formatted_logs:
       return
 
-    payload = json.dumps({
-      'service_name' : appid,
-      'host' : os.environ['MY_IP_ADDRESS'],
-      'logs' : formatted_logs
-    })
-
-    nginx_host = os.environ['NGINX_HOST']
-
-    logservice.SendLogsThread(payload, nginx_host).start()
+    logservice.log_shipper().enqueue(appid, os.environ['MY_IP_ADDRESS'],
+                                     formatted_logs)
 
     # AppScale: The following appear to cause a memory leak under high load.
     # Investigate this once we wish to support the Logs API.
@@ -0,0 +1,119 @@
+import httplib
+import json
+import os
+import sys
+import unittest
+from flexmock import flexmock
+
+logservice_path = "{0}/../../../../..".format(os.path.dirname(__file__))
+sys.path.append(logservice_path)
+from google.appengine.api.logservice import logservice
+
+
+class FakeResponse():
+  def __init__(self, status=httplib.OK):
+    self.status = status
+  def read(self):
+    return ''
+  def getheader(self, name, default=None):
+    return default
+
+
+class TestLogShipper(unittest.TestCase):
+
+  def setUp(self):
+    self.logs = [{'timestamp': 1, 'level': 2, 'message': 'line {0}'.format(i)}
+                 for i in range(5)]
+
+  def test_enqueue_drops_oldest_lines(self):
+    shipper = logservice.LogShipper('host', max_queued_lines=3)
+    flexmock(shipper).should_receive('_post').and_return(True)
+    shipper.enqueue('app', 'ip', self.logs)
+    stats = shipper.stats()
+    self.assertEquals(2, stats['dropped_lines'])
+    self.assertEquals(['line 2', 'line 3', 'line 4'],
+                      [log['message'] for _, log in shipper._queue])
+    shipper.stop()
+
+  def test_batches_are_coalesced(self):
+    shipper = logservice.LogShipper('host', batch_lines=100,
+                                    batch_seconds=60)
+    payloads = []
+    def post(payload):
+      payloads.append(json.loads(payload))
+      return True
+    flexmock(shipper).should_receive('_post').replace_with(post)
+
+    shipper.enqueue('app', 'ip', self.logs[:2])
+    shipper.enqueue('app', 'ip', self.logs[2:])
+    shipper.enqueue('app', 'other-ip', self.logs[:1])
+    shipper.stop()
+
+    self.assertEquals(2, len(payloads))
+    self.assertEquals('ip', payloads[0]['host'])
+    self.assertEquals(5, len(payloads[0]['logs']))
+    self.assertEquals('other-ip', payloads[1]['host'])
+    self.assertEquals({'shipped_lines': 6, 'dropped_lines': 0,
+                       'queued_lines': 0}, shipper.stats())
+
+  def test_failed_batches_are_counted_as_dropped(self):
+    shipper = logservice.LogShipper('host', batch_seconds=0)
+    flexmock(shipper).should_receive('_post').and_return(False)
+    shipper.enqueue('app', 'ip', self.logs)
+    shipper.stop()
+    self.assertEquals(5, shipper.stats()['dropped_lines'])
+    self.assertEquals(0, shipper.stats()['shipped_lines'])
+
+  def test_invalid_lines_are_dropped(self):
+    shipper = logservice.LogShipper('host', batch_seconds=0)
+    payloads = []
+    def post(payload):
+      payloads.append(json.loads(payload))
+      return True
+    flexmock(shipper).should_receive('_post').replace_with(post)
+    flexmock(logservice.logging).should_receive('exception')
+
+    invalid = [{'timestamp': 1, 'level': 2, 'message': 'bad \xff line'}]
+    shipper.enqueue('app', 'bad-ip', invalid)
+    shipper.enqueue('app', 'ip', self.logs)
+    shipper.stop()
+
+    self.assertEquals(['ip'], [payload['host'] for payload in payloads])
+    self.assertEquals({'shipped_lines': 5, 'dropped_lines': 1,
+                       'queued_lines': 0}, shipper.stats())
+
+  def test_enqueue_restarts_thread(self):
+    shipper = logservice.LogShipper('host', batch_seconds=0)
+    flexmock(shipper).should_receive('_post').and_return(True)
+    shipper._thread = flexmock(is_alive=lambda: False)
+    shipper.enqueue('app', 'ip', self.logs)
+    shipper.stop()
+    self.assertEquals(5, shipper.stats()['shipped_lines'])
+
+  def test_post_reuses_connection(self):
+    connection = flexmock(name='connection')
+    connection.should_receive('request').times(2)
+    connection.should_receive('getresponse').and_return(FakeResponse())
+    flexmock(httplib).should_receive('HTTPSConnection').with_args('host:1443')\
+      .and_return(connection).once()
+
+    shipper = logservice.LogShipper('host')
+    self.assertTrue(shipper._post('{}'))
+    self.assertTrue(shipper._post('{}'))
+
+  def test_post_reconnects_after_failure(self):
+    broken = flexmock(name='broken')
+    broken.should_receive('request').and_raise(httplib.BadStatusLine(''))
+    broken.should_receive('close').once()
+    working = flexmock(name='working')
+    working.should_receive('request').once()
+    working.should_receive('getresponse').and_return(FakeResponse())
+    flexmock(httplib).should_receive('HTTPSConnection')\
+      .and_return(broken).and_return(working)
+
+    shipper = logservice.LogShipper('host')
+    self.assertTrue(shipper._post('{}'))
+
+
+if __name__ == "__main__":
+  unittest.main()
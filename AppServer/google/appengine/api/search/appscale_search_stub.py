@@ -43,6 +43,10 @@ class SearchServiceStub(apiproxy_stub.APIProxyStub):
   This stub provides the search_service_pb.SearchService. But this is
   NOT a subclass of SearchService itself.  Services are provided by
   the methods prefixed by "_Dynamic_".
+
+  Calls from different threads can be made concurrently. The stub keeps no
+  state between calls, and each call to the search server uses its own
+  connection.
   """
 
   _VERSION = 1
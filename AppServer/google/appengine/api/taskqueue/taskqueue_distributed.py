@@ -83,6 +83,10 @@ class TaskQueueServiceStub(apiproxy_stub.APIProxyStub):
 
   This stub executes tasks when enabled by using the dev_appserver's AddEvent
   capability. 
+
+  Calls from different threads can be made concurrently. The stub keeps no
+  state between calls, and each call to the TaskQueue server uses its own
+  connection.
   """
   def __init__(self, app_id, host, port, service_name='taskqueue'):
     """Constructor.
@@ -0,0 +1,298 @@
+import BaseHTTPServer
+import os
+import SocketServer
+import sys
+import threading
+import time
+import unittest
+
+appserver_path = "{0}/../../../..".format(os.path.dirname(__file__))
+sys.path.append(appserver_path)
+sys.path.append(os.path.join(appserver_path, 'lib', 'cherrypy'))
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import api_base_pb
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore
+from google.appengine.api import datastore_distributed
+from google.appengine.api.taskqueue import taskqueue_service_pb
+from google.appengine.datastore import datastore_pb
+from google.appengine.ext.remote_api import remote_api_pb
+from google.appengine.runtime import apiproxy_errors
+from google.appengine.tools.devappserver2 import api_server
+
+APP_ID = 'guestbook'
+
+# The time the fake datastore server takes to handle each request.
+LATENCY = .05
+
+# The number of results the fake datastore server returns when a query does
+# not specify a count.
+DEFAULT_BATCH_SIZE = 5
+
+
+class FakeDatastore(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """ A datastore server that keeps entities in memory and handles each
+  request in its own thread. """
+  daemon_threads = True
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0),
+                                       FakeDatastoreHandler)
+    self.lock = threading.Lock()
+    self.entities = {}
+    self.next_transaction = 1
+
+  def put(self, request, response):
+    with self.lock:
+      for entity in request.entity_list():
+        self.entities[entity.key().Encode()] = entity
+        response.add_key().CopyFrom(entity.key())
+
+  def get(self, request, response):
+    with self.lock:
+      for key in request.key_list():
+        group = response.add_entity()
+        if key.Encode() in self.entities:
+          group.mutable_entity().CopyFrom(self.entities[key.Encode()])
+
+  def run_query(self, query, result):
+    with self.lock:
+      matches = [entity for entity in self.entities.itervalues()
+                 if entity.key().path().element_list()[-1].type() ==
+                 query.kind()]
+    matches.sort(key=lambda entity:
+                 entity.key().path().element_list()[-1].name())
+
+    start = query.offset()
+    if query.has_compiled_cursor():
+      start = int(query.compiled_cursor().position(0).start_key())
+    end = start + (query.count() if query.has_count() else
+                   DEFAULT_BATCH_SIZE)
+    for entity in matches[start:end]:
+      result.add_result().CopyFrom(entity)
+    result.set_more_results(end < len(matches))
+    result.mutable_compiled_cursor().add_position().set_start_key(str(end))
+
+  def begin_transaction(self, request, transaction):
+    with self.lock:
+      transaction.set_handle(self.next_transaction)
+      self.next_transaction += 1
+    transaction.set_app(request.app())
+
+  METHODS = {
+    'Put': (datastore_pb.PutRequest, datastore_pb.PutResponse, put),
+    'Get': (datastore_pb.GetRequest, datastore_pb.GetResponse, get),
+    'RunQuery': (datastore_pb.Query, datastore_pb.QueryResult, run_query),
+    'BeginTransaction': (datastore_pb.BeginTransactionRequest,
+                         datastore_pb.Transaction, begin_transaction),
+  }
+
+
+class FakeDatastoreHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_POST(self):
+    api_request = remote_api_pb.Request()
+    api_request.ParseFromString(
+      self.rfile.read(int(self.headers['Content-Length'])))
+    request_class, response_class, method = \
+      FakeDatastore.METHODS[api_request.method()]
+    request = request_class()
+    request.ParseFromString(api_request.request())
+    response = response_class()
+    time.sleep(LATENCY)
+    method(self.server, request, response)
+
+    api_response = remote_api_pb.Response()
+    api_response.set_response(response.Encode())
+    body = api_response.Encode()
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def run_in_threads(function, count):
+  """ Calls function(index) in count threads and returns the results. """
+  results = [None] * count
+  errors = []
+
+  def run(index):
+    try:
+      results[index] = function(index)
+    except Exception as error:
+      errors.append(error)
+
+  threads = [threading.Thread(target=run, args=(index,))
+             for index in range(count)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  if errors:
+    raise errors[0]
+  return results
+
+
+class TestDatastoreDistributedConcurrency(unittest.TestCase):
+  def setUp(self):
+    self.server = FakeDatastore()
+    server_thread = threading.Thread(target=self.server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    location = 'localhost:{0}'.format(self.server.server_address[1])
+    self.stub = datastore_distributed.DatastoreDistributed(APP_ID, location)
+    self.original_apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+    apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', self.stub)
+
+  def tearDown(self):
+    apiproxy_stub_map.apiproxy = self.original_apiproxy
+    self.server.shutdown()
+    self.server.server_close()
+
+  def call(self, method, request, response):
+    """ Makes an API call the way the API server does. """
+    api_request = remote_api_pb.Request()
+    api_request.set_service_name('datastore_v3')
+    api_request.set_method(method)
+    api_request.set_request(request.Encode())
+    api_request.set_request_id('request')
+    response.CopyFrom(api_server._execute_request(api_request))
+    return response
+
+  def put_items(self, count):
+    request = datastore_pb.PutRequest()
+    for index in range(count):
+      entity = datastore.Entity('Item', name='item-{0:03d}'.format(index),
+                                _app=APP_ID)
+      entity['index'] = index
+      request.add_entity().CopyFrom(entity.ToPb())
+    self.call('Put', request, datastore_pb.PutResponse())
+
+  def query(self):
+    query = datastore_pb.Query()
+    query.set_app(APP_ID)
+    query.set_kind('Item')
+    return self.call('RunQuery', query, datastore_pb.QueryResult())
+
+  def next(self, cursor):
+    request = datastore_pb.NextRequest()
+    request.mutable_cursor().CopyFrom(cursor)
+    request.set_count(DEFAULT_BATCH_SIZE)
+    return self.call('Next', request, datastore_pb.QueryResult())
+
+  def names(self, result):
+    return [entity.key().path().element_list()[-1].name()
+            for entity in result.result_list()]
+
+  def test_datastore_calls_skip_global_lock(self):
+    self.assertTrue('datastore_v3' in api_server.THREAD_SAFE_SERVICES)
+    self.assertTrue('taskqueue' in api_server.THREAD_SAFE_SERVICES)
+    self.assertTrue('search' in api_server.THREAD_SAFE_SERVICES)
+
+  def test_parallel_puts_and_gets(self):
+    threads = 16
+    calls_per_thread = 4
+
+    def put_and_get(thread_index):
+      for call_index in range(calls_per_thread):
+        entity = datastore.Entity(
+          'Item', name='item-{0}-{1}'.format(thread_index, call_index),
+          _app=APP_ID)
+        entity['owner'] = thread_index
+        put_request = datastore_pb.PutRequest()
+        put_request.add_entity().CopyFrom(entity.ToPb())
+        put_response = self.call('Put', put_request,
+                                 datastore_pb.PutResponse())
+
+        get_request = datastore_pb.GetRequest()
+        get_request.add_key().CopyFrom(put_response.key(0))
+        get_response = self.call('Get', get_request,
+                                 datastore_pb.GetResponse())
+        fetched = datastore.Entity.FromPb(get_response.entity(0).entity())
+        self.assertEquals(thread_index, fetched['owner'])
+      return True
+
+    start = time.time()
+    self.assertTrue(all(run_in_threads(put_and_get, threads)))
+    elapsed = time.time() - start
+
+    # With the global lock, every call would wait for the ones before it.
+    serial_time = threads * calls_per_thread * 2 * LATENCY
+    self.assertTrue(elapsed < serial_time / 4,
+                    'Took {0:.2f}s, serial would take {1:.2f}s'.format(
+                      elapsed, serial_time))
+    self.assertEquals(threads * calls_per_thread, len(self.server.entities))
+
+  def test_parallel_queries_keep_separate_cursors(self):
+    self.put_items(23)
+    expected = ['item-{0:03d}'.format(index) for index in range(23)]
+
+    def read_all(_):
+      result = self.query()
+      names = self.names(result)
+      while result.more_results():
+        result = self.next(result.cursor())
+        names.extend(self.names(result))
+      return names
+
+    for names in run_in_threads(read_all, 12):
+      self.assertEquals(expected, names)
+
+  def test_parallel_next_calls_share_a_cursor(self):
+    self.put_items(40)
+    first = self.query()
+    cursor = first.cursor()
+
+    def read_batches(_):
+      names = []
+      while True:
+        try:
+          result = self.next(cursor)
+        except apiproxy_errors.ApplicationError as error:
+          self.assertEquals(datastore_pb.Error.BAD_REQUEST,
+                            error.application_error)
+          return names
+        names.extend(self.names(result))
+        if not result.more_results():
+          return names
+
+    batches = run_in_threads(read_batches, 8)
+    names = self.names(first) + sum(batches, [])
+    self.assertEquals(len(set(names)), len(names))
+    self.assertEquals(['item-{0:03d}'.format(index) for index in range(40)],
+                      sorted(names))
+
+  def test_parallel_transactional_tasks(self):
+    begin_request = datastore_pb.BeginTransactionRequest()
+    begin_request.set_app(APP_ID)
+    transaction = self.call('BeginTransaction', begin_request,
+                            datastore_pb.Transaction())
+
+    def add_action(index):
+      request = taskqueue_service_pb.TaskQueueBulkAddRequest()
+      add_request = request.add_add_request()
+      add_request.set_queue_name('default')
+      add_request.set_task_name('task-{0}'.format(index))
+      add_request.set_eta_usec(0)
+      add_request.set_url('/work')
+      add_request.mutable_transaction().CopyFrom(transaction)
+      try:
+        self.stub.MakeSyncCall('datastore_v3', 'AddActions', request,
+                               api_base_pb.VoidProto())
+        return True
+      except apiproxy_errors.ApplicationError:
+        return False
+
+    added = run_in_threads(add_action, 20)
+    self.assertEquals(datastore_distributed._MAX_ACTIONS_PER_TXN,
+                      added.count(True))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -3,7 +3,10 @@
 import logging
 import os
 import re
+import socket
 import sys
+import threading
+import time
 import unittest
 
 
@@ -55,10 +58,11 @@ class TestXMPP(unittest.TestCase):
 
     # set up a fake xmpp client
     fake_xmpp_client = flexmock(name='xmpp')
-    fake_xmpp_client.should_receive('connect').with_args(secure=False) \
-      .and_return()
+    fake_xmpp_client.should_receive('connect').with_args(server=None,
+      secure=False).and_return('tcp')
     fake_xmpp_client.should_receive('auth').with_args(self.appid, self.uasecret,
-      resource='').and_return()
+      resource='').and_return('sasl')
+    fake_xmpp_client.should_receive('isConnected').and_return('tcp')
     fake_xmpp_client.should_receive('send').with_args(
       fake_xmpp_message).and_return()
 
@@ -104,10 +108,11 @@ class TestXMPP(unittest.TestCase):
 
     # set up a fake xmpp client
     fake_xmpp_client = flexmock(name='xmpp')
-    fake_xmpp_client.should_receive('connect').with_args(secure=False) \
-      .and_return()
+    fake_xmpp_client.should_receive('connect').with_args(server=None,
+      secure=False).and_return('tcp')
     fake_xmpp_client.should_receive('auth').with_args(self.appid, self.uasecret,
-      resource='').and_return()
+      resource='').and_return('sasl')
+    fake_xmpp_client.should_receive('isConnected').and_return('tcp')
     fake_xmpp_client.should_receive('send').with_args(
       fake_xmpp_message).and_return()
 
@@ -131,5 +136,197 @@ class TestXMPP(unittest.TestCase):
       None))
 
 
+  def test_connection_reused_between_messages(self):
+    flexmock(logging)
+    logging.should_receive('info').and_return()
+
+    fake_xmpp_client = flexmock(name='xmpp')
+    fake_xmpp_client.should_receive('connect').and_return('tcp')
+    fake_xmpp_client.should_receive('auth').and_return('sasl')
+    fake_xmpp_client.should_receive('isConnected').and_return('tcp')
+    fake_xmpp_client.should_receive('send').times(4)
+
+    flexmock(xmpppy)
+    xmpppy.should_receive('Client').and_return(fake_xmpp_client).once()
+
+    xmpp = xmpp_service_real.XmppService(log=logging.info, service_name='xmpp',
+      domain=self.domain, uaserver='public-ip', uasecret=self.uasecret)
+
+    fake_request = flexmock(name='xmpp_message_request')
+    fake_request.should_receive('jid_list').and_return(['one', 'two'])
+    fake_request.should_receive('body').and_return(self.message)
+    fake_request.should_receive('type').and_return(self.message_type)
+
+    fake_response = flexmock(name='xmpp_message_response')
+    fake_response.should_receive('add_status') \
+      .with_args(xmpp_service_pb.XmppMessageResponse.NO_ERROR).times(4)
+
+    xmpp._Dynamic_SendMessage(fake_request, fake_response)
+    xmpp._Dynamic_SendMessage(fake_request, fake_response)
+    self.assertEquals(1, xmpp.connection_pool.connections_made)
+
+
+  def test_reconnect_after_failure(self):
+    broken_client = flexmock(name='broken')
+    broken_client.should_receive('connect').and_return('tcp')
+    broken_client.should_receive('auth').and_return('sasl')
+    broken_client.should_receive('isConnected').and_return('tcp')
+    broken_client.should_receive('send').and_raise(IOError('Disconnected'))
+    broken_client.should_receive('disconnect').once()
+
+    working_client = flexmock(name='working')
+    working_client.should_receive('connect').and_return('tcp')
+    working_client.should_receive('auth').and_return('sasl')
+    working_client.should_receive('isConnected').and_return('tcp')
+    working_client.should_receive('send').twice()
+
+    flexmock(xmpppy)
+    xmpppy.should_receive('Client').and_return(broken_client) \
+      .and_return(working_client)
+
+    pool = xmpp_service_real.XmppConnectionPool(self.uasecret)
+    self.assertEquals([True, True], pool.send(self.my_jid, ['a', 'b']))
+    self.assertEquals(2, pool.connections_made)
+
+
+  def test_failed_connection_reported(self):
+    fake_xmpp_client = flexmock(name='xmpp')
+    fake_xmpp_client.should_receive('connect').and_return('')
+
+    flexmock(xmpppy)
+    xmpppy.should_receive('Client').and_return(fake_xmpp_client)
+
+    pool = xmpp_service_real.XmppConnectionPool(self.uasecret)
+    self.assertEquals([False, False], pool.send(self.my_jid, ['a', 'b']))
+
+
+class FakeXmppServer(object):
+  """ A minimal stand-in for ejabberd that accepts SASL PLAIN logins and
+  counts the messages it receives.
+  """
+
+  STREAM_HEADER = ("<?xml version='1.0'?><stream:stream "
+    "xmlns='jabber:client' xmlns:stream='http://etherx.jabber.org/streams' "
+    "id='{0}' from='{1}' version='1.0'>")
+
+  AUTH_FEATURES = ("<stream:features><mechanisms "
+    "xmlns='urn:ietf:params:xml:ns:xmpp-sasl'><mechanism>PLAIN</mechanism>"
+    "</mechanisms></stream:features>")
+
+  SESSION_FEATURES = ("<stream:features>"
+    "<bind xmlns='urn:ietf:params:xml:ns:xmpp-bind'/>"
+    "<session xmlns='urn:ietf:params:xml:ns:xmpp-session'/>"
+    "</stream:features>")
+
+  def __init__(self, domain):
+    self.domain = domain
+    self.logins = 0
+    self.messages = 0
+    self.lock = threading.Lock()
+    self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.server.bind(('127.0.0.1', 0))
+    self.server.listen(5)
+    self.port = self.server.getsockname()[1]
+    thread = threading.Thread(target=self.accept)
+    thread.daemon = True
+    thread.start()
+
+  def accept(self):
+    while True:
+      try:
+        connection, _ = self.server.accept()
+      except socket.error:
+        return
+      thread = threading.Thread(target=self.serve, args=(connection,))
+      thread.daemon = True
+      thread.start()
+
+  def serve(self, connection):
+    data = ''
+    authenticated = False
+    while True:
+      try:
+        chunk = connection.recv(65536)
+      except socket.error:
+        return
+      if not chunk:
+        return
+      data += chunk
+
+      while True:
+        if '<stream:stream' in data and '>' in data[data.index('<stream'):]:
+          start = data.index('<stream:stream')
+          data = data[data.index('>', start) + 1:]
+          features = self.SESSION_FEATURES if authenticated \
+            else self.AUTH_FEATURES
+          connection.sendall(self.STREAM_HEADER.format(id(connection),
+            self.domain) + features)
+        elif '</auth>' in data:
+          data = data[data.index('</auth>') + len('</auth>'):]
+          authenticated = True
+          with self.lock:
+            self.logins += 1
+          connection.sendall(
+            "<success xmlns='urn:ietf:params:xml:ns:xmpp-sasl'/>")
+        elif '</iq>' in data:
+          stanza = data[:data.index('</iq>')]
+          data = data[data.index('</iq>') + len('</iq>'):]
+          iq_id = re.search('id="([^"]+)"', stanza).group(1)
+          if 'xmpp-bind' in stanza:
+            connection.sendall("<iq type='result' id='{0}'><bind "
+              "xmlns='urn:ietf:params:xml:ns:xmpp-bind'><jid>app@{1}/bot</jid>"
+              "</bind></iq>".format(iq_id, self.domain))
+          else:
+            connection.sendall("<iq type='result' id='{0}'/>".format(iq_id))
+        elif '</stream:stream>' in data:
+          connection.sendall('</stream:stream>')
+          connection.close()
+          return
+        elif '</message>' in data:
+          data = data[data.index('</message>') + len('</message>'):]
+          with self.lock:
+            self.messages += 1
+        else:
+          break
+
+  def stop(self):
+    self.server.close()
+
+
+class TestXmppConnectionPoolWithServer(unittest.TestCase):
+
+  MESSAGES = 500
+
+  def setUp(self):
+    self.server = FakeXmppServer('localhost')
+
+  def tearDown(self):
+    self.server.stop()
+
+  def wait_for_messages(self, count):
+    deadline = time.time() + 10
+    while self.server.messages < count and time.time() < deadline:
+      time.sleep(0.01)
+
+  def test_many_messages_use_one_login(self):
+    pool = xmpp_service_real.XmppConnectionPool('secret',
+      server=('127.0.0.1', self.server.port))
+    messages = [xmpppy.protocol.Message(frm='app@localhost',
+      to='user{0}@localhost'.format(index), body='hello', typ='chat')
+      for index in range(self.MESSAGES)]
+
+    start = time.time()
+    for message in messages:
+      self.assertEquals([True], pool.send('app@localhost', [message]))
+    self.wait_for_messages(self.MESSAGES)
+    elapsed = time.time() - start
+
+    self.assertEquals(self.MESSAGES, self.server.messages)
+    self.assertEquals(1, self.server.logins)
+    logging.info('Sent {0} messages/second over a pooled connection'.
+      format(int(self.MESSAGES / elapsed)))
+
+
 if __name__ == "__main__":
   unittest.main()
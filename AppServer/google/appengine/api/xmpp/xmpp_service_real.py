@@ -22,7 +22,9 @@
 import hashlib
 import logging
 import os
+import socket
 import SOAPpy
+import threading
 import urllib
 import xmpp as xmpppy
 
@@ -35,6 +37,145 @@ from google.appengine.runtime import apiproxy_errors
 
 SECRET_KEY_FILE = "/etc/appscale/secret.key"
 
+# The maximum number of idle authenticated connections kept open per JID.
+MAX_IDLE_CONNECTIONS = 4
+
+
+class XmppConnectionError(Exception):
+  """ Indicates that a connection to the XMPP server could not be made. """
+  pass
+
+
+class XmppConnectionPool(object):
+  """ Keeps authenticated xmpppy clients open so that they can be reused for
+  many messages instead of logging in for every message.
+  """
+
+  def __init__(self, password, server=None, max_idle=MAX_IDLE_CONNECTIONS):
+    """ Constructor.
+
+    Args:
+      password: The password used to authenticate every JID.
+      server: An optional (host, port) tuple to connect to instead of the
+        JID's domain.
+      max_idle: The maximum number of idle connections to keep per JID.
+    """
+    self.password = password
+    self.server = server
+    self.max_idle = max_idle
+    self.connections_made = 0
+    self._idle = {}
+    self._lock = threading.Lock()
+
+  def _connect(self, jid):
+    """ Opens and authenticates a new connection.
+
+    Args:
+      jid: A string containing the JID to log in as.
+    Returns:
+      A connected xmpppy.Client.
+    Raises:
+      XmppConnectionError: If the connection or authentication fails.
+    """
+    my_jid = xmpppy.protocol.JID(jid)
+    client = xmpppy.Client(my_jid.getDomain(), debug=[])
+    if not client.connect(server=self.server, secure=False):
+      raise XmppConnectionError('Unable to connect to {0}'.
+        format(my_jid.getDomain()))
+    if not client.auth(my_jid.getNode(), self.password,
+                       resource=my_jid.getResource()):
+      raise XmppConnectionError('Unable to authenticate as {0}'.format(jid))
+    self.connections_made += 1
+    return client
+
+  def acquire(self, jid):
+    """ Returns a connected client for the given JID, reusing an idle one if
+    possible. The caller must pass it back to release() or discard().
+
+    Args:
+      jid: A string containing the JID to log in as.
+    Returns:
+      A connected xmpppy.Client.
+    Raises:
+      XmppConnectionError: If a new connection could not be made.
+    """
+    with self._lock:
+      idle = self._idle.get(jid, [])
+      while idle:
+        client = idle.pop()
+        if client.isConnected():
+          return client
+    return self._connect(jid)
+
+  def release(self, jid, client):
+    """ Returns a client to the pool after use.
+
+    Args:
+      jid: A string containing the JID the client logged in as.
+      client: An xmpppy.Client returned by acquire().
+    """
+    if not client.isConnected():
+      return
+
+    with self._lock:
+      idle = self._idle.setdefault(jid, [])
+      if len(idle) < self.max_idle:
+        idle.append(client)
+        return
+    self.discard(client)
+
+  def discard(self, client):
+    """ Closes a client that should not be reused.
+
+    Args:
+      client: An xmpppy.Client returned by acquire().
+    """
+    try:
+      client.disconnect()
+    except (IOError, socket.error):
+      pass
+
+  def send(self, jid, messages):
+    """ Sends messages over a single pooled connection, reconnecting once if
+    the connection turns out to be broken.
+
+    Args:
+      jid: A string containing the JID to send the messages as.
+      messages: A list of xmpppy.protocol.Message objects.
+    Returns:
+      A list with one boolean per message indicating whether it was sent.
+    """
+    sent = []
+    client = None
+    reconnected = False
+    for message in messages:
+      while True:
+        try:
+          if client is None:
+            client = self.acquire(jid)
+          client.send(message)
+          if not client.isConnected():
+            raise IOError('Disconnected while sending')
+          sent.append(True)
+          break
+        except XmppConnectionError as error:
+          logging.error(str(error))
+          return sent + [False] * (len(messages) - len(sent))
+        except (IOError, socket.error) as error:
+          logging.warning('XMPP connection for {0} failed: {1}'.
+            format(jid, error))
+          if client is not None:
+            self.discard(client)
+            client = None
+          if reconnected:
+            sent.append(False)
+            break
+          reconnected = True
+
+    if client is not None:
+      self.release(jid, client)
+    return sent
+
 
 class XmppService(apiproxy_stub.APIProxyStub):
   """Python only xmpp service stub. Ejabberd as the backend. Channel API
@@ -68,6 +209,7 @@ class XmppService(apiproxy_stub.APIProxyStub):
         uasecret = "secret"
 
     self.uasecret = uasecret
+    self.connection_pool = XmppConnectionPool(self.uasecret)
 
   def _Dynamic_GetPresence(self, request, response):
     """Implementation of XmppService::GetPresence.
@@ -106,17 +248,17 @@ class XmppService(apiproxy_stub.APIProxyStub):
 
     xmpp_username = appname + "@" + self.xmpp_domain
 
-    my_jid = xmpppy.protocol.JID(xmpp_username)
-    client = xmpppy.Client(my_jid.getDomain(), debug=[])
-    client.connect(secure=False)
-    client.auth(my_jid.getNode(), self.uasecret, resource=my_jid.getResource())
-
+    messages = []
     for jid in request.jid_list():
       stripped_to = jid.strip()
-      message = xmpppy.protocol.Message(frm=xmpp_username, to=stripped_to,
-                                        body=request.body(), typ=request.type())
-      client.send(message)
-      response.add_status(xmpp_service_pb.XmppMessageResponse.NO_ERROR)
+      messages.append(xmpppy.protocol.Message(frm=xmpp_username,
+        to=stripped_to, body=request.body(), typ=request.type()))
+
+    for sent in self.connection_pool.send(xmpp_username, messages):
+      if sent:
+        response.add_status(xmpp_service_pb.XmppMessageResponse.NO_ERROR)
+      else:
+        response.add_status(xmpp_service_pb.XmppMessageResponse.OTHER_ERROR)
 
   def _Dynamic_SendInvite(self, request, response):
     """Implementation of XmppService::SendInvite.
@@ -239,14 +381,11 @@ class XmppService(apiproxy_stub.APIProxyStub):
                                self.xmpp_domain)
  
     xmpp_username = appname + "@" + self.xmpp_domain
-    my_jid = xmpppy.protocol.JID(xmpp_username)
-    client = xmpppy.Client(my_jid.getDomain(), debug=[])
-    client.connect(secure=False)
-    client.auth(my_jid.getNode(), self.uasecret, resource=my_jid.getResource())
-
     message = xmpppy.protocol.Message(frm=xmpp_username, to=jid, 
                                       body=request.message(), typ="chat")
-    client.send(message)
+    if not self.connection_pool.send(xmpp_username, [message])[0]:
+      raise apiproxy_errors.ApplicationError(
+          channel_service_pb.ChannelServiceError.INTERNAL_ERROR)
 
 
   def app_key_from_client_id(self, client_id):
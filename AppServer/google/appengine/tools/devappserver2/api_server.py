@@ -82,11 +82,14 @@ THREAD_SAFE_SERVICES = frozenset((
     'app_identity_service',
     'capability_service',
     'channel',
+    'datastore_v3',
     'logservice',
     'mail',
     'memcache',
     'remote_socket',
+    'search',
     'servers',
+    'taskqueue',
     'urlfetch',
     'user',
     'xmpp',
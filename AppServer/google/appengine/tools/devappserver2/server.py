@@ -215,12 +215,14 @@ class Server(object):
         handlers.append(
             static_files_handler.StaticFilesHandler(
                 self._server_configuration.application_root,
-                url_map))
+                url_map,
+                trust_cached_mtimes=self._watcher is not None))
       elif handler_type == appinfo.STATIC_DIR:
         handlers.append(
             static_files_handler.StaticDirHandler(
                 self._server_configuration.application_root,
-                url_map))
+                url_map,
+                trust_cached_mtimes=self._watcher is not None))
       else:
         assert 0, 'unexpected handler %r for %r' % (handler_type, url_map)
     # Add a handler for /_ah/start if no script handler matches.
@@ -315,6 +317,7 @@ class Server(object):
         self._handlers = handlers
 
     if has_file_changes:
+      static_files_handler.StaticContentHandler.validate_cached_files()
       self._instance_factory.files_changed()
 
     if config_changes & _RESTART_INSTANCES_CONFIG_CHANGES:
@@ -1569,6 +1572,7 @@ class ManualScalingServer(Server):
         self._handlers = handlers
 
     if has_file_changes:
+      static_files_handler.StaticContentHandler.validate_cached_files()
       self._instance_factory.files_changed()
 
     if config_changes & _RESTART_INSTANCES_CONFIG_CHANGES:
@@ -2081,6 +2085,7 @@ class BasicScalingServer(Server):
         self._handlers = handlers
 
     if has_file_changes:
+      static_files_handler.StaticContentHandler.validate_cached_files()
       self._instance_factory.files_changed()
 
     if config_changes & _RESTART_INSTANCES_CONFIG_CHANGES:
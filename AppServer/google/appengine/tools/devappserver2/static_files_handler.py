@@ -18,11 +18,13 @@
 
 
 import base64
+import collections
 import errno
 import mimetypes
 import os
 import os.path
 import re
+import threading
 import zlib
 
 from google.appengine.api import appinfo
@@ -31,18 +33,130 @@ from google.appengine.tools.devappserver2 import url_handler
 
 _FILE_MISSING_ERRNO_CONSTANTS = frozenset([errno.ENOENT, errno.ENOTDIR])
 
+# The maximum total number of bytes of file content held in memory.
+_MAX_CACHE_SIZE_BYTES = 32 * 1024 * 1024
+
+# The maximum number of files tracked by the cache.
+_MAX_CACHE_ENTRIES = 10000
+
+# Files larger than this are never held in memory and are streamed from disk.
+_MAX_CACHED_FILE_SIZE_BYTES = 1024 * 1024
+
+# The number of bytes read from disk at a time when streaming a file.
+_STREAM_BLOCK_SIZE_BYTES = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# A cached static file. "data" is None for files too large to keep in memory.
+_CachedFile = collections.namedtuple('_CachedFile',
+                                     ['mtime', 'etag', 'size', 'data'])
+
+
+class _StaticContentCache(object):
+  """A thread-safe LRU cache of static files bounded by their total size."""
+
+  def __init__(self, max_size_bytes, max_entries):
+    """Initializer for _StaticContentCache.
+
+    Args:
+      max_size_bytes: An integer specifying the maximum number of bytes of file
+          content to keep in memory.
+      max_entries: An integer specifying the maximum number of files to track.
+    """
+    self._max_size_bytes = max_size_bytes
+    self._max_entries = max_entries
+    self._size_bytes = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    with self._lock:
+      return len(self._entries)
+
+  @property
+  def size_bytes(self):
+    """The number of bytes of file content currently held in memory."""
+    with self._lock:
+      return self._size_bytes
+
+  def get(self, full_path):
+    """Returns the _CachedFile for the given path or None if not cached."""
+    with self._lock:
+      entry = self._entries.pop(full_path, None)
+      if entry is not None:
+        self._entries[full_path] = entry
+      return entry
+
+  def put(self, full_path, entry):
+    """Caches a file, evicting the least recently used files if necessary.
+
+    Args:
+      full_path: A string containing the absolute path of the file.
+      entry: A _CachedFile describing the file.
+    """
+    with self._lock:
+      self._discard(full_path)
+      self._entries[full_path] = entry
+      if entry.data is not None:
+        self._size_bytes += len(entry.data)
+      while (self._size_bytes > self._max_size_bytes or
+             len(self._entries) > self._max_entries):
+        self._discard(next(iter(self._entries)))
+
+  def clear(self):
+    """Removes all files from the cache."""
+    with self._lock:
+      self._entries.clear()
+      self._size_bytes = 0
+
+  def validate(self):
+    """Evicts every file whose mtime has changed since it was cached.
+
+    This is called when the file watcher reports changes so that handlers
+    trusting cached mtimes do not have to stat files on every request.
+
+    Returns:
+      The number of files that were evicted.
+    """
+    with self._lock:
+      entries = self._entries.items()
+
+    stale = []
+    for full_path, entry in entries:
+      try:
+        mtime = os.path.getmtime(full_path)
+      except (OSError, IOError):
+        mtime = None
+      if mtime != entry.mtime:
+        stale.append((full_path, entry))
+
+    with self._lock:
+      for full_path, entry in stale:
+        # The file may have been reloaded while it was being statted.
+        if self._entries.get(full_path) is entry:
+          self._discard(full_path)
+    return len(stale)
+
+  def _discard(self, full_path):
+    """Removes a file from the cache. The caller must hold self._lock."""
+    entry = self._entries.pop(full_path, None)
+    if entry is not None and entry.data is not None:
+      self._size_bytes -= len(entry.data)
+
 
 class StaticContentHandler(url_handler.UserConfiguredURLHandler):
   """Abstract base class for subclasses serving static content."""
 
-  # Associate the full path of a static file with a 2-tuple containing the:
-  # - mtime at which the file was last read from disk
-  # - a etag constructed from a hash of the file's contents
+  # Associates the full path of a static file with a _CachedFile containing the
+  # mtime at which the file was last read from disk, an etag constructed from a
+  # hash of the file's contents and, for small files, the contents themselves.
   # Statting a small file to retrieve its mtime is approximately 20x faster than
   # reading it to generate a hash of its contents.
-  _filename_to_mtime_and_etag = {}
+  _content_cache = _StaticContentCache(_MAX_CACHE_SIZE_BYTES,
+                                       _MAX_CACHE_ENTRIES)
 
-  def __init__(self, root_path, url_map, url_pattern):
+  def __init__(self, root_path, url_map, url_pattern,
+               trust_cached_mtimes=False):
     """Initializer for StaticContentHandler.
 
     Args:
@@ -52,9 +166,22 @@ class StaticContentHandler(url_handler.UserConfiguredURLHandler):
           handler.
       url_pattern: A re.RegexObject that matches URLs that should be handled by
           this handler. It may also optionally bind groups.
+      trust_cached_mtimes: If True then cached files are served without
+          statting them first. The caller is then responsible for calling
+          validate_cached_files() whenever files under root_path change.
     """
     super(StaticContentHandler, self).__init__(url_map, url_pattern)
     self._root_path = root_path
+    self._trust_cached_mtimes = trust_cached_mtimes
+
+  @classmethod
+  def validate_cached_files(cls):
+    """Evicts cached files that have been modified since they were read.
+
+    Returns:
+      The number of files that were evicted.
+    """
+    return cls._content_cache.validate()
 
   def _get_mime_type(self, path):
     """Returns the mime type for the file at the given path."""
@@ -86,6 +213,71 @@ class StaticContentHandler(url_handler.UserConfiguredURLHandler):
   def _calculate_etag(data):
     return base64.b64encode(str(zlib.crc32(data)))
 
+  def _load_file(self, full_path, mtime):
+    """Reads a file from disk and caches it.
+
+    Files larger than _MAX_CACHED_FILE_SIZE_BYTES are read in blocks to
+    calculate their etag but their contents are not kept in memory.
+
+    Args:
+      full_path: A string containing the absolute path to the file to load.
+      mtime: The mtime of the file at full_path.
+
+    Returns:
+      A _CachedFile describing the file.
+
+    Raises:
+      OSError, IOError: If the file could not be read.
+    """
+    data = self._read_file(full_path, _MAX_CACHED_FILE_SIZE_BYTES)
+    if data is not None:
+      entry = _CachedFile(mtime, self._calculate_etag(data), len(data), data)
+    else:
+      crc = 0
+      size = 0
+      for block in self._iter_file(open(full_path, 'rb'), 0, None):
+        crc = zlib.crc32(block, crc)
+        size += len(block)
+      entry = _CachedFile(mtime, base64.b64encode(str(crc)), size, None)
+    self._content_cache.put(full_path, entry)
+    return entry
+
+  @staticmethod
+  def _parse_range(range_header, size):
+    """Parses a "Range" header for a file of the given size.
+
+    Only a single byte range is supported. Requests for multiple ranges are
+    answered with the complete file, which RFC-2616 permits.
+
+    Args:
+      range_header: A string containing the value of the "Range" header e.g.
+          'bytes=0-499', 'bytes=500-' or 'bytes=-500'.
+      size: An integer containing the size of the requested file.
+
+    Returns:
+      None if the whole file should be served, a (start, end) tuple of
+      inclusive byte offsets if a partial response should be served or
+      (None, None) if the range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(range_header.strip())
+    if not match or match.groups() == ('', ''):
+      return None
+
+    first, last = match.groups()
+    if not first:
+      # A suffix range e.g. 'bytes=-500' for the last 500 bytes.
+      if int(last) == 0:
+        return None, None
+      return max(size - int(last), 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+      return None
+    if start >= size:
+      return None, None
+    return start, end
+
   def _handle_path(self, full_path, environ, start_response):
     """Serves the response to a request for a particular file.
 
@@ -104,37 +296,35 @@ class StaticContentHandler(url_handler.UserConfiguredURLHandler):
     Returns:
       An iterable over strings containing the body of the HTTP response.
     """
-    data = None
-    if full_path in self._filename_to_mtime_and_etag:
-      last_mtime, etag = self._filename_to_mtime_and_etag[full_path]
-    else:
-      last_mtime = etag = None
+    entry = self._content_cache.get(full_path)
 
     user_headers = self._url_map.http_headers or appinfo.HttpHeadersDict()
 
     if_match = environ.get('HTTP_IF_MATCH')
     if_none_match = environ.get('HTTP_IF_NONE_MATCH')
 
-    try:
-      mtime = os.path.getmtime(full_path)
-    except (OSError, IOError) as e:
-      # RFC-2616 section 14.24 says:
-      # If none of the entity tags match, or if "*" is given and no current
-      # entity exists, the server MUST NOT perform the requested method, and
-      # MUST return a 412 (Precondition Failed) response.
-      if if_match:
-        start_response('412 Precondition Failed', [])
-        return []
-      else:
-        return self._handle_io_exception(start_response, e)
+    if entry is not None and self._trust_cached_mtimes:
+      mtime = entry.mtime
+    else:
+      try:
+        mtime = os.path.getmtime(full_path)
+      except (OSError, IOError) as e:
+        # RFC-2616 section 14.24 says:
+        # If none of the entity tags match, or if "*" is given and no current
+        # entity exists, the server MUST NOT perform the requested method, and
+        # MUST return a 412 (Precondition Failed) response.
+        if if_match:
+          start_response('412 Precondition Failed', [])
+          return []
+        else:
+          return self._handle_io_exception(start_response, e)
 
-    if mtime != last_mtime:
+    if entry is None or entry.mtime != mtime:
       try:
-        data = self._read_file(full_path)
+        entry = self._load_file(full_path, mtime)
       except (OSError, IOError) as e:
         return self._handle_io_exception(start_response, e)
-      etag = self._calculate_etag(data)
-      self._filename_to_mtime_and_etag[full_path] = mtime, etag
+    etag = entry.etag
 
     if if_match and not self._check_etag_match(if_match,
                                                etag,
@@ -150,45 +340,114 @@ class StaticContentHandler(url_handler.UserConfiguredURLHandler):
       start_response('304 Not Modified',
                      [('ETag', '"%s"' % etag)])
       return []
+
+    byte_range = None
+    range_header = environ.get('HTTP_RANGE')
+    if_range = environ.get('HTTP_IF_RANGE')
+    # http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.27
+    if range_header and (not if_range or
+                         self._check_etag_match(if_range,
+                                                etag,
+                                                allow_weak_match=False)):
+      byte_range = self._parse_range(range_header, entry.size)
+
+    if byte_range == (None, None):
+      # http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.16
+      start_response('416 Requested Range Not Satisfiable',
+                     [('Content-Range', 'bytes */%d' % entry.size),
+                      ('ETag', '"%s"' % etag)])
+      return []
+
+    if byte_range is None:
+      status = '200 OK'
+      start, length = 0, entry.size
+      headers = [('Content-length', str(entry.size))]
     else:
-      if data is None:
-        try:
-          data = self._read_file(full_path)
-        except (OSError, IOError) as e:
-          return self._handle_io_exception(start_response, e)
+      status = '206 Partial Content'
+      start, end = byte_range
+      length = end - start + 1
+      headers = [('Content-length', str(length)),
+                 ('Content-Range', 'bytes %d-%d/%d' % (start, end, entry.size))]
 
-        etag = self._calculate_etag(data)
-        self._filename_to_mtime_and_etag[full_path] = mtime, etag
+    headers.append(('Accept-Ranges', 'bytes'))
 
-      headers = [('Content-length', str(len(data)))]
+    if user_headers.Get('Content-type') is None:
+      headers.append(('Content-type', self._get_mime_type(full_path)))
 
-      if user_headers.Get('Content-type') is None:
-        headers.append(('Content-type', self._get_mime_type(full_path)))
+    if user_headers.Get('ETag') is None:
+      headers.append(('ETag', '"%s"' % etag))
 
-      if user_headers.Get('ETag') is None:
-        headers.append(('ETag', '"%s"' % etag))
+    if user_headers.Get('Expires') is None:
+      headers.append(('Expires', 'Fri, 01 Jan 1990 00:00:00 GMT'))
 
-      if user_headers.Get('Expires') is None:
-        headers.append(('Expires', 'Fri, 01 Jan 1990 00:00:00 GMT'))
+    if user_headers.Get('Cache-Control') is None:
+      headers.append(('Cache-Control', 'no-cache'))
 
-      if user_headers.Get('Cache-Control') is None:
-        headers.append(('Cache-Control', 'no-cache'))
+    for name, value in user_headers.iteritems():
+      # "name" will always be unicode due to the way that ValidatedDict works.
+      headers.append((str(name), value))
 
-      for name, value in user_headers.iteritems():
-        # "name" will always be unicode due to the way that ValidatedDict works.
-        headers.append((str(name), value))
+    # Open the file before the response starts so that a failure can still
+    # be reported with an error status.
+    if environ['REQUEST_METHOD'] != 'HEAD' and entry.data is None:
+      try:
+        f = open(full_path, 'rb')
+      except (OSError, IOError) as e:
+        return self._handle_io_exception(start_response, e)
 
-      start_response('200 OK', headers)
-      if environ['REQUEST_METHOD'] == 'HEAD':
-        return []
-      else:
-        return [data]
+    start_response(status, headers)
+    if environ['REQUEST_METHOD'] == 'HEAD':
+      return []
+    elif entry.data is not None:
+      return [entry.data[start:start + length]]
+    elif byte_range is None and 'wsgi.file_wrapper' in environ:
+      return environ['wsgi.file_wrapper'](f, _STREAM_BLOCK_SIZE_BYTES)
+    else:
+      return self._iter_file(f, start, length)
 
   @staticmethod
-  def _read_file(full_path):
+  def _read_file(full_path, max_size=None):
+    """Reads the contents of a file.
+
+    Args:
+      full_path: A string containing the absolute path to the file to read.
+      max_size: If set, the maximum size of file to read.
+
+    Returns:
+      A string containing the contents of the file or None if the file is
+      larger than max_size.
+    """
     with open(full_path, 'rb') as f:
+      if max_size is not None and os.fstat(f.fileno()).st_size > max_size:
+        return None
       return f.read()
 
+  @staticmethod
+  def _iter_file(f, start, length):
+    """Yields the contents of a file in blocks without reading it all at once.
+
+    Args:
+      f: The file to read, opened in binary mode. It is closed afterwards.
+      start: The offset of the first byte to yield.
+      length: The number of bytes to yield or None to read to the end of file.
+
+    Yields:
+      Strings of at most _STREAM_BLOCK_SIZE_BYTES bytes.
+    """
+    with f:
+      f.seek(start)
+      remaining = length
+      while remaining is None or remaining > 0:
+        block_size = _STREAM_BLOCK_SIZE_BYTES
+        if remaining is not None:
+          block_size = min(block_size, remaining)
+        block = f.read(block_size)
+        if not block:
+          break
+        if remaining is not None:
+          remaining -= len(block)
+        yield block
+
   @staticmethod
   def _check_etag_match(etag_headers, etag, allow_weak_match):
     """Checks if an etag header matches a given etag.
@@ -238,7 +497,7 @@ class StaticFilesHandler(StaticContentHandler):
       upload: (.*)/(.*)
   """
 
-  def __init__(self, root_path, url_map):
+  def __init__(self, root_path, url_map, trust_cached_mtimes=False):
     """Initializer for StaticFilesHandler.
 
     Args:
@@ -246,6 +505,8 @@ class StaticFilesHandler(StaticContentHandler):
           the application's app.yaml file.
       url_map: An appinfo.URLMap instance containing the configuration for this
           handler.
+      trust_cached_mtimes: If True then cached files are served without
+          statting them first. See StaticContentHandler.__init__.
     """
     try:
       url_pattern = re.compile('%s$' % url_map.url)
@@ -255,7 +516,8 @@ class StaticFilesHandler(StaticContentHandler):
 
     super(StaticFilesHandler, self).__init__(root_path,
                                              url_map,
-                                             url_pattern)
+                                             url_pattern,
+                                             trust_cached_mtimes)
 
   def handle(self, match, environ, start_response):
     """Serves the file content matching the request.
@@ -283,7 +545,7 @@ class StaticDirHandler(StaticContentHandler):
       static_dir: stylesheets
   """
 
-  def __init__(self, root_path, url_map):
+  def __init__(self, root_path, url_map, trust_cached_mtimes=False):
     """Initializer for StaticDirHandler.
 
     Args:
@@ -291,6 +553,8 @@ class StaticDirHandler(StaticContentHandler):
           the application's app.yaml file.
       url_map: An appinfo.URLMap instance containing the configuration for this
           handler.
+      trust_cached_mtimes: If True then cached files are served without
+          statting them first. See StaticContentHandler.__init__.
     """
     url = url_map.url
     # Take a url pattern like "/css" and transform it into a match pattern like
@@ -306,7 +570,8 @@ class StaticDirHandler(StaticContentHandler):
 
     super(StaticDirHandler, self).__init__(root_path,
                                            url_map,
-                                           url_pattern)
+                                           url_pattern,
+                                           trust_cached_mtimes)
 
   def handle(self, match, environ, start_response):
     """Serves the file content matching the request.
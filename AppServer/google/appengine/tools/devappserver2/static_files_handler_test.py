@@ -19,6 +19,8 @@
 
 import errno
 import os.path
+import shutil
+import tempfile
 import unittest
 
 import google
@@ -40,9 +42,16 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                              '_read_file')
 
   def tearDown(self):
-    static_files_handler.StaticContentHandler._filename_to_mtime_and_etag = {}
+    static_files_handler.StaticContentHandler._content_cache.clear()
     self.mox.UnsetStubs()
 
+  def assertCachedMtimesAndEtags(self, expected):
+    cache = static_files_handler.StaticContentHandler._content_cache
+    self.assertEqual(
+        expected,
+        dict((full_path, (entry.mtime, entry.etag))
+             for full_path, entry in cache._entries.items()))
+
   def test_load_file(self):
     url_map = appinfo.URLMap(url='/',
                              static_files='index.html')
@@ -54,11 +63,12 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
 
     os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndReturn('Hello World!')
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
 
     self.mox.ReplayAll()
     self.assertResponse('200 OK',
-                        {'Content-type': 'text/html',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
                          'Content-length': '12',
                          'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
                          'Cache-Control': 'no-cache',
@@ -68,13 +78,14 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         '/home/appdir/index.html',
                         {'REQUEST_METHOD': 'GET'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
 
   def test_load_cached_file(self):
-    static_files_handler.StaticContentHandler._filename_to_mtime_and_etag = {
-        '/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')}
+    static_files_handler.StaticContentHandler._content_cache.put(
+        '/home/appdir/index.html',
+        static_files_handler._CachedFile(
+            12345.6, 'NDcyNDU2MzU1', 12, 'Hello World!'))
 
     url_map = appinfo.URLMap(url='/',
                              static_files='index.html')
@@ -85,12 +96,11 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
         url_pattern='/$')
 
     os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
-    static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndReturn('Hello World!')
 
     self.mox.ReplayAll()
     self.assertResponse('200 OK',
-                        {'Content-type': 'text/html',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
                          'Content-length': '12',
                          'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
                          'Cache-Control': 'no-cache',
@@ -100,8 +110,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         '/home/appdir/index.html',
                         {'REQUEST_METHOD': 'GET'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
 
   def test_load_head(self):
@@ -115,11 +124,12 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
 
     os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndReturn('Hello World!')
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
 
     self.mox.ReplayAll()
     self.assertResponse('200 OK',
-                        {'Content-type': 'text/html',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
                          'Content-length': '12',
                          'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
                          'Cache-Control': 'no-cache',
@@ -129,8 +139,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         '/home/appdir/index.html',
                         {'REQUEST_METHOD': 'HEAD'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
 
   def test_no_permission_read(self):
@@ -146,7 +155,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
     error = IOError()
     error.errno = errno.EPERM
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndRaise(error)
+        '/home/appdir/index.html', mox.IgnoreArg()).AndRaise(error)
 
     self.mox.ReplayAll()
     self.assertResponse('403 Forbidden',
@@ -159,8 +168,10 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
     self.mox.VerifyAll()
 
   def test_cached_no_permission_read(self):
-    static_files_handler.StaticContentHandler._filename_to_mtime_and_etag = {
-        '/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')}
+    static_files_handler.StaticContentHandler._content_cache.put(
+        '/home/appdir/index.html',
+        static_files_handler._CachedFile(
+            12345.6, 'NDcyNDU2MzU1', 12, 'Hello World!'))
 
     url_map = appinfo.URLMap(url='/',
                              static_files='index.html')
@@ -170,11 +181,11 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
         url_map=url_map,
         url_pattern='/$')
 
-    os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
+    os.path.getmtime('/home/appdir/index.html').AndReturn(12345.7)
     error = IOError()
     error.errno = errno.EPERM
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndRaise(error)
+        '/home/appdir/index.html', mox.IgnoreArg()).AndRaise(error)
 
     self.mox.ReplayAll()
     self.assertResponse('403 Forbidden',
@@ -199,7 +210,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
     error = IOError()
     error.errno = errno.ENOENT
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndRaise(error)
+        '/home/appdir/index.html', mox.IgnoreArg()).AndRaise(error)
 
     self.mox.ReplayAll()
     self.assertResponse('404 Not Found',
@@ -245,7 +256,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
 
     os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndReturn('Hello World!')
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
 
     self.mox.ReplayAll()
     self.assertResponse('412 Precondition Failed',
@@ -256,8 +267,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         {'REQUEST_METHOD': 'GET',
                          'HTTP_IF_MATCH': '"nomatch"'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
 
   def test_if_match_no_file(self):
@@ -282,13 +292,14 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         {'REQUEST_METHOD': 'GET',
                          'HTTP_IF_MATCH': '"nomatch"'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {})
 
   def test_cached_if_match_without_match(self):
-    static_files_handler.StaticContentHandler._filename_to_mtime_and_etag = {
-        '/home/appdir/index.html': (12345.6, 'abc')}
+    static_files_handler.StaticContentHandler._content_cache.put(
+        '/home/appdir/index.html',
+        static_files_handler._CachedFile(
+            12345.6, 'abc', 12, 'Hello World!'))
 
     url_map = appinfo.URLMap(url='/',
                              static_files='index.html')
@@ -309,8 +320,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         {'REQUEST_METHOD': 'GET',
                          'HTTP_IF_MATCH': '"nomatch"'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'abc')})
 
   def test_if_none_match_with_match(self):
@@ -324,7 +334,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
 
     os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndReturn('Hello World!')
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
 
     self.mox.ReplayAll()
     self.assertResponse('304 Not Modified',
@@ -335,13 +345,14 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         {'REQUEST_METHOD': 'GET',
                          'HTTP_IF_NONE_MATCH': '"NDcyNDU2MzU1"'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
 
   def test_cached_if_none_match_with_match(self):
-    static_files_handler.StaticContentHandler._filename_to_mtime_and_etag = {
-        '/home/appdir/index.html': (12345.6, 'match')}
+    static_files_handler.StaticContentHandler._content_cache.put(
+        '/home/appdir/index.html',
+        static_files_handler._CachedFile(
+            12345.6, 'match', 12, 'Hello World!'))
 
     url_map = appinfo.URLMap(url='/',
                              static_files='index.html')
@@ -362,8 +373,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         {'REQUEST_METHOD': 'GET',
                          'HTTP_IF_NONE_MATCH': '"match"'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'match')})
 
   def test_custom_headers(self):
@@ -385,11 +395,12 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
 
     os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndReturn('Hello World!')
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
 
     self.mox.ReplayAll()
     self.assertResponse('200 OK',
-                        {'Content-length': '12',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-length': '12',
                          'Content-type': 'text/xml',
                          'ETag': 'abc123',
                          'Expires': 'tomorrow',
@@ -400,8 +411,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         '/home/appdir/index.html',
                         {'REQUEST_METHOD': 'GET'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
 
   def test_custom_mimetype(self):
@@ -416,11 +426,12 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
 
     os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndReturn('Hello World!')
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
 
     self.mox.ReplayAll()
     self.assertResponse('200 OK',
-                        {'Content-type': 'text/xml',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/xml',
                          'Content-length': '12',
                          'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
                          'Cache-Control': 'no-cache',
@@ -430,8 +441,7 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         '/home/appdir/index.html',
                         {'REQUEST_METHOD': 'GET'})
     self.mox.VerifyAll()
-    self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
 
   def test_custom_expiration_ignored(self):
@@ -446,11 +456,12 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
 
     os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
     static_files_handler.StaticContentHandler._read_file(
-        '/home/appdir/index.html').AndReturn('Hello World!')
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
 
     self.mox.ReplayAll()
     self.assertResponse('200 OK',
-                        {'Content-type': 'text/html',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
                          'Content-length': '12',
                          'ETag': '"NDcyNDU2MzU1"',
                          'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
@@ -460,10 +471,311 @@ class TestStaticContentHandlerHandlePath(wsgi_test_utils.WSGITestCase):
                         '/home/appdir/index.html',
                         {'REQUEST_METHOD': 'GET'})
     self.mox.VerifyAll()
+    self.assertCachedMtimesAndEtags(
+        {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
+
+  def test_trusted_cached_file_not_statted(self):
+    static_files_handler.StaticContentHandler._content_cache.put(
+        '/home/appdir/index.html',
+        static_files_handler._CachedFile(
+            12345.6, 'NDcyNDU2MzU1', 12, 'Hello World!'))
+
+    url_map = appinfo.URLMap(url='/',
+                             static_files='index.html')
+
+    h = static_files_handler.StaticContentHandler(
+        root_path=None,
+        url_map=url_map,
+        url_pattern='/$',
+        trust_cached_mtimes=True)
+
+    self.mox.ReplayAll()
+    self.assertResponse('200 OK',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
+                         'Content-length': '12',
+                         'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
+                         'Cache-Control': 'no-cache',
+                         'ETag': '"NDcyNDU2MzU1"'},
+                        'Hello World!',
+                        h._handle_path,
+                        '/home/appdir/index.html',
+                        {'REQUEST_METHOD': 'GET'})
+    self.mox.VerifyAll()
+
+  def test_validate_cached_files(self):
+    static_files_handler.StaticContentHandler._content_cache.put(
+        '/home/appdir/index.html',
+        static_files_handler._CachedFile(
+            12345.6, 'NDcyNDU2MzU1', 12, 'Hello World!'))
+    static_files_handler.StaticContentHandler._content_cache.put(
+        '/home/appdir/changed.html',
+        static_files_handler._CachedFile(
+            12345.6, 'NDcyNDU2MzU1', 12, 'Hello World!'))
+    static_files_handler.StaticContentHandler._content_cache.put(
+        '/home/appdir/deleted.html',
+        static_files_handler._CachedFile(
+            12345.6, 'NDcyNDU2MzU1', 12, 'Hello World!'))
+
+    os.path.getmtime('/home/appdir/index.html').InAnyOrder().AndReturn(
+        12345.6)
+    os.path.getmtime('/home/appdir/changed.html').InAnyOrder().AndReturn(
+        12345.7)
+    error = OSError()
+    error.errno = errno.ENOENT
+    os.path.getmtime('/home/appdir/deleted.html').InAnyOrder().AndRaise(
+        error)
+
+    self.mox.ReplayAll()
     self.assertEqual(
-        static_files_handler.StaticContentHandler._filename_to_mtime_and_etag,
+        2, static_files_handler.StaticContentHandler.validate_cached_files())
+    self.mox.VerifyAll()
+    self.assertCachedMtimesAndEtags(
         {'/home/appdir/index.html': (12345.6, 'NDcyNDU2MzU1')})
 
+  def test_range(self):
+    url_map = appinfo.URLMap(url='/',
+                             static_files='index.html')
+
+    h = static_files_handler.StaticContentHandler(
+        root_path=None,
+        url_map=url_map,
+        url_pattern='/$')
+
+    os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
+    static_files_handler.StaticContentHandler._read_file(
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
+
+    self.mox.ReplayAll()
+    self.assertResponse('206 Partial Content',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
+                         'Content-length': '5',
+                         'Content-Range': 'bytes 6-10/12',
+                         'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
+                         'Cache-Control': 'no-cache',
+                         'ETag': '"NDcyNDU2MzU1"'},
+                        'World',
+                        h._handle_path,
+                        '/home/appdir/index.html',
+                        {'REQUEST_METHOD': 'GET',
+                         'HTTP_RANGE': 'bytes=6-10'})
+    self.mox.VerifyAll()
+
+  def test_suffix_range(self):
+    url_map = appinfo.URLMap(url='/',
+                             static_files='index.html')
+
+    h = static_files_handler.StaticContentHandler(
+        root_path=None,
+        url_map=url_map,
+        url_pattern='/$')
+
+    os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
+    static_files_handler.StaticContentHandler._read_file(
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
+
+    self.mox.ReplayAll()
+    self.assertResponse('206 Partial Content',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
+                         'Content-length': '6',
+                         'Content-Range': 'bytes 6-11/12',
+                         'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
+                         'Cache-Control': 'no-cache',
+                         'ETag': '"NDcyNDU2MzU1"'},
+                        'World!',
+                        h._handle_path,
+                        '/home/appdir/index.html',
+                        {'REQUEST_METHOD': 'GET',
+                         'HTTP_RANGE': 'bytes=-6'})
+    self.mox.VerifyAll()
+
+  def test_unsatisfiable_range(self):
+    url_map = appinfo.URLMap(url='/',
+                             static_files='index.html')
+
+    h = static_files_handler.StaticContentHandler(
+        root_path=None,
+        url_map=url_map,
+        url_pattern='/$')
+
+    os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
+    static_files_handler.StaticContentHandler._read_file(
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
+
+    self.mox.ReplayAll()
+    self.assertResponse('416 Requested Range Not Satisfiable',
+                        {'Content-Range': 'bytes */12',
+                         'ETag': '"NDcyNDU2MzU1"'},
+                        '',
+                        h._handle_path,
+                        '/home/appdir/index.html',
+                        {'REQUEST_METHOD': 'GET',
+                         'HTTP_RANGE': 'bytes=12-'})
+    self.mox.VerifyAll()
+
+  def test_range_with_if_range_without_match(self):
+    url_map = appinfo.URLMap(url='/',
+                             static_files='index.html')
+
+    h = static_files_handler.StaticContentHandler(
+        root_path=None,
+        url_map=url_map,
+        url_pattern='/$')
+
+    os.path.getmtime('/home/appdir/index.html').AndReturn(12345.6)
+    static_files_handler.StaticContentHandler._read_file(
+        '/home/appdir/index.html', mox.IgnoreArg()).AndReturn('Hello World!')
+
+    self.mox.ReplayAll()
+    self.assertResponse('200 OK',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
+                         'Content-length': '12',
+                         'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
+                         'Cache-Control': 'no-cache',
+                         'ETag': '"NDcyNDU2MzU1"'},
+                        'Hello World!',
+                        h._handle_path,
+                        '/home/appdir/index.html',
+                        {'REQUEST_METHOD': 'GET',
+                         'HTTP_RANGE': 'bytes=6-10',
+                         'HTTP_IF_RANGE': '"nomatch"'})
+    self.mox.VerifyAll()
+
+
+class TestStaticContentHandlerLargeFiles(wsgi_test_utils.WSGITestCase):
+  """Tests for serving files too large to be held in memory."""
+
+  def setUp(self):
+    self.mox = mox.Mox()
+    self.mox.StubOutWithMock(static_files_handler,
+                             '_MAX_CACHED_FILE_SIZE_BYTES')
+    static_files_handler._MAX_CACHED_FILE_SIZE_BYTES = 4
+    self.mox.StubOutWithMock(static_files_handler, '_STREAM_BLOCK_SIZE_BYTES')
+    static_files_handler._STREAM_BLOCK_SIZE_BYTES = 5
+    self.tmpdir = tempfile.mkdtemp()
+    self.full_path = os.path.join(self.tmpdir, 'index.html')
+    with open(self.full_path, 'wb') as f:
+      f.write('Hello World!')
+    url_map = appinfo.URLMap(url='/',
+                             static_files='index.html')
+    self.handler = static_files_handler.StaticContentHandler(
+        root_path=None,
+        url_map=url_map,
+        url_pattern='/$')
+
+  def tearDown(self):
+    static_files_handler.StaticContentHandler._content_cache.clear()
+    self.mox.UnsetStubs()
+    shutil.rmtree(self.tmpdir)
+
+  def test_large_file_streamed(self):
+    self.assertResponse('200 OK',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
+                         'Content-length': '12',
+                         'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
+                         'Cache-Control': 'no-cache',
+                         'ETag': '"NDcyNDU2MzU1"'},
+                        'Hello World!',
+                        self.handler._handle_path,
+                        self.full_path,
+                        {'REQUEST_METHOD': 'GET'})
+    entry = static_files_handler.StaticContentHandler._content_cache.get(
+        self.full_path)
+    self.assertEqual(12, entry.size)
+    self.assertIsNone(entry.data)
+
+  def test_large_file_range_streamed(self):
+    self.assertResponse('206 Partial Content',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
+                         'Content-length': '7',
+                         'Content-Range': 'bytes 4-10/12',
+                         'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
+                         'Cache-Control': 'no-cache',
+                         'ETag': '"NDcyNDU2MzU1"'},
+                        'o World',
+                        self.handler._handle_path,
+                        self.full_path,
+                        {'REQUEST_METHOD': 'GET',
+                         'HTTP_RANGE': 'bytes=4-10'})
+
+  def test_large_file_uses_file_wrapper(self):
+    wrapped = []
+
+    def file_wrapper(f, block_size):
+      wrapped.append(block_size)
+      return iter(lambda: f.read(block_size), '')
+
+    self.assertResponse('200 OK',
+                        {'Accept-Ranges': 'bytes',
+                         'Content-type': 'text/html',
+                         'Content-length': '12',
+                         'Expires': 'Fri, 01 Jan 1990 00:00:00 GMT',
+                         'Cache-Control': 'no-cache',
+                         'ETag': '"NDcyNDU2MzU1"'},
+                        'Hello World!',
+                        self.handler._handle_path,
+                        self.full_path,
+                        {'REQUEST_METHOD': 'GET',
+                         'wsgi.file_wrapper': file_wrapper})
+    self.assertEqual([5], wrapped)
+
+  def test_large_file_removed_after_caching(self):
+    url_map = appinfo.URLMap(url='/',
+                             static_files='index.html')
+    handler = static_files_handler.StaticContentHandler(
+        root_path=None,
+        url_map=url_map,
+        url_pattern='/$',
+        trust_cached_mtimes=True)
+    environ = {'REQUEST_METHOD': 'GET',
+               'wsgi.file_wrapper': lambda f, block_size: f}
+    handler._handle_path(self.full_path, environ, lambda *args: None).close()
+    os.remove(self.full_path)
+
+    self.assertResponse('404 Not Found', {}, '',
+                        handler._handle_path,
+                        self.full_path,
+                        environ)
+
+
+class TestStaticContentCache(unittest.TestCase):
+  """Tests for static_files_handler._StaticContentCache."""
+
+  def test_evicts_least_recently_used(self):
+    cache = static_files_handler._StaticContentCache(max_size_bytes=10,
+                                                     max_entries=10)
+    cache.put('/a', static_files_handler._CachedFile(1, 'a', 4, 'aaaa'))
+    cache.put('/b', static_files_handler._CachedFile(1, 'b', 4, 'bbbb'))
+    cache.get('/a')
+    cache.put('/c', static_files_handler._CachedFile(1, 'c', 4, 'cccc'))
+    self.assertIsNone(cache.get('/b'))
+    self.assertEqual('aaaa', cache.get('/a').data)
+    self.assertEqual('cccc', cache.get('/c').data)
+    self.assertEqual(8, cache.size_bytes)
+
+  def test_max_entries(self):
+    cache = static_files_handler._StaticContentCache(max_size_bytes=10,
+                                                     max_entries=2)
+    cache.put('/a', static_files_handler._CachedFile(1, 'a', 100, None))
+    cache.put('/b', static_files_handler._CachedFile(1, 'b', 100, None))
+    cache.put('/c', static_files_handler._CachedFile(1, 'c', 100, None))
+    self.assertEqual(2, len(cache))
+    self.assertIsNone(cache.get('/a'))
+    self.assertEqual(0, cache.size_bytes)
+
+  def test_replace(self):
+    cache = static_files_handler._StaticContentCache(max_size_bytes=10,
+                                                     max_entries=10)
+    cache.put('/a', static_files_handler._CachedFile(1, 'a', 4, 'aaaa'))
+    cache.put('/a', static_files_handler._CachedFile(2, 'a', 2, 'aa'))
+    self.assertEqual(2, cache.size_bytes)
+    self.assertEqual(1, len(cache))
+
 
 class TestStaticContentHandlerCheckEtagMatch(unittest.TestCase):
   """Tests for static_files_handler.StaticContentHandler._check_etag_match."""
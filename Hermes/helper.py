@@ -4,11 +4,15 @@ import json
 import logging
 import os
 import SOAPpy
+import socket
 import sys
 import threading
+import time
 import tornado.httpclient
 import urllib
 
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 from socket import error as socket_error
 
 import hermes_constants
@@ -36,14 +40,27 @@ TASK_STATUS_LOCK = threading.Lock()
 # A list of tasks that we report status for.
 REPORT_TASKS = ['backup', 'restore']
 
+# The thread pool used for requests to other nodes. It is shared between
+# calls so that requests which are still running do not pile up threads.
+REQUEST_POOL = None
+
+# Lock for creating REQUEST_POOL.
+REQUEST_POOL_LOCK = threading.Lock()
+
+# The most recent stats received from each node, and when they arrived.
+LAST_KNOWN_STATS = {}
+
 
 class JSONTags(object):
   """ A class containing all JSON tags used for Hermes functionality. """
   ALL_STATS = 'all_stats'
   BUCKET_NAME = 'bucket_name'
   BODY = 'body'
+  CODE = 'code'
   DEPLOYMENT_ID = 'deployment_id'
   ERROR = 'error'
+  LAST_KNOWN = 'last_known'
+  LAST_UPDATED = 'last_updated'
   OBJECT_NAME = 'object_name'
   REASON = 'reason'
   STATUS = 'status'
@@ -51,6 +68,7 @@ class JSONTags(object):
   SUCCESS = 'success'
   TASK_ID = 'task_id'
   TIMESTAMP = 'timestamp'
+  TIMEOUT = 'timeout'
   TYPE = 'type'
   UNREACHABLE = 'unreachable'
 
@@ -65,13 +83,14 @@ class NodeInfoTags(object):
   ROLE = 'role'
 
 
-def create_request(url=None, method=None, body=None):
+def create_request(url=None, method=None, body=None, headers=None):
   """ Creates a tornado.httpclient.HTTPRequest with the given parameters.
 
   Args:
     url: A str, the URL to call.
     method: A str, one of GET, POST.
     body: A JSON object, the encoded dictionary that will be posted as payload.
+    headers: A dictionary of additional HTTP headers.
   Returns:
     A tornado.httpclient.HTTPRequest object.
   Raises:
@@ -80,7 +99,8 @@ def create_request(url=None, method=None, body=None):
   if not url or not method:
     raise MissingRequestArgs
   return tornado.httpclient.HTTPRequest(url=url, method=method, body=body,
-    validate_cert=False, request_timeout=hermes_constants.REQUEST_TIMEOUT)
+    headers=headers, validate_cert=False,
+    request_timeout=hermes_constants.REQUEST_TIMEOUT)
 
 
 def urlfetch(request):
@@ -100,7 +120,8 @@ def urlfetch(request):
     logging.error("Error while trying to fetch '{0}': {1}".format(request.url,
       str(http_error)))
     result = {JSONTags.SUCCESS: False,
-      JSONTags.REASON: hermes_constants.HTTPError}
+      JSONTags.REASON: hermes_constants.HTTPError,
+      JSONTags.CODE: http_error.code}
   except Exception as exception:
     logging.exception("Exception while trying to fetch '{0}': {1}".format(
       request.url, str(exception)))
@@ -251,39 +272,149 @@ def delete_task_from_mem(task_id):
   TASK_STATUS_LOCK.release()
 
 
+def get_request_pool():
+  """ Returns the thread pool used for requests to other nodes.
+
+  Returns:
+    A ThreadPool with MAX_CONCURRENT_REQUESTS threads.
+  """
+  global REQUEST_POOL
+  with REQUEST_POOL_LOCK:
+    if REQUEST_POOL is None:
+      REQUEST_POOL = ThreadPool(hermes_constants.MAX_CONCURRENT_REQUESTS)
+    return REQUEST_POOL
+
+
+def run_concurrently(function, args_list, timeout):
+  """ Calls a function once for each set of arguments, running up to
+  MAX_CONCURRENT_REQUESTS calls at a time.
+
+  Calls that are still running after the timeout are left to finish in the
+  background, so a slow node does not hold up the others. The function
+  should bound its own run time, since it keeps a pool thread busy until it
+  returns.
+
+  Args:
+    function: The function to call.
+    args_list: A list of argument tuples.
+    timeout: The number of seconds to wait for all of the calls.
+  Returns:
+    A list containing an AsyncResult for each call.
+  """
+  pool = get_request_pool()
+  results = [pool.apply_async(function, args) for args in args_list]
+
+  deadline = time.time() + timeout
+  for result in results:
+    result.wait(max(deadline - time.time(), 0))
+  return results
+
+
+def get_node_stats(ip, secret):
+  """ Retrieves the stats from a node's AppController.
+
+  Args:
+    ip: A str, the IP address of the node.
+    secret: A str, the deployment secret.
+  Returns:
+    A dictionary containing the node's stats.
+  """
+  appcontroller_endpoint = "https://{}:{}".format(ip,
+    hermes_constants.APPCONTROLLER_PORT)
+  logging.debug("Connecting to AC at: {}".format(appcontroller_endpoint))
+  # SOAPpy does not pass its timeout to HTTPS connections, so rely on the
+  # default socket timeout to keep a node that hangs from holding a thread.
+  socket.setdefaulttimeout(hermes_constants.STATS_TIMEOUT)
+  # Do a SOAP call to the AppController on that IP to get stats.
+  server = SOAPpy.SOAPProxy(appcontroller_endpoint)
+  return json.loads(server.get_all_stats(secret))
+
+
 def get_all_stats():
-  """ Collects platform stats from all deployment nodes.
+  """ Collects platform stats from all deployment nodes concurrently.
 
   Returns:
-    A dictionary containing all the monitoring stats, if all nodes are
-    accessible. {"success": False, "error": message} otherwise.
+    A dictionary containing the monitoring stats for each node. Nodes that
+    could not be reached within STATS_TIMEOUT contain
+    {"error": reason, "last_known": stats, "last_updated": timestamp}, where
+    the last two fields are only present if the node has reported before.
   """
   all_stats = {}
 
   secret = appscale_info.get_secret()
   logging.debug("Retrieved deployment secret: {}".format(secret))
-  for ip in appscale_info.get_all_ips():
-    appcontroller_endpoint = "https://{}:{}".format(ip,
-      hermes_constants.APPCONTROLLER_PORT)
-    logging.debug("Connecting to AC at: {}".format(appcontroller_endpoint))
-    # Do a SOAP call to the AppController on that IP to get stats.
-    server = SOAPpy.SOAPProxy(appcontroller_endpoint)
+  ips = appscale_info.get_all_ips()
+  results = run_concurrently(get_node_stats, [(ip, secret) for ip in ips],
+                             hermes_constants.STATS_TIMEOUT)
+  for ip, result in zip(ips, results):
     try:
-      all_stats[ip] = json.loads(server.get_all_stats(secret))
-    except SOAPpy.SOAPException as soap_exception:
-      logging.exception("Exception while performing SOAP call to "
-        "{}".format(appcontroller_endpoint))
-      logging.exception(soap_exception)
-      all_stats[ip] = {JSONTags.ERROR: JSONTags.UNREACHABLE}
-    except socket_error as serr:
-      logging.error("Socket error while performing SOAP call to "
-        "{}".format(appcontroller_endpoint))
-      logging.error(serr)
-      all_stats[ip] = {JSONTags.ERROR: JSONTags.UNREACHABLE}
+      all_stats[ip] = result.get(0)
+      LAST_KNOWN_STATS[ip] = (time.time(), all_stats[ip])
+      continue
+    except TimeoutError:
+      logging.error("Timed out while getting stats from {}".format(ip))
+      error = JSONTags.TIMEOUT
+    except (SOAPpy.SOAPException, socket_error, ValueError) as error:
+      logging.error("Error while getting stats from {}: {}".format(ip, error))
+      error = JSONTags.UNREACHABLE
+
+    all_stats[ip] = {JSONTags.ERROR: error}
+    if ip in LAST_KNOWN_STATS:
+      last_updated, stats = LAST_KNOWN_STATS[ip]
+      all_stats[ip][JSONTags.LAST_KNOWN] = stats
+      all_stats[ip][JSONTags.LAST_UPDATED] = last_updated
 
   return all_stats
 
 
+def is_br_service_up(br_host):
+  """ Checks if a backup and recovery service is running.
+
+  Args:
+    br_host: A str, the URL of the br_service.
+  Returns:
+    True if the service reports that it is up, False otherwise.
+  """
+  http_client = tornado.httpclient.HTTPClient()
+  request = tornado.httpclient.HTTPRequest(br_host,
+    request_timeout=hermes_constants.BR_STATUS_TIMEOUT)
+  try:
+    response = http_client.fetch(request)
+    if json.loads(response.body)['status'] != 'up':
+      logging.warn('Backup and Recovery service at {} is not up.'
+        .format(br_host))
+      return False
+  except (socket_error, ValueError, tornado.httpclient.HTTPError):
+    logging.exception('Backup and Recovery service at {} is not up.'
+      .format(br_host))
+    return False
+  finally:
+    http_client.close()
+
+  return True
+
+
+def are_br_services_up(nodes):
+  """ Checks the backup and recovery service on every node concurrently.
+
+  Args:
+    nodes: A list of node dictionaries from get_node_info.
+  Returns:
+    True if every service is up, False otherwise.
+  """
+  results = run_concurrently(
+    is_br_service_up, [(node[NodeInfoTags.HOST],) for node in nodes],
+    hermes_constants.BR_STATUS_TIMEOUT)
+  for node, result in zip(nodes, results):
+    if not result.ready():
+      logging.warn('Backup and Recovery service at {} did not respond.'
+        .format(node[NodeInfoTags.HOST]))
+      return False
+    if not result.get():
+      return False
+  return True
+
+
 def report_status(task, task_id, status):
   """ Sends a status report for the given task to the AppScale Portal.
   Upon success, it calls a function to delete the task from memory.
@@ -17,13 +17,13 @@ import string
 import sys
 import tarfile
 import tornado.escape
-import tornado.httpclient
 import tornado.web
 import urllib
 
 from handlers import MainHandler
 from handlers import TaskHandler
 from helper import JSONTags
+from stats_payload import StatsEncoder
 
 from tornado.ioloop import IOLoop
 from tornado.ioloop import PeriodicCallback
@@ -39,6 +39,11 @@ import appscale_info
 import appscale_utils
 # Tornado web server options.
 define("port", default=hermes_constants.HERMES_PORT, type=int)
+define("stats_deltas", default=False, type=bool,
+  help="Send stats to the AppScale Portal as gzipped deltas")
+
+# Tracks the stats that the AppScale Portal has received.
+stats_encoder = StatsEncoder()
 
 def poll():
   """ Callback function that polls for new tasks based on a schedule. """
@@ -49,20 +54,8 @@ def poll():
 
   # If we can't reach the backup and recovery services, skip.
   nodes = helper.get_node_info()
-  http_client = tornado.httpclient.HTTPClient()
-  for node in nodes:
-    br_host = node[helper.NodeInfoTags.HOST]
-    request = tornado.httpclient.HTTPRequest(br_host)
-    try:
-      response = http_client.fetch(request)
-      if json.loads(response.body)['status'] != 'up':
-        logging.warn('Backup and Recovery service at {} is not up.'
-          .format(br_host))
-        return
-    except (socket.error, ValueError):
-      logging.exception('Backup and Recovery service at {} is not up.'
-        .format(br_host))
-      return
+  if not helper.are_br_services_up(nodes):
+    return
 
   logging.info("Polling for new task.")
 
@@ -115,6 +108,10 @@ def send_all_stats():
   # Send request to AppScale Portal.
   portal_path = hermes_constants.PORTAL_STATS_PATH.format(deployment_id)
   url = "{0}{1}".format(hermes_constants.PORTAL_URL, portal_path)
+  if options.stats_deltas and stats_encoder.enabled:
+    if send_stats_delta(url, deployment_id, all_stats):
+      return
+
   data = {
     JSONTags.DEPLOYMENT_ID: deployment_id,
     JSONTags.TIMESTAMP: datetime.datetime.utcnow(),
@@ -131,6 +128,45 @@ def send_all_stats():
     logging.error("Inaccessible resource: {}".format(url))
     return
 
+def send_stats_delta(url, deployment_id, all_stats):
+  """ Sends the changes since the last accepted stats to the AppScale Portal.
+
+  Args:
+    url: A str, the portal's stats URL.
+    deployment_id: A str, the deployment ID.
+    all_stats: A dictionary containing the stats for each node.
+  Returns:
+    True if the portal accepted the payload or could not be reached, False
+    if the full stats should be sent instead.
+  """
+  payload, body = stats_encoder.encode(deployment_id,
+    str(datetime.datetime.utcnow()), all_stats)
+  logging.debug("Sending stats delta to the AppScale Portal. Data: \n{}".
+    format(payload))
+
+  headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+  request = helper.create_request(url=url, method='POST', body=body,
+    headers=headers)
+  response = helper.urlfetch(request)
+
+  if response[JSONTags.SUCCESS]:
+    stats_encoder.acknowledge()
+    return True
+
+  code = response.get(JSONTags.CODE)
+  if code is None:
+    logging.error("Inaccessible resource: {}".format(url))
+    return True
+
+  # The portal does not have the snapshot that the delta is based on.
+  if code == hermes_constants.HTTP_Codes.HTTP_CONFLICT:
+    stats_encoder.resync()
+  else:
+    logging.warning("The AppScale Portal rejected a stats delta ({}). "
+      "Sending full stats from now on.".format(code))
+    stats_encoder.disable()
+  return False
+
 def deploy_sensor_app():
   """ Uploads the sensor app for registered deployments. """
 
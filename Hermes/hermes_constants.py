@@ -18,6 +18,9 @@ BR_SERVICE_PORT = "8423"
 # The br_service path for starting a new task.
 BR_SERVICE_PATH = "/"
 
+# The amount of time to wait for a br_service status check in seconds.
+BR_STATUS_TIMEOUT = 10
+
 # The suffix for backup files from a DB master node.
 DB_MASTER_OBJECT_NAME = '/cassandra/db_master.tar.gz'
 
@@ -67,6 +70,12 @@ SUPPORTED_TASKS = ['backup', 'restore']
 # The interval for sending deployment stats.
 STATS_INTERVAL = 60*1000    # 60 seconds.
 
+# The amount of time to wait for every node to report its stats in seconds.
+STATS_TIMEOUT = 30
+
+# The maximum number of nodes to contact at the same time.
+MAX_CONCURRENT_REQUESTS = 20
+
 # The interval for checking for registered deployments.
 UPLOAD_SENSOR_INTERVAL = 60*1000    # 60 seconds.
 
@@ -82,6 +91,7 @@ class HTTP_Codes(object):
   HTTP_OK = 200
   HTTP_BAD_REQUEST = 400
   HTTP_DENIED = 403
+  HTTP_CONFLICT = 409
   HTTP_INTERNAL_ERROR = 500
   HTTP_NOT_IMPLEMENTED = 501
 
@@ -0,0 +1,168 @@
+""" Encodes deployment stats for the AppScale Portal as deltas against the
+last snapshot that the portal accepted. """
+
+import gzip
+import json
+import StringIO
+
+# The payload type for a snapshot of every node's stats.
+FULL = 'full'
+
+# The payload type for the changes since the previous payload.
+DELTA = 'delta'
+
+
+class PayloadTags(object):
+  """ A class containing the keys used in stats payloads. """
+  ALL_STATS = 'all_stats'
+  BASE_SEQUENCE = 'base_sequence'
+  CHANGED = 'changed'
+  DEPLOYMENT_ID = 'deployment_id'
+  REMOVED = 'removed'
+  SEQUENCE = 'sequence'
+  TIMESTAMP = 'timestamp'
+  TYPE = 'type'
+
+
+def diff_stats(old, new, path=()):
+  """ Finds the fields that differ between two sets of stats.
+
+  Dictionaries are compared field by field. Any other value, including a
+  list, is replaced as a whole when it changes.
+
+  Args:
+    old: A dictionary containing the previous stats.
+    new: A dictionary containing the current stats.
+    path: A tuple containing the keys that lead to these dictionaries.
+  Returns:
+    A tuple containing a dictionary with only the new or changed fields and
+    a list of key paths for fields that were removed.
+  """
+  changed = {}
+  removed = [list(path + (key,)) for key in old if key not in new]
+  for key, value in new.iteritems():
+    if key not in old:
+      changed[key] = value
+    elif isinstance(value, dict) and isinstance(old[key], dict):
+      nested_changed, nested_removed = diff_stats(old[key], value,
+                                                  path + (key,))
+      if nested_changed:
+        changed[key] = nested_changed
+      removed.extend(nested_removed)
+    elif value != old[key]:
+      changed[key] = value
+
+  return changed, removed
+
+
+def apply_delta(stats, changed, removed):
+  """ Applies the output of diff_stats to a set of stats.
+
+  Args:
+    stats: A dictionary containing the previous stats. It is modified in
+      place.
+    changed: A dictionary containing the new or changed fields.
+    removed: A list of key paths for fields that were removed.
+  Returns:
+    The updated stats dictionary.
+  """
+  for key_path in removed:
+    parent = stats
+    for key in key_path[:-1]:
+      parent = parent[key]
+    del parent[key_path[-1]]
+
+  def merge(target, updates):
+    for key, value in updates.iteritems():
+      if isinstance(value, dict) and isinstance(target.get(key), dict):
+        merge(target[key], value)
+      else:
+        target[key] = value
+
+  merge(stats, changed)
+  return stats
+
+
+def compress(payload):
+  """ Serializes and gzips a payload.
+
+  Args:
+    payload: A JSON-serializable dictionary.
+  Returns:
+    A str containing the compressed JSON.
+  """
+  buf = StringIO.StringIO()
+  with gzip.GzipFile(fileobj=buf, mode='wb') as gzip_file:
+    gzip_file.write(json.dumps(payload, separators=(',', ':')))
+  return buf.getvalue()
+
+
+class StatsEncoder(object):
+  """ Tracks the stats that the portal has accepted and encodes new stats
+  as the changes since then. """
+
+  # The number of deltas to send before sending another full snapshot, which
+  # limits how long the portal can drift from the deployment's state.
+  FULL_SNAPSHOT_INTERVAL = 60
+
+  def __init__(self):
+    """ Constructor. """
+    self.sequence = 0
+    self.acknowledged = None
+    self.deltas_sent = 0
+    self.pending = None
+    self.enabled = True
+
+  def encode(self, deployment_id, timestamp, all_stats):
+    """ Builds the payload for the current stats.
+
+    Args:
+      deployment_id: A str, the deployment ID.
+      timestamp: A str, the time the stats were collected.
+      all_stats: A dictionary containing the stats for each node.
+    Returns:
+      A tuple containing the payload dictionary and its gzipped JSON.
+    """
+    self.sequence += 1
+    payload = {
+      PayloadTags.DEPLOYMENT_ID: deployment_id,
+      PayloadTags.TIMESTAMP: timestamp,
+      PayloadTags.SEQUENCE: self.sequence
+    }
+    if (self.acknowledged is None or
+        self.deltas_sent >= self.FULL_SNAPSHOT_INTERVAL):
+      payload[PayloadTags.TYPE] = FULL
+      payload[PayloadTags.ALL_STATS] = all_stats
+    else:
+      base_sequence, base_stats = self.acknowledged
+      changed, removed = diff_stats(base_stats, all_stats)
+      payload[PayloadTags.TYPE] = DELTA
+      payload[PayloadTags.BASE_SEQUENCE] = base_sequence
+      payload[PayloadTags.CHANGED] = changed
+      payload[PayloadTags.REMOVED] = removed
+
+    self.pending = (self.sequence, payload[PayloadTags.TYPE], all_stats)
+    return payload, compress(payload)
+
+  def acknowledge(self):
+    """ Records that the portal accepted the last payload. """
+    if self.pending is None:
+      return
+
+    sequence, payload_type, all_stats = self.pending
+    self.acknowledged = (sequence, json.loads(json.dumps(all_stats)))
+    if payload_type == FULL:
+      self.deltas_sent = 0
+    else:
+      self.deltas_sent += 1
+    self.pending = None
+
+  def resync(self):
+    """ Makes the next payload a full snapshot. """
+    self.acknowledged = None
+    self.pending = None
+
+  def disable(self):
+    """ Records that the portal does not accept these payloads. """
+    self.resync()
+    self.enabled = False
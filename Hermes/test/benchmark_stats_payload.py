@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+""" Compares the size of stats payloads sent to the AppScale Portal for a
+synthetic deployment. """
+import argparse
+import json
+import os
+import random
+import sys
+import urllib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from stats_payload import StatsEncoder
+
+
+def node_stats(index):
+  """ Builds stats that resemble what a node reports. """
+  return {
+    'cpu': {'idle': random.uniform(0, 100), 'user': random.uniform(0, 100),
+            'system': random.uniform(0, 100), 'count': 4},
+    'memory': {'total': 8 * 1024 ** 3, 'available': random.randint(0, 8e9),
+               'used': random.randint(0, 8e9)},
+    'disk': [{'/': {'total': 100 * 1024 ** 3, 'free': random.randint(0, 1e11),
+                    'used': random.randint(0, 1e11)}}],
+    'load': [random.random() for _ in range(3)],
+    'apps': {'app{}'.format(app): {'language': 'python27', 'appservers': 3}
+             for app in range(5)},
+    'services': {'service{}'.format(service): 'Running'
+                 for service in range(20)},
+    'public_ip': '10.0.{}.{}'.format(index // 256, index % 256),
+    'roles': ['appengine', 'load_balancer']
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--nodes', type=int, default=100,
+                      help='The number of nodes in the deployment')
+  parser.add_argument('--changed', type=int, default=10,
+                      help='The number of nodes whose CPU stats change')
+  args = parser.parse_args()
+
+  all_stats = {'10.0.0.{}'.format(index): node_stats(index)
+               for index in range(args.nodes)}
+  urlencoded = urllib.urlencode({
+    'deployment_id': 'id', 'timestamp': 'now',
+    'all_stats': json.dumps(all_stats)})
+
+  encoder = StatsEncoder()
+  _, full = encoder.encode('id', 'now', all_stats)
+  encoder.acknowledge()
+
+  for ip in random.sample(sorted(all_stats), min(args.changed, args.nodes)):
+    all_stats[ip]['cpu']['idle'] = random.uniform(0, 100)
+  _, delta = encoder.encode('id', 'now', all_stats)
+
+  print('URL-encoded JSON: {} bytes'.format(len(urlencoded)))
+  print('Gzipped full snapshot: {} bytes'.format(len(full)))
+  print('Gzipped delta: {} bytes'.format(len(delta)))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
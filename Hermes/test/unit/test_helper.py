@@ -2,11 +2,14 @@
 
 import os
 import Queue
+import socket
 import sys
 import threading
+import time
 import tornado.httpclient
 import unittest
 from flexmock import flexmock
+from socket import error as socket_error
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../../"))
 import helper
@@ -141,6 +144,71 @@ class TestHelper(unittest.TestCase):
       and_return()
     helper.delete_task_from_mem('foo')
 
+  def test_get_all_stats(self):
+    flexmock(appscale_info).should_receive('get_secret').and_return('secret')
+    flexmock(appscale_info).should_receive('get_all_ips').\
+      and_return(['1.1.1.1', '2.2.2.2', '3.3.3.3'])
+    flexmock(hermes_constants, STATS_TIMEOUT=0.5)
+    blocked = threading.Event()
+
+    def get_node_stats(ip, secret):
+      if ip == '2.2.2.2':
+        raise socket_error('Connection refused')
+      if ip == '3.3.3.3' and blocked.is_set():
+        time.sleep(2)
+      return {'cpu': ip}
+
+    flexmock(helper).should_receive('get_node_stats').\
+      replace_with(get_node_stats)
+    self.assertEquals({
+      '1.1.1.1': {'cpu': '1.1.1.1'},
+      '2.2.2.2': {'error': 'unreachable'},
+      '3.3.3.3': {'cpu': '3.3.3.3'}
+    }, helper.get_all_stats())
+
+    # A slow node does not hold up the others, and its last known stats are
+    # included with the error.
+    blocked.set()
+    all_stats = helper.get_all_stats()
+    self.assertEquals({'cpu': '1.1.1.1'}, all_stats['1.1.1.1'])
+    self.assertEquals('timeout', all_stats['3.3.3.3']['error'])
+    self.assertEquals({'cpu': '3.3.3.3'},
+                      all_stats['3.3.3.3']['last_known'])
+
+  def test_get_all_stats_with_hanging_node(self):
+    # A node that accepts connections but never responds.
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    self.addCleanup(listener.close)
+    self.addCleanup(socket.setdefaulttimeout, None)
+
+    flexmock(appscale_info).should_receive('get_secret').and_return('secret')
+    flexmock(appscale_info).should_receive('get_all_ips').\
+      and_return(['127.0.0.1'])
+    flexmock(hermes_constants, STATS_TIMEOUT=0.5,
+             APPCONTROLLER_PORT=listener.getsockname()[1])
+
+    self.assertIn('error', helper.get_all_stats()['127.0.0.1'])
+
+    # The call gives up on its own instead of keeping a pool thread busy.
+    result, = helper.run_concurrently(helper.get_node_stats,
+                                      [('127.0.0.1', 'secret')], 0)
+    self.assertFalse(result.ready())
+    result.wait(5)
+    self.assertTrue(result.ready())
+    self.assertRaises(socket_error, result.get)
+    self.assertIs(helper.get_request_pool(), helper.get_request_pool())
+
+  def test_are_br_services_up(self):
+    flexmock(helper).should_receive('is_br_service_up').\
+      with_args('http://node1').and_return(True)
+    flexmock(helper).should_receive('is_br_service_up').\
+      with_args('http://node2').and_return(False)
+    self.assertTrue(helper.are_br_services_up([{'host': 'http://node1'}]))
+    self.assertFalse(helper.are_br_services_up([{'host': 'http://node1'},
+                                                {'host': 'http://node2'}]))
+
   def test_report_status(self):
     pass
 
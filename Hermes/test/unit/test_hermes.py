@@ -26,6 +26,7 @@ from hermes import poll
 from hermes import send_all_stats
 from hermes import shutdown
 from hermes import signal_handler
+from stats_payload import StatsEncoder
 from tornado.ioloop import IOLoop
 
 class TestHelper(unittest.TestCase):
@@ -49,6 +50,7 @@ class TestHelper(unittest.TestCase):
     # Assume backup and recovery service is down.
     http_client = flexmock()
     http_client.should_receive('fetch').and_raise(socket.error)
+    http_client.should_receive('close')
     flexmock(tornado.httpclient).should_receive('HTTPClient').\
       and_return(http_client)
     poll()
@@ -82,10 +84,59 @@ class TestHelper(unittest.TestCase):
 
     fake_stats = {}
     flexmock(helper).should_receive('get_all_stats').and_return(fake_stats)
-    flexmock(helper).should_receive('create_request').and_return()
     flexmock(helper).should_receive('urlfetch').\
       and_return({"success": True, "body": {}})
+    flexmock(hermes, stats_encoder=StatsEncoder())
+
+    requests = []
+    flexmock(helper).should_receive('create_request').\
+      replace_with(lambda **kwargs: requests.append(kwargs))
+
+    # Stats are sent in the legacy format by default.
+    self.addCleanup(setattr, hermes.options, 'stats_deltas',
+                    hermes.options.stats_deltas)
+    hermes.options.stats_deltas = False
+    send_all_stats()
+    self.assertNotIn('headers', requests[-1])
+    self.assertIsNone(hermes.stats_encoder.acknowledged)
+
+    hermes.options.stats_deltas = True
+    del requests[:]
+    send_all_stats()
+    self.assertEquals(['gzip'],
+                      [request['headers']['Content-Encoding']
+                       for request in requests])
+    self.assertIsNotNone(hermes.stats_encoder.acknowledged)
+
+    # If the portal asks for a full snapshot, the legacy payload is sent now
+    # and the next delta is a full snapshot.
+    responses = [{"success": False, "reason": "HTTPError", "code": 409},
+                 {"success": True, "body": {}}]
+    flexmock(helper).should_receive('urlfetch').\
+      and_return(*responses).one_by_one()
+    del requests[:]
+    send_all_stats()
+    self.assertEquals([True, False],
+                      ['headers' in request for request in requests])
+    self.assertIsNone(hermes.stats_encoder.acknowledged)
+    self.assertTrue(hermes.stats_encoder.enabled)
+
+    # A portal that rejects deltas only receives legacy payloads afterwards.
+    responses = [{"success": False, "reason": "HTTPError", "code": 415},
+                 {"success": True, "body": {}}]
+    flexmock(helper).should_receive('urlfetch').\
+      and_return(*responses).one_by_one()
+    del requests[:]
+    send_all_stats()
+    self.assertEquals([True, False],
+                      ['headers' in request for request in requests])
+    self.assertFalse(hermes.stats_encoder.enabled)
+
+    flexmock(helper).should_receive('urlfetch').\
+      and_return({"success": True, "body": {}})
+    del requests[:]
     send_all_stats()
+    self.assertEquals([False], ['headers' in request for request in requests])
 
   def test_signal_handler(self):
     flexmock(IOLoop.instance()).should_receive('add_callback').and_return()\
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import gzip
+import json
+import os
+import StringIO
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../"))
+import stats_payload
+from stats_payload import StatsEncoder
+
+
+def decompress(body):
+  return json.loads(gzip.GzipFile(fileobj=StringIO.StringIO(body)).read())
+
+
+class TestStatsPayload(unittest.TestCase):
+  """ A set of test cases for encoding stats payloads. """
+
+  OLD = {
+    '1.1.1.1': {'cpu': {'idle': 90, 'user': 5}, 'disk': [1, 2],
+                'apps': {'app1': True}},
+    '2.2.2.2': {'cpu': {'idle': 50, 'user': 40}}
+  }
+  NEW = {
+    '1.1.1.1': {'cpu': {'idle': 80, 'user': 5}, 'disk': [1, 3], 'apps': {}},
+    '3.3.3.3': {'cpu': {'idle': 10, 'user': 70}}
+  }
+
+  def test_diff_stats(self):
+    changed, removed = stats_payload.diff_stats(self.OLD, self.NEW)
+    self.assertEquals({
+      '1.1.1.1': {'cpu': {'idle': 80}, 'disk': [1, 3]},
+      '3.3.3.3': {'cpu': {'idle': 10, 'user': 70}}
+    }, changed)
+    self.assertEquals(sorted([['2.2.2.2'], ['1.1.1.1', 'apps', 'app1']]),
+                      sorted(removed))
+
+    old = json.loads(json.dumps(self.OLD))
+    self.assertEquals(self.NEW,
+                      stats_payload.apply_delta(old, changed, removed))
+
+  def test_encoder(self):
+    encoder = StatsEncoder()
+    payload, body = encoder.encode('id', 'now', self.OLD)
+    self.assertEquals('full', payload['type'])
+    self.assertEquals(payload, decompress(body))
+
+    # Deltas are only sent once the portal accepts a snapshot.
+    payload, _ = encoder.encode('id', 'now', self.OLD)
+    self.assertEquals('full', payload['type'])
+    encoder.acknowledge()
+
+    payload, body = encoder.encode('id', 'now', self.NEW)
+    self.assertEquals('delta', payload['type'])
+    self.assertEquals(2, payload['base_sequence'])
+    self.assertEquals(3, payload['sequence'])
+    self.assertEquals(payload, decompress(body))
+
+    # Unacknowledged deltas are resent against the same base.
+    payload, _ = encoder.encode('id', 'now', self.NEW)
+    self.assertEquals(2, payload['base_sequence'])
+    encoder.acknowledge()
+    payload, _ = encoder.encode('id', 'now', self.NEW)
+    self.assertEquals({}, payload['changed'])
+    self.assertEquals([], payload['removed'])
+
+    encoder.resync()
+    payload, _ = encoder.encode('id', 'now', self.NEW)
+    self.assertEquals('full', payload['type'])
+
+  def test_full_snapshot_interval(self):
+    encoder = StatsEncoder()
+    encoder.FULL_SNAPSHOT_INTERVAL = 2
+    types = []
+    for _ in range(5):
+      payload, _ = encoder.encode('id', 'now', self.OLD)
+      encoder.acknowledge()
+      types.append(payload['type'])
+    self.assertEquals(['full', 'delta', 'delta', 'full', 'delta'], types)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -68,6 +68,23 @@ class BaseAgent:
     """
     raise NotImplementedError
 
+  def describe_instances(self, parameters):
+    """
+    Look up the virtual machines that are currently running with the given
+    parameters.
+
+    Args:
+      parameters  A dictionary of parameters
+
+    Returns:
+      A tuple of the form (public ips, private ips, instance ids), where
+      the items at the same index in each list belong to the same VM.
+
+    Raises:
+      AgentRuntimeException If the VMs could not be looked up
+    """
+    raise NotImplementedError
+
   def assert_required_parameters(self, parameters, operation):
     """
     Check whether all the platform specific parameters are present in the
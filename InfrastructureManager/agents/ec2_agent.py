@@ -7,6 +7,7 @@ import glob
 import os
 import time
 from utils import utils
+from utils.describe_cache import DescribeCache
 
 __author__ = 'hiranya'
 __email__ = 'hiranya@appscale.com'
@@ -25,11 +26,26 @@ class EC2Agent(BaseAgent):
   # started.
   MAX_VM_CREATION_TIME = 1800
 
-  # The amount of time that run_instances waits between each describe-instances
-  # request. Setting this value too low can cause Eucalyptus to interpret
-  # requests as replay attacks.
+  # The maximum amount of time that run_instances waits between each
+  # describe-instances request. Setting this value too low can cause
+  # Eucalyptus to interpret requests as replay attacks.
   SLEEP_TIME = 20
 
+  # The amount of time that run_instances waits before polling again after
+  # launching VMs. The wait doubles each time a poll finds that none of them
+  # are running, up to SLEEP_TIME. VMs in the same request tend to boot
+  # together, so once one is running the rest are polled for at this rate.
+  # Agents for clouds that limit the request rate override this.
+  INITIAL_POLL_INTERVAL = 2
+
+  # The amount of time that run_instances waits after launching VMs before
+  # the first describe-instances request.
+  LAUNCH_WAIT_TIME = INITIAL_POLL_INTERVAL
+
+  # Polls accept describe-instances results up to this many seconds old, so
+  # reservations using the same account share a single request.
+  MIN_DESCRIBE_INTERVAL = 2
+
   PARAM_CREDENTIALS = 'credentials'
   PARAM_GROUP = 'group'
   PARAM_IMAGE_ID = 'image_id'
@@ -178,7 +194,9 @@ class EC2Agent(BaseAgent):
     try:
       attempts = 1
       while True:
-        instances = self.__describe_instances(parameters)
+        # Instances that are already running must not be mistaken for the
+        # ones this request starts, so skip any cached result.
+        instances = self.__describe_instances(parameters, time.time())
         term_instance_info = self.__get_instance_info(instances,
           'terminated', keyname)
         if len(term_instance_info[2]):
@@ -200,6 +218,7 @@ class EC2Agent(BaseAgent):
         attempts += 1
 
       conn = self.open_connection(parameters)
+      launch_time = time.time()
       if spot == 'True':
         price = parameters[self.PARAM_SPOT_PRICE]
         conn.request_spot_instances(str(price), image_id, key_name=keyname,
@@ -226,15 +245,17 @@ class EC2Agent(BaseAgent):
       instance_ids = []
       public_ips = []
       private_ips = []
-      utils.sleep(10)
+      utils.sleep(self.LAUNCH_WAIT_TIME)
       end_time = datetime.datetime.now() + datetime.timedelta(0,
         self.MAX_VM_CREATION_TIME)
       now = datetime.datetime.now()
+      newer_than = launch_time
+      poll_interval = self.INITIAL_POLL_INTERVAL
 
       while now < end_time:
         time_left = (end_time - now).seconds
         utils.log('[{0}] {1} seconds left...'.format(now, time_left))
-        instances = self.__describe_instances(parameters)
+        instances = self.__describe_instances(parameters, newer_than)
         term_instance_info = self.__get_instance_info(instances,
           'terminated', keyname)
         if len(term_instance_info[2]):
@@ -250,8 +271,14 @@ class EC2Agent(BaseAgent):
         instance_ids = utils.diff(instance_ids, active_instances)
         if count == len(public_ips):
           break
-        time.sleep(self.SLEEP_TIME)
+
+        if public_ips:
+          poll_interval = self.INITIAL_POLL_INTERVAL
+        else:
+          poll_interval = min(poll_interval * 2, self.SLEEP_TIME)
+        time.sleep(poll_interval)
         now = datetime.datetime.now()
+        newer_than = time.time() - self.MIN_DESCRIBE_INTERVAL
 
       if not public_ips:
         self.handle_failure('No public IPs were able to be procured '
@@ -299,6 +326,28 @@ class EC2Agent(BaseAgent):
       utils.log('Instance {0} was terminated'.format(instance.id))
 
 
+  def describe_instances(self, parameters):
+    """
+    Look up the running instances that were started with the given
+    keyname. (Also see documentation for the BaseAgent class)
+
+    Args:
+      parameters  A dictionary of parameters
+
+    Returns:
+      A tuple of the form (public ips, private ips, instance ids)
+
+    Raises:
+      AgentRuntimeException If the instances could not be looked up
+    """
+    try:
+      instances = self.__describe_instances(parameters, time.time())
+    except EC2ResponseError as exception:
+      self.handle_failure('EC2 response error while describing instances: '
+        '{0}'.format(exception.error_message))
+    return self.__get_instance_info(instances, 'running',
+      parameters[self.PARAM_KEYNAME])
+
   def attach_disk(self, parameters, disk_name, instance_id):
     """ Attaches the Elastic Block Store volume specified in 'disk_name' to this
     virtual machine.
@@ -361,7 +410,7 @@ class EC2Agent(BaseAgent):
     utils.log(msg)
     raise AgentRuntimeException(msg)
 
-  def __describe_instances(self, parameters):
+  def __describe_instances(self, parameters, newer_than):
     """
     Query the back-end EC2 services for instance details and return
     a list of instances. This is equivalent to running the standard
@@ -369,16 +418,25 @@ class EC2Agent(BaseAgent):
     will contain all the running and pending instances and it might
     also contain some recently terminated instances.
 
+    Results are shared with other requests that use the same account, so
+    the back-end is only queried if the latest result is too old.
+
     Args:
       parameters  A dictionary of parameters
+      newer_than  A timestamp. Results fetched before this time are not used.
 
     Returns:
       A list of instances (element type definition in boto.ec2 package)
     """
-    conn = self.open_connection(parameters)
-    reservations = conn.get_all_instances()
-    instances = [i for r in reservations for i in r.instances]
-    return instances
+    def describe():
+      conn = self.open_connection(parameters)
+      reservations = conn.get_all_instances()
+      return [i for r in reservations for i in r.instances]
+
+    credentials = parameters[self.PARAM_CREDENTIALS]
+    account = (self.__class__.__name__, parameters.get(self.PARAM_REGION),
+      credentials.get('EC2_URL'), credentials.get('EC2_ACCESS_KEY'))
+    return DescribeCache.for_account(account).get(describe, newer_than)
 
   def __get_instance_info(self, instances, status, keyname):
     """
@@ -16,6 +16,12 @@ class EucalyptusAgent(EC2Agent):
   # The version of Eucalyptus API used to interact with Euca clouds
   EUCA_API_VERSION = '2010-08-31'
 
+  # Describe-instances requests that arrive close together can be rejected as
+  # replay attacks, so polls keep to the fixed interval.
+  INITIAL_POLL_INTERVAL = EC2Agent.SLEEP_TIME
+  MIN_DESCRIBE_INTERVAL = EC2Agent.SLEEP_TIME
+  LAUNCH_WAIT_TIME = 10
+
   def open_connection(self, parameters):
     """
     Initialize a connection to the back-end Eucalyptus APIs.
@@ -22,6 +22,11 @@ class OpenStackAgent(EC2Agent):
   # The default region.
   DEFAULT_REGION = "nova"
 
+  # Poll at the same fixed interval as the Eucalyptus agent.
+  INITIAL_POLL_INTERVAL = EC2Agent.SLEEP_TIME
+  MIN_DESCRIBE_INTERVAL = EC2Agent.SLEEP_TIME
+  LAUNCH_WAIT_TIME = 10
+
   def configure_instance_security(self, parameters):
     """
     Setup OpenStack security keys and groups. Required input values are 
@@ -9,6 +9,7 @@ from agents.factory import InfrastructureAgentFactory
 from utils import utils
 from utils.persistent_dictionary import PersistentDictionary
 from utils.persistent_dictionary import PersistentStoreFactory
+from warm_pool import WarmPool
 
 class InfrastructureManager:
   """
@@ -41,6 +42,9 @@ class InfrastructureManager:
   PARAM_INFRASTRUCTURE = 'infrastructure'
   PARAM_NUM_VMS = 'num_vms'
 
+  # Configuration parameter containing the store settings for the warm pool
+  PARAM_WARM_POOL_STORE = 'warm_pool_store'
+
   # States a particular VM deployment could be in
   STATE_PENDING = 'pending'
   STATE_RUNNING = 'running'
@@ -75,6 +79,8 @@ class InfrastructureManager:
     Args
       params    A dictionary of parameters. Optional parameter. If
                 specified it must at least include the 'store_type' parameter.
+                It may also include a 'warm_pool_store' dictionary with the
+                store settings for the VMs kept in the warm pool.
       blocking  Whether to operate in blocking mode or not. Optional
                 and defaults to false.
     """
@@ -85,8 +91,15 @@ class InfrastructureManager:
       store_factory = PersistentStoreFactory()
       store = store_factory.create_store(params)
       self.reservations = PersistentDictionary(store)
+      if params.has_key(self.PARAM_WARM_POOL_STORE):
+        pool_store = store_factory.create_store(
+          params[self.PARAM_WARM_POOL_STORE])
+        self.warm_pool = WarmPool(PersistentDictionary(pool_store))
+      else:
+        self.warm_pool = WarmPool()
     else:
       self.reservations = PersistentDictionary()
+      self.warm_pool = WarmPool()
 
   def describe_instances(self, parameters, secret):
     """
@@ -161,6 +174,11 @@ class InfrastructureManager:
     this method will simply kick off the VM deployment process and return
     immediately.
 
+    If the parameters include a 'warm_pool_size', that many VMs with the
+    same configuration are kept running in addition to the ones requested.
+    Later requests are served from this pool first, and the pool is
+    replenished in the background.
+
     Args:
       parameters  A parameter map containing the keys 'infrastructure',
                   'num_vms' and any other cloud platform specific
@@ -289,6 +307,50 @@ class InfrastructureManager:
       thread.start_new_thread(self.__kill_vms, (agent, parameters))
     return self.__generate_response(True, self.REASON_NONE)
 
+  def clear_warm_pool(self, parameters, secret):
+    """
+    Terminate the VMs kept ready for a configuration and stop replenishing
+    them. This is called when the deployment is torn down.
+
+    Args:
+      parameters  A dictionary of parameters containing the required
+                  'infrastructure' parameter and the parameters that
+                  identify the pool. Alternatively one may provide a valid
+                  JSON string instead of a dictionary object.
+      secret      A previously established secret
+
+    Returns:
+      A dictionary with the key 'success' set to True if the pool is being
+      cleared. Otherwise 'success' is set to False and 'reason' is set to a
+      simple error message.
+
+    Raises:
+      TypeError   If the inputs are not of the expected types
+      ValueError  If the input JSON string (parameters) cannot be parsed properly
+    """
+    parameters, secret = self.__validate_args(parameters, secret)
+
+    if self.secret != secret:
+      return self.__generate_response(False, self.REASON_BAD_SECRET)
+
+    for param in self.TERMINATE_INSTANCES_REQUIRED_PARAMS:
+      if not utils.has_parameter(param, parameters):
+        return self.__generate_response(False, 'no ' + param)
+
+    infrastructure = parameters[self.PARAM_INFRASTRUCTURE]
+    agent = self.agent_factory.create_agent(infrastructure)
+    try:
+      agent.assert_required_parameters(parameters,
+        BaseAgent.OPERATION_TERMINATE)
+    except AgentConfigurationException as exception:
+      return self.__generate_response(False, str(exception))
+
+    if self.blocking:
+      self.warm_pool.clear(agent, parameters)
+    else:
+      thread.start_new_thread(self.warm_pool.clear, (agent, parameters))
+    return self.__generate_response(True, self.REASON_NONE)
+
   def attach_disk(self, parameters, disk_name, instance_id, secret):
     """ Contacts the infrastructure named in 'parameters' and tells it to
     attach a persistent disk to this machine.
@@ -325,13 +387,18 @@ class InfrastructureManager:
       reservation_id  Reservation ID of the current run request
     """
     status_info = self.reservations.get(reservation_id)
+    self.warm_pool.resize(parameters)
+    ids, public_ips, private_ips = self.warm_pool.take(agent, parameters,
+      num_vms)
     try:
-      security_configured = agent.configure_instance_security(parameters)
-      instance_info = agent.run_instances(num_vms, parameters,
-        security_configured)
-      ids = instance_info[0]
-      public_ips = instance_info[1]
-      private_ips = instance_info[2]
+      if len(ids) < num_vms:
+        with self.warm_pool.launch_lock(parameters):
+          security_configured = agent.configure_instance_security(parameters)
+          instance_info = agent.run_instances(num_vms - len(ids), parameters,
+            security_configured)
+        ids = ids + instance_info[0]
+        public_ips = public_ips + instance_info[1]
+        private_ips = private_ips + instance_info[2]
       status_info['state'] = self.STATE_RUNNING
       status_info['vm_info'] = {
         'public_ips': public_ips,
@@ -340,9 +407,14 @@ class InfrastructureManager:
       }
       utils.log('Successfully finished request {0}.'.format(reservation_id))
     except AgentRuntimeException as exception:
+      self.warm_pool.put(parameters, ids, public_ips, private_ips)
       status_info['state'] = self.STATE_FAILED
       status_info['reason'] = str(exception)
     self.reservations.put(reservation_id, status_info)
+    if self.blocking:
+      self.warm_pool.replenish(agent, parameters)
+    else:
+      thread.start_new_thread(self.warm_pool.replenish, (agent, parameters))
 
 
   def __kill_vms(self, agent, parameters):
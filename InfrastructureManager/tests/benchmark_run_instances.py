@@ -0,0 +1,139 @@
+""" Measures how long EC2Agent.run_instances takes to notice that simulated
+VMs have booted, and how many describe-instances calls it makes, with fixed
+and adaptive polling. The fixed mode waits 10s after launching, then polls
+every SLEEP_TIME without sharing describe-instances results between
+requests.
+
+All times are multiplied by --scale so that the benchmark finishes quickly.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from agents.ec2_agent import EC2Agent
+from utils import utils
+from utils.describe_cache import DescribeCache
+
+
+class FakeInstance:
+  """ A VM that becomes running once its boot time has passed. """
+  def __init__(self, instance_id, key_name, ready_at):
+    self.id = instance_id
+    self.key_name = key_name
+    self.ready_at = ready_at
+    self.public_dns_name = 'public-{}'.format(instance_id)
+    self.private_dns_name = 'private-{}'.format(instance_id)
+
+  @property
+  def state(self):
+    return 'running' if time.time() >= self.ready_at else 'pending'
+
+
+class FakeReservation:
+  def __init__(self, instances):
+    self.instances = instances
+
+
+class FakeEC2Connection:
+  """ Simulates the EC2 API calls that run_instances makes. The VMs in each
+  request take a common base time to boot, plus some jitter for each VM. """
+  def __init__(self, min_boot_time, max_boot_time, jitter):
+    self.min_boot_time = min_boot_time
+    self.max_boot_time = max_boot_time
+    self.jitter = jitter
+    self.instances = []
+    self.describe_calls = 0
+    self.lock = threading.Lock()
+
+  def get_all_instances(self):
+    with self.lock:
+      self.describe_calls += 1
+      return [FakeReservation(list(self.instances))]
+
+  def run_instances(self, image_id, min_count, max_count, key_name, **kwargs):
+    with self.lock:
+      boot_time = random.uniform(self.min_boot_time, self.max_boot_time)
+      for _ in range(max_count):
+        ready_at = time.time() + boot_time + random.uniform(0, self.jitter)
+        self.instances.append(FakeInstance(
+          'i-{}'.format(len(self.instances)), key_name, ready_at))
+
+
+class FakeAgent(EC2Agent):
+  """ An EC2 agent that talks to a FakeEC2Connection. """
+  connection = None
+
+  def open_connection(self, parameters):
+    return self.connection
+
+
+def run_reservations(reservations, vms, scale):
+  """ Starts reservations concurrently and waits for them to finish.
+
+  Returns:
+    A list with the number of seconds between the last VM in each
+    reservation booting and run_instances returning.
+  """
+  delays = []
+
+  def reserve(index):
+    keyname = 'key-{}'.format(index)
+    parameters = {
+      'credentials': {'EC2_ACCESS_KEY': 'access', 'EC2_SECRET_KEY': 'secret'},
+      'group': 'group', 'image_id': 'image', 'instance_type': 'type',
+      'keyname': keyname, 'region': 'region', 'use_spot_instances': False,
+      'zone': 'zone'}
+    FakeAgent().run_instances(vms, parameters, True)
+    last_boot = max(instance.ready_at for instance in
+                    FakeAgent.connection.instances
+                    if instance.key_name == keyname)
+    delays.append((time.time() - last_boot) / scale)
+
+  threads = [threading.Thread(target=reserve, args=(index,))
+             for index in range(reservations)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return delays
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--reservations', type=int, default=5,
+                      help='The number of concurrent run_instances requests')
+  parser.add_argument('--vms', type=int, default=4,
+                      help='The number of VMs in each request')
+  parser.add_argument('--scale', type=float, default=.02,
+                      help='The factor to apply to every duration')
+  args = parser.parse_args()
+
+  utils.log = lambda msg: None
+  modes = [('fixed', 10, EC2Agent.SLEEP_TIME, 0),
+           ('adaptive', EC2Agent.LAUNCH_WAIT_TIME,
+            EC2Agent.INITIAL_POLL_INTERVAL, EC2Agent.MIN_DESCRIBE_INTERVAL)]
+  for (name, launch_wait_time, initial_poll_interval,
+       min_describe_interval) in modes:
+    FakeAgent.SLEEP_TIME = EC2Agent.SLEEP_TIME * args.scale
+    FakeAgent.LAUNCH_WAIT_TIME = launch_wait_time * args.scale
+    FakeAgent.INITIAL_POLL_INTERVAL = initial_poll_interval * args.scale
+    FakeAgent.MIN_DESCRIBE_INTERVAL = min_describe_interval * args.scale
+    FakeAgent.connection = FakeEC2Connection(
+      30 * args.scale, 90 * args.scale, 10 * args.scale)
+    DescribeCache.caches = {}
+
+    delays = run_reservations(args.reservations, args.vms, args.scale)
+    print('{}: {:.1f}s average and {:.1f}s max after the last VM booted, '
+          '{} describe-instances calls'.format(
+            name, sum(delays) / len(delays), max(delays),
+            FakeAgent.connection.describe_calls))
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,53 @@
+import threading
+import time
+from utils.describe_cache import DescribeCache
+try:
+  from unittest import TestCase
+except ImportError:
+  from unittest.case import TestCase
+
+class TestDescribeCache(TestCase):
+
+  def test_get(self):
+    cache = DescribeCache()
+    results = [['i-1'], ['i-1', 'i-2']]
+    describe = lambda: results.pop(0)
+
+    start = time.time()
+    self.assertEquals(['i-1'], cache.get(describe, start))
+    self.assertEquals(['i-1'], cache.get(describe, start - 10))
+    self.assertEquals(['i-1', 'i-2'], cache.get(describe, time.time()))
+    self.assertEquals(2, cache.calls)
+
+  def test_concurrent_callers_share_a_call(self):
+    cache = DescribeCache()
+    calls = []
+    def describe():
+      calls.append(1)
+      time.sleep(.2)
+      return ['i-1']
+
+    newer_than = time.time()
+    results = []
+    threads = [threading.Thread(
+      target=lambda: results.append(cache.get(describe, newer_than)))
+      for _ in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEquals([['i-1']] * 5, results)
+    self.assertEquals(1, len(calls))
+
+  def test_errors(self):
+    cache = DescribeCache()
+    def describe():
+      raise ValueError()
+    self.assertRaises(ValueError, cache.get, describe, time.time())
+    self.assertEquals(['i-1'], cache.get(lambda: ['i-1'], time.time()))
+
+  def test_for_account(self):
+    self.assertTrue(DescribeCache.for_account(('ec2', 'key')) is
+                    DescribeCache.for_account(('ec2', 'key')))
+    self.assertFalse(DescribeCache.for_account(('ec2', 'key')) is
+                     DescribeCache.for_account(('ec2', 'other key')))
@@ -1,3 +1,7 @@
+import time
+
+from agents.ec2_agent import EC2Agent
+from agents.euca_agent import EucalyptusAgent
 from boto.ec2.connection import EC2Connection
 from boto.ec2.instance import Reservation, Instance
 from boto.ec2.keypair import KeyPair
@@ -105,6 +109,52 @@ class TestEucaAgent(TestCase):
       .should_receive('write_key_file')
       .and_return())
 
+  def test_euca_polls_at_fixed_interval(self):
+    parameters = {
+      'credentials': {
+        'EC2_URL': 'http://testing.appscale.com:8773/foo/bar',
+        'EC2_ACCESS_KEY': 'poll_access_key', 'EC2_SECRET_KEY': 'secret_key'},
+      'group': 'boogroup',
+      'image_id': 'booid',
+      'instance_type': 'booinstance_type',
+      'keyname': 'bookeyname',
+      'use_spot_instances': False,
+      'zone': 'my-zone-1b'
+    }
+
+    def reservation(state):
+      result = Reservation()
+      result.instances = [flexmock(private_dns_name='private-ip',
+        public_dns_name='public-ip', id='i-id', state=state,
+        key_name='bookeyname')]
+      return [result]
+
+    (flexmock(EC2Connection)
+      .should_receive('get_all_instances')
+      .and_return([])
+      .and_return(reservation('pending'))
+      .and_return(reservation('pending'))
+      .and_return(reservation('running')))
+    flexmock(EC2Connection).should_receive('run_instances')
+
+    # Requests close together could be taken for replay attacks.
+    clock = [time.time()]
+    sleeps = []
+    def sleep(seconds):
+      sleeps.append(seconds)
+      clock[0] += seconds
+    def now():
+      clock[0] += .001
+      return clock[0]
+    flexmock(time).should_receive('time').replace_with(now)
+    flexmock(time).should_receive('sleep').replace_with(sleep)
+    flexmock(utils).should_receive('sleep').replace_with(sleep)
+
+    ids = EucalyptusAgent().run_instances(1, parameters, True)[0]
+    self.assertEquals(['i-id'], ids)
+    self.assertEquals([EucalyptusAgent.LAUNCH_WAIT_TIME] +
+                      [EC2Agent.SLEEP_TIME] * 2, sleeps)
+
   def tearDown(self):
     (flexmock(utils)
      .should_receive('get_secret')
@@ -0,0 +1,176 @@
+import os
+import shutil
+import tempfile
+import time
+
+from flexmock import flexmock
+
+from agents.base_agent import AgentRuntimeException
+from agents.base_agent import BaseAgent
+from infrastructure_manager import InfrastructureManager
+from utils import utils
+from utils.persistent_dictionary import FileSystemBasedPersistentStore
+from utils.persistent_dictionary import PersistentDictionary
+from warm_pool import WarmPool
+try:
+  from unittest import TestCase
+except ImportError:
+  from unittest.case import TestCase
+
+class FakeAgent(BaseAgent):
+  """
+  An agent whose VMs take boot_time seconds to start.
+  """
+
+  def __init__(self, boot_time=.2):
+    self.boot_time = boot_time
+    self.started = 0
+    self.running = []
+    self.launches = []
+    self.terminated = []
+    self.fail = False
+
+  def configure_instance_security(self, parameters):
+    return True
+
+  def run_instances(self, count, parameters, security_configured):
+    if self.fail:
+      raise AgentRuntimeException('no capacity')
+    time.sleep(self.boot_time)
+    ids = ['i-{0}'.format(self.started + index) for index in range(count)]
+    self.started += count
+    self.launches.append(count)
+    self.running.extend(ids)
+    return (ids, ['public-' + id for id in ids],
+            ['private-' + id for id in ids])
+
+  def terminate_instances(self, parameters):
+    self.terminated.extend(parameters['instance_ids'])
+    self.running = [id for id in self.running
+                    if id not in parameters['instance_ids']]
+
+  def describe_instances(self, parameters):
+    return (['public-' + id for id in self.running],
+            ['private-' + id for id in self.running], list(self.running))
+
+  def assert_required_parameters(self, parameters, operation):
+    pass
+
+
+class TestWarmPool(TestCase):
+
+  def setUp(self):
+    flexmock(utils).should_receive('get_secret').and_return('secret')
+    flexmock(utils).should_receive('log')
+    self.agent = FakeAgent()
+    self.manager = InfrastructureManager(blocking=True)
+    flexmock(self.manager.agent_factory).should_receive('create_agent').\
+      and_return(self.agent)
+    self.parameters = {
+      'infrastructure': 'fake',
+      'keyname': 'key',
+      'zone': 'zone-a',
+      'warm_pool_size': '2'
+    }
+
+  def run_vms(self, num_vms, **extra):
+    parameters = dict(self.parameters, num_vms=str(num_vms), **extra)
+    reservation = self.manager.run_instances(parameters, 'secret')
+    return self.manager.describe_instances(
+      {'reservation_id': reservation['reservation_id']}, 'secret')
+
+  def test_run_instances_uses_pool(self):
+    # The first request waits for its VM, and the pool is filled afterwards.
+    result = self.run_vms(1)
+    self.assertEquals(InfrastructureManager.STATE_RUNNING, result['state'])
+    self.assertEquals(['i-0'], result['vm_info']['instance_ids'])
+    self.assertEquals([1, 2], self.agent.launches)
+
+    # Later requests take pooled VMs before starting new ones, and the pool
+    # is filled again afterwards.
+    self.agent.boot_time = 0
+    result = self.run_vms(3)
+    self.assertEquals(['i-1', 'i-2', 'i-3'], result['vm_info']['instance_ids'])
+    self.assertEquals(['public-i-1', 'public-i-2', 'public-i-3'],
+                      result['vm_info']['public_ips'])
+    self.assertEquals([1, 2, 1, 2], self.agent.launches)
+
+  def test_take_does_not_wait_for_boot(self):
+    self.run_vms(1)
+    self.agent.boot_time = 5
+    start = time.time()
+    ids, public_ips, private_ips = self.manager.warm_pool.take(
+      self.agent, self.parameters, 2)
+    self.assertTrue(time.time() - start < 1)
+    self.assertEquals(['i-1', 'i-2'], ids)
+    self.assertEquals(['public-i-1', 'public-i-2'], public_ips)
+    self.assertEquals(['private-i-1', 'private-i-2'], private_ips)
+
+  def test_pool_depends_on_configuration(self):
+    self.run_vms(1)
+    result = self.run_vms(1, zone='zone-b')
+    self.assertEquals(['i-3'], result['vm_info']['instance_ids'])
+
+  def test_no_pool_by_default(self):
+    del self.parameters['warm_pool_size']
+    self.run_vms(1)
+    self.run_vms(1)
+    self.assertEquals([1, 1], self.agent.launches)
+
+  def test_failed_run_returns_vms_to_pool(self):
+    self.run_vms(1)
+    self.agent.fail = True
+    result = self.run_vms(3)
+    self.assertEquals(InfrastructureManager.STATE_FAILED, result['state'])
+    self.assertEquals(['i-1', 'i-2'], self.manager.warm_pool.take(
+      self.agent, self.parameters, 5)[0])
+
+  def test_take_drops_stopped_vms(self):
+    self.run_vms(1)
+    self.agent.running.remove('i-1')
+    self.assertEquals(['i-2'], self.manager.warm_pool.take(
+      self.agent, self.parameters, 2)[0])
+    self.assertEquals([], self.manager.warm_pool.take(
+      self.agent, self.parameters, 2)[0])
+
+  def test_terminated_vms_are_not_pooled(self):
+    self.run_vms(2)
+    self.manager.warm_pool.take(self.agent, self.parameters, 2)
+
+    parameters = dict(self.parameters, instance_ids=['i-0', 'i-1'])
+    self.manager.terminate_instances(parameters, 'secret')
+    self.assertEquals(['i-0', 'i-1'], self.agent.terminated)
+    self.assertEquals([], self.manager.warm_pool.take(
+      self.agent, self.parameters, 5)[0])
+
+  def test_clear_warm_pool(self):
+    self.run_vms(1)
+    self.manager.clear_warm_pool(self.parameters, 'secret')
+    self.assertEquals(['i-1', 'i-2'], self.agent.terminated)
+
+    # The pool is not replenished once it is cleared.
+    del self.parameters['warm_pool_size']
+    self.run_vms(1)
+    self.assertEquals([1, 2, 1], self.agent.launches)
+
+  def test_shrinking_pool_terminates_vms(self):
+    self.run_vms(1)
+    result = self.run_vms(1, warm_pool_size='0')
+    self.assertEquals(['i-1'], result['vm_info']['instance_ids'])
+    self.assertEquals(['i-2'], self.agent.terminated)
+    self.assertEquals([1, 2], self.agent.launches)
+
+  def test_pool_is_persisted(self):
+    directory = tempfile.mkdtemp()
+    try:
+      store = FileSystemBasedPersistentStore(
+        {'file_path': os.path.join(directory, 'pool.json')})
+      pool = WarmPool(PersistentDictionary(store))
+      pool.resize(self.parameters)
+      pool.replenish(self.agent, self.parameters)
+
+      pool = WarmPool(PersistentDictionary(store))
+      self.assertEquals(['i-0', 'i-1'],
+                        pool.take(self.agent, self.parameters, 2)[0])
+    finally:
+      shutil.rmtree(directory)
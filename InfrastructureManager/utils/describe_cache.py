@@ -0,0 +1,84 @@
+import time
+from threading import Condition
+from threading import Lock
+
+class DescribeCache:
+  """
+  Caches the result of a describe-instances call so that every reservation
+  polling the same cloud account can share it. Concurrent callers wait for
+  a call that is already in progress instead of starting their own.
+  """
+
+  # Caches shared by all agents, keyed by cloud account.
+  caches = {}
+
+  # Guards the creation of entries in caches.
+  caches_lock = Lock()
+
+  def __init__(self):
+    """
+    Create a new, empty cache.
+    """
+    self.condition = Condition()
+    self.instances = None
+    self.fetched_at = None
+    self.fetching = False
+    self.calls = 0
+
+  @classmethod
+  def for_account(cls, key):
+    """
+    Return the cache shared by everyone using a given cloud account.
+
+    Args:
+      key       A hashable value that identifies the cloud account
+
+    Returns:
+      A DescribeCache instance
+    """
+    with cls.caches_lock:
+      if key not in cls.caches:
+        cls.caches[key] = cls()
+      return cls.caches[key]
+
+  def get(self, describe, newer_than):
+    """
+    Return the instances as they were at or after the given time, calling
+    describe only if the cached result is older than that.
+
+    Args:
+      describe    A function that returns a list of instances
+      newer_than  A timestamp. Results from calls that started before this
+                  time are not returned.
+
+    Returns:
+      A list of instances
+
+    Raises:
+      Any exception raised by the describe function
+    """
+    with self.condition:
+      while True:
+        if self.instances is not None and self.fetched_at >= newer_than:
+          return list(self.instances)
+        if not self.fetching:
+          break
+        self.condition.wait()
+      self.fetching = True
+
+    started = time.time()
+    try:
+      instances = describe()
+    except Exception:
+      with self.condition:
+        self.fetching = False
+        self.condition.notify_all()
+      raise
+
+    with self.condition:
+      self.instances = instances
+      self.fetched_at = started
+      self.fetching = False
+      self.calls += 1
+      self.condition.notify_all()
+    return list(instances)
@@ -0,0 +1,279 @@
+from threading import Lock
+
+from agents.base_agent import AgentRuntimeException
+from utils import utils
+from utils.persistent_dictionary import PersistentDictionary
+
+class WarmPool:
+  """
+  Keeps a number of booted VMs ready for each cloud configuration so that
+  run requests can be served without waiting for the cloud to start new
+  ones. The pooled VMs are tracked in a PersistentDictionary, keyed by the
+  parameters that determine what kind of VM a request gets. Each entry
+  holds the desired pool size and the VMs that are currently available.
+  Only freshly started VMs enter a pool, so VMs handed out never carry
+  state from an earlier role.
+  """
+
+  # The run_instances parameter that sets the number of VMs to keep ready.
+  PARAM_POOL_SIZE = 'warm_pool_size'
+
+  # The parameter that lists the VMs to terminate.
+  PARAM_INSTANCE_IDS = 'instance_ids'
+
+  # Parameters that must match for a pooled VM to be handed out.
+  KEY_PARAMS = (
+    'infrastructure',
+    'region',
+    'zone',
+    'keyname',
+    'group',
+    'image_id',
+    'instance_type'
+  )
+
+  def __init__(self, pool=None):
+    """
+    Create a new warm pool.
+
+    Args:
+      pool  A PersistentDictionary to track pooled VMs in (Optional). If
+            not specified the pool is only kept in memory.
+    """
+    if pool is None:
+      pool = PersistentDictionary()
+    self.pool = pool
+    self.lock = Lock()
+    self.launch_locks = {}
+    self.replenishing = set()
+
+  def key_for(self, parameters):
+    """
+    Return the pool key for the VMs described by a set of parameters.
+
+    Args:
+      parameters  A dictionary of parameters
+
+    Returns:
+      A string that identifies the kind of VM requested
+    """
+    return ':'.join(str(parameters.get(param) or '')
+                    for param in self.KEY_PARAMS)
+
+  def __get_entry(self, key):
+    """
+    Return the pool entry for a key, creating an empty one if needed. The
+    caller must hold the lock.
+
+    Args:
+      key   A pool key
+
+    Returns:
+      A dictionary containing 'size' and 'instances'
+    """
+    if self.pool.has_key(key):
+      return self.pool.get(key)
+    return {'size': 0, 'instances': []}
+
+  def resize(self, parameters):
+    """
+    Update the desired size of a pool if the parameters specify one.
+
+    Args:
+      parameters  A dictionary of run_instances parameters
+    """
+    size = parameters.get(self.PARAM_POOL_SIZE)
+    if size is None:
+      return
+
+    key = self.key_for(parameters)
+    with self.lock:
+      entry = self.__get_entry(key)
+      if entry['size'] != int(size):
+        entry['size'] = max(int(size), 0)
+        self.pool.put(key, entry)
+
+  def launch_lock(self, parameters):
+    """
+    Return a lock that serializes VM launches for a pool. Agents such as
+    the EC2 agent find the VMs they started by comparing instances with the
+    same keyname before and after launching, so a request could claim VMs
+    that are being started for the pool at the same time. Configurations
+    without a pool get a new lock each time, so their launches can still
+    overlap.
+
+    Args:
+      parameters  A dictionary of parameters
+
+    Returns:
+      A Lock instance
+    """
+    key = self.key_for(parameters)
+    with self.lock:
+      if self.__get_entry(key)['size'] == 0:
+        return Lock()
+      if key not in self.launch_locks:
+        self.launch_locks[key] = Lock()
+      return self.launch_locks[key]
+
+  def take(self, agent, parameters, count):
+    """
+    Remove up to count VMs from a pool. The cloud is asked which pooled VMs
+    are still running first, and any that are not are dropped from the
+    pool.
+
+    Args:
+      agent       Infrastructure agent for the pool's cloud
+      parameters  A dictionary of run_instances parameters
+      count       The number of VMs requested
+
+    Returns:
+      A tuple containing a list of instance IDs, a list of public IP
+      addresses and a list of private IP addresses. The lists may be
+      shorter than count, or empty.
+    """
+    key = self.key_for(parameters)
+    with self.lock:
+      checked = [instance['id']
+                 for instance in self.__get_entry(key)['instances']]
+    if not checked:
+      return [], [], []
+
+    try:
+      public_ips, private_ips, instance_ids = agent.describe_instances(
+        parameters)
+    except AgentRuntimeException as exception:
+      utils.log('Unable to check the warm pool: {0}'.format(str(exception)))
+      return [], [], []
+    running = dict(zip(instance_ids, zip(public_ips, private_ips)))
+
+    with self.lock:
+      entry = self.__get_entry(key)
+      # VMs added after the check are kept until the next one.
+      stopped = [instance for instance in entry['instances']
+                 if instance['id'] in checked and
+                 instance['id'] not in running]
+      available = [instance for instance in entry['instances']
+                   if instance not in stopped]
+      taken = available[:count]
+      if stopped or taken:
+        entry['instances'] = available[count:]
+        self.pool.put(key, entry)
+
+    if stopped:
+      utils.log('Dropped {0} VMs that are no longer running from the warm '
+        'pool.'.format(len(stopped)))
+    if taken:
+      utils.log('Took {0} VMs from the warm pool.'.format(len(taken)))
+    # Addresses can change while a VM waits in the pool.
+    for instance in taken:
+      if instance['id'] in running:
+        instance['public_ip'], instance['private_ip'] = running[instance['id']]
+    return ([instance['id'] for instance in taken],
+            [instance['public_ip'] for instance in taken],
+            [instance['private_ip'] for instance in taken])
+
+  def put(self, parameters, ids, public_ips, private_ips):
+    """
+    Add VMs to a pool.
+
+    Args:
+      parameters  A dictionary of parameters
+      ids         A list of instance IDs
+      public_ips  A list of public IP addresses, one for each instance
+      private_ips A list of private IP addresses, one for each instance
+    """
+    key = self.key_for(parameters)
+    with self.lock:
+      entry = self.__get_entry(key)
+      for index in range(len(ids)):
+        entry['instances'].append({
+          'id': ids[index],
+          'public_ip': public_ips[index],
+          'private_ip': private_ips[index]
+        })
+      self.pool.put(key, entry)
+
+  def clear(self, agent, parameters):
+    """
+    Terminate every VM in a pool and stop keeping VMs ready for its
+    configuration.
+
+    Args:
+      agent       Infrastructure agent for the pool's cloud
+      parameters  A dictionary of parameters
+    """
+    key = self.key_for(parameters)
+    with self.lock:
+      entry = self.__get_entry(key)
+      ids = [instance['id'] for instance in entry['instances']]
+      self.pool.put(key, {'size': 0, 'instances': []})
+
+    if ids:
+      utils.log('Terminating {0} VMs in the warm pool.'.format(len(ids)))
+      terminate_parameters = parameters.copy()
+      terminate_parameters[self.PARAM_INSTANCE_IDS] = ids
+      agent.terminate_instances(terminate_parameters)
+
+  def replenish(self, agent, parameters):
+    """
+    Start VMs until a pool reaches its desired size, and terminate any
+    VMs above that size. Only one replenish operation runs for each pool
+    at a time; other calls return immediately.
+
+    Args:
+      agent       Infrastructure agent for the pool's cloud
+      parameters  A dictionary of run_instances parameters
+    """
+    key = self.key_for(parameters)
+    with self.lock:
+      if key in self.replenishing:
+        return
+      self.replenishing.add(key)
+
+    try:
+      missing = self.__trim(agent, parameters)
+      if missing > 0:
+        utils.log('Starting {0} VMs for the warm pool.'.format(missing))
+        with self.launch_lock(parameters):
+          security_configured = agent.configure_instance_security(parameters)
+          ids, public_ips, private_ips = agent.run_instances(
+            missing, parameters, security_configured)
+        self.put(parameters, ids, public_ips, private_ips)
+        # The pool may have been resized or cleared while the VMs started.
+        self.__trim(agent, parameters)
+    except AgentRuntimeException as exception:
+      utils.log('Unable to replenish the warm pool: {0}'.format(
+        str(exception)))
+    finally:
+      with self.lock:
+        self.replenishing.discard(key)
+
+  def __trim(self, agent, parameters):
+    """
+    Terminate any VMs above a pool's desired size.
+
+    Args:
+      agent       Infrastructure agent for the pool's cloud
+      parameters  A dictionary of parameters
+
+    Returns:
+      The number of VMs the pool is missing
+    """
+    key = self.key_for(parameters)
+    with self.lock:
+      entry = self.__get_entry(key)
+      missing = entry['size'] - len(entry['instances'])
+      excess = []
+      if missing < 0:
+        excess = [instance['id'] for instance in entry['instances'][missing:]]
+        entry['instances'] = entry['instances'][:missing]
+        self.pool.put(key, entry)
+
+    if excess:
+      utils.log('Terminating {0} VMs above the warm pool size.'.format(
+        len(excess)))
+      terminate_parameters = parameters.copy()
+      terminate_parameters[self.PARAM_INSTANCE_IDS] = excess
+      agent.terminate_instances(terminate_parameters)
+    return missing
@@ -11,10 +11,14 @@ import yaml
 
 import constants
 import file_io
+from file_cache import FileCache
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../AppServer'))
 from google.appengine.api.appcontroller_client import AppControllerClient
 
+# Keeps the deployment's configuration files in memory until they change.
+config_files = FileCache()
+
 def read_file_contents(path):
   """ Reads the contents of the given file.
 
@@ -27,10 +31,10 @@ def read_file_contents(path):
 def get_appcontroller_client():
   """ Returns an AppControllerClient instance for this deployment. """
   head_node_ip_file = '/etc/appscale/head_node_ip'
-  head_node = read_file_contents(head_node_ip_file).rstrip('\n')
+  head_node = config_files.read(head_node_ip_file).rstrip('\n')
 
   secret_file = '/etc/appscale/secret.key'
-  secret = read_file_contents(secret_file)
+  secret = config_files.read(secret_file)
 
   return AppControllerClient(head_node, secret)
 
@@ -44,7 +48,7 @@ def get_all_ips():
   Returns:
     A list of node IPs.
   """
-  nodes = file_io.read(constants.ALL_IPS_LOC)
+  nodes = config_files.read(constants.ALL_IPS_LOC)
   nodes = nodes.split('\n')
   return filter(None, nodes)
 
@@ -54,7 +58,7 @@ def get_login_ip():
   Returns:
     String containing the public IP of the head node.
   """
-  return file_io.read(constants.LOGIN_IP_LOC).rstrip()
+  return config_files.read(constants.LOGIN_IP_LOC).rstrip()
 
 def get_private_ip():
   """ Get the private IP of the current machine.
@@ -62,7 +66,7 @@ def get_private_ip():
   Returns:
     String containing the private IP of the current machine.
   """
-  return file_io.read(constants.PRIVATE_IP_LOC).rstrip()
+  return config_files.read(constants.PRIVATE_IP_LOC).rstrip()
 
 def get_public_ip():
   """ Get the public IP of the current machine.
@@ -70,7 +74,7 @@ def get_public_ip():
   Returns:
     String containing the public IP of the current machine.
   """
-  return file_io.read(constants.PUBLIC_IP_LOC).rstrip()
+  return config_files.read(constants.PUBLIC_IP_LOC).rstrip()
 
 def get_secret():
   """ Get AppScale shared security key for authentication.
@@ -78,7 +82,7 @@ def get_secret():
   Returns:
     String containing the secret key.
   """
-  return file_io.read(constants.SECRET_LOC).rstrip()
+  return config_files.read(constants.SECRET_LOC).rstrip()
  
 def get_num_cpus():
   """ Get the number of CPU processes on the current machine.
@@ -94,8 +98,7 @@ def get_db_info():
   Returns:
     A dictionary with database info
   """
-  info = file_io.read(constants.DB_INFO_LOC) 
-  return yaml.load(info) 
+  return config_files.read(constants.DB_INFO_LOC, yaml.load)
 
 def get_taskqueue_nodes():
   """ Returns a list of all the taskqueue nodes (including the master). 
@@ -104,7 +107,7 @@ def get_taskqueue_nodes():
   Returns:
     A list of taskqueue nodes.
   """
-  nodes = file_io.read(constants.TASKQUEUE_NODE_FILE)
+  nodes = config_files.read(constants.TASKQUEUE_NODE_FILE)
   nodes = nodes.split('\n')
   if nodes[-1] == '':
     nodes = nodes[:-1]
@@ -128,8 +131,7 @@ def get_zk_locations_string():
     None is returned if there was a problem getting the location string.
   """
   try:
-    info = file_io.read(constants.ZK_LOCATIONS_JSON_FILE) 
-    zk_json = json.loads(info) 
+    zk_json = config_files.read(constants.ZK_LOCATIONS_JSON_FILE, json.loads)
     return ":2181,".join(zk_json['locations']) + ":2181"
   except IOError, io_error:
     logging.exception(io_error)
@@ -152,8 +154,7 @@ def get_zk_node_ips():
     AppScale deployment.
   """
   try:
-    info = file_io.read(constants.ZK_LOCATIONS_JSON_FILE)
-    zk_json = json.loads(info)
+    zk_json = config_files.read(constants.ZK_LOCATIONS_JSON_FILE, json.loads)
     return zk_json['locations']
   except IOError, io_error:
     logging.exception(io_error)
@@ -174,7 +175,7 @@ def get_db_master_ip():
   Returns:
     A str, the IP of the datastore master.
   """
-  return file_io.read(constants.MASTERS_FILE_LOC).rstrip()
+  return config_files.read(constants.MASTERS_FILE_LOC).rstrip()
 
 def get_db_slave_ips():
   """ Returns the slave datastore IPs.
@@ -182,7 +183,7 @@ def get_db_slave_ips():
   Returns:
     A list of IP of the datastore slaves.
   """
-  nodes = file_io.read(constants.SLAVES_FILE_LOC).rstrip()
+  nodes = config_files.read(constants.SLAVES_FILE_LOC).rstrip()
   nodes = nodes.split('\n')
   if nodes[-1] == '':
     nodes = nodes[:-1]
@@ -204,7 +205,7 @@ def get_search_location():
     is not available.
   """
   try:
-    return file_io.read(constants.SEARCH_FILE_LOC).rstrip()
+    return config_files.read(constants.SEARCH_FILE_LOC).rstrip()
   except IOError:
     logging.warning("Search role is not configured.")
     return ""
@@ -0,0 +1,235 @@
+""" Caches the contents of configuration files until they change.
+
+The directory of each cached file is watched with inotify, and a background
+thread drops entries as soon as their files are modified, replaced, or
+removed. Files are only cached when they exist and their directory can be
+watched, so on systems without inotify every read goes to disk.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import threading
+
+import file_io
+
+# inotify event masks from <sys/inotify.h>.
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0x80000
+
+# The events that invalidate the files in a watched directory.
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF)
+
+# The header of each inotify event: wd, mask, cookie, and name length.
+EVENT_HEADER = struct.Struct('iIII')
+
+# The number of bytes to read from the inotify file descriptor at once.
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+def load_libc():
+  """ Loads the C library functions that manage inotify watches.
+
+  Returns:
+    A ctypes library, or None if inotify is not available.
+  """
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1
+    libc.inotify_add_watch
+  except (AttributeError, OSError):
+    return None
+  return libc
+
+
+def copy_value(value):
+  """ Copies the dictionaries and lists in a parsed configuration file.
+
+  This is much faster than copy.deepcopy for the plain values that JSON and
+  YAML parsers return.
+
+  Args:
+    value: A parsed value.
+  Returns:
+    A copy of value that shares only its immutable parts.
+  """
+  if isinstance(value, dict):
+    return {key: copy_value(item) for key, item in value.iteritems()}
+  if isinstance(value, list):
+    return [copy_value(item) for item in value]
+  return value
+
+
+class FileCache(object):
+  """ Stores file contents, optionally parsed, until inotify reports a
+  change to the file. """
+  def __init__(self):
+    """ Constructor. """
+    self._libc = load_libc()
+    self._lock = threading.Lock()
+    self._reset()
+
+  def _reset(self):
+    """ Clears all entries and watches for the current process. """
+    self._pid = os.getpid()
+    self._entries = {}
+    self._watched_dirs = {}
+    self._changes = 0
+    self._inotify_fd = None
+
+  def _watch(self, directory):
+    """ Starts watching a directory if it is not already watched.
+
+    Args:
+      directory: A string containing the directory's path.
+    Returns:
+      A boolean indicating whether or not changes to the directory's files
+      will be reported.
+    """
+    if directory in self._watched_dirs.values():
+      return True
+
+    if self._libc is None:
+      return False
+
+    if self._inotify_fd is None:
+      inotify_fd = self._libc.inotify_init1(IN_CLOEXEC)
+      if inotify_fd < 0:
+        logging.warning('Unable to initialize inotify: {}'.format(
+          os.strerror(ctypes.get_errno())))
+        self._libc = None
+        return False
+
+      self._inotify_fd = inotify_fd
+      watcher = threading.Thread(target=self._process_events,
+                                 args=(inotify_fd,))
+      watcher.daemon = True
+      watcher.start()
+
+    wd = self._libc.inotify_add_watch(self._inotify_fd, directory, WATCH_MASK)
+    if wd < 0:
+      error = ctypes.get_errno()
+      if error != errno.ENOENT:
+        logging.warning('Unable to watch {}: {}'.format(
+          directory, os.strerror(error)))
+      return False
+
+    self._watched_dirs[wd] = directory
+    return True
+
+  def _process_events(self, inotify_fd):
+    """ Drops cache entries as their files change.
+
+    Args:
+      inotify_fd: The inotify file descriptor to read events from.
+    """
+    while True:
+      try:
+        data = os.read(inotify_fd, EVENT_BUFFER_SIZE)
+      except OSError as error:
+        if error.errno == errno.EINTR:
+          continue
+        logging.exception('Unable to read inotify events')
+        return
+
+      offset = 0
+      while offset < len(data):
+        wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset:offset + name_length].rstrip('\0')
+        offset += name_length
+        self._invalidate(wd, mask, name)
+
+  def _invalidate(self, wd, mask, name):
+    """ Drops the entries affected by an inotify event.
+
+    Args:
+      wd: An integer identifying the watched directory.
+      mask: An integer describing the event.
+      name: A string containing the name of the file that changed, or an
+        empty string if the event is for the directory itself.
+    """
+    with self._lock:
+      self._changes += 1
+      directory = self._watched_dirs.get(wd)
+      if mask & IN_Q_OVERFLOW:
+        self._entries.clear()
+        return
+
+      if mask & IN_IGNORED:
+        self._watched_dirs.pop(wd, None)
+
+      if directory is None:
+        return
+
+      if name:
+        path = os.path.join(directory, name)
+        stale = [key for key in self._entries if key[0] == path]
+      else:
+        stale = [key for key in self._entries
+                 if os.path.dirname(key[0]) == directory]
+
+      for key in stale:
+        del self._entries[key]
+
+  def read(self, path, parse=None):
+    """ Returns the contents of a file.
+
+    Args:
+      path: A string containing the file's absolute path.
+      parse: A function to apply to the contents. Its result is cached too.
+    Returns:
+      The contents of the file, passed through parse if it is given. Mutable
+      results are copies, so callers can modify them.
+    Raises:
+      IOError if the file cannot be read.
+    """
+    key = (path, parse)
+
+    # Watches and the event thread do not survive a fork, and the lock may
+    # have been held by another thread when the process forked.
+    if os.getpid() != self._pid:
+      if self._inotify_fd is not None:
+        os.close(self._inotify_fd)
+      self._lock = threading.Lock()
+      self._reset()
+
+    with self._lock:
+      try:
+        value = self._entries[key]
+      except KeyError:
+        watched = (os.path.isfile(path) and
+                   self._watch(os.path.dirname(path)))
+        changes = self._changes
+      else:
+        return copy_value(value)
+
+    contents = file_io.read(path)
+    value = contents if parse is None else parse(contents)
+    if watched:
+      with self._lock:
+        # Skip caching if the file may have changed while it was being read.
+        if changes == self._changes:
+          self._entries[key] = value
+          value = copy_value(value)
+
+    return value
+
+  def clear(self):
+    """ Drops every entry. """
+    with self._lock:
+      self._entries.clear()
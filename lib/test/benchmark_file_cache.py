@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+""" Compares the per-call cost of reading deployment configuration files
+from disk and from the inotify-backed cache. """
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+import file_cache
+import file_io
+
+DB_INFO = """---
+:keyname: appscale
+:replication: "1"
+:table: cassandra
+"""
+
+ZK_LOCATIONS = json.dumps({'locations': ['10.0.0.1', '10.0.0.2', '10.0.0.3'],
+                           'last_updated_at': 0})
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--calls', type=int, default=10000,
+                      help='The number of lookups to time for each file')
+  args = parser.parse_args()
+
+  directory = tempfile.mkdtemp()
+  try:
+    files = [('secret.key', 'secret', None),
+             ('zookeeper_locations.json', ZK_LOCATIONS, json.loads),
+             ('database_info.yaml', DB_INFO, yaml.load)]
+    cache = file_cache.FileCache()
+    for name, contents, parse in files:
+      path = os.path.join(directory, name)
+      file_io.write(path, contents)
+      parse = parse or (lambda contents: contents)
+
+      uncached = timeit.timeit(lambda: parse(file_io.read(path)),
+                               number=args.calls)
+      cached = timeit.timeit(lambda: cache.read(path, parse),
+                             number=args.calls)
+      print('{}: {:.1f}us from disk, {:.1f}us cached'.format(
+        name, uncached / args.calls * 1e6, cached / args.calls * 1e6))
+  finally:
+    shutil.rmtree(directory)
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from flexmock import flexmock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../"))
+import file_cache
+import file_io
+
+class TestFileCache(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'locations.json')
+    file_io.write(self.path, json.dumps({'locations': ['ip1']}))
+    self.cache = file_cache.FileCache()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def wait_for(self, expected):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+      value = self.cache.read(self.path, json.loads)
+      if value == expected:
+        return value
+      time.sleep(.01)
+    return value
+
+  def test_read(self):
+    flexmock(file_io).should_call('read').once()
+    self.assertEquals({'locations': ['ip1']},
+                      self.cache.read(self.path, json.loads))
+
+    # Callers can modify the results without affecting the cache.
+    self.cache.read(self.path, json.loads)['locations'].append('ip2')
+    self.assertEquals({'locations': ['ip1']},
+                      self.cache.read(self.path, json.loads))
+
+  def test_changes(self):
+    self.assertEquals({'locations': ['ip1']},
+                      self.cache.read(self.path, json.loads))
+
+    file_io.write(self.path, json.dumps({'locations': ['ip2']}))
+    self.assertEquals({'locations': ['ip2']},
+                      self.wait_for({'locations': ['ip2']}))
+
+    # Files replaced by a rename are picked up as well.
+    new_path = os.path.join(self.directory, 'new.json')
+    file_io.write(new_path, json.dumps({'locations': ['ip3']}))
+    os.rename(new_path, self.path)
+    self.assertEquals({'locations': ['ip3']},
+                      self.wait_for({'locations': ['ip3']}))
+
+    os.remove(self.path)
+    self.assertRaises(IOError, self.cache.read, self.path)
+
+  def test_missing_files_are_not_cached(self):
+    path = os.path.join(self.directory, 'missing')
+    flexmock(file_io).should_receive('read').and_return('1').and_return('2')
+    self.assertEquals('1', self.cache.read(path))
+    self.assertEquals('2', self.cache.read(path))
+
+  def test_without_inotify(self):
+    flexmock(file_cache).should_receive('load_libc').and_return(None)
+    cache = file_cache.FileCache()
+    flexmock(file_io).should_call('read').twice()
+    cache.read(self.path)
+    cache.read(self.path)
+
+if __name__ == "__main__":
+  unittest.main()
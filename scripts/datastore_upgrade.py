@@ -6,15 +6,20 @@ import math
 import os
 import subprocess
 import sys
+import threading
 import time
 
+from multiprocessing.pool import ThreadPool
+
 from appscale.datastore import appscale_datastore_batch
 from appscale.datastore import dbconstants
+from appscale.datastore import groomer
 from appscale.datastore.dbconstants import APP_ENTITY_SCHEMA
 from appscale.datastore.dbconstants import APP_ENTITY_TABLE
 from appscale.datastore.dbconstants import ID_KEY_LENGTH
 from appscale.datastore.dbconstants import TOMBSTONE
 from appscale.datastore.cassandra_env import cassandra_interface
+from appscale.datastore.cassandra_env.get_token import is_entity
 from appscale.datastore.zkappscale import zktransaction as zk
 from appscale.datastore.zkappscale.zktransaction import ZK_SERVER_CMD_LOCATIONS
 from appscale.datastore.zkappscale.zktransaction import ZKInternalException
@@ -36,6 +41,15 @@ BATCH_SIZE = 100
 # Log progress every time this many seconds have passed.
 LOG_PROGRESS_FREQUENCY = 30
 
+# The number of threads that validate entities.
+WORKERS = 8
+
+# The number of key ranges the entity table is divided into.
+RANGE_COUNT = WORKERS * 4
+
+# The path in ZooKeeper where the progress of each range is stored.
+UPGRADE_RANGES_PATH = '/appscale/datastore_upgrade_ranges'
+
 # Monit watch name for Cassandra.
 CASSANDRA_WATCH_NAME = "cassandra"
 
@@ -177,150 +191,392 @@ def get_zk_locations_string(zk_location_ips):
   return (":" + str(zk.DEFAULT_PORT) + ",").join(zk_location_ips) + ":" + str(zk.DEFAULT_PORT)
 
 
-def validate_and_update_entities(db_access, zookeeper, log_postfix,
-                                 total_entities):
-  """ Validates entities in batches of BATCH_SIZE, deletes tombstoned
-  entities (if any) and updates invalid entities.
+class UpgradeRange(object):
+  """ A part of the entity table that one worker validates. """
+  def __init__(self, name, start_key, end_key):
+    """ Constructor.
+
+    Args:
+      name: A string used as the range's ZooKeeper node name.
+      start_key: The key before the first row in the range (exclusive).
+      end_key: The last key in the range (inclusive).
+    """
+    self.name = name
+    self.start_key = start_key
+    self.end_key = end_key
+    self.last_key = start_key
+    self.done = False
+    self.checked = 0
+    self.app_ids = set()
+
+  def encode(self):
+    """ Serializes the range's checkpoint.
+
+    Returns:
+      A JSON string.
+    """
+    return json.dumps({
+      'start': groomer.encode_key(self.start_key),
+      'end': groomer.encode_key(self.end_key),
+      'last': groomer.encode_key(self.last_key),
+      'done': self.done,
+      'checked': self.checked,
+      'apps': sorted(self.app_ids)
+    })
+
+  @classmethod
+  def decode(cls, name, data):
+    """ Restores a range from its checkpoint.
+
+    Args:
+      name: A string containing the range's ZooKeeper node name.
+      data: A JSON string produced by encode.
+    Returns:
+      An UpgradeRange object.
+    """
+    checkpoint = json.loads(data)
+    upgrade_range = cls(name, groomer.decode_key(checkpoint['start']),
+                        groomer.decode_key(checkpoint['end']))
+    upgrade_range.last_key = groomer.decode_key(checkpoint['last'])
+    upgrade_range.done = checkpoint['done']
+    upgrade_range.checked = checkpoint['checked']
+    upgrade_range.app_ids = set(app_id.encode('utf-8')
+                                for app_id in checkpoint['apps'])
+    return upgrade_range
+
+
+def sample_entity_keys(db_ips, keyname):
+  """ Collects a sample of entity keys from each database node.
+
   Args:
-    db_access: A reference to the batch datastore interface.
-    zookeeper: A reference to ZKTransaction, which communicates with
-      ZooKeeper on the given host.
-    log_postfix: An identifier for the status log.
-    total_entities: A string containing an entity count or None.
+    db_ips: A list of database node IPs.
+    keyname: A string containing the deployment's keyname.
+  Returns:
+    A sorted list of entity keys.
   """
-  last_key = ""
-  entities_checked = 0
-  last_logged = time.time()
-  while True:
-    logging.debug("Fetching {} entities".format(BATCH_SIZE))
-    entities = get_entity_batch(last_key, db_access, BATCH_SIZE)
+  sample_cmd = '{} rangekeysample'.format(cassandra_interface.NODE_TOOL)
+  keys = set()
+  for ip in db_ips:
+    try:
+      output = utils.ssh(ip, keyname, sample_cmd,
+                         method=subprocess.check_output)
+    except subprocess.CalledProcessError:
+      logging.warning('Unable to sample keys on {}'.format(ip))
+      continue
 
-    if not entities:
-      break
+    for line in output.splitlines()[1:]:
+      try:
+        key = line.strip().decode('hex')
+      except TypeError:
+        continue
+      if is_entity(key):
+        keys.add(key)
 
-    for entity in entities:
-      process_entity(entity, db_access, zookeeper)
+  return sorted(keys)
 
-    last_key = entities[-1].keys()[0]
-    entities_checked += len(entities)
 
-    if time.time() > last_logged + LOG_PROGRESS_FREQUENCY:
-      progress = str(entities_checked)
-      if total_entities is not None:
-        progress += '/{}'.format(total_entities)
-      message = 'Processed {} entities'.format(progress)
-      logging.info(message)
-      write_to_json_file({'status': 'inProgress', 'message': message},
-                         log_postfix)
-      last_logged = time.time()
+def create_ranges(zookeeper, split_points):
+  """ Divides the entity table into ranges and stores their checkpoints.
 
+  Args:
+    zookeeper: A reference to ZKTransaction.
+    split_points: A sorted list of keys to divide the table at.
+  Returns:
+    A list of UpgradeRange objects.
+  """
+  zookeeper.delete_recursive(UPGRADE_RANGES_PATH)
+  boundaries = [''] + split_points + [dbconstants.TERMINATING_STRING]
+  ranges = []
+  for index in range(len(boundaries) - 1):
+    upgrade_range = UpgradeRange('{:04d}'.format(index), boundaries[index],
+                                 boundaries[index + 1])
+    save_range(zookeeper, upgrade_range)
+    ranges.append(upgrade_range)
+
+  # A pass is only resumed once all of its ranges have been created.
+  zookeeper.update_node(UPGRADE_RANGES_PATH, str(len(ranges)))
+  logging.info('Divided the entity table into {} ranges'.format(len(ranges)))
+  return ranges
+
+
+def load_ranges(zookeeper):
+  """ Fetches the checkpoints from an interrupted upgrade.
 
-def get_entity_batch(last_key, datastore, batch_size):
-  """ Gets a batch of entities to operate on.
   Args:
-    last_key: The last key from a previous query.
-    datastore: A reference to the batch datastore interface.
-    batch_size: The max number of entities retrieved in the datastore request.
+    zookeeper: A reference to ZKTransaction.
   Returns:
-    A list of entities with a limit of batch_size.
+    A list of UpgradeRange objects, or None if there is nothing to resume.
   """
-  return datastore.range_query(APP_ENTITY_TABLE, APP_ENTITY_SCHEMA, last_key,
-    "", batch_size, start_inclusive=False)
+  node = zookeeper.get_node(UPGRADE_RANGES_PATH)
+  if not node or not node[0].isdigit():
+    return None
+
+  ranges = []
+  for name in sorted(zookeeper.get_children(UPGRADE_RANGES_PATH)):
+    data = zookeeper.get_node('/'.join([UPGRADE_RANGES_PATH, name]))
+    if data:
+      ranges.append(UpgradeRange.decode(name, data[0]))
+
+  if len(ranges) != int(node[0]):
+    return None
+
+  return ranges
 
 
-def validate_row(app_id, row, zookeeper, db_access):
-  """ Fetch the valid version of a given entity.
+def save_range(zookeeper, upgrade_range):
+  """ Stores a range's checkpoint.
 
   Args:
-    app_id: A string containing the application ID.
-    row: A dictionary containing a row from the entities table.
-    zookeeper: A handler for making ZooKeeper operations.
-    db_access: A handler for making database operations.
+    zookeeper: A reference to ZKTransaction.
+    upgrade_range: An UpgradeRange object.
+  """
+  zookeeper.update_node('/'.join([UPGRADE_RANGES_PATH, upgrade_range.name]),
+                        upgrade_range.encode())
+
+
+def validate_range(upgrade_range, db_access, zookeeper, progress):
+  """ Validates the entities in a range, saving a checkpoint after each batch.
+
+  Args:
+    upgrade_range: An UpgradeRange object.
+    db_access: A reference to the batch datastore interface.
+    zookeeper: A reference to ZKTransaction.
+    progress: A dictionary containing the number of entities checked and a
+      lock that protects it.
+  """
+  while not upgrade_range.done:
+    entities = db_access.range_query(
+      APP_ENTITY_TABLE, APP_ENTITY_SCHEMA, upgrade_range.last_key,
+      upgrade_range.end_key, BATCH_SIZE, start_inclusive=False)
+
+    if entities:
+      process_entities(entities, db_access, zookeeper)
+      upgrade_range.last_key = entities[-1].keys()[0]
+      upgrade_range.checked += len(entities)
+      for entity in entities:
+        upgrade_range.app_ids.add(
+          entity.keys()[0].split(dbconstants.KEY_DELIMITER)[0])
+      with progress['lock']:
+        progress['checked'] += len(entities)
+
+    if len(entities) < BATCH_SIZE:
+      upgrade_range.done = True
+
+    save_range(zookeeper, upgrade_range)
+
+
+def validate_and_update_entities(db_access, zookeeper, log_postfix,
+                                 total_entities, split_points=()):
+  """ Validates entities in parallel key ranges, deletes tombstoned entities
+  (if any) and updates invalid entities. Progress is saved in ZooKeeper so
+  that an interrupted upgrade resumes where it left off.
+  Args:
+    db_access: A reference to the batch datastore interface.
+    zookeeper: A reference to ZKTransaction, which communicates with
+      ZooKeeper on the given host.
+    log_postfix: An identifier for the status log.
+    total_entities: A string containing an entity count or None.
+    split_points: A sorted list of keys to divide the entity table at.
   Returns:
-    An dictionary with a valid entity row or None.
+    A set of application IDs that have entities.
   """
-  row_key = row.keys()[0]
-  entity = row.values()[0]
+  ranges = load_ranges(zookeeper)
+  if ranges is None:
+    ranges = create_ranges(zookeeper, list(split_points))
+  else:
+    logging.info('Resuming the upgrade from {} saved ranges'.format(
+      len(ranges)))
+
+  progress = {'checked': sum(upgrade_range.checked for upgrade_range in ranges),
+              'lock': threading.Lock()}
+  pending = [upgrade_range for upgrade_range in ranges
+             if not upgrade_range.done]
+  pool = ThreadPool(WORKERS)
+  result = pool.map_async(
+    lambda upgrade_range: validate_range(upgrade_range, db_access, zookeeper,
+                                         progress),
+    pending)
+  pool.close()
+
+  start = time.time()
+  start_checked = progress['checked']
+  while not result.ready():
+    result.wait(LOG_PROGRESS_FREQUENCY)
+    checked = progress['checked']
+    rate = (checked - start_checked) / max(time.time() - start, 1)
+    progress_message = str(checked)
+    if total_entities is not None:
+      progress_message += '/{}'.format(total_entities)
+    message = 'Processed {} entities ({:.1f} entities/s)'.format(
+      progress_message, rate)
+    logging.info(message)
+    write_to_json_file({'status': 'inProgress', 'message': message},
+                       log_postfix)
+
+  pool.join()
+  # Re-raise any error from the workers. The checkpoints allow the next
+  # attempt to skip the work that finished.
+  result.get()
+
+  app_ids = set()
+  for upgrade_range in ranges:
+    app_ids.update(upgrade_range.app_ids)
+  zookeeper.delete_recursive(UPGRADE_RANGES_PATH)
+  return app_ids
+
+
+def clean_up_indexes(db_access, zookeeper, app_ids, trusted_apps=()):
+  """ Deletes index entries that do not match their entities and disables
+  query-time index validation for the applications that opted in.
 
-  # If there is no transaction ID for the record, assume it is valid.
-  if APP_ENTITY_SCHEMA[1] not in entity:
-    return row
+  Args:
+    db_access: A reference to the batch datastore interface.
+    zookeeper: A reference to ZKTransaction, which communicates with
+      ZooKeeper on the given host.
+    app_ids: A set of application IDs whose indexes have been cleaned.
+    trusted_apps: A list of application IDs that should skip index
+      validation once their indexes are clean.
+  """
+  db_info = appscale_info.get_db_info()
+  ds_groomer = groomer.DatastoreGroomer(zookeeper, db_info[':table'], None)
+  ds_groomer.db_access = db_access
+  # Entity statistics are not needed here.
+  ds_groomer.create_ranges([task['id'] for task in ds_groomer.scan_tasks()
+                            if task['id'] != ds_groomer.CLEAN_ENTITIES_TASK])
+  ds_groomer.groom_ranges()
+  incomplete = [groomer_range.name for groomer_range in ds_groomer.load_ranges()
+                if groomer_range.failed or not groomer_range.done]
+  zookeeper.delete_recursive(ds_groomer.GROOMER_RANGES_PATH)
+  logging.info('Removed {} invalid index entries'.format(
+    ds_groomer.index_entries_cleaned))
+
+  # Invalid entries may remain in ranges that were not fully scanned.
+  if incomplete and trusted_apps:
+    logging.error('Leaving index validation enabled because ranges {} were '
+                  'not fully cleaned'.format(incomplete))
+    return
 
-  row_txn = long(entity[APP_ENTITY_SCHEMA[1]])
-  valid_txn = zookeeper.get_valid_transaction_id(app_id, row_txn, row_key)
+  for app_id in trusted_apps:
+    if app_id not in app_ids:
+      logging.warning('No entities found for {}'.format(app_id))
+    zookeeper.disable_index_validation(app_id)
+    logging.info('Disabled index validation for {}'.format(app_id))
 
-  # If the transaction ID is valid, the entity is valid.
-  if row_txn == valid_txn:
-    return row
 
-  # A transaction ID of 0 indicates that the entity doesn't exist yet.
-  if valid_txn == 0:
-    return None
+def validate_rows(rows, zookeeper, db_access):
+  """ Fetch the valid version of each entity in a batch.
 
-  padded_version = str(valid_txn).zfill(ID_KEY_LENGTH)
-  journal_key = dbconstants.KEY_DELIMITER.join([row_key, padded_version])
+  Args:
+    rows: A list of dictionaries containing rows from the entities table.
+    zookeeper: A handler for making ZooKeeper operations.
+    db_access: A handler for making database operations.
+  Returns:
+    A dictionary mapping each row key to a valid entity row or None.
+  """
+  valid_rows = {}
+  journal_keys = {}
+  for row in rows:
+    row_key = row.keys()[0]
+    entity = row.values()[0]
+
+    # If there is no transaction ID for the record, assume it is valid.
+    if APP_ENTITY_SCHEMA[1] not in entity:
+      valid_rows[row_key] = row
+      continue
+
+    app_id = row_key.split(dbconstants.KEY_DELIMITER)[0]
+    row_txn = long(entity[APP_ENTITY_SCHEMA[1]])
+    valid_txn = zookeeper.get_valid_transaction_id(app_id, row_txn, row_key)
+
+    # If the transaction ID is valid, the entity is valid.
+    if row_txn == valid_txn:
+      valid_rows[row_key] = row
+      continue
+
+    # A transaction ID of 0 indicates that the entity doesn't exist yet.
+    if valid_txn == 0:
+      valid_rows[row_key] = None
+      continue
+
+    padded_version = str(valid_txn).zfill(ID_KEY_LENGTH)
+    journal_key = dbconstants.KEY_DELIMITER.join([row_key, padded_version])
+    journal_keys[journal_key] = (row_key, valid_txn)
+
+  if not journal_keys:
+    return valid_rows
+
+  # Fetch every journal entry that is needed in a single request.
   journal_results = db_access.batch_get_entity(
-    dbconstants.JOURNAL_TABLE, [journal_key], dbconstants.JOURNAL_SCHEMA)
-  journal_row = journal_results[journal_key]
+    dbconstants.JOURNAL_TABLE, journal_keys.keys(), dbconstants.JOURNAL_SCHEMA)
+  for journal_key, (row_key, valid_txn) in journal_keys.iteritems():
+    journal_row = journal_results.get(journal_key, {})
+    if dbconstants.JOURNAL_SCHEMA[0] not in journal_row:
+      valid_rows[row_key] = None
+      continue
 
-  if dbconstants.JOURNAL_SCHEMA[0] not in journal_row:
-    return None
+    valid_entity = journal_row[dbconstants.JOURNAL_SCHEMA[0]]
+    valid_rows[row_key] = {row_key: {APP_ENTITY_SCHEMA[0]: valid_entity,
+                                     APP_ENTITY_SCHEMA[1]: str(valid_txn)}}
 
-  valid_entity = journal_row[dbconstants.JOURNAL_SCHEMA[0]]
-  return {row_key: {APP_ENTITY_SCHEMA[0]: valid_entity,
-                    APP_ENTITY_SCHEMA[1]: str(valid_txn)}}
+  return valid_rows
 
 
-def process_entity(entity, datastore, zookeeper):
-  """ Processes an entity by updating it if necessary and removing tombstones.
+def process_entities(entities, datastore, zookeeper):
+  """ Processes a batch of entities by updating them if necessary and removing
+  tombstones.
   Args:
-    entity: The entity to process.
+    entities: A list of entities to process.
     datastore: A reference to the batch datastore interface.
     zookeeper: A handler for making ZooKeeper operations.
   Raises:
     AppScaleDBConnectionError: If the operation could not be performed due to
        an error with Cassandra.
   """
-  logging.debug("Process entity {}".format(str(entity)))
-  key = entity.keys()[0]
+  logging.debug("Process {} entities".format(len(entities)))
+  valid_rows = validate_rows(entities, zookeeper, datastore)
 
-  app_id = key.split(dbconstants.KEY_DELIMITER)[0]
-  valid_entity = validate_row(app_id, entity, zookeeper, datastore)
+  keys_to_delete = []
+  updated_rows = {}
+  for entity in entities:
+    key = entity.keys()[0]
+    valid_entity = valid_rows[key]
+    if (valid_entity is None or
+        valid_entity[key][APP_ENTITY_SCHEMA[0]] == TOMBSTONE):
+      keys_to_delete.append(key)
+    elif valid_entity != entity:
+      updated_rows[key] = valid_entity[key]
 
-  if (valid_entity is None or
-      valid_entity[key][APP_ENTITY_SCHEMA[0]] == TOMBSTONE):
-    delete_entity_from_table(key, datastore)
-    return
+  if updated_rows:
+    update_entities_in_table(updated_rows, datastore)
 
-  if valid_entity != entity:
-    update_entity_in_table(key, valid_entity, datastore)
+  if keys_to_delete:
+    delete_entities_from_table(keys_to_delete, datastore)
 
 
-def update_entity_in_table(key, validated_entity, datastore):
-  """ Updates the APP_ENTITY_TABLE with the valid entity.
+def update_entities_in_table(validated_rows, datastore):
+  """ Updates the APP_ENTITY_TABLE with the valid entities.
   Args:
-    key: A str representing the row key to update in the table.
-    validated_entity: A validated entity which needs to be updated in place of
-    the current entity.
+    validated_rows: A dictionary mapping row keys to validated entities which
+      need to be updated in place of the current entities.
     datastore: A reference to the batch datastore interface.
   Raises:
     AppScaleDBConnectionError: If the batch_put could not be performed due to
       an error with Cassandra.
   """
-  datastore.batch_put_entity(APP_ENTITY_TABLE, [key], APP_ENTITY_SCHEMA,
-                             validated_entity)
+  datastore.batch_put_entity(APP_ENTITY_TABLE, validated_rows.keys(),
+                             APP_ENTITY_SCHEMA, validated_rows)
 
 
-def delete_entity_from_table(key, datastore):
-  """ Performs a hard delete on the APP_ENTITY_TABLE for the given row key.
+def delete_entities_from_table(keys, datastore):
+  """ Performs a hard delete on the APP_ENTITY_TABLE for the given row keys.
   Args:
-    key: A str representing the row key to delete from the table.
+    keys: A list of row keys to delete from the table.
     datastore: A reference to the batch datastore interface.
   Raises:
     AppScaleDBConnectionError: If the batch_delete could not be performed due to
       an error with Cassandra.
   """
-  datastore.batch_delete(APP_ENTITY_TABLE, [key])
+  datastore.batch_delete(APP_ENTITY_TABLE, keys)
 
 
 def stop_cassandra(db_ips, keyname):
@@ -416,7 +672,8 @@ def estimate_total_entities(session, db_master, keyname):
   raise dbconstants.AppScaleDBError('Unable to estimate total entities.')
 
 
-def run_datastore_upgrade(db_access, zookeeper, log_postfix, total_entities):
+def run_datastore_upgrade(db_access, zookeeper, log_postfix, total_entities,
+                          db_ips=(), keyname=None, trusted_apps=()):
   """ Runs the data upgrade process of fetching, validating and updating data
   within ZooKeeper & Cassandra.
   Args:
@@ -424,6 +681,10 @@ def run_datastore_upgrade(db_access, zookeeper, log_postfix, total_entities):
     zookeeper: A handler for interacting with ZooKeeper.
     log_postfix: An identifier for the status log.
     total_entities: A string containing an entity count or None.
+    db_ips: A list of database node IPs to sample keys from.
+    keyname: A string containing the deployment's keyname.
+    trusted_apps: A list of application IDs that should skip index
+      validation after the upgrade.
   """
   # This datastore upgrade script is to be run offline, so make sure
   # appscale is not up while running this script.
@@ -431,8 +692,12 @@ def run_datastore_upgrade(db_access, zookeeper, log_postfix, total_entities):
 
   # Loop through entities table, fetch valid entities from journal table
   # if necessary, delete tombstoned entities and updated invalid ones.
-  validate_and_update_entities(db_access, zookeeper, log_postfix,
-                               total_entities)
+  split_points = []
+  if db_ips:
+    samples = sample_entity_keys(db_ips, keyname)
+    split_points = groomer.choose_split_points(samples, RANGE_COUNT)
+  app_ids = validate_and_update_entities(db_access, zookeeper, log_postfix,
+                                         total_entities, split_points)
 
   logging.info("Updated invalid entities and deleted tombstoned entities.")
 
@@ -441,5 +706,10 @@ def run_datastore_upgrade(db_access, zookeeper, log_postfix, total_entities):
                          str(cassandra_interface.EXPECTED_DATA_VERSION))
   logging.info('Stored the data version successfully.')
 
+  # Once leftover index entries are gone, entity changes keep the indexes
+  # consistent. Validation stays enabled unless an application opts out.
+  clean_up_indexes(db_access, zookeeper, app_ids, trusted_apps)
+  logging.info('Cleaned up indexes successfully.')
+
   db_access.delete_table(dbconstants.JOURNAL_TABLE)
   logging.info("Deleted Journal Table sucessfully.")
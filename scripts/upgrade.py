@@ -39,6 +39,10 @@ def init_parser():
                       help='A list of DB IP addresses')
   parser.add_argument('--replication', type=int,
                       help='The keyspace replication factor')
+  parser.add_argument('--trust-indexes', nargs='+', default=[],
+                      metavar='APP_ID',
+                      help='Applications whose queries should skip index '
+                           'validation after the upgrade')
   return parser
 
 
@@ -75,7 +79,8 @@ if __name__ == "__main__":
     except AppScaleDBError:
       total_entities = None
     run_datastore_upgrade(db_access, zookeeper, args.log_postfix,
-                          total_entities)
+                          total_entities, args.database, args.keyname,
+                          args.trust_indexes)
     status = {'status': 'complete', 'message': 'Data layout upgrade complete'}
   except Exception as error:
     status = {'status': 'error', 'message': error.message}